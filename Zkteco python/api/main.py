@@ -6,7 +6,7 @@ API REST para gestión de dispositivos ZKTeco
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from config import settings
-from models.database import init_db
+from models.database import init_db, SessionLocal
 import logging
 
 # Configurar logging
@@ -35,7 +35,7 @@ app.add_middleware(
 )
 
 # Importar routers
-from api.routers import dispositivos, usuarios, asistencias, horarios, sincronizacion, reportes, departamentos
+from api.routers import dispositivos, usuarios, asistencias, horarios, sincronizacion, reportes, departamentos, trabajos
 
 # Incluir routers
 app.include_router(dispositivos.router)
@@ -45,6 +45,7 @@ app.include_router(horarios.router)
 app.include_router(sincronizacion.router)
 app.include_router(reportes.router)
 app.include_router(departamentos.router)
+app.include_router(trabajos.router)
 
 
 @app.on_event("startup")
@@ -63,6 +64,43 @@ async def startup_event():
     except Exception as e:
         logger.error(f"Error al inicializar base de datos: {str(e)}")
         raise
+    
+    # Trabajos en segundo plano que quedaron sin terminar en la ejecución anterior
+    from zkteco_trabajos import gestor_trabajos
+    gestor_trabajos.recuperar()
+    
+    # Sincronizaciones cortadas por el cierre anterior: su punto de control se retoma
+    from services.sincronizacion_service import SincronizacionService
+    db = SessionLocal()
+    try:
+        SincronizacionService.marcar_ejecuciones_interrumpidas(db)
+    finally:
+        db.close()
+    
+    # Volcados de marcaciones descargados pero no confirmados en la BD
+    from zkteco_ingesta import spool_ingesta
+    if spool_ingesta.pendientes():
+        gestor_trabajos.enviar("reproducir_spool")
+    
+    # Sincronización automática de asistencias en segundo plano
+    if settings.AUTO_SYNC_ENABLED:
+        from zkteco_planificador import planificador_sincronizacion
+        planificador_sincronizacion.iniciar()
+    
+    # Captura de marcaciones en tiempo real
+    if settings.LIVE_CAPTURE_ENABLED:
+        from zkteco_tiempo_real import captura_tiempo_real
+        captura_tiempo_real.iniciar()
+    
+    # Sondeo de disponibilidad y latencia de los dispositivos
+    if settings.HEALTH_PROBE_ENABLED:
+        from zkteco_salud import monitor_salud
+        monitor_salud.iniciar()
+    
+    # Recálculo de la asistencia diaria de los días que reciben marcaciones
+    if settings.RECALC_ENABLED:
+        from zkteco_recalculo import recalculador_incremental
+        recalculador_incremental.iniciar()
 
 
 @app.on_event("shutdown")
@@ -71,6 +109,29 @@ async def shutdown_event():
     Evento que se ejecuta al cerrar la aplicación
     """
     logger.info("Cerrando API ZKTeco...")
+    
+    if settings.AUTO_SYNC_ENABLED:
+        from zkteco_planificador import planificador_sincronizacion
+        planificador_sincronizacion.detener()
+    
+    if settings.LIVE_CAPTURE_ENABLED:
+        from zkteco_tiempo_real import captura_tiempo_real
+        captura_tiempo_real.detener()
+    
+    if settings.HEALTH_PROBE_ENABLED:
+        from zkteco_salud import monitor_salud
+        monitor_salud.detener()
+    
+    if settings.RECALC_ENABLED:
+        from zkteco_recalculo import recalculador_incremental
+        recalculador_incremental.detener()
+    
+    from zkteco_trabajos import gestor_trabajos
+    gestor_trabajos.detener()
+    
+    # Habilitar los dispositivos y cerrar las sesiones persistentes
+    from zkteco_pool import pool_conexiones
+    pool_conexiones.cerrar_todas()
 
 
 @app.get("/")
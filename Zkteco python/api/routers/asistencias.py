@@ -3,10 +3,14 @@ Router de Asistencias
 Endpoints para gestión de registros de asistencia
 """
 
-from fastapi import APIRouter, Depends, HTTPException, status, Query
+from fastapi import APIRouter, Depends, HTTPException, status, Query, Request
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
 from typing import List, Optional
 from datetime import datetime, date
+import asyncio
+import json
+import os
 from models.database import get_db
 from schemas.asistencia import (
     AsistenciaResponse,
@@ -15,9 +19,17 @@ from schemas.asistencia import (
     AsistenciaDiariaResponse,
     AsistenciaManualCreate,
     ReporteUsuarioConResumen,
-    ResumenAsistencia
+    ResumenAsistencia,
+    PoliticaRotacionUpdate
 )
 from services.asistencia_service import AsistenciaService
+from services.flota_service import FlotaService
+from services.rotacion_service import RotacionService
+from services.recalculo_service import RecalculoService
+from zkteco_tiempo_real import difusor_eventos
+from zkteco_ingesta import spool_ingesta
+from zkteco_recalculo import recalculador_incremental
+from api.routers.trabajos import respuesta_trabajo, RESPUESTA_TRABAJO
 
 router = APIRouter(prefix="/api/asistencias", tags=["Asistencias"])
 
@@ -109,12 +121,56 @@ def obtener_asistencias_tiempo_real(
     return AsistenciaService.obtener_asistencias_tiempo_real(db, dispositivo_id, ultimos_minutos)
 
 
-@router.post("/sincronizar/{dispositivo_id}", response_model=AsistenciaSincronizacion)
-def sincronizar_asistencias(dispositivo_id: int, db: Session = Depends(get_db)):
+async def _eventos_sse(request: Request, dispositivo_id: Optional[int] = None):
     """
-    Sincroniza asistencias desde el dispositivo ZKTeco a la base de datos (TODO EL HISTORIAL)
+    Generador Server-Sent Events a partir de una suscripción al difusor
     """
-    resultado = AsistenciaService.sincronizar_asistencias_desde_dispositivo(db, dispositivo_id)
+    suscripcion = difusor_eventos.suscribir(dispositivo_id)
+    try:
+        while not await request.is_disconnected():
+            try:
+                evento = await asyncio.wait_for(suscripcion.cola.get(), timeout=15)
+            except asyncio.TimeoutError:
+                yield ": keepalive\n\n"
+                continue
+            yield f"event: marcacion\ndata: {json.dumps(evento)}\n\n"
+    finally:
+        difusor_eventos.cancelar(suscripcion)
+
+
+@router.get("/tiempo-real/{dispositivo_id}/stream")
+async def stream_asistencias_tiempo_real(dispositivo_id: int, request: Request):
+    """
+    Marcaciones del dispositivo en vivo (Server-Sent Events).
+    Requiere LIVE_CAPTURE_ENABLED=True.
+    """
+    return StreamingResponse(_eventos_sse(request, dispositivo_id), media_type="text/event-stream")
+
+
+@router.get("/eventos")
+async def stream_eventos(request: Request):
+    """
+    Marcaciones de todos los dispositivos en vivo (Server-Sent Events).
+    Requiere LIVE_CAPTURE_ENABLED=True.
+    """
+    return StreamingResponse(_eventos_sse(request), media_type="text/event-stream")
+
+
+@router.post("/sincronizar/{dispositivo_id}", response_model=AsistenciaSincronizacion, responses=RESPUESTA_TRABAJO)
+def sincronizar_asistencias(
+    dispositivo_id: int,
+    completo: bool = Query(False, description="Reprocesar todo el historial ignorando la marca de agua"),
+    asincrono: bool = Query(False, description="Ejecutar como trabajo en segundo plano (responde 202 con el id)"),
+    db: Session = Depends(get_db)
+):
+    """
+    Sincroniza asistencias desde el dispositivo ZKTeco a la base de datos.
+    Incremental: solo procesa los registros posteriores a la última sincronización
+    (con completo=true se reprocesa TODO EL HISTORIAL)
+    """
+    if asincrono:
+        return respuesta_trabajo("sincronizar_asistencias", {"dispositivo_id": dispositivo_id, "completo": completo})
+    resultado = AsistenciaService.sincronizar_asistencias_desde_dispositivo(db, dispositivo_id, completo)
     if not resultado["success"]:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -137,29 +193,58 @@ def sincronizar_asistencias_hoy(dispositivo_id: int, db: Session = Depends(get_d
     return resultado
 
 
-@router.post("/sincronizar-todos")
-def sincronizar_todos_dispositivos(db: Session = Depends(get_db)):
+@router.post("/sincronizar-todos", responses=RESPUESTA_TRABAJO)
+def sincronizar_todos_dispositivos(
+    stream: bool = Query(False, description="Entregar cada resultado (NDJSON) en cuanto termina su dispositivo"),
+    asincrono: bool = Query(False, description="Ejecutar como trabajo en segundo plano (responde 202 con el id)"),
+    db: Session = Depends(get_db)
+):
     """
-    Sincroniza asistencias de todos los dispositivos activos
+    Sincroniza asistencias de todos los dispositivos activos en paralelo.
+    Los resultados se listan en el orden en que terminan los dispositivos.
     """
-    from models.dispositivo import Dispositivo
-    
-    dispositivos = db.query(Dispositivo).filter(Dispositivo.activo == True).all()
-    resultados = []
-    
-    for dispositivo in dispositivos:
-        resultado = AsistenciaService.sincronizar_asistencias_desde_dispositivo(db, dispositivo.id)
-        resultados.append({
-            "dispositivo_id": dispositivo.id,
-            "dispositivo_nombre": dispositivo.nombre,
-            **resultado
-        })
-    
+    if asincrono:
+        return respuesta_trabajo("sincronizar_todos")
+    resultados = FlotaService.sincronizar_asistencias_todos(db)
+
+    if stream:
+        return StreamingResponse(
+            (json.dumps(r, default=str) + "\n" for r in resultados),
+            media_type="application/x-ndjson"
+        )
+
+    resultados = list(resultados)
     return {
-        "total_dispositivos": len(dispositivos),
+        "total_dispositivos": len(resultados),
         "resultados": resultados
     }
 
+@router.get("/spool")
+def listar_volcados_pendientes(dispositivo_id: Optional[int] = Query(None, description="Filtrar por dispositivo")):
+    """
+    Volcados descargados de los dispositivos que aún no se confirmaron en la BD
+    """
+    archivos = spool_ingesta.pendientes(dispositivo_id)
+    return {
+        "total": len(archivos),
+        "volcados": [{"archivo": os.path.basename(a), "bytes": os.path.getsize(a)} for a in archivos]
+    }
+
+
+@router.post("/spool/reproducir", responses=RESPUESTA_TRABAJO)
+def reproducir_volcados_pendientes(
+    dispositivo_id: Optional[int] = Query(None, description="Solo los volcados de este dispositivo"),
+    asincrono: bool = Query(False, description="Ejecutar como trabajo en segundo plano (responde 202 con el id)"),
+    db: Session = Depends(get_db)
+):
+    """
+    Escribe en la BD los volcados pendientes del spool (se reproducen solos al iniciar la API)
+    """
+    if asincrono:
+        return respuesta_trabajo("reproducir_spool", {"dispositivo_id": dispositivo_id})
+    return AsistenciaService.reproducir_descargas_pendientes(db, dispositivo_id)
+
+
 @router.post("/registrar", response_model=AsistenciaResponse, status_code=status.HTTP_201_CREATED)
 def registrar_asistencia_manual(
     datos: AsistenciaManualCreate,
@@ -195,21 +280,98 @@ def limpiar_asistencias_dispositivo(dispositivo_id: int, db: Session = Depends(g
     return resultado
 
 
+@router.get("/{dispositivo_id}/rotacion")
+def obtener_rotacion_dispositivo(
+    dispositivo_id: int,
+    limit: int = Query(20, ge=1, le=500, description="Límite de registros de auditoría"),
+    db: Session = Depends(get_db)
+):
+    """
+    Política de rotación de registros del dispositivo y auditoría de las rotaciones
+    """
+    politica = RotacionService.obtener_politica(db, dispositivo_id)
+    return {
+        "dispositivo_id": dispositivo_id,
+        "politica": politica.to_dict() if politica else None,
+        "historial": [r.to_dict() for r in RotacionService.obtener_historial(db, dispositivo_id, limit)]
+    }
+
+
+@router.put("/{dispositivo_id}/rotacion")
+def configurar_rotacion_dispositivo(
+    dispositivo_id: int,
+    politica: PoliticaRotacionUpdate,
+    db: Session = Depends(get_db)
+):
+    """
+    Configura la rotación automática: tras sincronizar, si el dispositivo alcanza
+    max_registros o su marcación más antigua supera max_dias, se verifica que todo
+    esté en la BD y se vacía su memoria de marcaciones.
+    """
+    resultado = RotacionService.configurar_politica(
+        db, dispositivo_id, politica.max_registros, politica.max_dias, politica.activo
+    )
+    if not resultado:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Dispositivo con ID {dispositivo_id} no encontrado"
+        )
+    return resultado.to_dict()
+
+
+@router.post("/{dispositivo_id}/rotar")
+def rotar_registros_dispositivo(dispositivo_id: int, db: Session = Depends(get_db)):
+    """
+    Vacía la memoria de marcaciones del dispositivo SOLO si cada registro ya está
+    en la BD (cantidad y checksum). A diferencia de /limpiar, nunca pierde datos.
+    """
+    resultado = RotacionService.rotar_dispositivo(db, dispositivo_id)
+    if not resultado["success"]:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=resultado["message"]
+        )
+    return resultado
+
+
 # Endpoints de Reportes y Cálculo
 
-@router.post("/calcular", status_code=status.HTTP_200_OK)
+@router.post("/calcular", status_code=status.HTTP_200_OK, responses=RESPUESTA_TRABAJO)
 def calcular_asistencia(
     fecha_inicio: date,
     fecha_fin: date,
     user_id: Optional[str] = None,
+    asincrono: bool = Query(False, description="Ejecutar como trabajo en segundo plano (responde 202 con el id)"),
+    procesos: Optional[int] = Query(None, ge=1, le=64, description="Procesos de cálculo (por defecto CALC_WORKERS)"),
     db: Session = Depends(get_db)
 ):
     """
     Calcula o recalcula la asistencia diaria procesada para un rango de fechas.
     """
-    resultados = AsistenciaService.calcular_rango_asistencia(db, fecha_inicio, fecha_fin, user_id)
+    if asincrono:
+        return respuesta_trabajo("calcular_asistencia", {
+            "fecha_inicio": fecha_inicio.isoformat(),
+            "fecha_fin": fecha_fin.isoformat(),
+            "user_id": user_id,
+            "procesos": procesos
+        })
+    resultados = AsistenciaService.calcular_rango_asistencia(db, fecha_inicio, fecha_fin, user_id, procesos=procesos)
     return {"message": "Cálculo completado", "dias_procesados": len(resultados)}
 
+@router.get("/recalculo")
+def estado_recalculo(db: Session = Depends(get_db)):
+    """
+    Estado del recálculo incremental y días que esperan ser recalculados
+    """
+    return {**recalculador_incremental.estado(), **RecalculoService.resumen_pendientes(db)}
+
+@router.post("/recalculo/procesar")
+def procesar_recalculo():
+    """
+    Recalcula ya todos los días pendientes, sin esperar el intervalo del recalculador
+    """
+    return recalculador_incremental.procesar()
+
 @router.get("/reporte", response_model=List[AsistenciaDiariaResponse])
 def obtener_reporte_asistencia(
     fecha_inicio: date,
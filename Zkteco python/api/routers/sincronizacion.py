@@ -3,7 +3,7 @@ Router de Sincronización
 Endpoints para sincronización de hora y estado
 """
 
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, status, Query
 from sqlalchemy.orm import Session
 from typing import Optional
 from datetime import datetime
@@ -13,6 +13,29 @@ from services.sincronizacion_service import SincronizacionService
 router = APIRouter(prefix="/api/sincronizacion", tags=["Sincronización"])
 
 
+@router.post("/hora")
+def sincronizar_hora_flota(
+    umbral: Optional[float] = None,
+    solo_medir: bool = False,
+    db: Session = Depends(get_db)
+):
+    """
+    Mide la deriva del reloj de todos los dispositivos activos en paralelo y corrige los que superan el umbral
+    
+    - **umbral**: Segundos de deriva tolerados (opcional, por defecto CLOCK_DRIFT_THRESHOLD)
+    - **solo_medir**: Medir sin corregir
+    """
+    return SincronizacionService.sincronizar_hora_flota(db, umbral, corregir=not solo_medir)
+
+
+@router.get("/hora/{dispositivo_id}/deriva")
+def obtener_historial_deriva(dispositivo_id: int, limit: int = 100, db: Session = Depends(get_db)):
+    """
+    Historial de mediciones de deriva del reloj de un dispositivo
+    """
+    return [d.to_dict() for d in SincronizacionService.obtener_historial_deriva(db, dispositivo_id, limit)]
+
+
 @router.post("/hora/{dispositivo_id}")
 def sincronizar_hora(
     dispositivo_id: int,
@@ -40,3 +63,27 @@ def obtener_estado_sincronizacion(db: Session = Depends(get_db)):
     Obtiene el estado de sincronización de todos los dispositivos activos
     """
     return SincronizacionService.obtener_estado_sincronizacion(db)
+
+
+@router.get("/ejecuciones")
+def obtener_ejecuciones(
+    dispositivo_id: Optional[int] = None,
+    estado: Optional[str] = Query(None, description="en_curso, completado, fallido o interrumpido"),
+    limit: int = Query(100, ge=1, le=1000, description="Límite de registros"),
+    db: Session = Depends(get_db)
+):
+    """
+    Registro de ejecuciones de la sincronización de asistencias: tiempos, contadores y punto de control
+    """
+    return [e.to_dict() for e in SincronizacionService.obtener_ejecuciones(db, dispositivo_id, estado, limit)]
+
+
+@router.get("/ejecuciones/resumen")
+def resumen_ejecuciones(
+    dias: int = Query(7, ge=1, le=365, description="Días hacia atrás"),
+    db: Session = Depends(get_db)
+):
+    """
+    Duración (promedio y p95), volumen y velocidad de escritura de las sincronizaciones por dispositivo
+    """
+    return SincronizacionService.resumen_ejecuciones(db, dias)
@@ -0,0 +1,111 @@
+"""
+Router de Trabajos
+Endpoints para consultar, seguir y cancelar trabajos en segundo plano
+"""
+
+from fastapi import APIRouter, HTTPException, status, Query, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+from typing import Optional
+import asyncio
+import json
+from schemas.trabajo import TrabajoEnviado
+from zkteco_trabajos import gestor_trabajos, ESTADOS_FINALES, CancelacionNoAdmitida
+
+router = APIRouter(prefix="/api/trabajos", tags=["Trabajos"])
+
+# Documenta la respuesta 202 de los endpoints con asincrono=true (su response_model
+# describe solo la respuesta síncrona)
+RESPUESTA_TRABAJO = {
+    status.HTTP_202_ACCEPTED: {"model": TrabajoEnviado, "description": "Trabajo encolado (asincrono=true)"}
+}
+
+
+def respuesta_trabajo(tipo: str, parametros: dict = None) -> JSONResponse:
+    """
+    Envía un trabajo y responde 202 con su id (o el del trabajo idéntico en curso)
+    """
+    trabajo, nuevo = gestor_trabajos.enviar(tipo, parametros)
+    enviado = TrabajoEnviado(
+        trabajo_id=trabajo["id"],
+        estado=trabajo["estado"],
+        duplicado=not nuevo,
+        url=f"/api/trabajos/{trabajo['id']}"
+    )
+    return JSONResponse(status_code=status.HTTP_202_ACCEPTED, content=enviado.model_dump())
+
+
+@router.get("/")
+def listar_trabajos(
+    estado: Optional[str] = Query(None, description="pendiente, en_curso, completado, fallido o cancelado"),
+    tipo: Optional[str] = Query(None, description="Tipo de trabajo"),
+    limit: int = Query(50, ge=1, le=500, description="Límite de registros")
+):
+    """
+    Lista los trabajos más recientes
+    """
+    return gestor_trabajos.listar(estado, tipo, limit)
+
+
+@router.get("/{trabajo_id}")
+def obtener_trabajo(trabajo_id: str):
+    """
+    Estado, progreso y resultado de un trabajo
+    """
+    trabajo = gestor_trabajos.obtener(trabajo_id)
+    if not trabajo:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Trabajo con ID {trabajo_id} no encontrado"
+        )
+    return trabajo
+
+
+async def _eventos_trabajo(request: Request, trabajo_id: str):
+    """
+    Emite el trabajo cada vez que cambia su estado o su progreso, hasta que termina
+    """
+    anterior = None
+    while not await request.is_disconnected():
+        trabajo = await asyncio.to_thread(gestor_trabajos.obtener, trabajo_id)
+        if trabajo is None:
+            return
+        instantanea = (trabajo["estado"], trabajo["progreso"], trabajo["mensaje"])
+        if instantanea != anterior:
+            anterior = instantanea
+            evento = "fin" if trabajo["estado"] in ESTADOS_FINALES else "progreso"
+            yield f"event: {evento}\ndata: {json.dumps(trabajo)}\n\n"
+            if evento == "fin":
+                return
+        await asyncio.sleep(1)
+
+
+@router.get("/{trabajo_id}/stream")
+async def stream_trabajo(trabajo_id: str, request: Request):
+    """
+    Progreso del trabajo en vivo (Server-Sent Events).
+    El último evento ('fin') trae el resultado.
+    """
+    if await asyncio.to_thread(gestor_trabajos.obtener, trabajo_id) is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Trabajo con ID {trabajo_id} no encontrado"
+        )
+    return StreamingResponse(_eventos_trabajo(request, trabajo_id), media_type="text/event-stream")
+
+
+@router.post("/{trabajo_id}/cancelar")
+def cancelar_trabajo(trabajo_id: str):
+    """
+    Cancela un trabajo pendiente, o pide detenerse a uno en curso.
+    Responde 409 si el trabajo está en curso y su tarea no admite cancelación.
+    """
+    try:
+        trabajo = gestor_trabajos.cancelar(trabajo_id)
+    except CancelacionNoAdmitida as e:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(e))
+    if not trabajo:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Trabajo con ID {trabajo_id} no encontrado"
+        )
+    return trabajo
@@ -13,6 +13,7 @@ from schemas.usuario import (
     UsuarioResponse
 )
 from services.usuario_service import UsuarioService
+from api.routers.trabajos import respuesta_trabajo, RESPUESTA_TRABAJO
 
 router = APIRouter(prefix="/api/usuarios", tags=["Usuarios"])
 
@@ -48,6 +49,22 @@ def listar_usuarios(
     return UsuarioService.obtener_usuarios(db, dispositivo_id=dispositivo_id, skip=skip, limit=limit)
 
 
+@router.get("/pendientes")
+def listar_operaciones_pendientes(dispositivo_id: Optional[int] = None, db: Session = Depends(get_db)):
+    """
+    Lista las escrituras de usuarios en cola para dispositivos sin conexión
+    """
+    return [o.to_dict() for o in UsuarioService.obtener_operaciones_pendientes(db, dispositivo_id)]
+
+
+@router.post("/pendientes/procesar")
+def procesar_operaciones_pendientes(dispositivo_id: Optional[int] = None, db: Session = Depends(get_db)):
+    """
+    Aplica las escrituras en cola de los dispositivos disponibles
+    """
+    return UsuarioService.procesar_operaciones_pendientes(db, [dispositivo_id] if dispositivo_id is not None else None)
+
+
 @router.get("/{usuario_id}", response_model=UsuarioResponse)
 def obtener_usuario(usuario_id: int, db: Session = Depends(get_db)):
     """
@@ -119,16 +136,22 @@ def sincronizar_usuario(usuario_id: int, db: Session = Depends(get_db)):
     if not UsuarioService.sincronizar_usuario_a_dispositivo(db, usuario_id):
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
-            detail="No se pudo sincronizar el usuario con el dispositivo"
+            detail="No se pudo sincronizar el usuario con el dispositivo (la escritura quedó en cola si el equipo no respondía)"
         )
     return {"message": "Usuario sincronizado exitosamente"}
 
 
-@router.post("/dispositivos/{dispositivo_id}/sincronizar")
-def sincronizar_usuarios_desde_dispositivo(dispositivo_id: int, db: Session = Depends(get_db)):
+@router.post("/dispositivos/{dispositivo_id}/sincronizar", responses=RESPUESTA_TRABAJO)
+def sincronizar_usuarios_desde_dispositivo(
+    dispositivo_id: int,
+    asincrono: bool = Query(False, description="Ejecutar como trabajo en segundo plano (responde 202 con el id)"),
+    db: Session = Depends(get_db)
+):
     """
     Sincroniza todos los usuarios desde el dispositivo ZKTeco a la base de datos
     """
+    if asincrono:
+        return respuesta_trabajo("sincronizar_usuarios", {"dispositivo_id": dispositivo_id})
     resultado = UsuarioService.sincronizar_usuarios_desde_dispositivo(db, dispositivo_id)
     if not resultado["success"]:
         raise HTTPException(
@@ -0,0 +1,12 @@
+"""
+Benchmarks de sincronización
+
+Miden registros por segundo y memoria máxima (RSS) de la ingesta de
+asistencias y usuarios contra dispositivos simulados (zkteco_simulador.py) y
+una base de datos desechable.
+
+Uso (desde la carpeta del proyecto):
+    python benchmarks/run_benchmarks.py
+    python benchmarks/run_benchmarks.py --rapido
+    python benchmarks/run_benchmarks.py --guardar-baseline
+"""
@@ -0,0 +1,271 @@
+"""
+Ejecución de un escenario de benchmark
+
+Los dispositivos simulados corren en el proceso principal; la sincronización
+corre en un proceso hijo nuevo (spawn) por escenario, así el RSS máximo medido
+corresponde solo a la ruta de ingesta y no arrastra memoria de escenarios
+anteriores ni del simulador.
+"""
+
+import contextlib
+import functools
+import logging
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, datetime, timedelta
+
+from zkteco_simulador import SimuladorFlota, ConfiguracionSimulador
+
+
+def rss_maximo_mb():
+    """
+    Memoria residente máxima del proceso actual, en MB (None si no se puede medir)
+    """
+    # En Linux, VmHWM es propio del proceso; ru_maxrss se hereda del padre a través de exec
+    try:
+        with open("/proc/self/status") as f:
+            for linea in f:
+                if linea.startswith("VmHWM:"):
+                    return round(int(linea.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    try:
+        import resource
+        maximo = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux reporta KB, macOS bytes
+        return round(maximo / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+    except ImportError:
+        pass
+    try:
+        import psutil
+        memoria = psutil.Process().memory_info()
+        return round(getattr(memoria, "peak_wset", memoria.rss) / (1024 * 1024), 1)
+    except ImportError:
+        return None
+
+
+def medir(escenario, db_url: str = None) -> dict:
+    """
+    Levanta los dispositivos del escenario, sincroniza en un proceso hijo y retorna las métricas
+    """
+    configuraciones = []
+    for i in range(escenario.dispositivos):
+        inicio = None
+        intervalo = 60
+        if escenario.operacion == "hoy":
+            # Mitad de la memoria de días anteriores y mitad de hoy
+            inicio = datetime.combine(date.today(), datetime.min.time()) - timedelta(seconds=escenario.registros // 2)
+            intervalo = 1
+        configuraciones.append(ConfiguracionSimulador(
+            registros=escenario.registros,
+            usuarios=escenario.usuarios,
+            proporcion_duplicados=escenario.duplicados,
+            inicio=inicio,
+            intervalo=intervalo,
+            semilla=i,
+            primer_user_id=1001 + i * escenario.usuarios
+        ))
+
+    directorio = None
+    if db_url is None:
+        directorio = tempfile.mkdtemp(prefix="zk-bench-")
+        db_url = f"sqlite:///{os.path.join(directorio, 'bench.db')}"
+
+    try:
+        contexto = multiprocessing.get_context("spawn")
+        if escenario.operacion == "calculo":
+            # El cálculo no usa dispositivos; el hijo no es daemon para poder lanzar sus procesos de cálculo
+            with ProcessPoolExecutor(1, mp_context=contexto) as ejecutor:
+                return ejecutor.submit(ejecutar_calculo, escenario, db_url).result()
+
+        with SimuladorFlota(configuraciones, direcciones_distintas=escenario.dispositivos > 1) as flota:
+            with contexto.Pool(1, maxtasksperchild=1) as pool:
+                resultado = pool.apply(ejecutar_escenario, (escenario, flota.direcciones, db_url))
+            resultado["segundos_deshabilitado"] = round(
+                sum(e["segundos_deshabilitado"] for e in flota.estadisticas()), 3
+            )
+        return resultado
+    finally:
+        if directorio:
+            shutil.rmtree(directorio, ignore_errors=True)
+
+
+def ejecutar_escenario(escenario, direcciones: list, db_url: str) -> dict:
+    """
+    Proceso hijo: prepara la BD desechable, sincroniza y mide
+    """
+    from sqlalchemy import create_engine
+    from models.database import Base, SessionLocal
+    from models.dispositivo import Dispositivo
+    from models.usuario import Usuario
+    from services.asistencia_service import AsistenciaService
+    from services.usuario_service import UsuarioService
+    from services.flota_service import FlotaService
+    from models.recalculo import DiaPendiente
+    from zkteco_pool import pool_conexiones
+    from config import settings
+
+    logging.getLogger().setLevel(logging.WARNING)
+    settings.RECALC_ENABLED = escenario.recalculo
+
+    argumentos = {"connect_args": {"timeout": 60}} if db_url.startswith("sqlite") else {}
+    engine = create_engine(db_url, **argumentos)
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+    SessionLocal.configure(bind=engine)
+
+    db = SessionLocal()
+    try:
+        ids = []
+        for i, (host, puerto) in enumerate(direcciones):
+            dispositivo = Dispositivo(nombre=f"Simulado {i + 1}", ip_address=host, puerto=puerto, activo=True)
+            db.add(dispositivo)
+            db.flush()
+            ids.append((dispositivo.id, dispositivo.nombre))
+
+        # La ingesta de asistencias solo guarda marcaciones de usuarios conocidos
+        if escenario.operacion != "usuarios":
+            db.bulk_insert_mappings(Usuario, [
+                {
+                    "uid": 1001 + i * escenario.usuarios + n,
+                    "user_id": str(1001 + i * escenario.usuarios + n),
+                    "nombre": f"Usuario {1001 + i * escenario.usuarios + n}",
+                    "dispositivo_id": dispositivo_id,
+                }
+                for i, (dispositivo_id, _) in enumerate(ids)
+                for n in range(escenario.usuarios)
+            ])
+        db.commit()
+    finally:
+        db.close()
+
+    tareas = {
+        "asistencias": AsistenciaService.sincronizar_asistencias_desde_dispositivo,
+        "hoy": AsistenciaService.sincronizar_asistencias_hoy,
+        "usuarios": UsuarioService.sincronizar_usuarios_desde_dispositivo,
+    }
+    tarea = tareas[escenario.operacion]
+
+    # pyzk y ZKTecoConnection escriben en stdout
+    with open(os.devnull, "w") as nulo, contextlib.redirect_stdout(nulo):
+        if escenario.completo:
+            # Primera pasada sin medir: la medida es el reproceso de lo ya guardado
+            list(FlotaService.ejecutar_en_paralelo(ids, tarea, plazo_total=3600, timeout_dispositivo=3600))
+            tarea = functools.partial(AsistenciaService.sincronizar_asistencias_desde_dispositivo, completo=True)
+            db = SessionLocal()
+            try:
+                db.query(DiaPendiente).delete()
+                db.commit()
+            finally:
+                db.close()
+
+        rss_inicial = rss_maximo_mb()
+        inicio = time.perf_counter()
+        resultados = list(FlotaService.ejecutar_en_paralelo(ids, tarea, plazo_total=3600, timeout_dispositivo=3600))
+        pool_conexiones.cerrar_todas()
+        segundos = time.perf_counter() - inicio
+
+    if escenario.operacion == "usuarios":
+        procesados = escenario.usuarios * len(ids)
+        nuevos = sum(r.get("usuarios_nuevos_descargados", 0) for r in resultados)
+    else:
+        procesados = escenario.registros * len(ids)
+        nuevos = sum(r.get("registros_nuevos", 0) for r in resultados)
+
+    errores = [r.get("message") for r in resultados if not r.get("success")]
+    db = SessionLocal()
+    try:
+        dias_marcados = db.query(DiaPendiente).count()
+    finally:
+        db.close()
+    engine.dispose()
+
+    return {
+        **escenario.como_dict(),
+        "segundos": round(segundos, 3),
+        "registros_por_segundo": round(procesados / segundos, 1) if segundos else None,
+        "registros_procesados": procesados,
+        "registros_nuevos": nuevos,
+        "dias_marcados": dias_marcados,
+        "rss_inicial_mb": rss_inicial,
+        "rss_maximo_mb": rss_maximo_mb(),
+        "errores": errores,
+    }
+
+
+def ejecutar_calculo(escenario, db_url: str) -> dict:
+    """
+    Proceso hijo: prepara usuarios, un horario partido y marcaciones, y mide el cálculo
+    de asistencia diaria (registros = usuario-día calculados)
+    """
+    import random
+    from datetime import time as dt_time
+    from sqlalchemy import create_engine
+    from models.database import Base, SessionLocal
+    from models.dispositivo import Dispositivo
+    from models.usuario import Usuario
+    from models.asistencia import Asistencia
+    from models.horario import Horario
+    from models.turnos import SegmentosHorario, AsignacionHorario
+    from services.calculo_service import CalculoService
+
+    logging.getLogger().setLevel(logging.WARNING)
+
+    argumentos = {"connect_args": {"timeout": 60}} if db_url.startswith("sqlite") else {}
+    engine = create_engine(db_url, **argumentos)
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+    SessionLocal.configure(bind=engine)
+
+    azar = random.Random(0)
+    desde = date(2025, 1, 1)
+    db = SessionLocal()
+    try:
+        dispositivo = Dispositivo(nombre="Simulado", ip_address="127.0.0.1", puerto=4370, activo=True)
+        horario = Horario(nombre="Partido")
+        db.add_all([dispositivo, horario])
+        db.flush()
+        db.add_all([
+            SegmentosHorario(horario_id=horario.id, dia_semana=dia, hora_inicio=inicio, hora_fin=fin, tolerancia_minutos=10)
+            for dia in range(7) for inicio, fin in ((dt_time(8), dt_time(13)), (dt_time(14), dt_time(17)))
+        ])
+        uids = range(1001, 1001 + escenario.usuarios)
+        db.bulk_insert_mappings(Usuario, [
+            {"uid": uid, "user_id": str(uid), "nombre": f"Usuario {uid}", "dispositivo_id": dispositivo.id}
+            for uid in uids
+        ])
+        db.bulk_insert_mappings(AsignacionHorario, [
+            {"user_id": str(uid), "horario_id": horario.id, "fecha_inicio": desde} for uid in uids
+        ])
+        db.bulk_insert_mappings(Asistencia, [
+            {"uid": uid, "dispositivo_id": dispositivo.id, "status": 1, "punch": 0,
+             "timestamp": datetime.combine(desde + timedelta(days=d), dt_time(0)) + timedelta(minutes=base + azar.randint(-20, 20))}
+            for uid in uids for d in range(escenario.dias) for base in (480, 780, 840, 1020)
+        ])
+        db.commit()
+
+        rss_inicial = rss_maximo_mb()
+        inicio = time.perf_counter()
+        filas = CalculoService.calcular_rango(db, desde, desde + timedelta(days=escenario.dias - 1),
+                                              procesos=escenario.procesos)
+        segundos = time.perf_counter() - inicio
+    finally:
+        db.close()
+    engine.dispose()
+
+    procesados = escenario.usuarios * escenario.dias
+    return {
+        **escenario.como_dict(),
+        "segundos": round(segundos, 3),
+        "registros_por_segundo": round(procesados / segundos, 1) if segundos else None,
+        "registros_procesados": procesados,
+        "registros_nuevos": len(filas),
+        "rss_inicial_mb": rss_inicial,
+        "rss_maximo_mb": rss_maximo_mb(),
+        "errores": [],
+    }
@@ -0,0 +1,88 @@
+"""
+Escenarios de los benchmarks de sincronización y cálculo
+"""
+
+
+class Escenario:
+    """
+    Una medición: operación, tamaño de la memoria de los dispositivos y tamaño de la flota
+    """
+
+    def __init__(self, nombre, operacion, registros=0, dispositivos=1, duplicados=0.0, usuarios=50, rapido=True,
+                 dias=0, procesos=1, recalculo=False, completo=False):
+        """
+        Parámetros:
+            nombre (str): Identificador del escenario (clave en el JSON de resultados)
+            operacion (str): 'asistencias', 'hoy', 'usuarios' o 'calculo'
+            registros (int): Marcaciones almacenadas en cada dispositivo
+            dispositivos (int): Dispositivos sincronizados a la vez
+            duplicados (float): Proporción de marcaciones repetidas en la memoria del dispositivo
+            usuarios (int): Usuarios de cada dispositivo
+            rapido (bool): Incluido en la ejecución con --rapido
+            dias (int): Días calculados (operación 'calculo')
+            procesos (int): Procesos del cálculo (operación 'calculo')
+            recalculo (bool): RECALC_ENABLED durante la ingesta (marca los días a recalcular)
+            completo (bool): Sincronizar dos veces y medir la segunda, completa (completo=True):
+                             toda la memoria se vuelve a ingerir y la clave única la descarta
+        """
+        self.nombre = nombre
+        self.operacion = operacion
+        self.registros = registros
+        self.dispositivos = dispositivos
+        self.duplicados = duplicados
+        self.usuarios = usuarios
+        self.rapido = rapido
+        self.dias = dias
+        self.procesos = procesos
+        self.recalculo = recalculo
+        self.completo = completo
+
+    def como_dict(self) -> dict:
+        return {
+            "operacion": self.operacion,
+            "registros": self.registros,
+            "dispositivos": self.dispositivos,
+            "duplicados": self.duplicados,
+            "usuarios": self.usuarios,
+            "dias": self.dias,
+            "procesos": self.procesos,
+            "recalculo": self.recalculo,
+            "completo": self.completo,
+        }
+
+
+ESCENARIOS = [
+    # sincronizar_asistencias_desde_dispositivo: tamaño de la memoria
+    Escenario("asistencias_1k", "asistencias", registros=1_000),
+    Escenario("asistencias_10k", "asistencias", registros=10_000),
+    Escenario("asistencias_100k", "asistencias", registros=100_000, rapido=False),
+
+    # Proporción de duplicados
+    Escenario("asistencias_10k_dup25", "asistencias", registros=10_000, duplicados=0.25),
+    Escenario("asistencias_10k_dup50", "asistencias", registros=10_000, duplicados=0.5),
+
+    # Tamaño de la flota
+    Escenario("asistencias_10k_x10", "asistencias", registros=10_000, dispositivos=10),
+    Escenario("asistencias_10k_x50", "asistencias", registros=10_000, dispositivos=50, rapido=False),
+
+    # Marcado de días para el recálculo incremental durante la ingesta: primera
+    # sincronización y reproceso completo de lo ya guardado
+    Escenario("asistencias_10k_recalc", "asistencias", registros=10_000, recalculo=True),
+    Escenario("asistencias_10k_completo_recalc", "asistencias", registros=10_000, recalculo=True, completo=True),
+    Escenario("asistencias_100k_completo_recalc", "asistencias", registros=100_000, recalculo=True, completo=True,
+              rapido=False),
+
+    # sincronizar_asistencias_hoy
+    Escenario("hoy_10k", "hoy", registros=10_000),
+    Escenario("hoy_100k", "hoy", registros=100_000, rapido=False),
+
+    # sincronizar_usuarios_desde_dispositivo
+    Escenario("usuarios_500", "usuarios", usuarios=500),
+    Escenario("usuarios_100_x10", "usuarios", usuarios=100, dispositivos=10),
+    Escenario("usuarios_100_x50", "usuarios", usuarios=100, dispositivos=50, rapido=False),
+
+    # CalculoService.calcular_rango: usuarios x días y procesos de cálculo
+    Escenario("calculo_1000x30", "calculo", usuarios=1000, dias=30),
+    Escenario("calculo_1000x30_p2", "calculo", usuarios=1000, dias=30, procesos=2),
+    Escenario("calculo_1000x30_p4", "calculo", usuarios=1000, dias=30, procesos=4, rapido=False),
+]
@@ -0,0 +1,128 @@
+"""
+Script para ejecutar los benchmarks de sincronización y compararlos con la línea base
+"""
+
+import sys
+import os
+import argparse
+import json
+import platform
+from datetime import datetime
+
+# Agregar el directorio raíz al path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.escenarios import ESCENARIOS
+from benchmarks.ejecutor import medir
+
+DIRECTORIO = os.path.dirname(os.path.abspath(__file__))
+BASELINE = os.path.join(DIRECTORIO, "baseline.json")
+
+
+def comparar(resultados: dict, baseline: dict, tolerancia: float) -> list:
+    """
+    Compara cada escenario con la línea base.
+
+    Hay regresión si el throughput cae más de la tolerancia o si el RSS
+    máximo crece más de la tolerancia.
+
+    Retorna:
+        list: Descripción de cada regresión encontrada
+    """
+    regresiones = []
+    for nombre, actual in resultados.items():
+        base = baseline.get("escenarios", {}).get(nombre)
+        if not base:
+            continue
+
+        comparacion = {}
+        if base.get("registros_por_segundo") and actual.get("registros_por_segundo"):
+            comparacion["throughput"] = round(actual["registros_por_segundo"] / base["registros_por_segundo"], 3)
+            if comparacion["throughput"] < 1 - tolerancia:
+                regresiones.append(
+                    f"{nombre}: {actual['registros_por_segundo']} registros/s "
+                    f"(línea base {base['registros_por_segundo']})"
+                )
+        if base.get("rss_maximo_mb") and actual.get("rss_maximo_mb"):
+            comparacion["rss"] = round(actual["rss_maximo_mb"] / base["rss_maximo_mb"], 3)
+            if comparacion["rss"] > 1 + tolerancia:
+                regresiones.append(
+                    f"{nombre}: RSS máximo {actual['rss_maximo_mb']} MB (línea base {base['rss_maximo_mb']} MB)"
+                )
+        actual["comparacion"] = comparacion
+
+    return regresiones
+
+
+def main():
+    """
+    Ejecuta los escenarios, guarda el JSON de resultados y reporta regresiones
+    """
+    parser = argparse.ArgumentParser(description="Benchmarks de sincronización ZKTeco")
+    parser.add_argument("--escenarios", help="Nombres separados por coma (por defecto, todos)")
+    parser.add_argument("--rapido", action="store_true", help="Omitir los escenarios de 100k registros y 50 dispositivos")
+    parser.add_argument("--salida", default=os.path.join(DIRECTORIO, "resultados.json"), help="Archivo JSON de resultados")
+    parser.add_argument("--baseline", default=BASELINE, help="Archivo JSON de la línea base")
+    parser.add_argument("--guardar-baseline", action="store_true", help="Guardar los resultados como nueva línea base")
+    parser.add_argument("--tolerancia", type=float, default=0.15, help="Variación admitida respecto de la línea base")
+    parser.add_argument("--db-url", help="URL de una BD desechable (por defecto, SQLite temporal). ¡Se borran sus tablas!")
+    args = parser.parse_args()
+
+    escenarios = ESCENARIOS
+    if args.escenarios:
+        nombres = {n.strip() for n in args.escenarios.split(",")}
+        escenarios = [e for e in ESCENARIOS if e.nombre in nombres]
+    elif args.rapido:
+        escenarios = [e for e in ESCENARIOS if e.rapido]
+
+    print("=" * 80)
+    print("BENCHMARKS DE SINCRONIZACIÓN")
+    print("=" * 80)
+
+    resultados = {}
+    for escenario in escenarios:
+        print(f"\n{escenario.nombre}...", end=" ", flush=True)
+        resultado = medir(escenario, args.db_url)
+        resultados[escenario.nombre] = resultado
+        print(f"{resultado['registros_por_segundo']} registros/s, "
+              f"RSS máximo {resultado['rss_maximo_mb']} MB, {resultado['segundos']} s")
+        if resultado["errores"]:
+            print(f"  [ADVERTENCIA] {len(resultado['errores'])} dispositivo(s) con error: {resultado['errores'][0]}")
+
+    documento = {
+        "fecha": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "plataforma": platform.platform(),
+        "base_de_datos": "sqlite" if not args.db_url else args.db_url.split(":", 1)[0],
+        "escenarios": resultados,
+    }
+
+    regresiones = []
+    if os.path.exists(args.baseline):
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        if args.guardar_baseline:
+            # Con --escenarios solo se reemplazan los medidos; el resto de la línea base se conserva
+            previos = baseline.get("escenarios", {})
+            documento["escenarios"] = {e.nombre: resultados.get(e.nombre, previos.get(e.nombre))
+                                       for e in ESCENARIOS if e.nombre in resultados or e.nombre in previos}
+        else:
+            regresiones = comparar(resultados, baseline, args.tolerancia)
+            documento["regresiones"] = regresiones
+
+    destino = args.baseline if args.guardar_baseline else args.salida
+    with open(destino, "w", encoding="utf-8") as f:
+        json.dump(documento, f, indent=2, ensure_ascii=False)
+
+    print("\n" + "=" * 80)
+    print(f"Resultados guardados en {destino}")
+    if regresiones:
+        print(f"\n[ERROR] {len(regresiones)} regresión(es) respecto de la línea base:")
+        for regresion in regresiones:
+            print(f"  - {regresion}")
+        sys.exit(1)
+    print("Sin regresiones respecto de la línea base")
+
+
+if __name__ == "__main__":
+    main()
@@ -44,9 +44,53 @@ class Settings(BaseSettings):
     # Configuración de Sincronización
     AUTO_SYNC_ENABLED: bool = True
     AUTO_SYNC_INTERVAL: int = 300  # 5 minutos
+    AUTO_SYNC_JITTER: float = 0.1  # ±10% aleatorio sobre el intervalo
+    AUTO_SYNC_MAX_BACKOFF: int = 3600  # Espera máxima para dispositivos que fallan
+    LIVE_CAPTURE_ENABLED: bool = False  # Captura de marcaciones en tiempo real
+    LIVE_CAPTURE_QUEUE_SIZE: int = 100  # Eventos en cola por cliente antes de descartar
+    SYNC_BATCH_SIZE: int = 5000  # Filas por INSERT masivo de marcaciones
+    SYNC_MAX_WORKERS: int = 8  # Dispositivos sincronizados en paralelo
+    SYNC_DEVICE_TIMEOUT: int = 120  # Segundos máximos por dispositivo
+    SYNC_TOTAL_TIMEOUT: int = 300  # Segundos máximos para toda la flota
+    LOG_ROTATION_RETRY_HOURS: int = 24  # Horas antes de reintentar una rotación no verificada
+    SYNC_SPOOL_DIR: str = "spool"  # Carpeta de volcados crudos (relativa a la aplicación; '' = sin spool)
+    SYNC_QUEUE_SIZE: int = 4  # Lotes en cola entre la decodificación y la escritura en la BD
+    SYNC_CHECKPOINT_BATCHES: int = 1  # Lotes insertados entre puntos de control (commit) de una sincronización
+    CALC_BATCH_SIZE: int = 5000  # Filas por lectura e INSERT masivo del cálculo de asistencia diaria
+    CALC_VECTORIZED: bool = True  # Emparejamiento de marcaciones vectorizado con NumPy (si está instalado)
+    CALC_WORKERS: int = 1  # Procesos del cálculo de asistencia diaria (1 = en el proceso de la API)
+    CALC_CHUNK_USERS: int = 500  # Usuarios por bloque repartido entre los procesos de cálculo
+    RECALC_ENABLED: bool = True  # Recálculo incremental de los días que reciben marcaciones
+    RECALC_INTERVAL: float = 5  # Segundos máximos entre revisiones de los días pendientes
+    RECALC_BATCH_SIZE: int = 5000  # Días pendientes recalculados por lote
+    CLOCK_DRIFT_THRESHOLD: float = 2  # Segundos de deriva tolerados antes de corregir el reloj
+    CLOCK_DRIFT_SAMPLES: int = 3  # Lecturas de hora por medición de deriva
+    
+    # Configuración del Pool de Conexiones ZKTeco
+    ZK_POOL_KEEPALIVE_INTERVAL: int = 30  # Segundos entre sondeos de sesiones inactivas
+    ZK_POOL_IDLE_TIMEOUT: int = 300  # Segundos sin uso antes de cerrar la sesión
+    ZK_ADAPTIVE_TIMEOUT_MIN: float = 1.0  # Piso del timeout de conexión derivado del RTT
+    ZK_READ_LOCK_MODE: str = "ventana"  # Bloqueo en lecturas: sesion, ventana (solo la descarga) o nunca
+    
+    # Configuración del Circuit Breaker por dispositivo
+    CIRCUIT_FAILURE_THRESHOLD: int = 3  # Fallos de conexión seguidos que abren el circuito
+    CIRCUIT_BASE_BACKOFF: int = 30  # Segundos de la primera espera con el circuito abierto
+    CIRCUIT_MAX_BACKOFF: int = 600  # Espera máxima entre intentos de prueba
+    
+    # Configuración del Monitor de Salud
+    HEALTH_PROBE_ENABLED: bool = True  # Sondeo periódico de disponibilidad y latencia
+    HEALTH_PROBE_INTERVAL: int = 60  # Segundos entre rondas de sondeo
+    HEALTH_PROBE_TIMEOUT: float = 3  # Segundos máximos por sondeo
+    HEALTH_PROBE_HISTORY: int = 120  # Muestras conservadas por dispositivo
+    
+    # Configuración de Trabajos en Segundo Plano
+    JOBS_MAX_WORKERS: int = 4  # Trabajos ejecutados a la vez
+    JOBS_RETENTION_DAYS: int = 7  # Días que se conservan los trabajos terminados
     
     # Configuración de Incidencias
     INCIDENCIAS_API_URL: str = "http://localhost:3003/api/incidencias"
+    INCIDENCIAS_TIMEOUT: float = 10  # Segundos máximos de la descarga de incidencias
+    INCIDENCIAS_CACHE_TTL: int = 120  # Segundos que se reutiliza una descarga de incidencias
     
     # Configuración de Logs
     LOG_LEVEL: str = "INFO"
@@ -63,6 +107,16 @@ class Settings(BaseSettings):
         """
         return f"mysql+pymysql://{self.DB_USER}:{self.DB_PASSWORD}@{self.DB_HOST}:{self.DB_PORT}/{self.DB_NAME}"
     
+    @property
+    def spool_dir(self) -> str:
+        """
+        Carpeta del spool de ingesta. Una ruta relativa se resuelve desde la carpeta
+        de la aplicación, no desde el directorio de trabajo del proceso
+        """
+        if not self.SYNC_SPOOL_DIR:
+            return ""
+        return os.path.join(os.path.dirname(os.path.abspath(__file__)), self.SYNC_SPOOL_DIR)
+    
     @property
     def cors_origins_list(self) -> List[str]:
         """
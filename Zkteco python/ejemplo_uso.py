@@ -251,67 +251,47 @@ def ejemplo_obtener_asistencias():
 def ejemplo_monitoreo_tiempo_real():
     """
     Ejemplo de cómo monitorear asistencias en tiempo real.
-    Este método consulta periódicamente el dispositivo para detectar
-    nuevos registros de asistencia.
+    El dispositivo envía cada marcación en el momento en que ocurre
+    (captura de eventos), sin necesidad de descargar los registros
+    una y otra vez.
     """
     print("\n" + "="*80)
     print("EJEMPLO 5: MONITOREO EN TIEMPO REAL")
     print("="*80)
     
-    import time
-    
-    # Paso 1: Conectar al dispositivo
+    # Paso 1: Conectar al dispositivo sin deshabilitarlo
+    # (debe seguir operativo para que los usuarios puedan marcar)
     dispositivo = ZKTecoConnection(IP_DISPOSITIVO, PUERTO)
     
-    if not dispositivo.conectar():
+    if not dispositivo.conectar(deshabilitar=False):
         print("No se pudo conectar al dispositivo")
         return
     
     try:
-        # Paso 2: Obtener registros iniciales para establecer baseline
-        print("\n--- Obteniendo registros iniciales ---")
-        asistencias_anteriores = dispositivo.obtener_asistencias()
-        cantidad_anterior = len(asistencias_anteriores)
-        print(f"Registros actuales: {cantidad_anterior}")
-        
         print("\n--- Iniciando monitoreo (presiona Ctrl+C para detener) ---")
         print("Esperando nuevos registros...\n")
         
-        # Paso 3: Loop de monitoreo
-        while True:
-            try:
-                # Esperar 5 segundos entre consultas
-                time.sleep(5)
-                
-                # Obtener registros actuales
-                asistencias_actuales = dispositivo.obtener_asistencias()
-                cantidad_actual = len(asistencias_actuales)
-                
-                # Paso 4: Detectar nuevos registros
-                if cantidad_actual > cantidad_anterior:
-                    nuevos_registros = cantidad_actual - cantidad_anterior
-                    print(f"\n¡{nuevos_registros} nuevo(s) registro(s) detectado(s)!")
-                    
-                    # Mostrar solo los nuevos registros
-                    for i in range(nuevos_registros):
-                        registro = asistencias_actuales[-(i+1)]
-                        print(f"  Usuario: {registro.user_id}")
-                        print(f"  Hora: {registro.timestamp}")
-                        print(f"  Estado: {registro.status}")
-                        print("-" * 40)
-                    
-                    cantidad_anterior = cantidad_actual
-                else:
+        # Paso 2: Recibir eventos a medida que ocurren
+        # capturar_eventos() entrega None cada segundo sin eventos
+        try:
+            for registro in dispositivo.capturar_eventos(timeout=1):
+                if registro is None:
                     # Mostrar punto para indicar que está monitoreando
                     print(".", end="", flush=True)
-            
-            except KeyboardInterrupt:
-                # Permitir salir con Ctrl+C
-                print("\n\nMonitoreo detenido por el usuario")
-                break
+                    continue
+                
+                print("\n¡Nuevo registro detectado!")
+                print(f"  Usuario: {registro.user_id}")
+                print(f"  Hora: {registro.timestamp}")
+                print(f"  Estado: {registro.status}")
+                print("-" * 40)
+        
+        except KeyboardInterrupt:
+            # Permitir salir con Ctrl+C
+            print("\n\nMonitoreo detenido por el usuario")
     
     finally:
-        # Paso 5: Desconectar
+        # Paso 3: Desconectar
         dispositivo.desconectar()
 
 
@@ -11,6 +11,12 @@ from models.horario import Horario
 from models.turnos import SegmentosHorario, AsignacionHorario, Feriados
 from models.reportes import AsistenciaDiaria, ReportesGenerados, TipoReporte
 from models.departamento import Departamento
+from models.sincronizacion import EstadoSincronizacion, EjecucionSincronizacion
+from models.reloj import DerivaReloj
+from models.operacion_pendiente import OperacionPendiente
+from models.trabajo import Trabajo
+from models.rotacion import PoliticaRotacion, RotacionRegistros
+from models.recalculo import DiaPendiente
 
 __all__ = [
     "Base",
@@ -28,4 +34,12 @@ __all__ = [
     "ReportesGenerados",
     "TipoReporte",
     "Departamento",
+    "EstadoSincronizacion",
+    "EjecucionSincronizacion",
+    "DerivaReloj",
+    "OperacionPendiente",
+    "Trabajo",
+    "PoliticaRotacion",
+    "RotacionRegistros",
+    "DiaPendiente",
 ]
@@ -3,7 +3,7 @@ Modelo de Asistencia
 Representa un registro de asistencia (marcación) de un usuario
 """
 
-from sqlalchemy import Column, Integer, String, DateTime, Boolean, ForeignKey, Index
+from sqlalchemy import Column, Integer, String, DateTime, Boolean, ForeignKey, Index, UniqueConstraint
 from sqlalchemy.orm import relationship
 from datetime import datetime
 from models.database import Base
@@ -41,6 +41,8 @@ class Asistencia(Base):
     
     # Índices compuestos para búsquedas eficientes
     __table_args__ = (
+        # Una marcación es única por usuario, instante y dispositivo (permite INSERT IGNORE masivo)
+        UniqueConstraint('uid', 'timestamp', 'dispositivo_id', name='uq_asistencia_uid_timestamp_dispositivo'),
         Index('idx_uid_timestamp', 'uid', 'timestamp'),
         Index('idx_dispositivo_timestamp', 'dispositivo_id', 'timestamp'),
         Index('idx_timestamp_dispositivo', 'timestamp', 'dispositivo_id'),
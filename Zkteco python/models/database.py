@@ -74,6 +74,14 @@ def drop_db():
             
             # Explicit drop to avoid metadata issues
             tables = [
+                "estado_sincronizacion",
+                "ejecuciones_sincronizacion",
+                "dias_pendientes_recalculo",
+                "trabajos",
+                "politica_rotacion",
+                "rotaciones_registros",
+                "deriva_reloj",
+                "operaciones_pendientes",
                 "asistencias",
                 "asistencia_diaria",
                 "asignacion_horario",
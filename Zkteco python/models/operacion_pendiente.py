@@ -0,0 +1,44 @@
+"""
+Modelo de Operación Pendiente
+Escrituras de usuarios en dispositivos que no se pudieron aplicar (equipo sin conexión)
+"""
+
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey
+from datetime import datetime
+from models.database import Base
+
+
+class OperacionPendiente(Base):
+    """
+    Cola de escrituras de usuarios para dispositivos fuera de servicio.
+    Hay como máximo una operación por usuario y dispositivo: la última solicitada.
+    """
+    __tablename__ = "operaciones_pendientes"
+
+    id = Column(Integer, primary_key=True, index=True, autoincrement=True)
+    dispositivo_id = Column(Integer, ForeignKey("dispositivos.id", ondelete="CASCADE"), nullable=False, index=True)
+    tipo = Column(String(20), nullable=False, comment="sincronizar o eliminar")
+    usuario_id = Column(Integer, nullable=True, comment="ID del usuario en la BD (sincronizar)")
+    user_id = Column(String(20), nullable=True, comment="ID del usuario en el dispositivo")
+
+    intentos = Column(Integer, default=0, comment="Intentos fallidos")
+    ultimo_error = Column(String(255), nullable=True, comment="Motivo del último fallo")
+
+    fecha_creacion = Column(DateTime, default=datetime.now, comment="Fecha de encolado")
+    fecha_actualizacion = Column(DateTime, default=datetime.now, onupdate=datetime.now, comment="Última actualización")
+
+    def __repr__(self):
+        return f"<OperacionPendiente(dispositivo_id={self.dispositivo_id}, tipo='{self.tipo}', user_id='{self.user_id}')>"
+
+    def to_dict(self):
+        """Convierte el objeto a diccionario"""
+        return {
+            "id": self.id,
+            "dispositivo_id": self.dispositivo_id,
+            "tipo": self.tipo,
+            "usuario_id": self.usuario_id,
+            "user_id": self.user_id,
+            "intentos": self.intentos,
+            "ultimo_error": self.ultimo_error,
+            "fecha_creacion": self.fecha_creacion.isoformat() if self.fecha_creacion else None,
+        }
@@ -0,0 +1,34 @@
+"""
+Modelo de Día Pendiente de Recálculo
+Usuario-días con marcaciones nuevas cuya asistencia diaria hay que recalcular
+"""
+
+from sqlalchemy import Column, Integer, Date, DateTime
+from datetime import datetime
+from models.database import Base
+
+
+class DiaPendiente(Base):
+    """
+    Usuario-día "sucio": entró al menos una marcación desde su último cálculo.
+    Hay como máximo una fila por (uid, fecha); cada nueva marcación incrementa la versión,
+    así el recálculo solo la borra si nadie la volvió a marcar mientras calculaba.
+    """
+    __tablename__ = "dias_pendientes_recalculo"
+
+    uid = Column(Integer, primary_key=True, autoincrement=False, comment="UID del usuario (como en asistencias)")
+    fecha = Column(Date, primary_key=True, comment="Día a recalcular")
+    version = Column(Integer, nullable=False, default=1, comment="Veces marcado desde el último recálculo")
+    fecha_marcado = Column(DateTime, default=datetime.now, index=True, comment="Momento en que el día quedó pendiente")
+
+    def __repr__(self):
+        return f"<DiaPendiente(uid={self.uid}, fecha={self.fecha}, version={self.version})>"
+
+    def to_dict(self):
+        """Convierte el objeto a diccionario"""
+        return {
+            "uid": self.uid,
+            "fecha": self.fecha.isoformat() if self.fecha else None,
+            "version": self.version,
+            "fecha_marcado": self.fecha_marcado.isoformat() if self.fecha_marcado else None,
+        }
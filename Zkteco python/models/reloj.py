@@ -0,0 +1,43 @@
+"""
+Modelo de Deriva de Reloj
+Historial de mediciones (y correcciones) del reloj de cada dispositivo
+"""
+
+from sqlalchemy import Column, Integer, Float, Boolean, DateTime, ForeignKey
+from datetime import datetime
+from models.database import Base
+
+
+class DerivaReloj(Base):
+    """
+    Tabla con cada medición del desfase entre el reloj del dispositivo y el del servidor.
+    Una deriva positiva indica que el dispositivo está adelantado.
+    """
+    __tablename__ = "deriva_reloj"
+
+    id = Column(Integer, primary_key=True, index=True, autoincrement=True)
+    dispositivo_id = Column(Integer, ForeignKey("dispositivos.id", ondelete="CASCADE"), nullable=False, index=True)
+    fecha = Column(DateTime, default=datetime.now, index=True, comment="Momento de la medición")
+
+    deriva_segundos = Column(Float, nullable=False, comment="Desfase medido (positivo = dispositivo adelantado)")
+    incertidumbre_segundos = Column(Float, comment="Margen de error de la medición (±)")
+    rtt_ms = Column(Float, comment="Menor tiempo de ida y vuelta observado")
+
+    corregido = Column(Boolean, default=False, comment="Si se ajustó el reloj tras la medición")
+    deriva_posterior = Column(Float, nullable=True, comment="Desfase medido después de corregir")
+
+    def __repr__(self):
+        return f"<DerivaReloj(dispositivo_id={self.dispositivo_id}, deriva={self.deriva_segundos}, corregido={self.corregido})>"
+
+    def to_dict(self):
+        """Convierte el objeto a diccionario"""
+        return {
+            "id": self.id,
+            "dispositivo_id": self.dispositivo_id,
+            "fecha": self.fecha.isoformat() if self.fecha else None,
+            "deriva_segundos": self.deriva_segundos,
+            "incertidumbre_segundos": self.incertidumbre_segundos,
+            "rtt_ms": self.rtt_ms,
+            "corregido": self.corregido,
+            "deriva_posterior": self.deriva_posterior,
+        }
@@ -0,0 +1,77 @@
+"""
+Modelos de Rotación de Registros
+Política de vaciado de la memoria de marcaciones de cada dispositivo y su auditoría
+"""
+
+from sqlalchemy import Column, Integer, String, Boolean, DateTime, ForeignKey
+from datetime import datetime
+from models.database import Base
+
+
+class PoliticaRotacion(Base):
+    """
+    Cuándo vaciar la memoria de marcaciones de un dispositivo tras sincronizar.
+    Se rota al alcanzar max_registros o cuando la marcación más antigua supera max_dias.
+    """
+    __tablename__ = "politica_rotacion"
+
+    dispositivo_id = Column(Integer, ForeignKey("dispositivos.id", ondelete="CASCADE"), primary_key=True)
+    activo = Column(Boolean, default=True, comment="Rotación automática habilitada")
+    max_registros = Column(Integer, nullable=True, comment="Registros en el dispositivo que disparan la rotación")
+    max_dias = Column(Integer, nullable=True, comment="Antigüedad (días) de la marcación más antigua que dispara la rotación")
+
+    fecha_actualizacion = Column(DateTime, default=datetime.now, onupdate=datetime.now, comment="Última actualización")
+
+    def __repr__(self):
+        return f"<PoliticaRotacion(dispositivo_id={self.dispositivo_id}, max_registros={self.max_registros}, max_dias={self.max_dias})>"
+
+    def to_dict(self):
+        """Convierte el objeto a diccionario"""
+        return {
+            "dispositivo_id": self.dispositivo_id,
+            "activo": self.activo,
+            "max_registros": self.max_registros,
+            "max_dias": self.max_dias,
+            "fecha_actualizacion": self.fecha_actualizacion.isoformat() if self.fecha_actualizacion else None,
+        }
+
+
+class RotacionRegistros(Base):
+    """
+    Auditoría de cada intento de rotación: qué se verificó y si se vació el dispositivo
+    """
+    __tablename__ = "rotaciones_registros"
+
+    id = Column(Integer, primary_key=True, index=True, autoincrement=True)
+    dispositivo_id = Column(Integer, ForeignKey("dispositivos.id", ondelete="CASCADE"), nullable=False, index=True)
+    fecha = Column(DateTime, default=datetime.now, index=True, comment="Momento del intento")
+    motivo = Column(String(100), nullable=False, comment="Condición de la política cumplida (o manual)")
+    resultado = Column(String(20), nullable=False, comment="rotado, omitido o error")
+
+    registros_dispositivo = Column(Integer, default=0, comment="Registros distintos leídos del dispositivo")
+    registros_verificados = Column(Integer, default=0, comment="Registros encontrados en la BD")
+    checksum_dispositivo = Column(String(16), nullable=True, comment="Checksum de los registros del dispositivo")
+    checksum_bd = Column(String(16), nullable=True, comment="Checksum de los mismos registros en la BD")
+    desde = Column(DateTime, nullable=True, comment="Marcación más antigua del rango verificado")
+    hasta = Column(DateTime, nullable=True, comment="Marcación más reciente del rango verificado")
+    mensaje = Column(String(255), nullable=True, comment="Detalle del resultado")
+
+    def __repr__(self):
+        return f"<RotacionRegistros(dispositivo_id={self.dispositivo_id}, resultado='{self.resultado}', registros={self.registros_dispositivo})>"
+
+    def to_dict(self):
+        """Convierte el objeto a diccionario"""
+        return {
+            "id": self.id,
+            "dispositivo_id": self.dispositivo_id,
+            "fecha": self.fecha.isoformat() if self.fecha else None,
+            "motivo": self.motivo,
+            "resultado": self.resultado,
+            "registros_dispositivo": self.registros_dispositivo,
+            "registros_verificados": self.registros_verificados,
+            "checksum_dispositivo": self.checksum_dispositivo,
+            "checksum_bd": self.checksum_bd,
+            "desde": self.desde.isoformat() if self.desde else None,
+            "hasta": self.hasta.isoformat() if self.hasta else None,
+            "mensaje": self.mensaje,
+        }
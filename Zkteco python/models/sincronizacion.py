@@ -0,0 +1,123 @@
+"""
+Modelos de Sincronización
+Marca de agua (high-water mark) de la sincronización incremental por dispositivo
+y registro de cada ejecución con su punto de control
+"""
+
+from sqlalchemy import Column, Integer, BigInteger, String, Boolean, Float, DateTime, ForeignKey
+from datetime import datetime
+from models.database import Base
+
+
+class EstadoSincronizacion(Base):
+    """
+    Tabla con el estado de la última sincronización de asistencias de cada dispositivo.
+    Permite omitir dispositivos sin cambios y procesar solo los registros nuevos.
+    """
+    __tablename__ = "estado_sincronizacion"
+
+    dispositivo_id = Column(Integer, ForeignKey("dispositivos.id", ondelete="CASCADE"), primary_key=True)
+
+    # Identidad del equipo: si cambia el serial la marca de agua deja de ser válida
+    serial_number = Column(String(50), nullable=True, comment="Serial del dispositivo al sincronizar")
+
+    # Marca de agua
+    ultimo_conteo_registros = Column(Integer, default=0, comment="Registros almacenados en el dispositivo en la última sincronización")
+    ultimo_timestamp = Column(DateTime, nullable=True, comment="Marcación más reciente ingerida")
+    primer_epoch = Column(BigInteger, nullable=True, comment="Primera marcación de la memoria (epoch): cambia si se borró y volvió a llenar")
+
+    # Marca baja: marcaciones de usuarios que no existían en la BD al leerlas
+    indice_pendiente = Column(Integer, nullable=True, comment="Primer registro de un usuario desconocido aún sin ingerir")
+    usuarios_hasta = Column(DateTime, nullable=True, comment="Inicio de la lectura que fijó indice_pendiente (usuarios posteriores obligan a releer)")
+
+    fecha_actualizacion = Column(DateTime, default=datetime.now, onupdate=datetime.now, comment="Última actualización")
+
+    def __repr__(self):
+        return f"<EstadoSincronizacion(dispositivo_id={self.dispositivo_id}, registros={self.ultimo_conteo_registros}, ultimo='{self.ultimo_timestamp}')>"
+
+    def to_dict(self):
+        """Convierte el objeto a diccionario"""
+        return {
+            "dispositivo_id": self.dispositivo_id,
+            "serial_number": self.serial_number,
+            "ultimo_conteo_registros": self.ultimo_conteo_registros,
+            "ultimo_timestamp": self.ultimo_timestamp.isoformat() if self.ultimo_timestamp else None,
+            "primer_epoch": self.primer_epoch,
+            "indice_pendiente": self.indice_pendiente,
+            "usuarios_hasta": self.usuarios_hasta.isoformat() if self.usuarios_hasta else None,
+            "fecha_actualizacion": self.fecha_actualizacion.isoformat() if self.fecha_actualizacion else None,
+        }
+
+
+class EjecucionSincronizacion(Base):
+    """
+    Cada ejecución de la sincronización de asistencias de un dispositivo: tiempos,
+    contadores y el punto de control (checkpoint) confirmado en la BD.
+
+    Las marcaciones se confirman por lotes junto con el punto de control: si la
+    ejecución falla, la siguiente retoma la memoria del dispositivo desde
+    checkpoint_indice en lugar de volver a escribirla desde el principio.
+    """
+    __tablename__ = "ejecuciones_sincronizacion"
+
+    id = Column(Integer, primary_key=True, index=True, autoincrement=True)
+    dispositivo_id = Column(Integer, ForeignKey("dispositivos.id", ondelete="CASCADE"), nullable=False, index=True)
+    estado = Column(String(20), nullable=False, default="en_curso", comment="en_curso, completado, fallido o interrumpido")
+    completo = Column(Boolean, default=False, comment="Se pidió procesar toda la memoria")
+    serial_number = Column(String(50), nullable=True, comment="Serial del dispositivo")
+    reanuda_de = Column(Integer, nullable=True, comment="Ejecución fallida cuyo punto de control se retomó")
+
+    # Tiempos
+    fecha_inicio = Column(DateTime, default=datetime.now, index=True, comment="Inicio de la ejecución")
+    fecha_fin = Column(DateTime, nullable=True, comment="Fin de la ejecución")
+    segundos_descarga = Column(Float, nullable=True, comment="Conexión, conteos y descarga del buffer")
+    segundos_escritura = Column(Float, nullable=True, comment="Decodificación e inserción en la BD")
+    dispositivo_deshabilitado_ms = Column(Integer, nullable=True, comment="Tiempo con el dispositivo deshabilitado")
+
+    # Contadores (confirmados en la BD)
+    registros_dispositivo = Column(Integer, nullable=True, comment="Registros en la memoria del dispositivo")
+    indice_inicial = Column(Integer, default=0, comment="Posición de la memoria desde la que se procesó")
+    registros_procesados = Column(Integer, default=0, comment="Registros recorridos tras el filtro de la marca de agua")
+    registros_insertados = Column(Integer, default=0, comment="Registros nuevos en la BD")
+    registros_duplicados = Column(Integer, default=0, comment="Registros ya existentes")
+    usuarios_desconocidos = Column(Integer, default=0, comment="Registros de usuarios que no existen en la BD")
+    lotes_confirmados = Column(Integer, default=0, comment="Puntos de control confirmados")
+
+    # Punto de control: todo lo anterior a checkpoint_indice está confirmado en la BD
+    checkpoint_indice = Column(Integer, nullable=True, comment="Posición siguiente al último registro confirmado")
+    checkpoint_epoch = Column(BigInteger, nullable=True, comment="Marcación más reciente confirmada (epoch)")
+
+    error = Column(String(255), nullable=True, comment="Motivo del fallo")
+
+    def __repr__(self):
+        return f"<EjecucionSincronizacion(id={self.id}, dispositivo_id={self.dispositivo_id}, estado='{self.estado}', checkpoint={self.checkpoint_indice})>"
+
+    def to_dict(self):
+        """Convierte el objeto a diccionario"""
+        duracion = None
+        if self.fecha_inicio and self.fecha_fin:
+            duracion = round((self.fecha_fin - self.fecha_inicio).total_seconds(), 3)
+        return {
+            "id": self.id,
+            "dispositivo_id": self.dispositivo_id,
+            "estado": self.estado,
+            "completo": self.completo,
+            "serial_number": self.serial_number,
+            "reanuda_de": self.reanuda_de,
+            "fecha_inicio": self.fecha_inicio.isoformat() if self.fecha_inicio else None,
+            "fecha_fin": self.fecha_fin.isoformat() if self.fecha_fin else None,
+            "segundos_total": duracion,
+            "segundos_descarga": self.segundos_descarga,
+            "segundos_escritura": self.segundos_escritura,
+            "dispositivo_deshabilitado_ms": self.dispositivo_deshabilitado_ms,
+            "registros_dispositivo": self.registros_dispositivo,
+            "indice_inicial": self.indice_inicial,
+            "registros_procesados": self.registros_procesados,
+            "registros_insertados": self.registros_insertados,
+            "registros_duplicados": self.registros_duplicados,
+            "usuarios_desconocidos": self.usuarios_desconocidos,
+            "lotes_confirmados": self.lotes_confirmados,
+            "checkpoint_indice": self.checkpoint_indice,
+            "checkpoint_epoch": self.checkpoint_epoch,
+            "error": self.error,
+        }
@@ -0,0 +1,52 @@
+"""
+Modelo de Trabajo
+Operaciones largas (sincronizaciones, cálculos) ejecutadas en segundo plano
+"""
+
+from sqlalchemy import Column, Integer, String, Text, DateTime
+from datetime import datetime
+import json
+from models.database import Base
+
+
+class Trabajo(Base):
+    """
+    Tabla con el estado, el progreso y el resultado de cada trabajo en segundo plano.
+    La clave identifica trabajos equivalentes (mismo tipo y parámetros) para no duplicarlos.
+    """
+    __tablename__ = "trabajos"
+
+    id = Column(String(32), primary_key=True, comment="Identificador público del trabajo")
+    tipo = Column(String(50), nullable=False, index=True, comment="Operación ejecutada")
+    clave = Column(String(255), nullable=False, index=True, comment="Tipo y parámetros normalizados")
+    parametros = Column(Text, nullable=True, comment="Parámetros en JSON")
+
+    estado = Column(String(20), nullable=False, default="pendiente", index=True,
+                    comment="pendiente, en_curso, completado, fallido o cancelado")
+    progreso = Column(Integer, default=0, comment="Porcentaje de avance (0-100)")
+    mensaje = Column(String(255), nullable=True, comment="Último paso informado")
+    resultado = Column(Text, nullable=True, comment="Resultado en JSON")
+    error = Column(Text, nullable=True, comment="Motivo del fallo")
+
+    fecha_creacion = Column(DateTime, default=datetime.now, index=True, comment="Fecha de envío")
+    fecha_inicio = Column(DateTime, nullable=True, comment="Inicio de la ejecución")
+    fecha_fin = Column(DateTime, nullable=True, comment="Fin de la ejecución")
+
+    def __repr__(self):
+        return f"<Trabajo(id='{self.id}', tipo='{self.tipo}', estado='{self.estado}')>"
+
+    def to_dict(self):
+        """Convierte el objeto a diccionario"""
+        return {
+            "id": self.id,
+            "tipo": self.tipo,
+            "parametros": json.loads(self.parametros) if self.parametros else {},
+            "estado": self.estado,
+            "progreso": self.progreso,
+            "mensaje": self.mensaje,
+            "resultado": json.loads(self.resultado) if self.resultado else None,
+            "error": self.error,
+            "fecha_creacion": self.fecha_creacion.isoformat() if self.fecha_creacion else None,
+            "fecha_inicio": self.fecha_inicio.isoformat() if self.fecha_inicio else None,
+            "fecha_fin": self.fecha_fin.isoformat() if self.fecha_fin else None,
+        }
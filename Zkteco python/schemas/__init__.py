@@ -20,6 +20,7 @@ from schemas.asistencia import (
     AsistenciaFilter,
     AsistenciaSincronizacion
 )
+from schemas.trabajo import TrabajoEnviado
 from schemas.horario import (
     HorarioCreate,
     HorarioUpdate,
@@ -39,6 +40,7 @@ __all__ = [
     "AsistenciaResponse",
     "AsistenciaFilter",
     "AsistenciaSincronizacion",
+    "TrabajoEnviado",
     "HorarioCreate",
     "HorarioUpdate",
     "HorarioResponse",
@@ -45,8 +45,21 @@ class AsistenciaSincronizacion(BaseModel):
     success: bool
     message: str
     registros_nuevos: int = 0
+    registros_omitidos: int = 0
     registros_totales: int = 0
+    registros_procesados: int = 0
     dispositivo_id: int
+    dispositivo_deshabilitado_ms: Optional[int] = Field(None, description="Tiempo que el dispositivo estuvo deshabilitado (descarga)")
+    rotacion: Optional[dict] = Field(None, description="Resultado de la rotación de registros, si se aplicó")
+    ejecucion_id: Optional[int] = Field(None, description="Ejecución registrada en ejecuciones_sincronizacion")
+    reanudada_desde: Optional[int] = Field(None, description="Registro desde el que se retomó una ejecución fallida")
+
+
+class PoliticaRotacionUpdate(BaseModel):
+    """Schema para configurar la rotación de registros de un dispositivo"""
+    max_registros: Optional[int] = Field(None, ge=1, description="Registros en el dispositivo que disparan la rotación")
+    max_dias: Optional[int] = Field(None, ge=1, description="Antigüedad (días) de la marcación más antigua que dispara la rotación")
+    activo: bool = Field(default=True, description="Rotación automática habilitada")
 
 
 class AsistenciaDiariaResponse(BaseModel):
@@ -0,0 +1,14 @@
+"""
+Schemas de Pydantic para Trabajos en Segundo Plano
+Respuesta de los endpoints que aceptan asincrono=true
+"""
+
+from pydantic import BaseModel, Field
+
+
+class TrabajoEnviado(BaseModel):
+    """Schema para la respuesta 202 de un trabajo encolado"""
+    trabajo_id: str = Field(..., description="Id del trabajo (o del trabajo idéntico que sigue en curso)")
+    estado: str = Field(..., description="pendiente, en_curso, completado, fallido o cancelado")
+    duplicado: bool = Field(..., description="True si se devolvió un trabajo idéntico ya encolado")
+    url: str = Field(..., description="Endpoint para consultar el estado del trabajo")
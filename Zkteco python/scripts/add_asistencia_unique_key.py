@@ -0,0 +1,57 @@
+import sys
+import os
+
+# Add parent directory to path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, text
+from config import settings
+
+
+def add_unique_key():
+    """
+    Agrega la clave única (uid, timestamp, dispositivo_id) a `asistencias`.
+    Antes elimina las marcaciones duplicadas conservando la de menor id.
+    """
+    print("Connecting to database...")
+    engine = create_engine(settings.database_url)
+
+    delete_duplicates = """
+        DELETE a FROM asistencias a
+        JOIN asistencias b
+          ON a.uid = b.uid
+         AND a.timestamp = b.timestamp
+         AND a.dispositivo_id = b.dispositivo_id
+         AND a.id > b.id
+    """
+    add_key = (
+        "ALTER TABLE asistencias ADD UNIQUE KEY uq_asistencia_uid_timestamp_dispositivo "
+        "(uid, timestamp, dispositivo_id)"
+    )
+
+    with engine.connect() as connection:
+        print("Removing duplicated punches...")
+        result = connection.execute(text(delete_duplicates))
+        print(f"Deleted {result.rowcount} duplicated rows")
+
+        try:
+            print(f"Executing: {add_key}")
+            connection.execute(text(add_key))
+            print("Success")
+        except Exception as e:
+            if "Duplicate key name" in str(e):
+                print("Unique key already exists, skipping.")
+            else:
+                raise
+
+        connection.commit()
+    print("Schema update completed.")
+
+
+if __name__ == "__main__":
+    try:
+        add_unique_key()
+        sys.exit(0)
+    except Exception as e:
+        print(f"Critical error: {e}")
+        sys.exit(1)
@@ -0,0 +1,76 @@
+"""
+Script para ejecutar dispositivos ZKTeco simulados (pruebas de carga e integración)
+"""
+
+import sys
+import os
+import argparse
+import time
+
+# Agregar el directorio raíz al path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from zkteco_simulador import SimuladorFlota, ConfiguracionSimulador
+
+
+def main():
+    """
+    Inicia N dispositivos simulados en localhost hasta presionar Ctrl+C
+    """
+    parser = argparse.ArgumentParser(description="Simulador de dispositivos ZKTeco")
+    parser.add_argument("--dispositivos", type=int, default=1, help="Cantidad de dispositivos")
+    parser.add_argument("--registros", type=int, default=1000, help="Marcaciones por dispositivo")
+    parser.add_argument("--usuarios", type=int, default=50, help="Usuarios por dispositivo")
+    parser.add_argument("--duplicados", type=float, default=0.0, help="Proporción de marcaciones repetidas")
+    parser.add_argument("--latencia", type=float, default=0.0, help="Segundos de latencia por respuesta")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Variación de la latencia (segundos)")
+    parser.add_argument("--perdida", type=float, default=0.0, help="Probabilidad de perder una respuesta")
+    parser.add_argument("--desconexion", type=float, default=0.0, help="Probabilidad de cortar la conexión")
+    parser.add_argument("--password", type=int, default=0, help="Contraseña de comunicación")
+    parser.add_argument("--direcciones-distintas", action="store_true", help="Una IP 127.0.0.N por dispositivo (Linux)")
+    parser.add_argument("--marcaciones-por-minuto", type=int, default=0, help="Marcaciones nuevas por minuto y dispositivo")
+    args = parser.parse_args()
+
+    configuraciones = [
+        ConfiguracionSimulador(
+            registros=args.registros,
+            usuarios=args.usuarios,
+            proporcion_duplicados=args.duplicados,
+            latencia=args.latencia,
+            jitter=args.jitter,
+            perdida=args.perdida,
+            desconexion=args.desconexion,
+            password=args.password,
+            semilla=i,
+            primer_user_id=1001 + i * args.usuarios
+        )
+        for i in range(args.dispositivos)
+    ]
+
+    print("=" * 80)
+    print("SIMULADOR DE DISPOSITIVOS ZKTECO")
+    print("=" * 80)
+
+    with SimuladorFlota(configuraciones, direcciones_distintas=args.direcciones_distintas) as flota:
+        for dispositivo, (host, puerto) in zip(flota.dispositivos, flota.direcciones):
+            print(f"  {dispositivo.serial}: {host}:{puerto} "
+                  f"({len(dispositivo.marcaciones)} marcaciones, {len(dispositivo.usuarios)} usuarios)")
+        print("\nPresione Ctrl+C para detener los dispositivos")
+        print("=" * 80 + "\n")
+
+        try:
+            while True:
+                time.sleep(60)
+                if args.marcaciones_por_minuto:
+                    for dispositivo in flota.dispositivos:
+                        flota.ejecutar(dispositivo.agregar_marcaciones, args.marcaciones_por_minuto)
+        except KeyboardInterrupt:
+            pass
+
+        print("\nEstadísticas:")
+        for estadistica in flota.estadisticas():
+            print(f"  {estadistica}")
+
+
+if __name__ == "__main__":
+    main()
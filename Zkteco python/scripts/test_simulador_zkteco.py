@@ -0,0 +1,2002 @@
+import sys
+import os
+import asyncio
+import shutil
+import struct
+import tempfile
+import threading
+import time
+import tracemalloc
+import unittest
+from unittest import mock
+from datetime import datetime, timedelta, date, time as dt_time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import zkteco_tcp_protocol as protocolo
+from zkteco_tcp_protocol import DecodificadorAsistencias, datetime_a_epoch
+from zkteco_connection import ZKTecoConnection
+from zkteco_async import ZKTecoAsyncConnection
+from zkteco_simulador import SimuladorFlota, ConfiguracionSimulador
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import Session
+from sqlalchemy.pool import StaticPool
+from models.database import Base, SessionLocal
+from models.dispositivo import Dispositivo
+from models.usuario import Usuario
+from services.usuario_service import UsuarioService
+from services.sincronizacion_service import SincronizacionService
+from services.asistencia_service import AsistenciaService
+from services.rotacion_service import RotacionService
+from services.flota_service import FlotaService
+from models.sincronizacion import EstadoSincronizacion, EjecucionSincronizacion
+from models.asistencia import Asistencia
+from models.rotacion import PoliticaRotacion
+from zkteco_pool import PoolConexiones, pool_conexiones
+import zkteco_pyzk
+from zkteco_salud import MonitorSalud
+from zkteco_circuito import Circuito, ABIERTO, CERRADO, SEMIABIERTO
+from zkteco_trabajos import GestorTrabajos, gestor_trabajos, TrabajoCancelado, CancelacionNoAdmitida
+from zkteco_ingesta import flujo_acotado, spool_ingesta
+from zkteco_tiempo_real import CapturaTiempoReal, DifusorEventos
+from zkteco_planificador import PlanificadorSincronizacion
+from models.horario import Horario
+from models.turnos import SegmentosHorario, AsignacionHorario, Feriados
+from models.reportes import AsistenciaDiaria
+from services import calculo_service
+from services.calculo_service import CalculoService
+from services.incidencia_service import IndiceIncidencias, CacheIncidencias, cache_incidencias
+from services.recalculo_service import RecalculoService
+from zkteco_recalculo import recalculador_incremental
+from models.recalculo import DiaPendiente
+from config import settings
+
+
+INICIO = datetime(2025, 1, 6, 7, 0, 0)
+# BD desechable para las pruebas de servicios (se crea al importar el módulo)
+ENGINE = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+
+
+def setUpModule():
+    # El spool de las pruebas va a una carpeta temporal, no al spool/ de la aplicación
+    global DIRECTORIO_SPOOL
+    DIRECTORIO_SPOOL = spool_ingesta.directorio
+    spool_ingesta.directorio = tempfile.mkdtemp(prefix="zk-spool-")
+
+
+def tearDownModule():
+    shutil.rmtree(spool_ingesta.directorio, ignore_errors=True)
+    spool_ingesta.directorio = DIRECTORIO_SPOOL
+
+
+def esperados(dispositivo):
+    """Marcaciones del simulador como tuplas (uid, epoch, estado, punch)"""
+    return [(int(user_id), datetime_a_epoch(ts), estado, punch)
+            for _uid, user_id, ts, estado, punch in dispositivo.marcaciones]
+
+
+class TestDecodificadorAsistencias(unittest.TestCase):
+    def test_bloques_partidos_y_filtros(self):
+        for tam in (8, 16, 40):
+            registros = [(i % 5 + 1, str(1001 + i % 5), INICIO + timedelta(minutes=i), 1, 0) for i in range(300)]
+            cuerpo = b''.join(protocolo.pack_attendance(tam, *r) for r in registros)
+            buffer = struct.pack('<I', len(cuerpo)) + cuerpo
+            bloques = [buffer[i:i + 37] for i in range(0, len(buffer), 37)]
+            mapa = {uid: str(1000 + uid) for uid in range(1, 6)}
+            todos = [(int(r[1]), datetime_a_epoch(r[2]), 1, 0) for r in registros]
+
+            decodificador = DecodificadorAsistencias(len(registros), mapa, bloques=bloques)
+            self.assertEqual(list(decodificador), todos)
+            self.assertEqual(decodificador.total, 300)
+            self.assertEqual(decodificador.maximo_epoch, todos[-1][1])
+
+            # Marca de agua: lo posterior al índice o al último timestamp ingerido
+            decodificador = DecodificadorAsistencias(
+                len(registros), mapa, indice_desde=250, marca_epoch=todos[199][1], bloques=bloques
+            )
+            self.assertEqual(list(decodificador), todos[200:])
+
+            decodificador = DecodificadorAsistencias(
+                len(registros), mapa, epoch_min=todos[10][1], epoch_max=todos[20][1], bloques=bloques
+            )
+            self.assertEqual(list(decodificador), todos[10:20])
+
+            # Conteo leído antes (o después) que el buffer: se decodifica lo que trae el buffer
+            for conteo in (len(registros) - 1, len(registros) + 2):
+                decodificador = DecodificadorAsistencias(conteo, mapa, bloques=bloques)
+                self.assertEqual(list(decodificador), todos)
+
+    def test_buffer_incompatible_falla_visiblemente(self):
+        buffer = struct.pack('<I', 1001) + bytes(1001)
+        with self.assertRaises(ValueError):
+            list(DecodificadorAsistencias(25, bloques=[buffer]))
+        self.assertEqual(list(DecodificadorAsistencias(0, bloques=[struct.pack('<I', 0)])), [])
+
+
+class TestLecturaPorBloques(unittest.TestCase):
+    def test_memoria_acotada_en_un_dispositivo_grande(self):
+        flota = SimuladorFlota([ConfiguracionSimulador(registros=60000, usuarios=50, inicio=INICIO, semilla=8)])
+        (host, puerto), = flota.iniciar()
+        tamanos = []
+
+        def medidos(bloques):
+            for bloque in bloques:
+                tamanos.append(len(bloque))
+                yield bloque
+
+        try:
+            zk = ZKTecoConnection(host, puerto, ommit_ping=True)
+            self.assertTrue(zk.conectar())
+            try:
+                registros = zk.iterar_asistencias()
+                registros.bloques = medidos(registros.bloques)
+                tracemalloc.start()
+                try:
+                    leidos = sum(1 for _ in registros)
+                    _, pico = tracemalloc.get_traced_memory()
+                finally:
+                    tracemalloc.stop()
+                # La sesión sigue sirviendo: el buffer del dispositivo se liberó
+                self.assertEqual(zk.obtener_conteos()['registros'], 60000)
+            finally:
+                zk.desconectar()
+        finally:
+            flota.detener()
+
+        buffer = 4 + 60000 * 40
+        self.assertEqual(leidos, 60000)
+        self.assertEqual(sum(tamanos), buffer)
+        # Nunca se junta el buffer: bloques de CMD_READ_BUFFER y memoria muy por debajo de su tamaño
+        self.assertLessEqual(max(tamanos), protocolo.MAX_CHUNK)
+        self.assertLess(pico, buffer // 2)
+
+
+class TestSimuladorZKTeco(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.flota = SimuladorFlota([
+            ConfiguracionSimulador(registros=3000, usuarios=20, inicio=INICIO, semilla=1),
+            ConfiguracionSimulador(registros=500, usuarios=5, inicio=INICIO, tam_registro=8,
+                                   tam_usuario=28, password=1234, desfase_reloj=-90, semilla=2),
+        ])
+        cls.direcciones = cls.flota.iniciar()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.flota.detener()
+
+    def conectar(self, indice, password=0):
+        host, puerto = self.direcciones[indice]
+        zk = ZKTecoConnection(host, puerto, password=password, ommit_ping=True)
+        self.assertTrue(zk.conectar())
+        return zk
+
+    def test_pyzk_lee_asistencias_en_bloques(self):
+        zk = self.conectar(0)
+        try:
+            self.assertEqual(zk.obtener_conteos()['registros'], 3000)
+            self.assertEqual(zk.obtener_numero_serie(), self.flota.dispositivos[0].serial)
+            self.assertEqual(list(zk.iterar_asistencias()), esperados(self.flota.dispositivos[0]))
+            self.assertEqual(len(zk.obtener_asistencias()), 3000)
+        finally:
+            zk.desconectar()
+        self.assertGreater(self.flota.estadisticas()[0]["segundos_deshabilitado"], 0)
+
+    def test_timeout_de_operaciones_tras_conectar(self):
+        host, puerto = self.direcciones[0]
+        for version in (zkteco_pyzk.VERSION_PYZK, (99, 0)):
+            with mock.patch.object(zkteco_pyzk, "VERSION_PYZK", version):
+                zk = ZKTecoConnection(host, puerto, timeout=7, ommit_ping=True, timeout_conexion=1)
+                self.assertTrue(zk.conectar())
+            try:
+                # Versión no verificada: sesión nueva en lugar de tocar los internos de pyzk
+                self.assertEqual(zk.conn is zk.zk, version == zkteco_pyzk.VERSION_PYZK)
+                self.assertEqual(zk.conn._ZK__sock.gettimeout(), 7)
+                self.assertEqual(zk.obtener_conteos()['registros'], 3000)
+            finally:
+                zk.desconectar()
+
+    def test_primera_marcacion_sin_descargar_el_buffer(self):
+        for indice, password in ((0, 0), (1, 1234)):
+            simulado = self.flota.dispositivos[indice]
+            zk = self.conectar(indice, password=password)
+            try:
+                self.assertEqual(zk.obtener_primera_marcacion(), esperados(simulado)[0][1])
+                # La sesión sigue sirviendo tras la lectura parcial
+                self.assertEqual(len(list(zk.iterar_asistencias())), len(simulado.marcaciones))
+            finally:
+                zk.desconectar()
+
+    def test_pyzk_con_password_y_registros_de_8_bytes(self):
+        zk = self.conectar(1, password=1234)
+        try:
+            self.assertEqual(list(zk.iterar_asistencias()), esperados(self.flota.dispositivos[1]))
+        finally:
+            zk.desconectar()
+
+    def test_pyzk_usuarios_y_hora(self):
+        zk = self.conectar(1, password=1234)
+        try:
+            self.assertEqual(len(zk.obtener_usuarios()), 5)
+            self.assertTrue(zk.agregar_usuario('2001', 'Nuevo', user_id_num=50))
+            self.assertIn('2001', [u.user_id for u in zk.obtener_usuarios()])
+            self.assertTrue(zk.eliminar_usuario('2001'))
+            self.assertNotIn('2001', [u.user_id for u in zk.obtener_usuarios()])
+
+            desfase = (zk.obtener_hora_dispositivo() - datetime.now()).total_seconds()
+            self.assertAlmostEqual(desfase, -90, delta=2)
+            self.assertTrue(zk.establecer_hora_dispositivo())
+            desfase = (zk.obtener_hora_dispositivo() - datetime.now()).total_seconds()
+            self.assertAlmostEqual(desfase, 0, delta=2)
+        finally:
+            zk.desconectar()
+
+    def test_lote_de_usuarios_solo_con_pyzk_verificado(self):
+        dispositivo = self.flota.dispositivos[0]
+        zk = self.conectar(0)
+        try:
+            for version, escrituras in ((zkteco_pyzk.VERSION_PYZK, 1), ((99, 0), 3)):
+                lote = [(800 + n, f"Lote {n}", 0, "", "", str(4100 + n)) for n in range(3)]
+                antes = dispositivo.escrituras
+                with mock.patch.object(zkteco_pyzk, "VERSION_PYZK", version):
+                    self.assertEqual(zk.agregar_usuarios_lote(lote), 3)
+                # Versión no verificada: uno a uno con la API pública (set_user)
+                self.assertEqual(dispositivo.escrituras - antes, escrituras)
+                self.assertEqual({dispositivo.usuarios[uid][4] for uid, *_ in lote}, {"4100", "4101", "4102"})
+                for uid, *_ in lote:
+                    del dispositivo.usuarios[uid]
+        finally:
+            zk.desconectar()
+
+    def test_indice_de_usuarios(self):
+        dispositivo = self.flota.dispositivos[0]
+        zk = self.conectar(0)
+        try:
+            zk.obtener_usuarios()
+            lecturas, escrituras = dispositivo.lecturas_usuarios, dispositivo.escrituras
+
+            # Las ediciones resuelven el UID con el índice: una escritura, sin descargar la tabla
+            self.assertTrue(zk.agregar_usuario('3001', 'Indice', user_id_num=700000))
+            self.assertTrue(zk.modificar_usuario('3001', name='Indice 2'))
+            self.assertTrue(zk.modificar_usuario('3001', name='Indice 2'))
+            self.assertTrue(zk.eliminar_usuario('3001'))
+            self.assertEqual(dispositivo.lecturas_usuarios, lecturas)
+            self.assertEqual(dispositivo.escrituras, escrituras + 3)
+
+            # Un alta hecha por fuera cambia la cantidad de usuarios: el índice se recarga
+            uid = max(dispositivo.usuarios) + 1
+            dispositivo.usuarios[uid] = ("Externo", 0, "", "", "3002", 0)
+            self.assertTrue(zk.modificar_usuario('3002', name='Externo 2'))
+            self.assertEqual(dispositivo.lecturas_usuarios, lecturas + 1)
+            self.assertEqual(dispositivo.usuarios[uid][0], 'Externo 2')
+            self.assertTrue(zk.eliminar_usuario('3002'))
+        finally:
+            zk.desconectar()
+
+    def test_monitor_de_salud(self):
+        import socket
+        with socket.socket() as libre:
+            libre.bind(("127.0.0.1", 0))
+            puerto_cerrado = libre.getsockname()[1]
+
+        (host0, puerto0), (host1, puerto1) = self.direcciones
+        monitor = MonitorSalud(timeout=2, capacidad=3)
+        dispositivos = [
+            (1, host0, puerto0, 0),
+            (2, host1, puerto1, 1234),
+            (3, host1, puerto1, 999),  # Contraseña incorrecta
+            (4, "127.0.0.1", puerto_cerrado, 0),
+        ]
+        for _ in range(4):
+            estado = monitor.sondear(dispositivos)
+
+        self.assertTrue(estado[1]["alcanzable"])
+        self.assertTrue(estado[2]["alcanzable"])
+        self.assertEqual(estado[1]["muestras"], 3)
+        self.assertLessEqual(estado[1]["rtt_p50_ms"], estado[1]["rtt_p95_ms"])
+        self.assertEqual(estado[3]["ultimo_error"], "autenticacion")
+        self.assertEqual(estado[4]["errores"], {"rechazado": 3})
+        self.assertEqual(estado[4]["fallos_consecutivos"], 4)
+        self.assertIsNone(estado[4]["rtt_p50_ms"])
+
+        # Un dispositivo que deja de estar activo deja de reportarse
+        self.assertEqual(set(monitor.sondear(dispositivos[:1])), {1})
+
+        # Con una sesión abierta en el pool no se abre otra conexión para sondearlo
+        from types import SimpleNamespace
+        pooled = SimpleNamespace(id=901, ip_address=host0, puerto=puerto0, timeout=5, password=0)
+        with pool_conexiones.sesion(pooled, lectura=True) as zk:
+            self.assertIsNotNone(zk)
+        try:
+            sondeados, original = [], ZKTecoAsyncConnection.sondear
+
+            async def sondear(conexion):
+                sondeados.append(conexion)
+                return await original(conexion)
+            with mock.patch.object(ZKTecoAsyncConnection, "sondear", sondear):
+                estado = monitor.sondear([(901, host0, puerto0, 0), (1, host0, puerto0, 0)])
+            self.assertEqual(len(sondeados), 1)
+            self.assertNotIn(901, estado)
+        finally:
+            pool_conexiones.cerrar(901)
+
+    def test_cliente_asincrono(self):
+        host, puerto = self.direcciones[0]
+
+        async def leer():
+            async with ZKTecoAsyncConnection(host, puerto) as zk:
+                decodificador = DecodificadorAsistencias(None)
+                registros = [r async for r in zk.iterar_asistencias(decodificador)]
+                usuarios = await zk.obtener_usuarios()
+                return registros, decodificador.total, len(usuarios)
+
+        registros, total, usuarios = asyncio.run(leer())
+        self.assertEqual(registros, esperados(self.flota.dispositivos[0]))
+        self.assertEqual(total, 3000)
+        self.assertEqual(usuarios, 20)
+
+
+class TestClienteAsincrono(unittest.TestCase):
+    def test_autenticacion_escrituras_y_hora(self):
+        flota = SimuladorFlota([ConfiguracionSimulador(registros=200, usuarios=3, tam_registro=8, tam_usuario=28,
+                                                       password=4321, semilla=13, primer_user_id=84001)])
+        host, puerto = flota.iniciar()[0]
+        simulado = flota.dispositivos[0]
+
+        async def operar():
+            rechazado = await ZKTecoAsyncConnection(host, puerto, password=1).conectar()
+            async with ZKTecoAsyncConnection(host, puerto, password=4321) as zk:
+                deshabilitado = simulado.deshabilitado_desde is not None
+                registros = [r async for r in zk.iterar_asistencias()]
+                self.assertTrue(await zk.agregar_usuario("84100", "Nuevo"))
+                self.assertTrue(await zk.modificar_usuario("84100", name="Editado"))  # Registros de 28 bytes: nombre de 8
+                usuarios = {u.user_id: u.name for u in await zk.obtener_usuarios()}
+                self.assertTrue(await zk.eliminar_usuario("84001"))
+                self.assertTrue(await zk.establecer_hora_dispositivo(datetime(2030, 1, 1, 8, 0, 0)))
+                hora = await zk.obtener_hora_dispositivo()
+                conteos = await zk.obtener_conteos()
+            return rechazado, deshabilitado, registros, usuarios, hora, conteos
+
+        try:
+            rechazado, deshabilitado, registros, usuarios, hora, conteos = asyncio.run(operar())
+            self.assertFalse(rechazado)
+            self.assertTrue(deshabilitado)
+            self.assertIsNone(simulado.deshabilitado_desde)  # Habilitado al salir del bloque
+            self.assertEqual(registros, esperados(simulado))
+            self.assertEqual(usuarios["84100"], "Editado")
+            self.assertEqual(len(usuarios), 4)
+            self.assertLess(abs((hora - datetime(2030, 1, 1, 8, 0, 0)).total_seconds()), 5)
+            self.assertEqual((conteos["usuarios"], conteos["registros"]), (3, 200))
+        finally:
+            flota.detener()
+
+    def test_un_event_loop_para_cientos_de_dispositivos(self):
+        import threading
+        flota = SimuladorFlota([ConfiguracionSimulador(registros=40, usuarios=2, semilla=n, primer_user_id=85001 + n * 2)
+                                for n in range(200)])
+        direcciones = flota.iniciar()
+        hilos = []
+
+        async def leer(host, puerto):
+            async with ZKTecoAsyncConnection(host, puerto) as zk:
+                hilos.append(threading.active_count())
+                return [r async for r in zk.iterar_asistencias()]
+
+        async def leer_todos():
+            antes = threading.active_count()
+            return antes, await asyncio.gather(*(leer(host, puerto) for host, puerto in direcciones))
+
+        try:
+            antes, resultados = asyncio.run(leer_todos())
+            # Sin un hilo por dispositivo: todas las sesiones corren en el mismo event loop
+            self.assertEqual(max(hilos), antes)
+            self.assertEqual(resultados, [esperados(d) for d in flota.dispositivos])
+        finally:
+            flota.detener()
+
+
+class TestReconciliacionUsuarios(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.flota = SimuladorFlota([ConfiguracionSimulador(registros=10, usuarios=30, semilla=3)])
+        host, puerto = cls.flota.iniciar()[0]
+        Base.metadata.create_all(bind=ENGINE)
+        SessionLocal.configure(bind=ENGINE)
+        cls.db = SessionLocal()
+        dispositivo = Dispositivo(nombre="Simulado", ip_address=host, puerto=puerto, activo=True)
+        cls.db.add(dispositivo)
+        cls.db.commit()
+        cls.dispositivo_id = dispositivo.id
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.db.close()
+        pool_conexiones.cerrar_todas()
+        cls.flota.detener()
+
+    def test_diff_y_lote(self):
+        dispositivo = self.flota.dispositivos[0]
+
+        resultado = UsuarioService.sincronizar_usuarios_desde_dispositivo(self.db, self.dispositivo_id)
+        self.assertTrue(resultado["success"], resultado["message"])
+        self.assertEqual(resultado["usuarios_nuevos_descargados"], 30)
+        self.assertEqual(resultado["usuarios_subidos_dispositivo"], 0)
+
+        # Sin cambios: una lectura y ninguna escritura
+        resultado = UsuarioService.sincronizar_usuarios_desde_dispositivo(self.db, self.dispositivo_id)
+        self.assertEqual(resultado["usuarios_sin_cambios"], 30)
+        self.assertEqual(resultado["lecturas_dispositivo"], 1)
+        self.assertEqual(resultado["usuarios_actualizados_bd"] + resultado["usuarios_nuevos_descargados"], 0)
+        self.assertEqual(dispositivo.escrituras, 0)
+
+        # Un cambio en el equipo actualiza solo ese usuario; los faltantes se suben en un lote
+        nombre, *resto = dispositivo.usuarios[1]
+        dispositivo.usuarios[1] = ("Renombrado", *resto)
+        self.db.add_all([Usuario(uid=90000000 + n, user_id=str(90000000 + n), nombre=f"Nuevo {n}",
+                                 dispositivo_id=self.dispositivo_id) for n in range(5)])
+        self.db.commit()
+
+        resultado = UsuarioService.sincronizar_usuarios_desde_dispositivo(self.db, self.dispositivo_id)
+        self.assertEqual(resultado["usuarios_actualizados_bd"], 1)
+        self.assertEqual(resultado["usuarios_sin_cambios"], 29)
+        self.assertEqual(resultado["usuarios_subidos_dispositivo"], 5)
+        self.assertEqual(dispositivo.escrituras, 1)
+        self.assertEqual(self.db.query(Usuario).filter(Usuario.uid == int(resto[3])).one().nombre, "Renombrado")
+        self.assertIn("90000004", [u[4] for u in dispositivo.usuarios.values()])
+
+        resultado = UsuarioService.sincronizar_usuarios_desde_dispositivo(self.db, self.dispositivo_id)
+        self.assertEqual(resultado["usuarios_sin_cambios"], 35)
+        self.assertEqual(dispositivo.escrituras, 1)
+
+
+def corpus_calculo(db, semilla, usuarios, desde, dias, primer_uid):
+    """
+    Usuarios, horarios, asignaciones, un feriado y marcaciones aleatorias alrededor
+    de los bordes de las ventanas de entrada y salida. Retorna los user_id creados.
+    """
+    import random
+    azar = random.Random(semilla)
+    dispositivo = Dispositivo(nombre=f"Calculo {semilla}", ip_address=f"10.9.{semilla % 250}.{usuarios % 250}",
+                              puerto=4370, activo=True)
+    partido = Horario(nombre=f"Partido {semilla}")
+    corrido = Horario(nombre=f"Corrido {semilla}")
+    db.add_all([dispositivo, partido, corrido])
+    db.flush()
+    for dia in range(5):
+        db.add_all([
+            SegmentosHorario(horario_id=partido.id, dia_semana=dia, hora_inicio=dt_time(8, 0), hora_fin=dt_time(13, 0), tolerancia_minutos=15),
+            SegmentosHorario(horario_id=partido.id, dia_semana=dia, hora_inicio=dt_time(14, 0), hora_fin=dt_time(17, 0), tolerancia_minutos=10),
+        ])
+    for dia in range(6):
+        db.add(SegmentosHorario(horario_id=corrido.id, dia_semana=dia, hora_inicio=dt_time(9, 0), hora_fin=dt_time(18, 0), tolerancia_minutos=5))
+    if not db.query(Feriados).filter(Feriados.fecha == desde + timedelta(days=2)).first():
+        db.add(Feriados(fecha=desde + timedelta(days=2), nombre="Feriado de prueba"))
+
+    user_ids = []
+    for n in range(usuarios):
+        uid = primer_uid + n
+        user_id = str(uid)
+        user_ids.append(user_id)
+        db.add(Usuario(uid=uid, user_id=user_id, nombre=f"Calculo {uid}", dispositivo_id=dispositivo.id))
+        if n % 7 == 6:
+            continue  # Sin horario
+        horario = partido if n % 2 else corrido
+        db.add(AsignacionHorario(user_id=user_id, horario_id=horario.id, fecha_inicio=desde - timedelta(days=30)))
+        if n % 5 == 0:
+            # Cambio de horario a mitad del rango
+            otro = corrido if horario is partido else partido
+            db.add(AsignacionHorario(user_id=user_id, horario_id=otro.id, fecha_inicio=desde + timedelta(days=dias // 2)))
+        for d in range(dias):
+            fecha = desde + timedelta(days=d)
+            for base in (8 * 60, 9 * 60, 13 * 60, 14 * 60, 17 * 60, 18 * 60):
+                if azar.random() < 0.55:
+                    minuto = base + azar.randint(-150, 260)
+                    if 0 <= minuto < 24 * 60:
+                        instante = datetime.combine(fecha, dt_time(minuto // 60, minuto % 60, azar.randint(0, 59)))
+                        db.add(Asistencia(uid=uid, dispositivo_id=dispositivo.id, timestamp=instante, status=1, punch=0))
+    db.commit()
+    return user_ids
+
+
+def calculo_original(db, user_id, fecha_proceso, incidencias):
+    """
+    Copia congelada del cálculo por día previo al motor por lotes
+    (AsistenciaService.procesar_asistencia_dia del baseline, sin escribir en la BD
+    y con las incidencias ya descargadas). Es la referencia de las pruebas de
+    cálculo: no debe cambiar junto con el motor.
+
+    Retorna la tupla de TestCalculoPorLotes.CAMPOS, o None si el usuario no existe.
+    """
+    usuario = db.query(Usuario).filter(Usuario.user_id == user_id).first()
+    if not usuario:
+        return None
+
+    asignacion = db.query(AsignacionHorario).filter(
+        AsignacionHorario.user_id == user_id,
+        AsignacionHorario.fecha_inicio <= fecha_proceso,
+        (AsignacionHorario.fecha_fin == None) | (AsignacionHorario.fecha_fin >= fecha_proceso)
+    ).order_by(AsignacionHorario.fecha_inicio.desc()).first()
+    es_feriado = db.query(Feriados).filter(Feriados.fecha == fecha_proceso).first()
+
+    es_justificado = bool(es_feriado)
+    estado = "FERIADO" if es_feriado else "FALTA"
+    if not asignacion:
+        return (None, 0.0, 0.0, estado if es_feriado else "SIN_HORARIO", es_justificado, None, None)
+
+    segmentos = db.query(SegmentosHorario).filter(
+        SegmentosHorario.horario_id == asignacion.horario_id,
+        SegmentosHorario.dia_semana == fecha_proceso.weekday()
+    ).order_by(SegmentosHorario.hora_inicio).all()
+    if not segmentos:
+        return (asignacion.horario_id, 0.0, 0.0, estado if es_feriado else "DIA_LIBRE", es_justificado, None, None)
+
+    logs = db.query(Asistencia).filter(
+        Asistencia.uid == usuario.uid,
+        Asistencia.timestamp >= datetime.combine(fecha_proceso, dt_time.min),
+        Asistencia.timestamp <= datetime.combine(fecha_proceso, dt_time.max)
+    ).order_by(Asistencia.timestamp).all()
+    logs_times = [log.timestamp.time() for log in logs]
+
+    total_horas_trabajadas = 0.0
+    total_horas_esperadas = 0.0
+    llegada_tarde = False
+    primer_ingreso = None
+    ultima_salida = None
+    used_indices = set()
+    dummy_date = date(2000, 1, 1)
+
+    for segmento in segmentos:
+        inicio_seg, fin_seg = segmento.hora_inicio, segmento.hora_fin
+        total_horas_esperadas += (datetime.combine(dummy_date, fin_seg)
+                                  - datetime.combine(dummy_date, inicio_seg)).total_seconds() / 3600.0
+
+        entrada_valida, entrada_idx, min_diff_entrada = None, -1, float('inf')
+        inicio_min = inicio_seg.hour * 60 + inicio_seg.minute
+        for i, t in enumerate(logs_times):
+            if i in used_indices:
+                continue
+            t_min = t.hour * 60 + t.minute
+            if (inicio_min - 120) <= t_min <= (inicio_min + segmento.tolerancia_minutos + 60):
+                diff = abs(t_min - inicio_min)
+                if diff < min_diff_entrada:
+                    min_diff_entrada, entrada_valida, entrada_idx = diff, t, i
+
+        salida_valida, salida_idx = None, -1
+        fin_min = fin_seg.hour * 60 + fin_seg.minute
+        candidatos_salida = []
+        if entrada_valida:
+            for i, t in enumerate(logs_times):
+                if i in used_indices or i == entrada_idx or i <= entrada_idx:
+                    continue
+                t_min = t.hour * 60 + t.minute
+                if (inicio_min + 30) <= t_min <= (fin_min + 240):
+                    candidatos_salida.append((i, t, t_min, abs(t_min - fin_min)))
+        if candidatos_salida:
+            post_salida = [c for c in candidatos_salida if c[2] >= fin_min]
+            if post_salida:
+                post_salida.sort(key=lambda x: x[3])
+                seleccionado = post_salida[0]
+            else:
+                candidatos_salida.sort(key=lambda x: x[3])
+                seleccionado = candidatos_salida[0]
+            salida_idx, salida_valida = seleccionado[0], seleccionado[1]
+
+        if entrada_valida:
+            used_indices.add(entrada_idx)
+        if salida_valida:
+            used_indices.add(salida_idx)
+        if entrada_valida:
+            if not primer_ingreso or entrada_valida < primer_ingreso:
+                primer_ingreso = entrada_valida
+            if entrada_valida.hour * 60 + entrada_valida.minute > inicio_min + segmento.tolerancia_minutos:
+                llegada_tarde = True
+        if salida_valida:
+            if not ultima_salida or salida_valida > ultima_salida:
+                ultima_salida = salida_valida
+            total_horas_trabajadas += (datetime.combine(dummy_date, salida_valida)
+                                       - datetime.combine(dummy_date, entrada_valida)).total_seconds() / 3600.0
+
+    ahora = datetime.now()
+    dt_limite_salida = datetime.combine(fecha_proceso, max(seg.hora_fin for seg in segmentos)) + timedelta(hours=2)
+    terminado = fecha_proceso < ahora.date() or (fecha_proceso == ahora.date() and ahora > dt_limite_salida)
+    estado_base = "FALTA"
+    if total_horas_trabajadas >= (total_horas_esperadas - 0.05):
+        estado_base = "TARDE" if llegada_tarde else "PRESENTE"
+    elif not terminado and primer_ingreso:
+        estado_base = "TARDE" if llegada_tarde else "PRESENTE"
+
+    codigo_just = None
+    for inc in incidencias:
+        if str(inc.get('empleado_id')) != str(user_id):
+            continue
+        if (inc.get('estado') or {}).get('nombre') != 'Aprobado':
+            continue
+        if not inc.get('fecha_inicio') or not inc.get('fecha_fin'):
+            continue
+        inicio_inc = datetime.fromisoformat(inc['fecha_inicio'].replace('Z', '+00:00')).date()
+        fin_inc = datetime.fromisoformat(inc['fecha_fin'].replace('Z', '+00:00')).date()
+        if inicio_inc <= fecha_proceso <= fin_inc:
+            codigo_just = inc.get('tipo_incidencia', {}).get('codigo', 'JUSTIFICADO')
+            break
+
+    if estado_base in ("PRESENTE", "TARDE"):
+        estado_final = estado_base
+    elif es_feriado:
+        estado_final, es_justificado = "FERIADO", True
+    elif codigo_just:
+        estado_final, es_justificado = codigo_just, True
+    else:
+        estado_final = "FALTA"
+
+    return (asignacion.horario_id, total_horas_esperadas, round(total_horas_trabajadas, 2), estado_final,
+            es_justificado, primer_ingreso, ultima_salida)
+
+
+class TestDerivaReloj(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.flota = SimuladorFlota([
+            ConfiguracionSimulador(registros=1, usuarios=1, desfase_reloj=desfase) for desfase in (0, -90, 45.4)
+        ], direcciones_distintas=True)
+        direcciones = cls.flota.iniciar()
+        Base.metadata.create_all(bind=ENGINE)
+        SessionLocal.configure(bind=ENGINE)
+        cls.db = SessionLocal()
+        # Solo los dispositivos de esta prueba (los de otras clases comparten la BD)
+        cls.db.query(Dispositivo).delete()
+        cls.ids = []
+        for i, (host, puerto) in enumerate(direcciones):
+            dispositivo = Dispositivo(nombre=f"Reloj {i}", ip_address=host, puerto=puerto, activo=True)
+            cls.db.add(dispositivo)
+            cls.db.flush()
+            cls.ids.append(dispositivo.id)
+        cls.db.commit()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.db.close()
+        cls.flota.detener()
+
+    def test_medicion_y_correccion_de_flota(self):
+        resultado = SincronizacionService.sincronizar_hora_flota(self.db, umbral=2, corregir=False)
+        derivas = {r["dispositivo_id"]: r for r in resultado["dispositivos"]}
+        for dispositivo_id, esperado in zip(self.ids, (0, -90, 45.4)):
+            self.assertTrue(derivas[dispositivo_id]["success"], derivas[dispositivo_id])
+            self.assertAlmostEqual(derivas[dispositivo_id]["deriva_segundos"], esperado, delta=1)
+        self.assertEqual(resultado["corregidos"], 0)
+
+        resultado = SincronizacionService.sincronizar_hora_flota(self.db, umbral=2)
+        self.assertEqual(resultado["corregidos"], 2)
+        for r in resultado["dispositivos"]:
+            self.assertEqual(r["corregido"], r["dispositivo_id"] != self.ids[0])
+            if r["corregido"]:
+                self.assertLess(abs(r["deriva_posterior"]), 1)
+        for dispositivo in self.flota.dispositivos:
+            self.assertLess(abs(dispositivo.desfase_reloj), 0.5)
+
+        historial = SincronizacionService.obtener_historial_deriva(self.db, self.ids[1])
+        self.assertEqual(len(historial), 2)
+        self.assertTrue(historial[0].corregido)
+        self.assertAlmostEqual(historial[1].deriva_segundos, -90, delta=1)
+
+    def test_respeta_el_pool_y_el_circuito(self):
+        dispositivo = self.db.get(Dispositivo, self.ids[0])
+        with pool_conexiones.sesion(dispositivo, lectura=True) as zk:
+            self.assertIsNotNone(zk)
+        self.assertTrue(pool_conexiones.sesion_abierta(self.ids[0]))
+        try:
+            for _ in range(settings.CIRCUIT_FAILURE_THRESHOLD):
+                pool_conexiones.registrar_sondeo(self.ids[1], exito=False, error="timeout")
+            resultado = SincronizacionService.sincronizar_hora_flota(self.db, umbral=2, corregir=False)
+            derivas = {r["dispositivo_id"]: r for r in resultado["dispositivos"]}
+            # Circuito abierto: se informa sin conectar
+            self.assertFalse(derivas[self.ids[1]]["success"])
+            self.assertIn("fuera de servicio", derivas[self.ids[1]]["message"])
+            # La medición usó el acceso reservado: la sesión del pool se cerró para no tener dos
+            self.assertTrue(derivas[self.ids[0]]["success"], derivas[self.ids[0]])
+            self.assertFalse(pool_conexiones.sesion_abierta(self.ids[0]))
+        finally:
+            pool_conexiones.cerrar(self.ids[0])
+            pool_conexiones.cerrar(self.ids[1])
+
+
+class TestCircuitoYCola(unittest.TestCase):
+    def test_transiciones_del_circuito(self):
+        import time
+        circuito = Circuito(umbral_fallos=2, espera_base=0.05, espera_maxima=1)
+        self.assertEqual(circuito.timeout_adaptativo(5), 5)
+        circuito.registrar_fallo()
+        self.assertTrue(circuito.permitir())
+        circuito.registrar_fallo()
+        self.assertEqual(circuito.estado, ABIERTO)
+        self.assertFalse(circuito.permitir())
+
+        time.sleep(0.06)
+        self.assertTrue(circuito.permitir())
+        self.assertEqual(circuito.estado, SEMIABIERTO)
+        self.assertFalse(circuito.permitir())  # Un solo intento de prueba
+        circuito.registrar_fallo()
+        self.assertEqual(circuito.estado, ABIERTO)
+        self.assertGreater(circuito.reintentar_en - time.monotonic(), 0.06)  # Backoff duplicado
+
+        circuito.registrar_exito(0.01)
+        self.assertEqual(circuito.estado, CERRADO)
+        self.assertEqual(circuito.timeout_adaptativo(5), circuito.timeout_minimo)
+
+    def test_dispositivo_caido_falla_rapido_y_encola(self):
+        import socket
+        import time
+        with socket.socket() as libre:
+            libre.bind(("127.0.0.1", 0))
+            puerto_cerrado = libre.getsockname()[1]
+
+        Base.metadata.create_all(bind=ENGINE)
+        SessionLocal.configure(bind=ENGINE)
+        db = SessionLocal()
+        flota = SimuladorFlota([ConfiguracionSimulador(registros=1, usuarios=1)])
+        host, puerto = flota.iniciar()[0]
+        try:
+            db.query(Dispositivo).delete()
+            dispositivo = Dispositivo(nombre="Caido", ip_address=host, puerto=puerto_cerrado, timeout=2, activo=True)
+            db.add(dispositivo)
+            db.flush()
+            usuario = Usuario(uid=4242, user_id="4242", nombre="En cola", dispositivo_id=dispositivo.id)
+            db.add(usuario)
+            db.commit()
+
+            for _ in range(3):
+                self.assertFalse(UsuarioService.sincronizar_usuario_a_dispositivo(db, usuario.id))
+            inicio = time.monotonic()
+            self.assertFalse(UsuarioService.sincronizar_usuario_a_dispositivo(db, usuario.id))
+            self.assertLess(time.monotonic() - inicio, 0.5)
+            self.assertIn("fuera de servicio", pool_conexiones.motivo_sin_conexion(dispositivo.id))
+
+            pendientes = UsuarioService.obtener_operaciones_pendientes(db, dispositivo.id)
+            self.assertEqual([(o.tipo, o.user_id) for o in pendientes], [("sincronizar", "4242")])
+            resultado = UsuarioService.procesar_operaciones_pendientes(db)
+            self.assertEqual(resultado["dispositivos_no_disponibles"], [dispositivo.id])
+
+            # El equipo vuelve (un sondeo exitoso cierra el circuito) y la cola se aplica
+            dispositivo.puerto = puerto
+            db.commit()
+            pool_conexiones.registrar_sondeo(dispositivo.id, 0.002, True)
+            resultado = UsuarioService.procesar_operaciones_pendientes(db)
+            self.assertEqual(resultado["operaciones_aplicadas"], 1)
+            self.assertEqual(resultado["operaciones_pendientes"], 0)
+            self.assertIn("4242", [u[4] for u in flota.dispositivos[0].usuarios.values()])
+        finally:
+            db.close()
+            pool_conexiones.cerrar_todas()
+            flota.detener()
+
+
+class TestRotacionRegistros(unittest.TestCase):
+    def test_rota_solo_lo_verificado(self):
+        flota = SimuladorFlota([ConfiguracionSimulador(registros=200, usuarios=5, semilla=5, primer_user_id=71001)])
+        host, puerto = flota.iniciar()[0]
+        simulado = flota.dispositivos[0]
+        Base.metadata.create_all(bind=ENGINE)
+        SessionLocal.configure(bind=ENGINE)
+        db = SessionLocal()
+        try:
+            db.query(Dispositivo).delete()
+            dispositivo = Dispositivo(nombre="Rotacion", ip_address=host, puerto=puerto, activo=True)
+            db.add(dispositivo)
+            db.flush()
+            # Falta un usuario en la BD: sus marcaciones no se ingieren
+            db.add_all([Usuario(uid=71001 + n, user_id=str(71001 + n), nombre=f"Rot {n}",
+                                dispositivo_id=dispositivo.id) for n in range(4)])
+            db.commit()
+            RotacionService.configurar_politica(db, dispositivo.id, max_registros=100)
+
+            resultado = AsistenciaService.sincronizar_asistencias_desde_dispositivo(db, dispositivo.id)
+            self.assertTrue(resultado["success"], resultado["message"])
+            self.assertFalse(resultado["rotacion"]["rotado"])
+            self.assertEqual(resultado["rotacion"]["auditoria"]["resultado"], "omitido")
+            self.assertEqual(len(simulado.marcaciones), 200)
+            # Tras un intento no verificado no se reintenta en cada sincronización
+            self.assertIsNone(RotacionService.motivo_rotacion(db, dispositivo.id, 200))
+            estado = db.query(EstadoSincronizacion).filter(EstadoSincronizacion.dispositivo_id == dispositivo.id).one()
+            pendiente = min(n for n, m in enumerate(simulado.marcaciones) if m[1] == "71005")
+            self.assertEqual(estado.indice_pendiente, pendiente)
+
+            # Sin usuarios nuevos no hay nada que releer; con el usuario creado, el
+            # incremental relee desde la marca baja e ingiere sus marcaciones
+            resultado = AsistenciaService.sincronizar_asistencias_desde_dispositivo(db, dispositivo.id)
+            self.assertEqual(resultado["registros_nuevos"], 0)
+            db.add(Usuario(uid=71005, user_id="71005", nombre="Rot 4", dispositivo_id=dispositivo.id))
+            db.commit()
+            resultado = AsistenciaService.sincronizar_asistencias_desde_dispositivo(db, dispositivo.id)
+            self.assertEqual(resultado["registros_nuevos"], len({m[2] for m in simulado.marcaciones if m[1] == "71005"}))
+            db.refresh(estado)
+            self.assertIsNone(estado.indice_pendiente)
+            resultado = RotacionService.rotar_dispositivo(db, dispositivo.id)
+            self.assertTrue(resultado["rotado"], resultado["message"])
+            auditoria = resultado["auditoria"]
+            self.assertEqual(auditoria["registros_verificados"], auditoria["registros_dispositivo"])
+            self.assertEqual(auditoria["checksum_bd"], auditoria["checksum_dispositivo"])
+            self.assertEqual(simulado.marcaciones, [])
+            estado = db.query(EstadoSincronizacion).filter(EstadoSincronizacion.dispositivo_id == dispositivo.id).one()
+            self.assertEqual(estado.ultimo_conteo_registros, 0)
+
+            # Lo marcado después del vaciado se ingiere desde el índice 0
+            simulado.agregar_marcaciones(10)
+            resultado = AsistenciaService.sincronizar_asistencias_desde_dispositivo(db, dispositivo.id)
+            self.assertEqual(resultado["registros_nuevos"], 10)
+            self.assertIsNone(resultado["rotacion"])
+
+            # Memoria borrada y vuelta a llenar con la misma cantidad: el conteo no basta
+            simulado.marcaciones.clear()
+            simulado.agregar_marcaciones(10)
+            resultado = AsistenciaService.sincronizar_asistencias_desde_dispositivo(db, dispositivo.id)
+            self.assertEqual(resultado["registros_nuevos"], len({(m[1], m[2]) for m in simulado.marcaciones}))
+
+            RotacionService.configurar_politica(db, dispositivo.id, max_dias=10)
+            self.assertIn("antigüedad", RotacionService.motivo_rotacion(db, dispositivo.id, 10))
+            self.assertEqual(
+                [r.resultado for r in RotacionService.obtener_historial(db, dispositivo.id)], ["rotado", "omitido"]
+            )
+        finally:
+            db.close()
+            pool_conexiones.cerrar_todas()
+            flota.detener()
+
+
+class TestFlotaEnParalelo(unittest.TestCase):
+    def test_dispositivo_abandonado_se_omite_hasta_que_termina(self):
+        import threading
+        liberar, llamadas = threading.Event(), []
+
+        def tarea(db, dispositivo_id):
+            llamadas.append(dispositivo_id)
+            if dispositivo_id == 1:
+                liberar.wait(10)  # Colgado (sigue reteniendo su sesión)
+            return {"success": True, "message": "ok"}
+
+        dispositivos = [(1, "Colgado"), (2, "Sano")]
+        resultados = {r["dispositivo_id"]: r for r in FlotaService.ejecutar_en_paralelo(
+            dispositivos, tarea, timeout_dispositivo=0.2, plazo_total=5)}
+        self.assertIn("Tiempo de espera agotado", resultados[1]["message"])
+        self.assertTrue(resultados[2]["success"])
+
+        # Mientras el hilo siga colgado, la siguiente ejecución no lo espera
+        llamadas.clear()
+        resultados = {r["dispositivo_id"]: r for r in FlotaService.ejecutar_en_paralelo(
+            dispositivos, tarea, timeout_dispositivo=0.2, plazo_total=5)}
+        self.assertIn("ocupado", resultados[1]["message"])
+        self.assertEqual(llamadas, [2])
+
+        liberar.set()
+        for _ in range(100):
+            if not FlotaService._abandonados:
+                break
+            time.sleep(0.05)
+        resultados = {r["dispositivo_id"]: r for r in FlotaService.ejecutar_en_paralelo(
+            dispositivos, tarea, timeout_dispositivo=2, plazo_total=5)}
+        self.assertTrue(resultados[1]["success"])
+
+
+    def test_resultados_al_terminar_cada_dispositivo_y_plazo_total(self):
+        duraciones = {21: 0.3, 22: 0.05, 23: 0.15}
+        sesiones = set()
+
+        def tarea(db, dispositivo_id):
+            sesiones.add(id(db))
+            time.sleep(duraciones[dispositivo_id])
+            return {"success": True, "message": "ok"}
+
+        dispositivos = [(21, "Lento"), (22, "Rápido"), (23, "Medio")]
+        inicio = time.monotonic()
+        orden = [r["dispositivo_id"] for r in FlotaService.ejecutar_en_paralelo(
+            dispositivos, tarea, max_workers=3, timeout_dispositivo=5, plazo_total=5)]
+        transcurrido = time.monotonic() - inicio
+        # Cada resultado sale al terminar su dispositivo; el total es el del más lento, no la suma
+        self.assertEqual(orden, [22, 23, 21])
+        self.assertLess(transcurrido, sum(duraciones.values()))
+        self.assertEqual(len(sesiones), 3)
+
+        # Con un solo hilo, el plazo total corta la ronda: el que corre se abandona y el resto no arranca
+        duraciones.update({21: 0.2, 22: 0.2, 23: 0.2})
+        resultados = list(FlotaService.ejecutar_en_paralelo(
+            dispositivos, tarea, max_workers=1, timeout_dispositivo=5, plazo_total=0.3))
+        self.assertEqual([r["success"] for r in resultados], [True, False, False])
+        self.assertIn("Plazo total", resultados[1]["message"])
+        self.assertIn("no iniciado", resultados[2]["message"])
+        for _ in range(100):
+            if not FlotaService._abandonados:
+                break
+            time.sleep(0.05)
+        self.assertEqual(FlotaService._abandonados, set())
+
+
+class TestBenchmarks(unittest.TestCase):
+    def test_comparacion_con_la_linea_base(self):
+        from benchmarks.run_benchmarks import comparar
+        baseline = {"escenarios": {
+            "lento": {"registros_por_segundo": 1000, "rss_maximo_mb": 100},
+            "pesado": {"registros_por_segundo": 1000, "rss_maximo_mb": 100},
+            "estable": {"registros_por_segundo": 1000, "rss_maximo_mb": 100},
+        }}
+        resultados = {
+            "lento": {"registros_por_segundo": 800, "rss_maximo_mb": 100},
+            "pesado": {"registros_por_segundo": 1100, "rss_maximo_mb": 130},
+            "estable": {"registros_por_segundo": 900, "rss_maximo_mb": 110},
+            "nuevo": {"registros_por_segundo": 10, "rss_maximo_mb": 999},  # Sin línea base: no se compara
+        }
+        regresiones = comparar(resultados, baseline, tolerancia=0.15)
+        self.assertEqual(len(regresiones), 2)
+        self.assertTrue(regresiones[0].startswith("lento: 800 registros/s"))
+        self.assertTrue(regresiones[1].startswith("pesado: RSS máximo 130 MB"))
+        self.assertEqual(resultados["estable"]["comparacion"], {"throughput": 0.9, "rss": 1.1})
+        self.assertNotIn("comparacion", resultados["nuevo"])
+
+    def test_linea_base_cubre_los_escenarios(self):
+        import json
+        from benchmarks.escenarios import ESCENARIOS
+        from benchmarks.run_benchmarks import BASELINE
+        with open(BASELINE, encoding="utf-8") as f:
+            baseline = json.load(f)["escenarios"]
+        self.assertEqual(list(baseline), [e.nombre for e in ESCENARIOS])
+        for escenario in ESCENARIOS:
+            base = baseline[escenario.nombre]
+            parametros = {k: v for k, v in escenario.como_dict().items() if k in base}
+            self.assertEqual(parametros, {k: base[k] for k in parametros}, escenario.nombre)
+
+    def test_escenario_de_punta_a_punta(self):
+        from benchmarks.escenarios import Escenario
+        from benchmarks.ejecutor import medir
+        resultado = medir(Escenario("prueba", "asistencias", registros=500, usuarios=5, duplicados=0.2))
+        self.assertEqual(resultado["errores"], [])
+        self.assertEqual(resultado["registros_procesados"], 500)
+        self.assertLess(resultado["registros_nuevos"], 500)
+        self.assertGreater(resultado["registros_nuevos"], 0)
+        self.assertGreater(resultado["registros_por_segundo"], 0)
+        self.assertGreaterEqual(resultado["rss_maximo_mb"], resultado["rss_inicial_mb"])
+
+
+class TestCapturaTiempoReal(unittest.TestCase):
+    def test_cede_sin_perder_marcaciones(self):
+        from contextlib import contextmanager
+        import threading
+        Base.metadata.create_all(bind=ENGINE)
+        SessionLocal.configure(bind=ENGINE)
+        db = SessionLocal()
+        try:
+            db.query(Dispositivo).delete()
+            dispositivo = Dispositivo(nombre="Captura", ip_address="127.0.0.1", puerto=4370, activo=True)
+            db.add(dispositivo)
+            db.commit()
+            dispositivo_id = dispositivo.id
+        finally:
+            db.close()
+
+        captura = CapturaTiempoReal(DifusorEventos(), timeout_evento=0.05)
+        parar, procesadas, recuperaciones = threading.Event(), [], []
+
+        class Equipo:
+            detenida = False
+
+            def obtener_conteos(self):
+                # Conteo desconocido: al reanudar siempre se sincroniza
+                return {}
+
+            def obtener_usuarios(self):
+                return []
+
+            def capturar_eventos(self, timeout, usuarios=None):
+                # La marcación llega justo cuando otra operación pide la sesión
+                yield "marcacion"
+                if self.detenida:
+                    yield None
+
+            def detener_captura(self):
+                self.detenida = True
+
+        @contextmanager
+        def sesion(dispositivo, deshabilitar=True, lectura=False):
+            yield Equipo()
+
+        def sincronizar(db, dispositivo_id):
+            recuperaciones.append(captura.en_linea(dispositivo_id))
+            parar.set()
+            return {"success": True, "registros_nuevos": 0}
+
+        with mock.patch.object(pool_conexiones, "sesion", sesion), \
+                mock.patch.object(pool_conexiones, "hay_espera", return_value=True), \
+                mock.patch.object(CapturaTiempoReal, "_procesar", lambda self, d, m: procesadas.append(m)), \
+                mock.patch.object(AsistenciaService, "sincronizar_asistencias_desde_dispositivo", sincronizar):
+            captura._capturar(dispositivo_id, parar)
+
+        # Se guardó la marcación recibida al ceder, y al reanudar se sincronizó lo
+        # marcado durante la pausa (con el dispositivo fuera de línea mientras tanto)
+        self.assertEqual(procesadas, ["marcacion", "marcacion"])
+        self.assertEqual(recuperaciones, [False])
+        self.assertFalse(captura.en_linea(dispositivo_id))
+
+
+    def test_reanuda_sin_releer_usuarios_ni_sincronizar_sin_cambios(self):
+        import threading
+        flota = SimuladorFlota([ConfiguracionSimulador(registros=20, usuarios=3, semilla=6, primer_user_id=80001)])
+        host, puerto = flota.iniciar()[0]
+        simulado = flota.dispositivos[0]
+        Base.metadata.create_all(bind=ENGINE)
+        SessionLocal.configure(bind=ENGINE)
+        db = SessionLocal()
+        captura = CapturaTiempoReal(DifusorEventos(), timeout_evento=0.05)
+        parar = threading.Event()
+        hilo = threading.Thread(target=lambda: captura._capturar(dispositivo.id, parar), daemon=True)
+
+        def esperar(condicion):
+            limite = time.monotonic() + 10
+            while not condicion():
+                self.assertLess(time.monotonic(), limite)
+                time.sleep(0.02)
+
+        def capturando():
+            return captura.en_linea(dispositivo.id) and flota.estadisticas()[0]["suscritas"] == 1
+
+        def guardadas():
+            db.expire_all()
+            return db.query(Asistencia).filter(Asistencia.uid.between(80001, 80003)).count()
+
+        def pausar(marcar=False):
+            # Otra operación toma la sesión: la captura cede y se reanuda al soltarla
+            with pool_conexiones.sesion(dispositivo, deshabilitar=False) as zk:
+                self.assertIsNotNone(zk)
+                self.assertFalse(captura.en_linea(dispositivo.id))
+                if marcar:
+                    flota.ejecutar(simulado.marcar_en_vivo, 2)
+            esperar(capturando)
+
+        sincronizar = AsistenciaService.sincronizar_asistencias_desde_dispositivo
+        try:
+            db.query(Dispositivo).delete()
+            db.query(PoliticaRotacion).delete()
+            dispositivo = Dispositivo(nombre="Captura sim", ip_address=host, puerto=puerto, activo=True)
+            db.add(dispositivo)
+            db.flush()
+            db.add_all([Usuario(uid=80001 + n, user_id=str(80001 + n), nombre=f"Vivo {n}",
+                                dispositivo_id=dispositivo.id) for n in range(3)])
+            db.commit()
+
+            with mock.patch.object(AsistenciaService, "sincronizar_asistencias_desde_dispositivo",
+                                   side_effect=sincronizar) as recuperaciones, \
+                    mock.patch.object(AsistenciaService, "_insertar_registros_masivo",
+                                      side_effect=AsistenciaService._insertar_registros_masivo) as masivo:
+                hilo.start()
+                esperar(capturando)
+                lecturas = flota.estadisticas()[0]["lecturas_usuarios"]
+
+                flota.ejecutar(simulado.marcar_en_vivo, 1)
+                esperar(lambda: guardadas() == 1)
+                # Una marcación en vivo se inserta sola, sin la inserción masiva
+                self.assertEqual(masivo.call_count, 0)
+
+                # Nada se marcó durante la pausa: no se sincroniza ni se releen los usuarios
+                pausar()
+                self.assertEqual(recuperaciones.call_count, 0)
+                self.assertEqual(flota.estadisticas()[0]["lecturas_usuarios"], lecturas)
+
+                # Lo marcado durante la pausa se recupera al reanudar
+                pausar(marcar=True)
+                self.assertEqual(recuperaciones.call_count, 1)
+                self.assertEqual(guardadas(), len({(m[1], m[2]) for m in simulado.marcaciones}))
+        finally:
+            parar.set()
+            if hilo.is_alive():
+                hilo.join(timeout=5)
+            db.close()
+            pool_conexiones.cerrar_todas()
+            flota.detener()
+
+
+class TestPlanificador(unittest.TestCase):
+    def setUp(self):
+        Base.metadata.create_all(bind=ENGINE)
+        SessionLocal.configure(bind=ENGINE)
+        db = SessionLocal()
+        try:
+            db.query(PoliticaRotacion).delete()
+            db.query(Dispositivo).delete()
+            self.dispositivos = [Dispositivo(nombre=f"Plan {i}", ip_address=f"10.0.0.{i}", activo=True)
+                                 for i in range(1, 5)]
+            db.add_all(self.dispositivos)
+            db.commit()
+            self.ids = [d.id for d in self.dispositivos]
+        finally:
+            db.close()
+        # Reloj controlado por la prueba (solo en el módulo del planificador)
+        self.ahora = 1000.0
+        reloj = mock.patch("zkteco_planificador.time")
+        reloj.start().monotonic.side_effect = lambda: self.ahora
+        self.addCleanup(reloj.stop)
+        self.en_linea = set()
+        captura = mock.patch("zkteco_planificador.captura_tiempo_real.en_linea",
+                             side_effect=lambda dispositivo_id: dispositivo_id in self.en_linea)
+        captura.start()
+        self.addCleanup(captura.stop)
+        self.planificador = PlanificadorSincronizacion(intervalo=300, jitter=0, backoff_maximo=2000)
+
+    def vencidos(self):
+        return sorted(d[0] for d in self.planificador._actualizar_dispositivos())
+
+    def test_primera_ejecucion_repartida_en_el_intervalo(self):
+        with mock.patch("zkteco_planificador.random.uniform", side_effect=[0, 100, 200, 300]) as uniforme:
+            self.assertEqual(self.vencidos(), [self.ids[0]])
+        uniforme.assert_called_with(0, 300)
+        self.ahora += 150
+        self.assertEqual(self.vencidos(), self.ids[:2])
+        self.ahora += 150
+        self.assertEqual(self.vencidos(), self.ids)
+
+    def test_backoff_creciente_con_tope(self):
+        self.vencidos()
+        dispositivo_id = self.ids[0]
+        esperas = []
+        for _ in range(4):
+            self.planificador._registrar({"dispositivo_id": dispositivo_id, "success": False, "message": "sin conexión"})
+            esperas.append(self.planificador.estado()[dispositivo_id]["segundos_para_proxima"])
+        self.assertEqual(esperas, [600, 1200, 2000, 2000])
+        self.assertEqual(self.planificador.estado()[dispositivo_id]["fallos_consecutivos"], 4)
+
+        self.planificador._registrar({"dispositivo_id": dispositivo_id, "success": True, "message": "ok"})
+        estado = self.planificador.estado()[dispositivo_id]
+        self.assertEqual((estado["segundos_para_proxima"], estado["fallos_consecutivos"]), (300, 0))
+
+    def test_omite_captura_en_vivo_y_retira_inactivos(self):
+        self.vencidos()
+        self.ahora += 300
+        self.en_linea = {self.ids[1]}
+        self.assertEqual(self.vencidos(), [self.ids[0]] + self.ids[2:])
+
+        db = SessionLocal()
+        try:
+            db.query(Dispositivo).filter(Dispositivo.id == self.ids[2]).update({"activo": False})
+            db.commit()
+        finally:
+            db.close()
+        self.assertEqual(self.vencidos(), [self.ids[0], self.ids[3]])
+        self.assertEqual(sorted(self.planificador.estado()), [self.ids[0], self.ids[1], self.ids[3]])
+
+        # La ronda solo sincroniza los vencidos y registra sus resultados
+        with mock.patch("zkteco_planificador.FlotaService.ejecutar_en_paralelo",
+                        side_effect=lambda pendientes, tarea: [
+                            {"dispositivo_id": d[0], "success": False, "message": "sin conexión"}
+                            for d in pendientes]) as ejecutar:
+            self.planificador._ejecutar_ronda()
+        self.assertEqual([d[0] for d in ejecutar.call_args[0][0]], [self.ids[0], self.ids[3]])
+        estado = self.planificador.estado()
+        self.assertEqual([estado[i]["fallos_consecutivos"] for i in (self.ids[0], self.ids[1], self.ids[3])], [1, 0, 1])
+
+
+class TestIngestaPorEtapas(unittest.TestCase):
+    def test_flujo_acotado(self):
+        self.assertEqual(list(flujo_acotado(range(10), lote=3, capacidad=1)), list(range(10)))
+
+        def falla():
+            yield 1
+            raise ValueError("buffer corrupto")
+        with self.assertRaises(ValueError):
+            list(flujo_acotado(falla()))
+
+        # Si el consumidor deja de leer, el productor no queda bloqueado en la cola
+        flujo = flujo_acotado(iter(range(100000)), lote=10, capacidad=1)
+        self.assertEqual(next(flujo), 0)
+        flujo.close()
+
+    def test_duplicados_entre_bloques_los_descarta_la_clave_unica(self):
+        Base.metadata.create_all(bind=ENGINE)
+        SessionLocal.configure(bind=ENGINE)
+        db = SessionLocal()
+        lote_original = settings.SYNC_BATCH_SIZE
+        try:
+            settings.SYNC_BATCH_SIZE = 2
+            db.query(Dispositivo).delete()
+            dispositivo = Dispositivo(nombre="Bloques", ip_address="127.0.0.1", puerto=4370, activo=True)
+            db.add(dispositivo)
+            db.flush()
+            db.add(Usuario(uid=72101, user_id="72101", nombre="Bloques", dispositivo_id=dispositivo.id))
+            db.flush()
+            a, b, c = (datetime_a_epoch(INICIO + timedelta(minutes=n)) for n in range(3))
+            registros = [(72101, e, 1, 0) for e in (a, a, b, a, c, b)]
+            resultado = AsistenciaService._insertar_registros_masivo(db, dispositivo.id, iter(registros))
+            db.commit()
+            self.assertEqual((resultado["insertados"], resultado["duplicados"]), (3, 3))
+            self.assertEqual(db.query(Asistencia).filter(Asistencia.uid == 72101).count(), 3)
+        finally:
+            settings.SYNC_BATCH_SIZE = lote_original
+            db.close()
+
+    def test_insercion_masiva_por_lotes_sin_consultas_por_fila(self):
+        from zk.attendance import Attendance
+        Base.metadata.create_all(bind=ENGINE)
+        SessionLocal.configure(bind=ENGINE)
+        db = SessionLocal()
+        lote_original = settings.SYNC_BATCH_SIZE
+        sentencias = []
+
+        def registrar(conn, cursor, sentencia, parametros, contexto, executemany):
+            if "asistencias" in sentencia:
+                sentencias.append(sentencia.split()[0].upper())
+
+        try:
+            settings.SYNC_BATCH_SIZE = 50
+            db.query(Dispositivo).delete()
+            dispositivo = Dispositivo(nombre="Masivo", ip_address="127.0.0.1", puerto=4370, activo=True)
+            db.add(dispositivo)
+            db.flush()
+            db.add_all([Usuario(uid=83001 + n, user_id=str(83001 + n), nombre=f"Masivo {n}",
+                                dispositivo_id=dispositivo.id) for n in range(3)])
+            db.commit()
+
+            logs = [Attendance(str(83001 + n % 3), INICIO + timedelta(minutes=n), 1, 0, n) for n in range(120)]
+            logs += [
+                Attendance("83999", INICIO, 1, 0, 200),  # usuario desconocido
+                Attendance("83001", datetime(2099, 1, 1), 1, 0, 201),  # fecha inválida
+                Attendance("ABC", INICIO, 1, 0, 202),  # user_id no numérico
+            ]
+            event.listen(ENGINE, "before_cursor_execute", registrar)
+            try:
+                resultado = AsistenciaService.guardar_marcaciones_dispositivo(db, dispositivo.id, logs)
+                # 120 filas en lotes de 50: tres INSERT multi-fila y ningún SELECT por marcación
+                self.assertEqual(sentencias, ["INSERT"] * 3)
+                self.assertEqual(
+                    (resultado["procesados"], resultado["insertados"], resultado["duplicados"],
+                     resultado["usuarios_desconocidos"], resultado["invalidos"]),
+                    (121, 120, 0, 1, 2)
+                )
+                # La segunda pasada la descarta entera la clave única
+                repetido = AsistenciaService.guardar_marcaciones_dispositivo(db, dispositivo.id, logs[:120])
+                self.assertEqual((repetido["insertados"], repetido["duplicados"]), (0, 120))
+            finally:
+                event.remove(ENGINE, "before_cursor_execute", registrar)
+            self.assertEqual(db.query(Asistencia).filter(Asistencia.uid.between(83001, 83003)).count(), 120)
+        finally:
+            settings.SYNC_BATCH_SIZE = lote_original
+            db.close()
+
+    def test_spool_se_reproduce_y_se_descarta(self):
+        flota = SimuladorFlota([ConfiguracionSimulador(registros=150, usuarios=4, semilla=6, primer_user_id=72001)])
+        host, puerto = flota.iniciar()[0]
+        Base.metadata.create_all(bind=ENGINE)
+        SessionLocal.configure(bind=ENGINE)
+        db = SessionLocal()
+        try:
+            db.query(Dispositivo).delete()
+            dispositivo = Dispositivo(nombre="Spool", ip_address=host, puerto=puerto, activo=True)
+            db.add(dispositivo)
+            db.flush()
+            db.add_all([Usuario(uid=72001 + n, user_id=str(72001 + n), nombre=f"Spool {n}",
+                                dispositivo_id=dispositivo.id) for n in range(4)])
+            db.commit()
+
+            # Descarga guardada en el spool y proceso caído antes de escribir en la BD
+            zk = ZKTecoConnection(host, puerto, ommit_ping=True)
+            self.assertTrue(zk.conectar())
+            try:
+                spool_ingesta.guardar(dispositivo.id, zk.iterar_asistencias(), zk.obtener_numero_serie())
+            finally:
+                zk.desconectar()
+            self.assertEqual(len(spool_ingesta.pendientes(dispositivo.id)), 1)
+
+            resultado = AsistenciaService.reproducir_descargas_pendientes(db)
+            self.assertEqual((resultado["volcados_reproducidos"], resultado["registros_insertados"]), (1, 150))
+            self.assertEqual(spool_ingesta.pendientes(), [])
+
+            resultado = AsistenciaService.sincronizar_asistencias_desde_dispositivo(db, dispositivo.id)
+            self.assertTrue(resultado["success"], resultado["message"])
+            self.assertEqual(resultado["registros_nuevos"], 0)
+            self.assertGreaterEqual(resultado["dispositivo_deshabilitado_ms"], 0)
+            self.assertEqual(spool_ingesta.pendientes(), [])
+        finally:
+            db.close()
+            pool_conexiones.cerrar_todas()
+            flota.detener()
+
+
+class TestBloqueoPorOperacion(unittest.TestCase):
+    def test_lecturas_sin_bloqueo_y_escrituras_exclusivas(self):
+        flota = SimuladorFlota([ConfiguracionSimulador(registros=2000, usuarios=5, semilla=7, primer_user_id=73001)])
+        host, puerto = flota.iniciar()[0]
+        simulado = flota.dispositivos[0]
+        Base.metadata.create_all(bind=ENGINE)
+        SessionLocal.configure(bind=ENGINE)
+        db = SessionLocal()
+        modo_original = settings.ZK_READ_LOCK_MODE
+        try:
+            db.query(PoliticaRotacion).delete()
+            db.query(Dispositivo).delete()
+            dispositivo = Dispositivo(nombre="Bloqueo", ip_address=host, puerto=puerto, activo=True)
+            db.add(dispositivo)
+            db.commit()
+
+            # Ventana: solo la descarga con buffer deshabilita el equipo
+            settings.ZK_READ_LOCK_MODE = "ventana"
+            with pool_conexiones.sesion(dispositivo, lectura=True) as zk:
+                self.assertFalse(zk.deshabilitado)
+                zk.obtener_conteos()
+                self.assertIsNone(simulado.deshabilitado_desde)
+                self.assertEqual(len(list(zk.iterar_asistencias())), 2000)
+                self.assertIsNone(simulado.deshabilitado_desde)
+            bloqueo = pool_conexiones.estadisticas_bloqueo(dispositivo.id)
+            self.assertEqual(bloqueo["bloqueos"], 1)
+            self.assertGreater(simulado.estadisticas()["segundos_deshabilitado"], 0)
+
+            # Nunca: el equipo no se deshabilita en toda la sincronización
+            settings.ZK_READ_LOCK_MODE = "nunca"
+            antes = simulado.estadisticas()["segundos_deshabilitado"]
+            resultado = AsistenciaService.sincronizar_asistencias_desde_dispositivo(db, dispositivo.id, completo=True)
+            self.assertTrue(resultado["success"], resultado["message"])
+            self.assertEqual(resultado["dispositivo_deshabilitado_ms"], 0)
+            self.assertEqual(simulado.estadisticas()["segundos_deshabilitado"], antes)
+            self.assertEqual(pool_conexiones.estadisticas_bloqueo(dispositivo.id)["bloqueos"], 1)
+
+            # Las escrituras mantienen el modo exclusivo durante toda la sesión
+            with pool_conexiones.sesion(dispositivo) as zk:
+                self.assertTrue(zk.deshabilitado)
+                self.assertIsNotNone(simulado.deshabilitado_desde)
+            bloqueo = pool_conexiones.estadisticas_bloqueo(dispositivo.id)
+            self.assertEqual(bloqueo["bloqueos"], 2)
+            self.assertGreaterEqual(bloqueo["bloqueo_maximo_ms"], bloqueo["ultimo_bloqueo_ms"])
+        finally:
+            settings.ZK_READ_LOCK_MODE = modo_original
+            db.close()
+            pool_conexiones.cerrar_todas()
+            flota.detener()
+
+
+class TestPoolConexiones(unittest.TestCase):
+    def setUp(self):
+        self.flota = SimuladorFlota([ConfiguracionSimulador(registros=200, usuarios=5, semilla=9, primer_user_id=75001)])
+        host, puerto = self.flota.iniciar()[0]
+        self.dispositivo = Dispositivo(id=9501, nombre="Pool", ip_address=host, puerto=puerto, timeout=5, password=0)
+        self.pool = PoolConexiones(keepalive_intervalo=60, tiempo_inactividad=300)
+        self.modo_original = settings.ZK_READ_LOCK_MODE
+
+    def tearDown(self):
+        settings.ZK_READ_LOCK_MODE = self.modo_original
+        self.pool.cerrar_todas()
+        self.flota.detener()
+
+    def test_solo_habilita_si_la_sesion_deshabilito(self):
+        settings.ZK_READ_LOCK_MODE = "nunca"
+        for lectura, habilitaciones in ((True, 0), (False, 1)):
+            with self.pool.sesion(self.dispositivo, lectura=lectura) as zk:
+                self.assertEqual(zk.deshabilitado, not lectura)
+                espia = mock.patch.object(zk, "habilitar_dispositivo", wraps=zk.habilitar_dispositivo)
+                habilitar = espia.start()
+            espia.stop()
+            self.assertEqual(habilitar.call_count, habilitaciones)
+            self.assertIsNone(self.flota.dispositivos[0].deshabilitado_desde)
+
+    def test_sesiones_concurrentes_se_serializan(self):
+        activos, maximo, resultados = [0], [0], []
+        candado = threading.Lock()
+
+        def operar():
+            with self.pool.sesion(self.dispositivo) as zk:
+                with candado:
+                    activos[0] += 1
+                    maximo[0] = max(maximo[0], activos[0])
+                resultados.append(zk.obtener_conteos()["registros"])
+                time.sleep(0.02)
+                with candado:
+                    activos[0] -= 1
+
+        hilos = [threading.Thread(target=operar) for _ in range(6)]
+        for hilo in hilos:
+            hilo.start()
+        for hilo in hilos:
+            hilo.join(timeout=30)
+
+        self.assertEqual(resultados, [200] * 6)
+        self.assertEqual(maximo[0], 1)
+        estado = self.pool.estado()[0]
+        # Una sola sesión TCP reutilizada por todas las operaciones
+        self.assertEqual((estado["conexiones_realizadas"], estado["operaciones"]), (1, 6))
+
+    def test_sesion_descartada_tras_un_error(self):
+        with self.assertRaises(RuntimeError):
+            with self.pool.sesion(self.dispositivo) as zk:
+                self.assertIsNotNone(zk)
+                raise RuntimeError("fallo en el bloque")
+        # Estado desconocido: la sesión se cierra y el dispositivo queda habilitado
+        self.assertFalse(self.pool.sesion_abierta(self.dispositivo.id))
+        self.assertIsNone(self.flota.dispositivos[0].deshabilitado_desde)
+
+        with self.pool.sesion(self.dispositivo) as zk:
+            self.assertEqual(zk.obtener_conteos()["registros"], 200)
+        self.assertTrue(self.pool.sesion_abierta(self.dispositivo.id))
+        self.assertEqual(self.pool.estado()[0]["conexiones_realizadas"], 2)
+
+
+class TestMarcaDeAgua(unittest.TestCase):
+    def test_omite_sin_cambios_y_reinicia_si_cambia_el_serial(self):
+        flota = SimuladorFlota([ConfiguracionSimulador(registros=300, usuarios=4, semilla=12, primer_user_id=82001)])
+        host, puerto = flota.iniciar()[0]
+        simulado = flota.dispositivos[0]
+        Base.metadata.create_all(bind=ENGINE)
+        SessionLocal.configure(bind=ENGINE)
+        db = SessionLocal()
+        try:
+            for modelo in (EjecucionSincronizacion, EstadoSincronizacion, PoliticaRotacion, Dispositivo):
+                db.query(modelo).delete()
+            dispositivo = Dispositivo(nombre="Marca de agua", ip_address=host, puerto=puerto, activo=True)
+            db.add(dispositivo)
+            db.flush()
+            db.add_all([Usuario(uid=82001 + n, user_id=str(82001 + n), nombre=f"Marca {n}",
+                                dispositivo_id=dispositivo.id) for n in range(4)])
+            db.commit()
+
+            def sincronizar():
+                resultado = AsistenciaService.sincronizar_asistencias_desde_dispositivo(db, dispositivo.id)
+                self.assertTrue(resultado["success"], resultado["message"])
+                return resultado
+
+            self.assertEqual(sincronizar()["registros_nuevos"], 300)
+
+            # Mismo conteo y misma memoria: no se descarga el buffer
+            original = ZKTecoConnection.iterar_asistencias
+            with mock.patch.object(ZKTecoConnection, "iterar_asistencias", autospec=True,
+                                   side_effect=original) as iterar:
+                resultado = sincronizar()
+                self.assertEqual(iterar.call_count, 0)
+                self.assertEqual((resultado["registros_nuevos"], resultado["registros_procesados"]), (0, 0))
+
+                # Marcaciones nuevas: solo se decodifica lo posterior a la marca de agua
+                flota.ejecutar(simulado.agregar_marcaciones, 50)
+                resultado = sincronizar()
+                self.assertEqual(iterar.call_count, 1)
+                self.assertEqual((resultado["registros_nuevos"], resultado["registros_procesados"]), (50, 50))
+            estado = db.query(EstadoSincronizacion).filter(EstadoSincronizacion.dispositivo_id == dispositivo.id).one()
+            self.assertEqual((estado.ultimo_conteo_registros, estado.serial_number), (350, simulado.serial))
+
+            # Otro equipo en la misma IP: la marca de agua no aplica y se relee toda la memoria
+            simulado.serial = "OTRO00001"
+            resultado = sincronizar()
+            self.assertEqual((resultado["registros_nuevos"], resultado["registros_procesados"]), (0, 350))
+            db.refresh(estado)
+            self.assertEqual((estado.ultimo_conteo_registros, estado.serial_number), (350, "OTRO00001"))
+            self.assertEqual(sincronizar()["registros_procesados"], 0)
+        finally:
+            db.close()
+            pool_conexiones.cerrar_todas()
+            flota.detener()
+
+
+class TestPuntosDeControl(unittest.TestCase):
+    def test_sincronizacion_fallida_se_retoma_desde_el_ultimo_lote(self):
+        import zkteco_ingesta
+        flota = SimuladorFlota([ConfiguracionSimulador(registros=1000, usuarios=5, semilla=8, primer_user_id=74001)])
+        host, puerto = flota.iniciar()[0]
+        Base.metadata.create_all(bind=ENGINE)
+        SessionLocal.configure(bind=ENGINE)
+        db = SessionLocal()
+        lote_original, directorio_original = settings.SYNC_BATCH_SIZE, spool_ingesta.directorio
+        try:
+            settings.SYNC_BATCH_SIZE = 100
+            spool_ingesta.directorio = ""
+            for modelo in (EjecucionSincronizacion, EstadoSincronizacion, PoliticaRotacion, Dispositivo):
+                db.query(modelo).delete()
+            dispositivo = Dispositivo(nombre="Checkpoint", ip_address=host, puerto=puerto, activo=True)
+            db.add(dispositivo)
+            db.flush()
+            db.add_all([Usuario(uid=74001 + n, user_id=str(74001 + n), nombre=f"Checkpoint {n}",
+                                dispositivo_id=dispositivo.id) for n in range(5)])
+            db.commit()
+
+            # La BD "cae" tras 350 registros: quedan confirmados los 3 primeros lotes
+            def cortado(iterable, lote, capacidad):
+                for n, registro in enumerate(zkteco_ingesta.flujo_acotado(iterable, lote, capacidad)):
+                    if n == 350:
+                        raise ConnectionError("conexión con la BD perdida")
+                    yield registro
+
+            with mock.patch("services.asistencia_service.flujo_acotado", cortado):
+                fallida = AsistenciaService.sincronizar_asistencias_desde_dispositivo(db, dispositivo.id)
+            self.assertFalse(fallida["success"])
+            ejecucion = db.get(EjecucionSincronizacion, fallida["ejecucion_id"])
+            self.assertEqual((ejecucion.estado, ejecucion.checkpoint_indice, ejecucion.lotes_confirmados), ("fallido", 300, 3))
+            self.assertEqual(ejecucion.registros_insertados, 300)
+            self.assertEqual(db.query(Asistencia).filter(Asistencia.uid.between(74001, 74005)).count(), 300)
+
+            # El reintento solo procesa lo que falta
+            resultado = AsistenciaService.sincronizar_asistencias_desde_dispositivo(db, dispositivo.id)
+            self.assertTrue(resultado["success"], resultado["message"])
+            self.assertEqual(resultado["reanudada_desde"], 300)
+            self.assertEqual((resultado["registros_procesados"], resultado["registros_nuevos"]), (700, 700))
+            self.assertEqual(db.query(Asistencia).filter(Asistencia.uid.between(74001, 74005)).count(), 1000)
+            reanudada = db.get(EjecucionSincronizacion, resultado["ejecucion_id"])
+            self.assertEqual((reanudada.estado, reanudada.reanuda_de, reanudada.indice_inicial), ("completado", ejecucion.id, 300))
+            self.assertIsNotNone(reanudada.segundos_escritura)
+
+            # Completada la ejecución, ya no hay nada que retomar
+            resultado = AsistenciaService.sincronizar_asistencias_desde_dispositivo(db, dispositivo.id)
+            self.assertEqual(resultado["registros_nuevos"], 0)
+            self.assertIsNone(resultado.get("reanudada_desde"))
+
+            resumen = SincronizacionService.resumen_ejecuciones(db)["dispositivos"][0]
+            self.assertEqual((resumen["ejecuciones"], resumen["completadas"], resumen["fallidas"], resumen["reanudadas"]), (3, 2, 1, 1))
+            self.assertEqual(resumen["registros_insertados"], 1000)
+        finally:
+            settings.SYNC_BATCH_SIZE, spool_ingesta.directorio = lote_original, directorio_original
+            db.close()
+            pool_conexiones.cerrar_todas()
+            flota.detener()
+
+
+class TestCalculoPorLotes(unittest.TestCase):
+    maxDiff = None
+    CAMPOS = ("horario_id_snapshot", "horas_esperadas", "horas_trabajadas", "estado_asistencia",
+              "es_justificado", "entrada_real", "salida_real")
+
+    def test_mismo_resultado_que_el_calculo_original(self):
+        Base.metadata.create_all(bind=ENGINE)
+        SessionLocal.configure(bind=ENGINE)
+        db = SessionLocal()
+        desde, dias = date(2025, 3, 3), 12
+        incidencias = [{
+            "empleado_id": "76003", "estado": {"nombre": "Aprobado"}, "tipo_incidencia": {"codigo": "VAC"},
+            "fecha_inicio": "2025-03-05T00:00:00Z", "fecha_fin": "2025-03-08T00:00:00Z"
+        }]
+        try:
+            user_ids = corpus_calculo(db, semilla=11, usuarios=15, desde=desde, dias=dias, primer_uid=76001)
+            descargas = []
+
+            def descargar(empleado_id=None, timeout=3):
+                descargas.append(empleado_id)
+                return incidencias
+
+            def verificar(user_id, fecha):
+                # Búsqueda lineal original como referencia del índice
+                return AsistenciaService.buscar_incidencia(incidencias, user_id, fecha)
+
+            # verificar_incidencia se fija explícitamente: otros módulos de prueba la reemplazan al importarse
+            # Referencia: el algoritmo previo al motor por lotes (copia congelada)
+            original = {(user_id, desde + timedelta(days=d)): calculo_original(db, user_id, desde + timedelta(days=d), incidencias)
+                        for d in range(dias) for user_id in user_ids}
+
+            cache_incidencias.invalidar()
+            with mock.patch("services.incidencia_service.descargar_incidencias", side_effect=descargar), \
+                    mock.patch.object(AsistenciaService, "verificar_incidencia", side_effect=verificar):
+                por_dia = {}
+                for d in range(dias):
+                    fecha = desde + timedelta(days=d)
+                    for user_id in user_ids:
+                        reporte = AsistenciaService.procesar_asistencia_dia(db, user_id, fecha)
+                        por_dia[(user_id, fecha)] = tuple(getattr(reporte, c) for c in self.CAMPOS)
+                diferencias = {k: (v, por_dia.get(k)) for k, v in original.items() if por_dia.get(k) != v}
+                self.assertEqual(diferencias, {})
+                descargas.clear()
+
+                filas = CalculoService.calcular_rango(db, desde, desde + timedelta(days=dias - 1), user_ids)
+
+            self.assertEqual(len(filas), len(original))
+            guardados = db.query(AsistenciaDiaria).filter(AsistenciaDiaria.user_id.in_(user_ids)).all()
+            self.assertEqual(len(guardados), len(original))
+            por_lotes = {(r.user_id, r.fecha): tuple(getattr(r, c) for c in self.CAMPOS) for r in guardados}
+            diferencias = {k: (v, por_lotes.get(k)) for k, v in original.items() if por_lotes.get(k) != v}
+            self.assertEqual(diferencias, {})
+            self.assertIn("VAC", {v[3] for v in por_lotes.values()})
+            self.assertIn("FERIADO", {v[3] for v in por_lotes.values()})
+            # Una sola descarga de incidencias para todo el rango
+            self.assertEqual(descargas, [None])
+        finally:
+            cache_incidencias.invalidar()
+            db.close()
+
+
+@unittest.skipUnless(calculo_service.np is not None, "NumPy no está instalado")
+class TestEmparejamientoVectorizado(unittest.TestCase):
+    def test_mismas_decisiones_que_el_emparejamiento_por_dia(self):
+        import random
+        from types import SimpleNamespace
+        azar = random.Random(23)
+        casos = []
+        for _ in range(3000):
+            segmentos, hora = [], azar.randint(5, 10) * 60
+            for _ in range(azar.randint(1, 3)):
+                fin = hora + azar.randint(60, 300)
+                if fin >= 24 * 60:
+                    break
+                segmentos.append(SimpleNamespace(hora_inicio=dt_time(hora // 60, hora % 60),
+                                                 hora_fin=dt_time(fin // 60, fin % 60, azar.choice([0, 0, 30])),
+                                                 tolerancia_minutos=azar.choice([0, 5, 10, 15])))
+                hora = fin + azar.randint(0, 90)
+            # Marcaciones cerca de los bordes de las ventanas, con repetidas y empates de distancia
+            minutos = []
+            for segmento in segmentos:
+                for borde in (segmento.hora_inicio, segmento.hora_fin):
+                    base = borde.hour * 60 + borde.minute
+                    minutos.extend(base + azar.choice([-121, -120, -60, -1, 0, 1, 16, 30, 75, 76, 240, 241])
+                                   for _ in range(azar.randint(0, 3)))
+            horas = sorted(dt_time(m // 60, m % 60, azar.choice([0, 0, 59])) for m in minutos if 0 <= m < 24 * 60)
+            if horas and azar.random() < 0.2:
+                horas.insert(azar.randrange(len(horas)), horas[azar.randrange(len(horas))])
+                horas.sort()
+            casos.append((horas, segmentos))
+        casos.append(([], casos[0][1]))
+
+        esperado = [calculo_service.emparejar_segmentos(horas, segmentos) for horas, segmentos in casos]
+        with mock.patch.object(settings, "CALC_BATCH_SIZE", 700):
+            self.assertEqual(calculo_service.emparejar_lote(casos), esperado)
+        self.assertGreater(sum(1 for r in esperado if r["llegada_tarde"]), 0)
+        self.assertGreater(sum(1 for r in esperado if r["ultima_salida"] is None), 0)
+
+    def test_calculo_por_lotes_igual_con_y_sin_numpy(self):
+        Base.metadata.create_all(bind=ENGINE)
+        SessionLocal.configure(bind=ENGINE)
+        db = SessionLocal()
+        desde, dias = date(2025, 4, 7), 10
+        try:
+            user_ids = corpus_calculo(db, semilla=29, usuarios=20, desde=desde, dias=dias, primer_uid=77001)
+            hasta = desde + timedelta(days=dias - 1)
+            with mock.patch("services.incidencia_service.descargar_incidencias", return_value=[]):
+                vectorizado = CalculoService.calcular_rango(db, desde, hasta, user_ids)
+                with mock.patch.object(calculo_service, "np", None):
+                    en_python = CalculoService.calcular_rango(db, desde, hasta, user_ids)
+            self.assertEqual(vectorizado, en_python)
+            self.assertIn("TARDE", {f["estado_asistencia"] for f in vectorizado})
+        finally:
+            cache_incidencias.invalidar()
+            db.close()
+
+
+class TestCalculoEnProcesos(unittest.TestCase):
+    def test_mismo_resultado_que_en_un_proceso(self):
+        directorio = tempfile.mkdtemp(prefix="zk-calculo-")
+        motor = create_engine(f"sqlite:///{os.path.join(directorio, 'calculo.db')}")
+        Base.metadata.create_all(bind=motor)
+        db = Session(bind=motor)
+        desde, dias = date(2025, 5, 5), 8
+        incidencias = [{"empleado_id": "78002", "estado": {"nombre": "Aprobado"}, "tipo_incidencia": {"codigo": "LIC"},
+                        "fecha_inicio": "2025-05-05", "fecha_fin": "2025-05-12"}]
+        try:
+            user_ids = corpus_calculo(db, semilla=31, usuarios=18, desde=desde, dias=dias, primer_uid=78001)
+            hasta = desde + timedelta(days=dias - 1)
+            avance = []
+            with mock.patch("services.incidencia_service.descargar_incidencias", return_value=incidencias), \
+                    mock.patch.object(settings, "CALC_CHUNK_USERS", 5):
+                en_uno = CalculoService.calcular_rango(db, desde, hasta, user_ids, procesos=1)
+                en_varios = CalculoService.calcular_rango(db, desde, hasta, user_ids, procesos=3,
+                                                          al_avanzar=lambda n, total: avance.append((n, total)))
+            self.assertEqual(en_varios, en_uno)
+            self.assertIn("LIC", {f["estado_asistencia"] for f in en_varios})
+            # Un aviso por bloque de 5 usuarios y una sola escritura con todas las filas
+            self.assertEqual([n for n, _ in avance][-1], 18)
+            self.assertEqual(len(avance), 4)
+            self.assertEqual(db.query(AsistenciaDiaria).filter(AsistenciaDiaria.user_id.in_(user_ids)).count(),
+                             18 * dias)
+        finally:
+            cache_incidencias.invalidar()
+            db.close()
+            motor.dispose()
+            shutil.rmtree(directorio, ignore_errors=True)
+
+
+class TestRecalculoIncremental(unittest.TestCase):
+    CAMPOS = TestCalculoPorLotes.CAMPOS
+
+    def guardados(self, db, user_ids):
+        return {(r.user_id, r.fecha): tuple(getattr(r, c) for c in self.CAMPOS)
+                for r in db.query(AsistenciaDiaria).filter(AsistenciaDiaria.user_id.in_(user_ids))}
+
+    def test_recalcula_solo_los_dias_que_recibieron_marcaciones(self):
+        Base.metadata.create_all(bind=ENGINE)
+        SessionLocal.configure(bind=ENGINE)
+        db = SessionLocal()
+        desde, dias = date(2025, 6, 2), 6
+        hasta = desde + timedelta(days=dias - 1)
+        try:
+            user_ids = corpus_calculo(db, semilla=37, usuarios=10, desde=desde, dias=dias, primer_uid=79001)
+            # Un día laborable sin marcaciones, que las nuevas convierten en asistencia
+            martes = desde + timedelta(days=1)
+            db.query(Asistencia).filter(Asistencia.uid == 79002, Asistencia.timestamp.between(
+                datetime.combine(martes, dt_time.min), datetime.combine(martes, dt_time.max))).delete()
+            db.query(DiaPendiente).delete()
+            db.commit()
+            dispositivo_id = db.query(Usuario.dispositivo_id).filter(Usuario.uid == 79001).scalar()
+            with mock.patch("services.incidencia_service.descargar_incidencias", return_value=[]):
+                CalculoService.calcular_rango(db, desde, hasta, user_ids)
+                antes = self.guardados(db, user_ids)
+
+                # Llegan marcaciones de hoy y, tarde, de días pasados
+                nuevas = [
+                    (79002, datetime.combine(martes, dt_time(7, 58))),
+                    (79002, datetime.combine(martes, dt_time(17, 20))),
+                    (79006, datetime.combine(hasta, dt_time(9, 2))),
+                    (79004, datetime.combine(desde, dt_time(9, 40))),
+                    (79009, datetime.combine(desde + timedelta(days=3), dt_time(13, 5))),
+                ]
+                resultado = AsistenciaService._insertar_registros_masivo(
+                    db, dispositivo_id, [(uid, datetime_a_epoch(ts), 1, 0) for uid, ts in nuevas])
+                db.commit()
+                self.assertEqual(resultado["insertados"], 5)
+                pendientes = {(p.uid, p.fecha) for p in db.query(DiaPendiente)}
+                self.assertEqual(pendientes, {(uid, ts.date()) for uid, ts in nuevas})
+
+                # Un duplicado no vuelve a marcar el día
+                AsistenciaService._insertar_registros_masivo(db, dispositivo_id, [(79002, datetime_a_epoch(nuevas[0][1]), 1, 0)])
+                self.assertEqual(db.query(DiaPendiente.version).filter(DiaPendiente.uid == 79002).scalar(), 1)
+
+                procesado = RecalculoService.procesar_pendientes(db)
+                self.assertEqual((procesado["pendientes_procesados"], procesado["dias_recalculados"]), (4, 4))
+                self.assertEqual(RecalculoService.resumen_pendientes(db)["dias_pendientes"], 0)
+
+                # Solo cambian los días marcados y quedan igual que un recálculo completo
+                despues = self.guardados(db, user_ids)
+                cambiados = {k for k in antes if antes[k] != despues[k]}
+                self.assertIn(("79002", martes), cambiados)
+                self.assertLessEqual(cambiados, {(str(uid), ts.date()) for uid, ts in nuevas})
+                CalculoService.calcular_rango(db, desde, hasta, user_ids)
+                self.assertEqual(self.guardados(db, user_ids), despues)
+
+            # Reingesta de lo ya guardado (sincronización completa, captura, spool) con una
+            # sola marcación nueva: los bloques sin filas nuevas no marcan nada, solo el de
+            # la nueva, y se avisa al recalculador
+            from types import SimpleNamespace
+            db.query(DiaPendiente).delete()
+            db.commit()
+            nueva = datetime.combine(desde + timedelta(days=4), dt_time(12, 1))
+            logs = [SimpleNamespace(uid=0, user_id=str(a.uid), timestamp=a.timestamp, status=1, punch=0)
+                    for a in db.query(Asistencia).filter(Asistencia.uid.between(79001, 79010))]
+            logs.append(SimpleNamespace(uid=0, user_id="79003", timestamp=nueva, status=1, punch=0))
+            lote_original = settings.SYNC_BATCH_SIZE
+            try:
+                settings.SYNC_BATCH_SIZE = 10
+                with mock.patch.object(recalculador_incremental, "avisar") as aviso, \
+                        mock.patch.object(db, "query", wraps=db.query) as consultas:
+                    resultado = AsistenciaService.guardar_marcaciones_dispositivo(db, dispositivo_id, logs)
+            finally:
+                settings.SYNC_BATCH_SIZE = lote_original
+            self.assertEqual(resultado["insertados"], 1)
+            # Sin lecturas previas por bloque: solo la carga de los uids conocidos
+            self.assertEqual(consultas.call_count, 1)
+            ultimo = logs[len(logs) - (len(logs) % 10 or 10):]
+            self.assertEqual({(p.uid, p.fecha) for p in db.query(DiaPendiente)},
+                             {(int(l.user_id), l.timestamp.date()) for l in ultimo})
+            aviso.assert_called_once()
+        finally:
+            cache_incidencias.invalidar()
+            db.query(DiaPendiente).delete()
+            db.commit()
+            db.close()
+
+    def test_dia_marcado_durante_el_calculo_sigue_pendiente(self):
+        Base.metadata.create_all(bind=ENGINE)
+        SessionLocal.configure(bind=ENGINE)
+        db = SessionLocal()
+        desde = date(2025, 6, 16)
+        try:
+            corpus_calculo(db, semilla=41, usuarios=3, desde=desde, dias=2, primer_uid=79101)
+            db.query(DiaPendiente).delete()
+            RecalculoService.marcar(db, {(79101, desde), (79102, desde)})
+            db.commit()
+            original = CalculoService.calcular_dias
+
+            def con_marcacion_concurrente(db_, pares):
+                filas = original(db_, pares)
+                RecalculoService.marcar(db_, {(79101, desde)})
+                return filas
+
+            with mock.patch("services.incidencia_service.descargar_incidencias", return_value=[]), \
+                    mock.patch.object(CalculoService, "calcular_dias", side_effect=con_marcacion_concurrente):
+                RecalculoService.procesar_pendientes(db)
+            self.assertEqual([(p.uid, p.version) for p in db.query(DiaPendiente)], [(79101, 2)])
+
+        finally:
+            cache_incidencias.invalidar()
+            db.query(DiaPendiente).delete()
+            db.commit()
+            db.close()
+
+
+class TestIndiceIncidencias(unittest.TestCase):
+    def test_misma_respuesta_que_la_busqueda_lineal(self):
+        import random
+        azar = random.Random(5)
+        desde = date(2025, 1, 1)
+        incidencias = []
+        for n in range(300):
+            inicio = desde + timedelta(days=azar.randint(0, 80))
+            fin = inicio + timedelta(days=azar.randint(-2, 12))
+            incidencias.append({
+                "empleado_id": azar.choice(["1", "2", "3", "4", 5]),
+                "estado": azar.choice([{"nombre": "Aprobado"}] * 3 + [{"nombre": "Pendiente"}, None]),
+                "tipo_incidencia": azar.choice([{"codigo": f"T{n % 7}"}, {}, None]),
+                "fecha_inicio": azar.choice([f"{inicio.isoformat()}T00:00:00Z"] * 8 + [None, "no-es-fecha"]),
+                "fecha_fin": f"{fin.isoformat()}T00:00:00.000Z",
+            })
+
+        indice = IndiceIncidencias(incidencias)
+        for empleado in ("1", "2", "3", "4", "5", "6"):
+            for d in range(-3, 100):
+                fecha = desde + timedelta(days=d)
+                self.assertEqual(indice.buscar(empleado, fecha),
+                                 AsistenciaService.buscar_incidencia(incidencias, empleado, fecha), (empleado, fecha))
+
+    def test_descarga_sigue_la_paginacion(self):
+        paginas = {
+            1: [{"empleado_id": "9", "estado": {"nombre": "Aprobado"}, "tipo_incidencia": {"codigo": "LIC"},
+                 "fecha_inicio": "2025-02-03", "fecha_fin": "2025-02-04"}],
+            2: [{"empleado_id": "10", "estado": {"nombre": "Aprobado"}, "tipo_incidencia": {"codigo": "VAC"},
+                 "fecha_inicio": "2025-02-10", "fecha_fin": "2025-02-14"}],
+        }
+        pedidos = []
+
+        def get(url, params=None, timeout=None):
+            pedidos.append(params)
+            pagina = (params or {}).get("page", 1)
+            return mock.Mock(status_code=200, json=lambda: {
+                "data": paginas[pagina], "pagination": {"total": 2, "page": pagina, "limit": 1, "totalPages": 2}
+            })
+
+        with mock.patch("services.incidencia_service.requests.get", side_effect=get):
+            indice = CacheIncidencias(ttl=60, timeout=5).obtener()
+        self.assertEqual(pedidos, [None, {"page": 2, "limit": 1}])
+        self.assertEqual(indice.buscar("9", date(2025, 2, 4)), (True, "LIC"))
+        self.assertEqual(indice.buscar("10", date(2025, 2, 12)), (True, "VAC"))
+
+    def test_cache_con_vigencia_y_respaldo_vencido(self):
+        incidencias = [{"empleado_id": "9", "estado": {"nombre": "Aprobado"}, "tipo_incidencia": {"codigo": "LIC"},
+                        "fecha_inicio": "2025-02-03", "fecha_fin": "2025-02-04"}]
+        cache = CacheIncidencias(ttl=60, timeout=1)
+        with mock.patch("services.incidencia_service.descargar_incidencias", return_value=incidencias) as descargar:
+            primero = cache.obtener()
+            self.assertIs(cache.obtener(), primero)
+            self.assertEqual(descargar.call_count, 1)
+        self.assertEqual(primero.buscar("9", date(2025, 2, 4)), (True, "LIC"))
+
+        # Vencida la vigencia, si la API no responde se usa el índice anterior
+        cache.ttl = 0
+        with mock.patch("services.incidencia_service.descargar_incidencias", side_effect=TimeoutError("lenta")):
+            self.assertIs(cache.obtener(), primero)
+        estadisticas = cache.estadisticas()
+        self.assertEqual((estadisticas["descargas"], estadisticas["aciertos"], estadisticas["fallos"],
+                          estadisticas["respaldos"]), (1, 1, 1, 1))
+
+        # Sin descarga previa no hay respaldo: ninguna justificación
+        cache.invalidar()
+        with mock.patch("services.incidencia_service.descargar_incidencias", side_effect=TimeoutError("lenta")):
+            self.assertEqual(cache.obtener().buscar("9", date(2025, 2, 4)), (False, None))
+
+
+class TestTrabajos(unittest.TestCase):
+    def setUp(self):
+        import threading
+        Base.metadata.create_all(bind=ENGINE)
+        SessionLocal.configure(bind=ENGINE)
+        self.liberar = threading.Event()
+        self.gestor = GestorTrabajos(max_workers=1)
+
+        def lenta(db, contexto, pasos=3):
+            for i in range(pasos):
+                contexto.progreso(i * 100 / pasos, f"Paso {i + 1}")
+                self.liberar.wait(5)
+            return {"success": True, "pasos": pasos}
+
+        def rota(db, contexto):
+            raise RuntimeError("sin conexión")
+
+        self.gestor.registrar("lenta", lenta)
+        self.gestor.registrar("rota", rota)
+
+    def tearDown(self):
+        self.liberar.set()
+        executor = self.gestor._executor
+        self.gestor.detener()
+        # La BD de las pruebas es una sola conexión: los trabajos terminan antes de la siguiente prueba
+        if executor:
+            executor.shutdown(wait=True)
+
+    def esperar(self, trabajo_id, estados=("completado", "fallido", "cancelado")):
+        import time
+        limite = time.monotonic() + 5
+        while time.monotonic() < limite:
+            trabajo = self.gestor.obtener(trabajo_id)
+            if trabajo["estado"] in estados:
+                return trabajo
+            time.sleep(0.02)
+        self.fail(f"El trabajo {trabajo_id} no llegó a {estados}")
+
+    def test_deduplicacion_cancelacion_y_resultado(self):
+        primero, nuevo = self.gestor.enviar("lenta", {"pasos": 2})
+        self.assertTrue(nuevo)
+        duplicado, nuevo = self.gestor.enviar("lenta", {"pasos": 2})
+        self.assertFalse(nuevo)
+        self.assertEqual(duplicado["id"], primero["id"])
+        self.esperar(primero["id"], ("en_curso",))
+
+        # Con el único worker ocupado, el segundo trabajo queda pendiente y se cancela sin ejecutarse
+        segundo, _ = self.gestor.enviar("lenta", {"pasos": 5})
+        self.assertEqual(self.gestor.cancelar(segundo["id"])["estado"], "cancelado")
+
+        # Cancelar el trabajo en curso lo detiene en su siguiente punto de control
+        self.gestor.cancelar(primero["id"])
+        self.liberar.set()
+        self.assertEqual(self.esperar(primero["id"])["estado"], "cancelado")
+
+        completo, nuevo = self.gestor.enviar("lenta", {"pasos": 2})
+        self.assertTrue(nuevo)
+        completo = self.esperar(completo["id"])
+        self.assertEqual((completo["estado"], completo["progreso"]), ("completado", 100))
+        self.assertEqual(completo["resultado"], {"success": True, "pasos": 2})
+
+        fallido, _ = self.gestor.enviar("rota")
+        fallido = self.esperar(fallido["id"])
+        self.assertEqual((fallido["estado"], fallido["error"]), ("fallido", "sin conexión"))
+
+        with self.assertRaises(ValueError):
+            self.gestor.enviar("desconocida")
+        self.assertEqual(
+            gestor_trabajos.tipos,
+            ["calcular_asistencia", "reproducir_spool", "sincronizar_asistencias", "sincronizar_todos",
+             "sincronizar_usuarios"]
+        )
+
+    def test_tarea_sin_puntos_de_control_rechaza_cancelar_en_curso(self):
+        self.gestor.registrar("opaca", lambda db, contexto, otro=None: {"success": self.liberar.wait(5)},
+                             cancelable=False)
+        trabajo, _ = self.gestor.enviar("opaca")
+        self.esperar(trabajo["id"], ("en_curso",))
+        with self.assertRaises(CancelacionNoAdmitida):
+            self.gestor.cancelar(trabajo["id"])
+        # Pendiente detrás del único worker, sí se cancela
+        pendiente, _ = self.gestor.enviar("opaca", {"otro": 1})
+        self.assertEqual(self.gestor.cancelar(pendiente["id"])["estado"], "cancelado")
+        self.liberar.set()
+        self.assertEqual(self.esperar(trabajo["id"])["estado"], "completado")
+
+    def test_cancelar_sincronizacion_en_un_punto_de_control(self):
+        flota = SimuladorFlota([ConfiguracionSimulador(registros=500, usuarios=4, semilla=10, primer_user_id=81001)])
+        host, puerto = flota.iniciar()[0]
+        db = SessionLocal()
+        lote_original = settings.SYNC_BATCH_SIZE
+        try:
+            settings.SYNC_BATCH_SIZE = 100
+            for modelo in (EjecucionSincronizacion, EstadoSincronizacion, PoliticaRotacion, Dispositivo):
+                db.query(modelo).delete()
+            dispositivo = Dispositivo(nombre="Cancelable", ip_address=host, puerto=puerto, activo=True)
+            db.add(dispositivo)
+            db.flush()
+            db.add_all([Usuario(uid=81001 + n, user_id=str(81001 + n), nombre=f"Cancelable {n}",
+                                dispositivo_id=dispositivo.id) for n in range(4)])
+            db.commit()
+
+            # La cancelación llega tras el segundo lote confirmado
+            puntos = []
+
+            def verificar():
+                puntos.append(len(puntos))
+                if len(puntos) == 2:
+                    raise TrabajoCancelado()
+
+            with self.assertRaises(TrabajoCancelado):
+                AsistenciaService.sincronizar_asistencias_desde_dispositivo(db, dispositivo.id, verificar=verificar)
+            ejecucion = db.query(EjecucionSincronizacion).order_by(EjecucionSincronizacion.id.desc()).first()
+            self.assertEqual((ejecucion.estado, ejecucion.checkpoint_indice), ("interrumpido", 200))
+            self.assertEqual(db.query(Asistencia).filter(Asistencia.uid.between(81001, 81004)).count(), 200)
+            # El volcado no se reproduce: lo que falta lo retoma la próxima sincronización
+            self.assertEqual(spool_ingesta.pendientes(dispositivo.id), [])
+
+            resultado = AsistenciaService.sincronizar_asistencias_desde_dispositivo(db, dispositivo.id)
+            self.assertTrue(resultado["success"], resultado["message"])
+            self.assertEqual((resultado["reanudada_desde"], resultado["registros_nuevos"]), (200, 300))
+            self.assertEqual(db.query(Asistencia).filter(Asistencia.uid.between(81001, 81004)).count(), 500)
+        finally:
+            settings.SYNC_BATCH_SIZE = lote_original
+            db.close()
+            pool_conexiones.cerrar_todas()
+            flota.detener()
+
+    def test_recuperar_marca_interrumpidos(self):
+        trabajo, _ = self.gestor.enviar("lenta", {"pasos": 1})
+        self.esperar(trabajo["id"], ("en_curso",))
+        GestorTrabajos(max_workers=1).recuperar()
+        trabajo = self.gestor.obtener(trabajo["id"])
+        self.assertEqual(trabajo["estado"], "fallido")
+        self.assertIn("reinicio", trabajo["error"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -14,7 +14,10 @@ def update_schema():
     commands = [
         "ALTER TABLE usuarios ADD COLUMN fecha_nacimiento DATE NULL COMMENT 'Fecha de nacimiento'",
         "ALTER TABLE usuarios ADD COLUMN direccion VARCHAR(255) NULL COMMENT 'Dirección del usuario'",
-        "ALTER TABLE usuarios ADD COLUMN comentarios VARCHAR(500) NULL COMMENT 'Comentarios adicionales'"
+        "ALTER TABLE usuarios ADD COLUMN comentarios VARCHAR(500) NULL COMMENT 'Comentarios adicionales'",
+        "ALTER TABLE estado_sincronizacion ADD COLUMN primer_epoch BIGINT NULL COMMENT 'Primera marcación de la memoria (epoch)'",
+        "ALTER TABLE estado_sincronizacion ADD COLUMN indice_pendiente INT NULL COMMENT 'Primer registro de un usuario desconocido aún sin ingerir'",
+        "ALTER TABLE estado_sincronizacion ADD COLUMN usuarios_hasta DATETIME NULL COMMENT 'Inicio de la lectura que fijó indice_pendiente'"
     ]
     
     with engine.connect() as connection:
@@ -1,17 +1,27 @@
 from datetime import date, datetime, timedelta, time
 from sqlalchemy.orm import Session
-from sqlalchemy import and_, extract, desc
-from typing import List, Optional
+from sqlalchemy import and_, extract, desc, func
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from typing import Callable, List, Optional
+from time import monotonic
 
 from models.usuario import Usuario
 from models.asistencia import Asistencia
 from models.dispositivo import Dispositivo
 from models.turnos import SegmentosHorario, AsignacionHorario, Feriados
 from models.reportes import AsistenciaDiaria
+from models.sincronizacion import EstadoSincronizacion, EjecucionSincronizacion
+from services.rotacion_service import RotacionService
+from services.recalculo_service import RecalculoService
+from services.calculo_service import CalculoService, calcular_dia
+from services.incidencia_service import cache_incidencias, descargar_incidencias
 from schemas.asistencia import AsistenciaFilter
-from zkteco_connection import ZKTecoConnection
+from zkteco_pool import pool_conexiones
+from zkteco_tcp_protocol import datetime_a_epoch, epoch_a_datetime
+from zkteco_ingesta import spool_ingesta, flujo_acotado
+from zkteco_recalculo import recalculador_incremental
 from config import settings
-import requests
 
 import logging
 
@@ -61,6 +71,379 @@ class AsistenciaService:
             Asistencia.timestamp >= limite
         ).order_by(Asistencia.timestamp.desc()).all()
 
+    @staticmethod
+    def _leer_registros_nuevos(db: Session, dispositivo: Dispositivo, conn, completo: bool = False,
+                               epoch_min: int = None, epoch_max: int = None, ejecucion=None):
+        """
+        Lee del dispositivo solo lo necesario según la marca de agua (high-water mark).
+
+        Solo se omite la descarga si el conteo no cambió y la primera marcación de la
+        memoria es la misma (no se borró y volvió a llenar). Las marcaciones de usuarios
+        que no existían al leerlas (indice_pendiente) se releen cuando se crean o
+        modifican usuarios.
+
+        Con ejecucion (EjecucionSincronizacion en curso) se registran en ella el serial
+        y los conteos y, si una ejecución anterior falló con un punto de control aún
+        válido, la lectura se retoma desde ese punto.
+
+        Retorna (estado, conteos, serial, registros):
+            - registros es None si el dispositivo no tuvo cambios (no se descarga nada)
+            - si no, es un DecodificadorAsistencias que produce de forma perezosa
+              las tuplas (uid, epoch, status, punch) posteriores a la marca de agua
+              (y dentro de [epoch_min, epoch_max) si se indican)
+        Debe llamarse dentro de una sesión del pool y el decodificador debe recorrerse
+        (o volcarse con spool_ingesta.descargar) antes de liberarla: lee el buffer del
+        dispositivo bloque a bloque.
+        """
+        estado = db.query(EstadoSincronizacion).filter(
+            EstadoSincronizacion.dispositivo_id == dispositivo.id
+        ).first()
+
+        conteos = conn.obtener_conteos()
+        serial = conn.obtener_numero_serie()
+        registros = conteos.get('registros')
+
+        # Si cambió el equipo (serial distinto) la marca de agua anterior no aplica
+        if estado and serial and estado.serial_number and estado.serial_number != serial:
+            logger.info(f"Dispositivo {dispositivo.id}: serial cambió ({estado.serial_number} -> {serial}), marca de agua reiniciada")
+            estado = None
+
+        # Ni el conteo ni los índices sirven si la memoria se borró y volvió a llenarse:
+        # la primera marcación identifica el contenido (None = no se pudo verificar)
+        primer_epoch = conn.obtener_primera_marcacion() if estado is not None and registros else None
+        if estado is not None and primer_epoch is not None and estado.primer_epoch is not None \
+                and primer_epoch != estado.primer_epoch:
+            logger.info(f"Dispositivo {dispositivo.id}: la memoria de marcaciones cambió desde la última "
+                        f"sincronización, marca de agua reiniciada")
+            estado = None
+        memoria_verificada = not registros or (
+            estado is not None and primer_epoch is not None and primer_epoch == estado.primer_epoch
+        )
+
+        # Marcaciones de usuarios desconocidos: se releen cuando hay usuarios nuevos o modificados
+        releer_desde = None
+        if not completo and estado is not None and estado.indice_pendiente is not None:
+            hay_usuarios_nuevos = estado.usuarios_hasta is None or db.query(Usuario.id).filter(
+                Usuario.fecha_actualizacion >= estado.usuarios_hasta
+            ).first() is not None
+            if hay_usuarios_nuevos:
+                releer_desde = estado.indice_pendiente
+
+        punto = None
+        if ejecucion is not None:
+            ejecucion.serial_number = serial
+            ejecucion.registros_dispositivo = registros
+            punto = AsistenciaService._punto_reanudacion(db, dispositivo.id, serial, registros)
+
+        sin_cambios = (
+            not completo
+            and punto is None
+            and releer_desde is None
+            and estado is not None
+            and memoria_verificada
+            and registros is not None
+            and registros == estado.ultimo_conteo_registros
+        )
+        if sin_cambios:
+            return estado, conteos, serial, None
+
+        # El protocolo no permite pedir un rango de la memoria de marcaciones:
+        # lo ya ingerido se descarta al decodificar. Los registros se almacenan
+        # en orden de llegada, así que lo nuevo está a partir del último conteo;
+        # el filtro por timestamp cubre el caso de memoria borrada.
+        filtros = {"epoch_min": epoch_min, "epoch_max": epoch_max}
+        if not completo and estado is not None and estado.ultimo_timestamp is not None:
+            filtros["indice_desde"] = estado.ultimo_conteo_registros or 0
+            filtros["marca_epoch"] = datetime_a_epoch(estado.ultimo_timestamp)
+
+        if punto is not None:
+            # Lo anterior al punto de control ya está confirmado en la BD
+            marca = punto.checkpoint_epoch
+            if filtros.get("marca_epoch") is not None:
+                marca = max(marca, filtros["marca_epoch"])
+            filtros["indice_desde"] = max(punto.checkpoint_indice, filtros.get("indice_desde", 0))
+            filtros["marca_epoch"] = marca
+            ejecucion.reanuda_de = punto.id
+            ejecucion.checkpoint_indice = filtros["indice_desde"]
+            ejecucion.checkpoint_epoch = marca
+            logger.info(f"Dispositivo {dispositivo.id}: se retoma la ejecución {punto.id} "
+                        f"desde el registro {filtros['indice_desde']}")
+
+        if releer_desde is not None and filtros.get("marca_epoch") is not None:
+            filtros["indice_desde"] = min(filtros["indice_desde"], releer_desde)
+            logger.info(f"Dispositivo {dispositivo.id}: hay usuarios nuevos, se releen las marcaciones "
+                        f"desconocidas desde el registro {releer_desde}")
+
+        if ejecucion is not None:
+            ejecucion.indice_inicial = filtros.get("indice_desde", 0)
+
+        return estado, conteos, serial, conn.iterar_asistencias(**filtros)
+
+    @staticmethod
+    def _punto_reanudacion(db: Session, dispositivo_id: int, serial, registros_dispositivo) -> Optional[EjecucionSincronizacion]:
+        """
+        Ejecución fallida (o interrumpida) posterior a la última completada cuyo punto
+        de control sigue siendo válido: mismo equipo y memoria no borrada desde entonces.
+        """
+        ultima_completada = db.query(func.max(EjecucionSincronizacion.id)).filter(
+            EjecucionSincronizacion.dispositivo_id == dispositivo_id,
+            EjecucionSincronizacion.estado == "completado"
+        ).scalar() or 0
+        punto = db.query(EjecucionSincronizacion).filter(
+            EjecucionSincronizacion.dispositivo_id == dispositivo_id,
+            EjecucionSincronizacion.id > ultima_completada,
+            EjecucionSincronizacion.estado.in_(("fallido", "interrumpido")),
+            EjecucionSincronizacion.checkpoint_indice != None,
+            EjecucionSincronizacion.checkpoint_epoch != None
+        ).order_by(EjecucionSincronizacion.id.desc()).first()
+        if punto is None:
+            return None
+        if serial and punto.serial_number and serial != punto.serial_number:
+            return None
+        if registros_dispositivo is None or registros_dispositivo < punto.checkpoint_indice:
+            return None
+        return punto
+
+    @staticmethod
+    def _guardar_marca_agua(db: Session, dispositivo: Dispositivo, estado, conteos: dict, serial, registros,
+                            pendiente: Optional[int] = None, inicio: Optional[datetime] = None):
+        """
+        Avanza la marca de agua del dispositivo tras una sincronización completa.
+        registros es el DecodificadorAsistencias ya recorrido; pendiente, el primer
+        registro de un usuario desconocido que quedó sin ingerir (None si no hay) e
+        inicio, el momento en que empezó la lectura.
+        """
+        estado = AsistenciaService._estado_sincronizacion(db, dispositivo.id, estado)
+
+        estado.primer_epoch = registros.primer_epoch
+        estado.indice_pendiente = pendiente
+        estado.usuarios_hasta = inicio if pendiente is not None else None
+
+        if registros.maximo_epoch is not None:
+            maximo = epoch_a_datetime(registros.maximo_epoch)
+            if estado.ultimo_timestamp is None or maximo > estado.ultimo_timestamp:
+                estado.ultimo_timestamp = maximo
+
+        estado.ultimo_conteo_registros = conteos.get('registros', registros.total)
+        if serial:
+            estado.serial_number = serial
+        dispositivo.ultima_sincronizacion = datetime.now()
+
+    @staticmethod
+    def _estado_sincronizacion(db: Session, dispositivo_id: int, estado=None) -> EstadoSincronizacion:
+        """
+        Estado de sincronización del dispositivo (se crea si no existe)
+        """
+        if estado is None:
+            estado = db.query(EstadoSincronizacion).filter(
+                EstadoSincronizacion.dispositivo_id == dispositivo_id
+            ).first()
+        if estado is None:
+            estado = EstadoSincronizacion(dispositivo_id=dispositivo_id)
+            db.add(estado)
+        return estado
+
+    @staticmethod
+    def _indice_pendiente(previo: Optional[int], releido_desde: int, encontrado: Optional[int]) -> Optional[int]:
+        """
+        Primer registro de un usuario desconocido que sigue sin ingerir tras una lectura
+        que recorrió la memoria desde releido_desde: el encontrado en ella o el anterior,
+        si quedó antes de lo releído
+        """
+        candidatos = [i for i in (previo if previo is not None and previo < releido_desde else None, encontrado)
+                      if i is not None]
+        return min(candidatos) if candidatos else None
+
+    @staticmethod
+    def _insertar_registros_masivo(db: Session, dispositivo_id: int, registros, al_confirmar=None,
+                                   al_descartar=None) -> dict:
+        """
+        Inserta marcaciones del dispositivo en lote (INSERT IGNORE por bloques).
+
+        registros es un iterable de tuplas (uid, epoch, status, punch), como las
+        que produce DecodificadorAsistencias; se consume de forma perezosa y se
+        inserta cada SYNC_BATCH_SIZE filas, así que la memoria no crece con el
+        tamaño de la descarga. Los usuarios desconocidos y los duplicados dentro
+        del mismo lote se descartan en memoria; los duplicados contra la BD los
+        descarta la clave única (uid, timestamp, dispositivo_id). Los usuario-día de
+        los bloques con filas insertadas quedan pendientes de recálculo. No hace commit:
+        si se indica al_confirmar(contadores), se llama cada SYNC_CHECKPOINT_BATCHES
+        bloques insertados (y tras el último) para que el llamador confirme un punto
+        de control. al_descartar() se llama por cada registro de un usuario desconocido.
+
+        Retorna un diccionario con los contadores: procesados, insertados,
+        duplicados y usuarios_desconocidos.
+        """
+        known_uids = {u for (u,) in db.query(Usuario.uid).filter(Usuario.uid != None).all()}
+        stmt = AsistenciaService._sentencia_insercion(db)
+
+        contadores = {"procesados": 0, "insertados": 0, "duplicados": 0, "usuarios_desconocidos": 0}
+        cada = max(1, settings.SYNC_CHECKPOINT_BATCHES)
+        lotes = 0
+
+        def volcar(bloque):
+            nonlocal lotes
+            resultado = db.execute(stmt, bloque)
+            afectados = resultado.rowcount if resultado.rowcount is not None and resultado.rowcount >= 0 else len(bloque)
+            contadores["insertados"] += afectados
+            contadores["duplicados"] += len(bloque) - afectados
+            if afectados:
+                # Días a recalcular, confirmados junto con las marcaciones. Sin consultas extra:
+                # un bloque sin filas nuevas (reproceso completo) no encola nada y uno con
+                # alguna encola sus usuario-días (recalcular un día sin cambios es inocuo)
+                RecalculoService.marcar(db, {(fila["uid"], fila["timestamp"].date()) for fila in bloque})
+            lotes += 1
+            if al_confirmar is not None and lotes % cada == 0:
+                al_confirmar(contadores)
+
+        ahora = datetime.now()
+        lote = settings.SYNC_BATCH_SIZE
+        vistos = set()
+        filas = []
+        for uid, epoch, status, punch in registros:
+            contadores["procesados"] += 1
+
+            # El usuario DEBE existir en la BD (UsuarioService se encarga de crearlo)
+            if uid not in known_uids:
+                contadores["usuarios_desconocidos"] += 1
+                if al_descartar is not None:
+                    al_descartar()
+                continue
+
+            clave = (uid, epoch)
+            if clave in vistos:
+                contadores["duplicados"] += 1
+                continue
+            vistos.add(clave)
+
+            filas.append({
+                "uid": uid,
+                "dispositivo_id": dispositivo_id,
+                "timestamp": epoch_a_datetime(epoch),
+                "status": status,
+                "punch": punch,
+                "sincronizado": True,
+                "fecha_sincronizacion": ahora,
+                "fecha_creacion": ahora,
+            })
+            if len(filas) >= lote:
+                volcar(filas)
+                # Los duplicados de bloques anteriores los descarta la clave única
+                filas, vistos = [], set()
+
+        if filas:
+            volcar(filas)
+        if al_confirmar is not None and lotes % cada:
+            al_confirmar(contadores)
+
+        return contadores
+
+    @staticmethod
+    def _sentencia_insercion(db: Session):
+        """
+        INSERT de marcaciones que descarta en silencio los duplicados de la clave única
+        """
+        dialecto = db.get_bind().dialect.name
+        if dialecto == "mysql":
+            return mysql_insert(Asistencia.__table__).prefix_with("IGNORE")
+        if dialecto == "sqlite":
+            return sqlite_insert(Asistencia.__table__).on_conflict_do_nothing()
+        return Asistencia.__table__.insert()
+
+    @staticmethod
+    def _insertar_asistencias_masivo(db: Session, dispositivo_id: int, logs) -> dict:
+        """
+        Inserta objetos Attendance de pyzk (p. ej. de la captura en tiempo real)
+        con _insertar_registros_masivo. Las fechas inválidas y los user_id no
+        numéricos se descartan y cuentan como invalidos. No hace commit.
+
+        Retorna los contadores de la inserción masiva más invalidos.
+        """
+        invalidos = 0
+
+        def convertir():
+            nonlocal invalidos
+            for log in logs:
+                registro = AsistenciaService._registro_de_marcacion(log)
+                if registro is None:
+                    invalidos += 1
+                    continue
+                yield registro
+
+        resultado = AsistenciaService._insertar_registros_masivo(db, dispositivo_id, convertir())
+        resultado["invalidos"] = invalidos
+        return resultado
+
+    @staticmethod
+    def _registro_de_marcacion(log) -> Optional[tuple]:
+        """
+        Attendance de pyzk -> (uid, epoch, status, punch), o None si la fecha es
+        inválida o el user_id no es numérico
+        """
+        if log.timestamp.year > 2050:
+            logger.warning(f"Log ignorado por fecha futura inválida: {log.timestamp} (UID: {log.uid})")
+            return None
+
+        # Mapear log.user_id (Badge Number del dispositivo, ej "13") -> DB.uid (int, ej 13)
+        try:
+            real_uid = int(log.user_id)
+        except (ValueError, TypeError):
+            logger.warning(f"Log ignorado: user_id no numerico '{log.user_id}' en registro {log.uid}")
+            return None
+
+        return real_uid, datetime_a_epoch(log.timestamp), log.status, log.punch
+
+    @staticmethod
+    def guardar_marcacion(db: Session, dispositivo_id: int, uid: int, epoch: int, status: int, punch: int) -> bool:
+        """
+        Inserta una sola marcación (captura en tiempo real) y confirma la transacción.
+        No lee la tabla de usuarios: quien llama verifica antes que el uid exista
+        (la captura lleva su propio caché de uids conocidos). El usuario-día queda
+        pendiente de recálculo si la fila se insertó.
+
+        Retorna:
+            bool: True si se insertó, False si ya estaba guardada
+        """
+        ahora = datetime.now()
+        timestamp = epoch_a_datetime(epoch)
+        try:
+            resultado = db.execute(AsistenciaService._sentencia_insercion(db), {
+                "uid": uid,
+                "dispositivo_id": dispositivo_id,
+                "timestamp": timestamp,
+                "status": status,
+                "punch": punch,
+                "sincronizado": True,
+                "fecha_sincronizacion": ahora,
+                "fecha_creacion": ahora,
+            })
+            insertada = resultado.rowcount != 0
+            if insertada:
+                RecalculoService.marcar(db, {(uid, timestamp.date())})
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        if insertada:
+            recalculador_incremental.avisar()
+        return insertada
+
+    @staticmethod
+    def guardar_marcaciones_dispositivo(db: Session, dispositivo_id: int, logs) -> dict:
+        """
+        Guarda marcaciones recibidas del dispositivo (p. ej. captura en tiempo real)
+        y confirma la transacción. Retorna los contadores de la inserción masiva.
+        """
+        try:
+            resultado = AsistenciaService._insertar_asistencias_masivo(db, dispositivo_id, logs)
+            db.commit()
+            if resultado["insertados"]:
+                recalculador_incremental.avisar()
+            return resultado
+        except Exception:
+            db.rollback()
+            raise
+
     @staticmethod
     def sincronizar_asistencias_hoy(db: Session, dispositivo_id: int):
         """Sincroniza SOLO asistencias de HOY desde el dispositivo"""
@@ -71,79 +454,80 @@ class AsistenciaService:
         if not dispositivo.activo:
              return {"success": False, "message": "Dispositivo inactivo"}
 
-        conn = ZKTecoConnection(dispositivo.ip_address, dispositivo.puerto, dispositivo.timeout, dispositivo.password)
-        if not conn.conectar():
-             return {"success": False, "message": "No se pudo conectar al dispositivo"}
-        
-        try:
-            logs = conn.obtener_asistencias()
-            nuevos = 0
-            total_procesados = 0
-            hoy = date.today()
-            
-            # Filtrar logs solo de hoy
-            logs_hoy = [log for log in logs if log.timestamp.date() == hoy]
-            
-            logger.info(f"[DEBUG] Sincronizar Hoy: Total logs recuperados del dispositivo: {len(logs)}")
-            logger.info(f"[DEBUG] Fecha hoy sistema: {hoy}")
-            if logs:
-                 logger.info(f"[DEBUG] Fecha primer log: {logs[0].timestamp} (Date: {logs[0].timestamp.date()})")
-                 logger.info(f"[DEBUG] Fecha ultimo log: {logs[-1].timestamp}")
-            logger.info(f"[DEBUG] Total logs para hoy: {len(logs_hoy)}")
+        hoy = date.today()
+        inicio_hoy = datetime_a_epoch(datetime.combine(hoy, time.min))
 
-            
-            for log in logs_hoy:
-                total_procesados += 1
-                
-                # FIX: Usar log.user_id (Badge Number) en lugar de log.uid (Indice interno)
-                try:
-                    real_uid = int(log.user_id)
-                except (ValueError, TypeError):
-                    logger.warning(f"Log ignorado: user_id no numerico '{log.user_id}'")
-                    continue
+        with pool_conexiones.sesion(dispositivo, lectura=True) as conn:
+            if conn is None:
+                return {"success": False, "message": pool_conexiones.motivo_sin_conexion(dispositivo.id)}
+            inicio = conn.tiempo_deshabilitado()
+            try:
+                # El filtro de fecha se aplica al decodificar: solo se materializan los registros
+                # de hoy, leídos bloque a bloque dentro de la sesión
+                _, _, _, registros = AsistenciaService._leer_registros_nuevos(
+                    db, dispositivo, conn, epoch_min=inicio_hoy, epoch_max=inicio_hoy + 86400
+                )
+                de_hoy = list(registros) if registros is not None else None
+            except Exception as e:
+                return {"success": False, "message": f"Error al leer asistencias del dispositivo: {e}"}
+            deshabilitado_ms = int((conn.tiempo_deshabilitado() - inicio) * 1000)
 
-                # Verificar si existe (uid + timestamp + dispositivo_id)
-                exists = db.query(Asistencia).filter(
-                    Asistencia.uid == real_uid,
-                    Asistencia.timestamp == log.timestamp,
-                    Asistencia.dispositivo_id == dispositivo_id
-                ).first()
-                
-                if not exists:
-                    # Verificar si el usuario existe en la BD por UID
-                    # IMPORTANTE: El Usuario.uid en BD corresponde al Badge Number (user_id del dispositivo)
-                    usuario_existe = db.query(Usuario).filter(Usuario.uid == real_uid).first()
-                    
-                    if usuario_existe:
-                        nuevo_log = Asistencia(
-                            uid=real_uid,
-                            dispositivo_id=dispositivo_id,
-                            timestamp=log.timestamp,
-                            status=log.status,
-                            punch=log.punch,
-                            sincronizado=True,
-                            fecha_sincronizacion=datetime.now()
-                        )
-                        db.add(nuevo_log)
-                        nuevos += 1
+        if registros is None:
+            return {
+                "success": True,
+                "message": f"Sin cambios en el dispositivo desde la última sincronización ({hoy})",
+                "registros_nuevos": 0,
+                "registros_totales_hoy": 0,
+                "dispositivo_id": dispositivo_id,
+                "dispositivo_deshabilitado_ms": deshabilitado_ms
+            }
+        
+        try:
+            # Inserción masiva: duplicados y usuarios inexistentes se descartan sin consultas por fila
+            resultado = AsistenciaService._insertar_registros_masivo(db, dispositivo_id, de_hoy)
+            nuevos = resultado["insertados"]
+            logger.info(
+                f"Sincronizar Hoy ({hoy}): {registros.total} registros en el dispositivo, "
+                f"{resultado['procesados']} de hoy, {nuevos} insertados"
+            )
             
             db.commit()
+            if nuevos:
+                recalculador_incremental.avisar()
             return {
                 "success": True, 
                 "message": f"Sincronización de HOY completada ({hoy})", 
                 "registros_nuevos": nuevos, 
-                "registros_totales_hoy": len(logs_hoy), 
-                "dispositivo_id": dispositivo_id
+                "registros_omitidos": resultado["procesados"] - nuevos,
+                "registros_totales_hoy": resultado["procesados"], 
+                "dispositivo_id": dispositivo_id,
+                "dispositivo_deshabilitado_ms": deshabilitado_ms
             }
         except Exception as e:
             db.rollback()
             return {"success": False, "message": str(e)}
-        finally:
-            conn.desconectar()
 
     @staticmethod
-    def sincronizar_asistencias_desde_dispositivo(db: Session, dispositivo_id: int):
-        """Sincroniza asistencias desde el dispositivo físico"""
+    def sincronizar_asistencias_desde_dispositivo(db: Session, dispositivo_id: int, completo: bool = False,
+                                                  verificar: Optional[Callable[[], None]] = None):
+        """
+        Sincroniza asistencias desde el dispositivo físico.
+
+        Es incremental: si el dispositivo no cambió (mismo serial y mismo número
+        de registros) no se descarga nada, y si cambió solo se procesan los
+        registros posteriores a la marca de agua. Con completo=True se procesa
+        toda la memoria del dispositivo.
+
+        Cada llamada queda en ejecuciones_sincronizacion. Las marcaciones se
+        confirman por lotes junto con el punto de control de la ejecución: si
+        algo falla a mitad de camino, la siguiente sincronización retoma la
+        memoria del dispositivo desde el último lote confirmado.
+
+        verificar(), si se indica, se llama tras cada punto de control confirmado
+        (p. ej. la cancelación de un trabajo). Si lanza una excepción, la ejecución
+        queda interrumpida en ese punto (la próxima sincronización la retoma), el
+        volcado se descarta y la excepción se propaga.
+        """
         dispositivo = db.query(Dispositivo).filter(Dispositivo.id == dispositivo_id).first()
         if not dispositivo:
             return {"success": False, "message": "Dispositivo no encontrado"}
@@ -151,90 +535,264 @@ class AsistenciaService:
         if not dispositivo.activo:
              return {"success": False, "message": "Dispositivo inactivo"}
 
-        conn = ZKTecoConnection(dispositivo.ip_address, dispositivo.puerto, dispositivo.timeout, dispositivo.password)
-        if not conn.conectar():
-             return {"success": False, "message": "No se pudo conectar al dispositivo"}
+        ejecucion = AsistenciaService._iniciar_ejecucion(db, dispositivo_id, completo)
+        inicio_descarga = monotonic()
+
+        # Etapa 1: solo la descarga del buffer crudo ocurre con el dispositivo deshabilitado
+        # (lectura: según ZK_READ_LOCK_MODE, ni siquiera el resto de la sesión lo bloquea)
+        with pool_conexiones.sesion(dispositivo, lectura=True) as conn:
+            if conn is None:
+                motivo = pool_conexiones.motivo_sin_conexion(dispositivo.id)
+                AsistenciaService._finalizar_ejecucion(db, ejecucion, "fallido", motivo)
+                return {"success": False, "message": motivo, "ejecucion_id": ejecucion.id}
+            inicio = conn.tiempo_deshabilitado()
+            try:
+                estado, conteos, serial, registros = AsistenciaService._leer_registros_nuevos(
+                    db, dispositivo, conn, completo, ejecucion=ejecucion
+                )
+                # Etapa 2: la lectura se vuelca al spool bloque a bloque y queda ahí
+                # hasta que la BD la confirme
+                ruta_spool = None
+                if registros is not None:
+                    ruta_spool, registros = spool_ingesta.descargar(dispositivo_id, registros, serial, conteos)
+            except Exception as e:
+                mensaje = f"Error al leer asistencias del dispositivo: {e}"
+                AsistenciaService._finalizar_ejecucion(db, ejecucion, "fallido", mensaje)
+                return {"success": False, "message": mensaje, "ejecucion_id": ejecucion.id}
+            deshabilitado_ms = int((conn.tiempo_deshabilitado() - inicio) * 1000)
+        ejecucion.segundos_descarga = round(monotonic() - inicio_descarga, 3)
+        ejecucion.dispositivo_deshabilitado_ms = deshabilitado_ms
+
+        if registros is None:
+            try:
+                dispositivo.ultima_sincronizacion = datetime.now()
+                db.commit()
+            except Exception as e:
+                db.rollback()
+                logger.warning(f"No se pudo actualizar ultima_sincronizacion del dispositivo {dispositivo_id}: {e}")
+            AsistenciaService._finalizar_ejecucion(db, ejecucion, "completado")
+            return {
+                "success": True,
+                "message": "Sin cambios en el dispositivo desde la última sincronización",
+                "registros_nuevos": 0,
+                "registros_totales": conteos.get('registros', 0),
+                "registros_procesados": 0,
+                "dispositivo_id": dispositivo_id,
+                "dispositivo_deshabilitado_ms": deshabilitado_ms,
+                "ejecucion_id": ejecucion.id,
+                "rotacion": AsistenciaService._rotar_tras_sincronizar(db, dispositivo_id, conteos.get('registros'))
+            }
         
+        reanudada_desde = ejecucion.checkpoint_indice if ejecucion.reanuda_de else None
+        # Los tiempos de la descarga se confirman ya: un fallo posterior hace rollback
+        db.commit()
+
+        inicio_escritura = monotonic()
         try:
-            logs = conn.obtener_asistencias()
-            nuevos = 0
-            total = len(logs)
-            
-            # Cache de usuarios conocidos para evitar queries repetitivos
-            # Set de UIDs que sabemos que existen en la BD (o acabamos de crear)
-            known_uids = set()
-            existing_users = db.query(Usuario.uid).filter(Usuario.uid != None).all()
-            for u in existing_users:
-                known_uids.add(u.uid)
-                
-            for log in logs:
-                if log.timestamp.year > 2050:
-                    logger.warning(f"Log ignorado por fecha futura inválida: {log.timestamp} (UID: {log.uid})")
-                    continue
+            # Etapa 3: decodificación y escritura solapadas a través de una cola acotada;
+            # cada SYNC_CHECKPOINT_BATCHES lotes se confirman con el punto de control
+            registros.con_posicion = True
+            punto = {"indice": ejecucion.checkpoint_indice, "epoch": ejecucion.checkpoint_epoch}
+            # Marca baja: registros de usuarios desconocidos (los anteriores a lo releído siguen pendientes)
+            previo = estado.indice_pendiente if estado is not None else None
+            releido_desde = registros.indice_desde if registros.marca_epoch is not None else 0
+            desconocido = {"indice": None}
+            detenida = {"error": None}
 
-                try:
-                    # IMPLEMENTACION "DESDE CERO":
-                    # Mapear log.user_id (string del dispositivo, ej "13") -> DB.uid (int, ej 13)
-                    
+            def con_punto_de_control(flujo):
+                for posicion, uid, epoch, status, punch in flujo:
+                    punto["posicion"] = posicion
+                    punto["indice"] = posicion + 1
+                    if punto["epoch"] is None or epoch > punto["epoch"]:
+                        punto["epoch"] = epoch
+                    yield uid, epoch, status, punch
+
+            def descartado():
+                if desconocido["indice"] is None:
+                    desconocido["indice"] = punto["posicion"]
+
+            def confirmar(contadores):
+                if desconocido["indice"] is not None:
+                    # Se confirma con el punto de control: si la ejecución falla, no se pierde
+                    pendiente = AsistenciaService._estado_sincronizacion(db, dispositivo_id, estado)
+                    pendiente.indice_pendiente = min(i for i in (previo, desconocido["indice"]) if i is not None)
+                    pendiente.usuarios_hasta = ejecucion.fecha_inicio
+                ejecucion.checkpoint_indice = punto["indice"]
+                ejecucion.checkpoint_epoch = punto["epoch"]
+                ejecucion.registros_procesados = contadores["procesados"]
+                ejecucion.registros_insertados = contadores["insertados"]
+                ejecucion.registros_duplicados = contadores["duplicados"]
+                ejecucion.usuarios_desconocidos = contadores["usuarios_desconocidos"]
+                ejecucion.lotes_confirmados = (ejecucion.lotes_confirmados or 0) + 1
+                db.commit()
+                if verificar is not None:
                     try:
-                        real_uid = int(log.user_id)
-                    except (ValueError, TypeError):
-                        logger.warning(f"Log ignorado: user_id no numerico '{log.user_id}' en registro {log.uid}")
-                        continue
-                        
-                    # 1. Validación de Duplicados (Estricta: UID + Timestamp)
-                    # Usamos real_uid para chequear si ya guardamos esta asistencia
-                    exists = db.query(Asistencia).filter(
-                        Asistencia.uid == real_uid,
-                        Asistencia.timestamp == log.timestamp
-                    ).first()
-                    
-                    if exists:
-                        continue # Duplicado exacto
-
-                    # 2. Verificar existencia del Usuario
-                    # El usuario DEBE existir con ese UID (que debe coincidir con su user_id numérico)
-                    if real_uid not in known_uids:
-                        # Si no existe, lo ignoramos (UsuarioService debe encargarse primero)
-                        # El usuario pidio eliminar logica fantasma.
-                        # logger.warning(f"Asistencia ignorada: Usuario UID {real_uid} no existe en DB.")
-                        continue 
-
-                    # 3. Insertar Registro
-                    nuevo_log = Asistencia(
-                        uid=real_uid,
-                        dispositivo_id=dispositivo_id,
-                        timestamp=log.timestamp,
-                        status=log.status,
-                        punch=log.punch,
-                        sincronizado=True,
-                        fecha_sincronizacion=datetime.now()
-                    )
-                    db.add(nuevo_log)
-                    nuevos += 1
-                    
-                    # Commit periódico
-                    if nuevos % 100 == 0:
-                        db.commit()
-                        
-                except Exception as e:
-                    logger.error(f"Error procesando log {log.uid}: {e}")
-                    continue
+                        verificar()
+                    except Exception as e:
+                        detenida["error"] = e
+                        raise
+
+            resultado = AsistenciaService._insertar_registros_masivo(
+                db, dispositivo_id,
+                con_punto_de_control(flujo_acotado(registros, settings.SYNC_BATCH_SIZE, settings.SYNC_QUEUE_SIZE)),
+                al_confirmar=confirmar, al_descartar=descartado
+            )
+            nuevos = resultado["insertados"]
+            logger.info(
+                f"Dispositivo {dispositivo_id}: {nuevos} insertados, {resultado['duplicados']} duplicados, "
+                f"{resultado['usuarios_desconocidos']} de usuarios desconocidos, {registros.invalidos} inválidos "
+                f"(deshabilitado {deshabilitado_ms} ms)"
+            )
             
-            db.commit() # Commit final
+            AsistenciaService._guardar_marca_agua(
+                db, dispositivo, estado, conteos, serial, registros,
+                pendiente=AsistenciaService._indice_pendiente(previo, releido_desde, desconocido["indice"]),
+                inicio=ejecucion.fecha_inicio
+            )
+            ejecucion.registros_procesados = resultado["procesados"]
+            ejecucion.registros_insertados = nuevos
+            ejecucion.registros_duplicados = resultado["duplicados"]
+            ejecucion.usuarios_desconocidos = resultado["usuarios_desconocidos"]
+            ejecucion.estado = "completado"
+            ejecucion.segundos_escritura = round(monotonic() - inicio_escritura, 3)
+            ejecucion.fecha_fin = datetime.now()
+            db.commit() # Commit final: marca de agua y ejecución completada
+            spool_ingesta.descartar(ruta_spool)
+            if nuevos:
+                recalculador_incremental.avisar()
             
             return {
                 "success": True, 
                 "message": "Sincronización completada", 
                 "registros_nuevos": nuevos, 
-                "registros_totales": total, 
-                "dispositivo_id": dispositivo_id
+                "registros_omitidos": resultado["procesados"] - nuevos,
+                "registros_totales": registros.total, 
+                "registros_procesados": resultado["procesados"],
+                "dispositivo_id": dispositivo_id,
+                "dispositivo_deshabilitado_ms": deshabilitado_ms,
+                "ejecucion_id": ejecucion.id,
+                "reanudada_desde": reanudada_desde,
+                "rotacion": AsistenciaService._rotar_tras_sincronizar(db, dispositivo_id, conteos.get('registros'))
             }
         except Exception as e:
             db.rollback()
-            return {"success": False, "message": str(e)}
-        finally:
-            conn.desconectar()
+            if detenida["error"] is e:
+                # Detenida en un punto de control: lo confirmado queda y el resto lo
+                # retoma la próxima sincronización (reproducir el volcado no respetaría la detención)
+                spool_ingesta.descartar(ruta_spool)
+                AsistenciaService._finalizar_ejecucion(
+                    db, ejecucion, "interrumpido", "Sincronización detenida en un punto de control",
+                    segundos_escritura=round(monotonic() - inicio_escritura, 3)
+                )
+                raise
+            if ruta_spool:
+                logger.warning(f"Volcado del dispositivo {dispositivo_id} conservado para reproducir: {ruta_spool}")
+            AsistenciaService._finalizar_ejecucion(
+                db, ejecucion, "fallido", str(e),
+                segundos_escritura=round(monotonic() - inicio_escritura, 3)
+            )
+            return {
+                "success": False,
+                "message": str(e),
+                "dispositivo_deshabilitado_ms": deshabilitado_ms,
+                "ejecucion_id": ejecucion.id
+            }
+
+    @staticmethod
+    def _iniciar_ejecucion(db: Session, dispositivo_id: int, completo: bool) -> EjecucionSincronizacion:
+        """
+        Registra (y confirma) una ejecución en curso: si el proceso cae, queda en_curso
+        y al reiniciar se marca como interrumpida
+        """
+        ejecucion = EjecucionSincronizacion(dispositivo_id=dispositivo_id, completo=completo, estado="en_curso")
+        db.add(ejecucion)
+        db.commit()
+        return ejecucion
+
+    @staticmethod
+    def _finalizar_ejecucion(db: Session, ejecucion: EjecucionSincronizacion, estado: str,
+                             error: Optional[str] = None, **campos):
+        """
+        Cierra una ejecución. Tras un rollback sus contadores y su punto de control
+        vuelven a los últimos confirmados, que son los que quedan registrados.
+        """
+        try:
+            ejecucion.estado = estado
+            ejecucion.error = error[:255] if error else None
+            ejecucion.fecha_fin = datetime.now()
+            for campo, valor in campos.items():
+                setattr(ejecucion, campo, valor)
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            logger.error(f"No se pudo registrar la ejecución de sincronización {ejecucion.id}: {e}")
+
+    @staticmethod
+    def reproducir_descargas_pendientes(db: Session, dispositivo_id: int = None,
+                                        verificar: Optional[Callable[[], None]] = None) -> dict:
+        """
+        Escribe en la BD los volcados del spool que quedaron sin confirmar
+        (caída del proceso o error de BD a mitad de una sincronización).
+
+        La inserción es idempotente (la clave única descarta lo ya guardado). Solo se
+        avanza la marca de tiempo de la marca de agua, nunca el conteo: la próxima
+        sincronización vuelve a mirar desde el último índice confirmado.
+
+        verificar(), si se indica, se llama antes de cada volcado: si lanza una
+        excepción, los volcados restantes quedan en el spool y la excepción se propaga.
+        """
+        archivos = spool_ingesta.pendientes(dispositivo_id)
+        reproducidos, insertados, errores = 0, 0, []
+        for ruta in archivos:
+            if verificar is not None:
+                verificar()
+            try:
+                cabecera, registros = spool_ingesta.cargar(ruta)
+                resultado = AsistenciaService._insertar_registros_masivo(
+                    db, cabecera["dispositivo_id"],
+                    flujo_acotado(registros, settings.SYNC_BATCH_SIZE, settings.SYNC_QUEUE_SIZE)
+                )
+                estado = db.query(EstadoSincronizacion).filter(
+                    EstadoSincronizacion.dispositivo_id == cabecera["dispositivo_id"]
+                ).first()
+                mismo_equipo = estado is not None and (
+                    not cabecera["serial"] or not estado.serial_number or estado.serial_number == cabecera["serial"]
+                )
+                if mismo_equipo and registros.maximo_epoch is not None:
+                    maximo = epoch_a_datetime(registros.maximo_epoch)
+                    if estado.ultimo_timestamp is None or maximo > estado.ultimo_timestamp:
+                        estado.ultimo_timestamp = maximo
+                db.commit()
+                spool_ingesta.descartar(ruta)
+                reproducidos += 1
+                insertados += resultado["insertados"]
+            except Exception as e:
+                db.rollback()
+                logger.error(f"No se pudo reproducir el volcado {ruta}: {e}")
+                errores.append({"archivo": ruta, "error": str(e)})
+
+        if insertados:
+            recalculador_incremental.avisar()
+        return {
+            "success": not errores,
+            "message": f"{reproducidos} de {len(archivos)} volcados reproducidos",
+            "volcados_reproducidos": reproducidos,
+            "registros_insertados": insertados,
+            "errores": errores
+        }
+
+    @staticmethod
+    def _rotar_tras_sincronizar(db: Session, dispositivo_id: int, registros_en_dispositivo) -> Optional[dict]:
+        """
+        Aplica la política de rotación del dispositivo tras una sincronización exitosa.
+        Un fallo de la rotación no invalida la sincronización.
+        """
+        try:
+            return RotacionService.rotar_si_corresponde(db, dispositivo_id, registros_en_dispositivo)
+        except Exception as e:
+            db.rollback()
+            logger.error(f"Error en la rotación de registros del dispositivo {dispositivo_id}: {e}")
+            return {"success": False, "rotado": False, "message": str(e)}
 
     @staticmethod
     def limpiar_asistencias_dispositivo(db: Session, dispositivo_id: int):
@@ -243,17 +801,14 @@ class AsistenciaService:
         if not dispositivo:
             return {"success": False, "message": "Dispositivo no encontrado"}
             
-        conn = ZKTecoConnection(dispositivo.ip_address, dispositivo.puerto, dispositivo.timeout, dispositivo.password)
-        if not conn.conectar():
-             return {"success": False, "message": "No se pudo conectar al dispositivo"}
+        with pool_conexiones.sesion(dispositivo) as conn:
+            if conn is None:
+                return {"success": False, "message": pool_conexiones.motivo_sin_conexion(dispositivo.id)}
 
-        try:
             if conn.limpiar_asistencias():
                 return {"success": True, "message": "Registros eliminados del dispositivo"}
             else:
                 return {"success": False, "message": "Error al eliminar registros"}
-        finally:
-            conn.desconectar()
 
     @staticmethod
     def registrar_manual(db: Session, datos: 'AsistenciaManualCreate') -> Asistencia:
@@ -327,7 +882,9 @@ class AsistenciaService:
         )
         
         db.add(registro)
+        RecalculoService.marcar(db, {(empleado.uid, datos.fecha_hora.date())})
         db.commit()
+        recalculador_incremental.avisar()
         db.refresh(registro)
         logger.info(f"Asistencia manual registrada: {datos.tipo} - {datos.empleado_id}")
         
@@ -341,74 +898,74 @@ class AsistenciaService:
     @staticmethod
     def verificar_incidencia(user_id: str, fecha_proceso: date) -> tuple[bool, str]:
         """
-        Consulta la API de incidencias para ver si el usuario tiene una justificación aprobada.
+        Consulta las incidencias (índice en caché de la API de incidencias) para ver si el
+        usuario tiene una justificación aprobada.
         Retorna (True, Codigo) si existe, o (False, None).
         """
+        return cache_incidencias.obtener().buscar(user_id, fecha_proceso)
+
+    @staticmethod
+    def consultar_incidencias(user_id: str) -> list:
+        """
+        Incidencias del usuario según la API de incidencias ([] si la consulta falla)
+        """
         try:
             # Añadir filtro por empleado_id para ser mas eficiente y preciso
-            url = f"{settings.INCIDENCIAS_API_URL}?empleado_id={user_id}"
-            
-            resp = requests.get(url, timeout=3)
-            if resp.status_code != 200:
-                logger.warning(f"Error consultando incidencias: {resp.status_code}")
-                return False, None
-            
-            data = resp.json()
-            incidencias = []
-            
-            # Manejar estructura paginada { data: [...], pagination: {...} } vs Lista directa [...]
-            if isinstance(data, dict):
-                incidencias = data.get('data', [])
-            elif isinstance(data, list):
-                incidencias = data
+            return descargar_incidencias(user_id, timeout=3)
+        except Exception as e:
+            logger.error(f"Excepción verificando incidencias: {e}")
+            return []
+
+    @staticmethod
+    def buscar_incidencia(incidencias: list, user_id: str, fecha_proceso: date) -> tuple[bool, str]:
+        """
+        Busca entre las incidencias del usuario una aprobada que cubra la fecha.
+        Retorna (True, Codigo) si existe, o (False, None).
+        """
+        for inc in incidencias:
+            # Validar empleado (redundante si la API filtra, pero seguro)
+            if str(inc.get('empleado_id')) != str(user_id):
+                continue
+                
+            # Validar estado Aprobado
+            estado_obj = inc.get('estado', {})
+            if not estado_obj or estado_obj.get('nombre') != 'Aprobado':
+                continue
             
-            dt_proceso = datetime.combine(fecha_proceso, time.min)
+            # Validar fechas
+            f_inicio_str = inc.get('fecha_inicio') 
+            f_fin_str = inc.get('fecha_fin')
             
-            for inc in incidencias:
-                # Validar empleado (redundante si la API filtra, pero seguro)
-                if str(inc.get('empleado_id')) != str(user_id):
-                    continue
-                    
-                # Validar estado Aprobado
-                estado_obj = inc.get('estado', {})
-                if not estado_obj or estado_obj.get('nombre') != 'Aprobado':
-                    continue
+            if not f_inicio_str or not f_fin_str:
+                continue
                 
-                # Validar fechas
-                f_inicio_str = inc.get('fecha_inicio') 
-                f_fin_str = inc.get('fecha_fin')
+            # Parsear fechas (ISO format)
+            try:
+                # Cortamos la Z si existe
+                dt_inicio = datetime.fromisoformat(f_inicio_str.replace('Z', '+00:00')).date()
+                dt_fin = datetime.fromisoformat(f_fin_str.replace('Z', '+00:00')).date()
                 
-                if not f_inicio_str or not f_fin_str:
-                    continue
-                    
-                # Parsear fechas (ISO format)
-                try:
-                    # Cortamos la Z si existe
-                    dt_inicio = datetime.fromisoformat(f_inicio_str.replace('Z', '+00:00')).date()
-                    dt_fin = datetime.fromisoformat(f_fin_str.replace('Z', '+00:00')).date()
-                    
-                    if dt_inicio <= fecha_proceso <= dt_fin:
-                        # ENCONTRADA
-                        tipo_obj = inc.get('tipo_incidencia', {})
-                        codigo = tipo_obj.get('codigo', 'JUSTIFICADO')
-                        logger.info(f"Justificación encontrada para {user_id} el {fecha_proceso}: {codigo}")
-                        return True, codigo
-                        
-                except Exception as e_date:
-                    logger.error(f"Error parseando fechas incidencia: {e_date}")
-                    continue
+                if dt_inicio <= fecha_proceso <= dt_fin:
+                    # ENCONTRADA
+                    tipo_obj = inc.get('tipo_incidencia', {})
+                    codigo = tipo_obj.get('codigo', 'JUSTIFICADO')
+                    logger.info(f"Justificación encontrada para {user_id} el {fecha_proceso}: {codigo}")
+                    return True, codigo
                     
-            return False, None
-            
-        except Exception as e:
-            logger.error(f"Excepción verificando incidencias: {e}")
-            return False, None
+            except Exception as e_date:
+                logger.error(f"Error parseando fechas incidencia: {e_date}")
+                continue
+                
+        return False, None
 
     @staticmethod
     def procesar_asistencia_dia(db: Session, user_id: str, fecha_proceso: date):
         """
         Procesa la asistencia de un usuario para una fecha específica.
         Calcula horas trabajadas, estado (presente, falta, tarde) basándose en su horario.
+
+        Las reglas de cálculo están en calculo_service.calcular_dia (las mismas del
+        cálculo por lotes); aquí solo se cargan los datos del día y se guarda el resultado.
         """
         
         # 1. Obtener usuario (opcional, para validar existencia)
@@ -428,7 +985,6 @@ class AsistenciaService:
 
         es_feriado = db.query(Feriados).filter(Feriados.fecha == fecha_proceso).first()
         
-        # Estado inicial del reporte
         # Estrategia Agresiva: Eliminar cualquier registro previo para este día/usuario y crear uno nuevo.
         # Esto garantiza que no queden duplicados y se limpie el estado.
         db.query(AsistenciaDiaria).filter(
@@ -436,275 +992,54 @@ class AsistenciaService:
             AsistenciaDiaria.fecha == fecha_proceso
         ).delete()
         
-        # Crear nuevo registro limpio
-        reporte = AsistenciaDiaria(
-            user_id=user_id,
-            fecha=fecha_proceso
-        )
-        db.add(reporte)
-        # Commit intermedio para asegurar que el delete se aplique antes de seguir (opcional pero seguro)
-        db.flush() 
-        
-        # Reset valores cálculo (redundante pues es nuevo, pero mantenemos por consistencia)
-        reporte.horas_trabajadas = 0.0
-        reporte.horas_esperadas = 0.0
-        reporte.entrada_real = None
-        reporte.salida_real = None
-        reporte.es_justificado = False
-        
-        # Si es feriado
-        if es_feriado:
-            reporte.estado_asistencia = "FERIADO"
-            reporte.es_justificado = True
-        else:
-            reporte.estado_asistencia = "FALTA" # Por defecto
-        
+        segmentos = []
+        logs_times = []
         if not asignacion:
             logger.info(f"Usuario {user_id} NO tiene horario asignado para {fecha_proceso}")
-            if not es_feriado:
-                reporte.estado_asistencia = "SIN_HORARIO"
-            db.add(reporte)
-            db.commit()
-            return reporte
-        
-        logger.info(f"Horario asignado encontrado: ID {asignacion.horario_id}")
-
-        reporte.horario_id_snapshot = asignacion.horario_id
-        
-        # 3. Obtener segmentos del día (0=Lunes, 6=Domingo)
-        dia_semana = fecha_proceso.weekday()
-        segmentos = db.query(SegmentosHorario).filter(
-            SegmentosHorario.horario_id == asignacion.horario_id,
-            SegmentosHorario.dia_semana == dia_semana
-        ).order_by(SegmentosHorario.hora_inicio).all()
-        
-        if not segmentos:
-            logger.info(f"Horario {asignacion.horario_id} NO tiene segmentos para dia {dia_semana}")
-            if not es_feriado:
-                reporte.estado_asistencia = "DIA_LIBRE"
-            db.add(reporte)
-            db.commit()
-            return reporte
-
-        logger.info(f"Segmentos encontrados: {len(segmentos)}")
-
-        # Buscar logs del día usando UID
-        inicio_dia = datetime.combine(fecha_proceso, time.min)
-        fin_dia = datetime.combine(fecha_proceso, time.max)
-        
-        # IMPORTANTE: Buscar por UID, no por user_id directamente en la tabla de asistencias
-        logs = db.query(Asistencia).filter(
-            Asistencia.uid == usuario.uid,
-            Asistencia.timestamp >= inicio_dia,
-            Asistencia.timestamp <= fin_dia
-        ).order_by(Asistencia.timestamp).all()
-        
-        logger.info(f"Logs crudos encontrados para UID {usuario.uid} en fecha {fecha_proceso}: {len(logs)}")
-        # for l in logs:
-        #      logger.info(f"  -> Log: {l.timestamp} (Status: {l.status}, Punch: {l.punch})")
-        
-        logs_times = [log.timestamp.time() for log in logs]
-        
-        total_horas_trabajadas = 0.0
-        total_horas_esperadas = 0.0
-        llegada_tarde = False
-        hubo_asistencia = False
-        
-        primer_ingreso = None
-        ultima_salida = None
-
-        used_indices = set()
-
-        for segmento in segmentos:
-            inicio_seg = segmento.hora_inicio
-            fin_seg = segmento.hora_fin
-            
-            # Cálculo horas esperadas
-            dummy_date = date(2000, 1, 1)
-            dt_inicio = datetime.combine(dummy_date, inicio_seg)
-            dt_fin = datetime.combine(dummy_date, fin_seg)
-            duracion_horas = (dt_fin - dt_inicio).total_seconds() / 3600.0
-            total_horas_esperadas += duracion_horas
-            
-            # --- Lógica de "Mejor Coincidencia" (Closest Match) ---
-            
-            # 1. Buscar MEJOR Entrada
-            entrada_valida = None
-            entrada_idx = -1
-            min_diff_entrada = float('inf')
-            
-            inicio_min = inicio_seg.hour * 60 + inicio_seg.minute
-            
-            for i, t in enumerate(logs_times):
-                if i in used_indices:
-                    continue
-                    
-                t_min = t.hour * 60 + t.minute
-                
-                # Ventana: 2h antes hasta tolerancia
-                if (inicio_min - 120) <= t_min <= (inicio_min + segmento.tolerancia_minutos + 60):
-                    # Candidato válido, verificar si es el más cercano
-                    diff = abs(t_min - inicio_min)
-                    if diff < min_diff_entrada:
-                        min_diff_entrada = diff
-                        entrada_valida = t
-                        entrada_idx = i
-            
-            # 2. Buscar MEJOR Salida
-            salida_valida = None
-            salida_idx = -1
+        else:
+            logger.info(f"Horario asignado encontrado: ID {asignacion.horario_id}")
             
-            fin_min = fin_seg.hour * 60 + fin_seg.minute
+            # 3. Obtener segmentos del día (0=Lunes, 6=Domingo)
+            dia_semana = fecha_proceso.weekday()
+            segmentos = db.query(SegmentosHorario).filter(
+                SegmentosHorario.horario_id == asignacion.horario_id,
+                SegmentosHorario.dia_semana == dia_semana
+            ).order_by(SegmentosHorario.hora_inicio).all()
             
-            candidatos_salida = [] # Lista de tuplas: (index, time_obj, minutes_val, diff_abs)
-
-            if entrada_valida:
-                for i, t in enumerate(logs_times):
-                    if i in used_indices or i == entrada_idx:
-                        continue
-                        
-                    # La salida debe ser posterior a la entrada seleccionada
-                    # IMPORTANTE: Usamos índices o tiempos para asegurar orden
-                    if i <= entrada_idx: 
-                        continue
-                        
-                    t_min = t.hour * 60 + t.minute
-                    
-                    # Ventana salida: desde (inicio + 30m) hasta (fin + 4h)
-                    if (inicio_min + 30) <= t_min <= (fin_min + 240):
-                        # Candidato válido dentro de la ventana amplia
-                        diff = abs(t_min - fin_min)
-                        candidatos_salida.append((i, t, t_min, diff))
-
-            # LÓGICA DE SELECCIÓN PRIORIZADA
-            if candidatos_salida:
-                # 1. Prioridad: Buscar registros DESPUES o IGUAL a la hora de salida
-                post_salida = [c for c in candidatos_salida if c[2] >= fin_min]
-                
-                seleccionado = None
-                
-                if post_salida:
-                    # Si existen salidas después de la hora, tomamos la más cercana a la hora de salida
-                    # (Es decir, la primera que ocurrió después de la salida oficial)
-                    post_salida.sort(key=lambda x: x[3]) # Ordenar por menor diferencia
-                    seleccionado = post_salida[0]
-                    # logger.info(f"  [Segmento {inicio_seg}-{fin_seg}] SALIDA: Prioridad Post-Salida aplicada.")
-                else:
-                    # 2. Fallback: Si no hay salidas posteriores, usamos la más cercana en general (Closest Match)
-                    # Esto seleccionará la salida ANTERIOR a la hora (ej: salió temprano) que esté más cerca
-                    candidatos_salida.sort(key=lambda x: x[3])
-                    seleccionado = candidatos_salida[0]
-                    # logger.info(f"  [Segmento {inicio_seg}-{fin_seg}] SALIDA: Fallback Closest Match aplicado.")
-                
-                salida_idx = seleccionado[0]
-                salida_valida = seleccionado[1]
-
-            # Logs de debug emparejamiento
-            if entrada_valida:
-                logger.info(f"  [Segmento {inicio_seg}-{fin_seg}] ENTRADA encontrada: {entrada_valida}")
+            if not segmentos:
+                logger.info(f"Horario {asignacion.horario_id} NO tiene segmentos para dia {dia_semana}")
             else:
-                logger.info(f"  [Segmento {inicio_seg}-{fin_seg}] NO se encontró entrada válida en ventana {inicio_min-120} - {inicio_min + segmento.tolerancia_minutos + 60}")
+                logger.info(f"Segmentos encontrados: {len(segmentos)}")
+
+                # Buscar logs del día usando UID
+                inicio_dia = datetime.combine(fecha_proceso, time.min)
+                fin_dia = datetime.combine(fecha_proceso, time.max)
                 
-            if salida_valida:
-                logger.info(f"  [Segmento {inicio_seg}-{fin_seg}] SALIDA encontrada: {salida_valida}")
-            
-            if entrada_valida:
-                used_indices.add(entrada_idx)
-            
-            if salida_valida:
-                used_indices.add(salida_idx)
-            
-            if entrada_valida:
-                hubo_asistencia = True
-                if not primer_ingreso or entrada_valida < primer_ingreso:
-                    primer_ingreso = entrada_valida
+                # IMPORTANTE: Buscar por UID, no por user_id directamente en la tabla de asistencias
+                logs = db.query(Asistencia).filter(
+                    Asistencia.uid == usuario.uid,
+                    Asistencia.timestamp >= inicio_dia,
+                    Asistencia.timestamp <= fin_dia
+                ).order_by(Asistencia.timestamp).all()
                 
-                t_ent_min = entrada_valida.hour * 60 + entrada_valida.minute
-                inicio_seg_min = inicio_seg.hour * 60 + inicio_seg.minute
-                if t_ent_min > (inicio_seg_min + segmento.tolerancia_minutos):
-                    llegada_tarde = True
-            
-            if salida_valida:
-                if not ultima_salida or salida_valida > ultima_salida:
-                    ultima_salida = salida_valida
-                    
-                dt_ent = datetime.combine(dummy_date, entrada_valida)
-                dt_sal = datetime.combine(dummy_date, salida_valida)
-                horas_reales = (dt_sal - dt_ent).total_seconds() / 3600.0
-                total_horas_trabajadas += horas_reales
-                
-        # -------------------------------------------------------------
-        # LÓGICA DE ESTADO BASE (Basado solo en horas trabajadas)
-        # -------------------------------------------------------------
-        estado_base = "FALTA" # Default preliminar
-        
-        # Lógica de Estado en Tiempo Real vs Pasado
-        ultimo_fin_seg = max([seg.hora_fin for seg in segmentos]) if segmentos else time(0,0)
-        fecha_ahora = datetime.now()
-        
-        # Limite para marcar salida: Fin de turno + tolerancias (ej 4h)
-        dt_fin_turno = datetime.combine(fecha_proceso, ultimo_fin_seg)
-        dt_limite_salida = dt_fin_turno + timedelta(hours=2)
-        
-        es_dia_pasado_o_terminado = (fecha_proceso < fecha_ahora.date()) or (fecha_proceso == fecha_ahora.date() and fecha_ahora > dt_limite_salida)
-        
-        completo_horas = total_horas_trabajadas >= (total_horas_esperadas - 0.05)
-        
-        if completo_horas:
-            # Horas completas -> PRESENTE o TARDE
-            if llegada_tarde:
-                estado_base = "TARDE"
-            else:
-                estado_base = "PRESENTE"
-        else:
-            # Horas incompletas (o 0 horas)
-            if not es_dia_pasado_o_terminado:
-                 # AUN ESTA EN HORARIO LABORAL (o dentro del limite)
-                 # Si ya marco entrada, decimos PRESENTE/TARDE temporalmente
-                 if primer_ingreso:
-                    if llegada_tarde:
-                        estado_base = "TARDE"
-                    else:
-                        estado_base = "PRESENTE"
-                 # Si no ha marcado nada, sigue siendo FALTA (o S/M)
-            else:
-                 # DIA TERMINADO y no completó horas
-                 estado_base = "FALTA"
-
-        # -------------------------------------------------------------
-        # LÓGICA DE PRIORIDAD FINAL (Requirements Usuario)
-        # -------------------------------------------------------------
-        # Prioridad:
-        # 1. Si TRABAJÓ COMPLETO (PRESENTE/TARDE) -> Se queda ese estado (incluso si es feriado, es Feriado Trabajado implícito)
-        # 2. Si es FERIADO y no trabajó completo -> FERIADO (Incluso si marcó entrada y se fue, o no vino)
-        # 3. Si tiene INCIDENCIA y no trabajó completo -> INCIDENCIA
-        # 4. FALTA
-        
-        tiene_justificacion, codigo_just = AsistenciaService.verificar_incidencia(user_id, fecha_proceso)
+                logger.info(f"Logs crudos encontrados para UID {usuario.uid} en fecha {fecha_proceso}: {len(logs)}")
+                logs_times = [log.timestamp.time() for log in logs]
 
-        if estado_base in ["PRESENTE", "TARDE"]:
-            estado_final = estado_base
-            # Caso especial: Si es feriado y trabajó, a veces quieren ver "FERIADO_TRABAJADO" o simplemente "PRESENTE"
-            # El usuario dijo: "solo si el usuario tiene su estado presente no priorizar el feriado" -> PRESENTE gana.
-        
-        elif es_feriado:
-             estado_final = "FERIADO"
-             reporte.es_justificado = True
-             
-        elif tiene_justificacion:
-             estado_final = codigo_just
-             reporte.es_justificado = True
-        
-        else:
-             estado_final = "FALTA"
-
-        logger.info(f"  -> Estado Final: {estado_final} (Base: {estado_base}, Feriado: {bool(es_feriado)}, Incidencia: {tiene_justificacion})")
+        valores = calcular_dia(
+            fecha_proceso,
+            asignacion.horario_id if asignacion else None,
+            segmentos,
+            logs_times,
+            bool(es_feriado),
+            lambda: AsistenciaService.verificar_incidencia(user_id, fecha_proceso),
+            datetime.now()
+        )
+        logger.info(f"  -> Estado Final: {valores['estado_asistencia']} (Feriado: {bool(es_feriado)})")
 
-        reporte.horas_esperadas = total_horas_esperadas
-        reporte.horas_trabajadas = round(total_horas_trabajadas, 2)
-        reporte.estado_asistencia = estado_final
-        reporte.entrada_real = primer_ingreso
-        reporte.salida_real = ultima_salida
+        # Crear nuevo registro limpio
+        reporte = AsistenciaDiaria(user_id=user_id, fecha=fecha_proceso)
+        for campo, valor in valores.items():
+            setattr(reporte, campo, valor)
         
         db.add(reporte)
         db.commit()
@@ -734,27 +1069,23 @@ class AsistenciaService:
         return logs
 
     @staticmethod
-    def calcular_rango_asistencia(db: Session, fecha_inicio: date, fecha_fin: date, user_id: str = None):
+    def calcular_rango_asistencia(db: Session, fecha_inicio: date, fecha_fin: date, user_id: str = None,
+                                  al_avanzar=None, procesos: Optional[int] = None):
         """
-        Procesa un rango de fechas.
+        Procesa un rango de fechas con el motor por lotes (CalculoService): carga
+        masiva, cálculo en memoria y una sola escritura. El resultado es el mismo
+        que procesar cada usuario-día con procesar_asistencia_dia.
+
+        procesos reparte el cálculo entre varios procesos (por defecto CALC_WORKERS).
+
+        Retorna las filas calculadas (una por usuario y día).
         """
-        usuarios = []
-        if user_id:
-            usuarios = db.query(Usuario).filter(Usuario.user_id == user_id).all()
-        else:
-            usuarios = db.query(Usuario).all() 
-            
-        delta = fecha_fin - fecha_inicio
-        resultados = []
-        
-        for i in range(delta.days + 1):
-            fecha = fecha_inicio + timedelta(days=i)
-            for usu in usuarios:
-                res = AsistenciaService.procesar_asistencia_dia(db, usu.user_id, fecha)
-                if res:
-                    resultados.append(res)
-                    
-        return resultados
+        return CalculoService.calcular_rango(
+            db, fecha_inicio, fecha_fin,
+            [user_id] if user_id else None,
+            al_avanzar=al_avanzar,
+            procesos=procesos
+        )
 
     @staticmethod
     def obtener_reporte(db: Session, fecha_inicio: date, fecha_fin: date, user_id: Optional[str] = None) -> List[dict]:
@@ -0,0 +1,732 @@
+"""
+Servicio de Cálculo de Asistencia por Lotes
+Calcula la asistencia diaria (AsistenciaDiaria) de un conjunto de usuarios y un
+rango de fechas con pocas consultas masivas y una sola escritura
+
+El cálculo de un día (emparejar marcaciones con los segmentos del horario y
+decidir el estado) es una función pura que comparten el cálculo por día
+(AsistenciaService.procesar_asistencia_dia) y el cálculo por lotes, así que
+ambos producen exactamente el mismo resultado.
+"""
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import date, datetime, timedelta, time
+from typing import Callable, Optional
+import multiprocessing
+import logging
+
+try:
+    import numpy as np
+except ImportError:  # Opcional: sin NumPy el emparejamiento por lotes usa emparejar_segmentos
+    np = None
+
+from models.usuario import Usuario
+from models.asistencia import Asistencia
+from models.turnos import SegmentosHorario, AsignacionHorario, Feriados
+from models.reportes import AsistenciaDiaria
+from services.incidencia_service import cache_incidencias
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+# Valores por IN (...) en las consultas y borrados masivos
+TAMANO_IN = 500
+
+
+def emparejar_segmentos(horas: list, segmentos: list) -> dict:
+    """
+    Empareja las marcaciones de un día con los segmentos de su horario
+    (lógica de "mejor coincidencia").
+
+    Por cada segmento:
+    - Entrada: la marcación libre más cercana al inicio dentro de la ventana
+      [inicio - 2 h, inicio + tolerancia + 1 h]
+    - Salida: entre las marcaciones libres posteriores a la entrada dentro de la
+      ventana [inicio + 30 min, fin + 4 h], la más cercana al fin entre las que
+      son iguales o posteriores al fin; si no hay, la más cercana en general
+
+    Parámetros:
+        horas (list): datetime.time de las marcaciones del día, en orden cronológico
+        segmentos (list): Objetos con hora_inicio, hora_fin y tolerancia_minutos,
+                          ordenados por hora_inicio
+
+    Retorna:
+        dict: horas_trabajadas (sin redondear), horas_esperadas, llegada_tarde,
+              primer_ingreso y ultima_salida
+    """
+    total_horas_trabajadas = 0.0
+    total_horas_esperadas = 0.0
+    llegada_tarde = False
+    primer_ingreso = None
+    ultima_salida = None
+
+    used_indices = set()
+    dummy_date = date(2000, 1, 1)
+
+    for segmento in segmentos:
+        inicio_seg = segmento.hora_inicio
+        fin_seg = segmento.hora_fin
+
+        # Cálculo horas esperadas
+        dt_inicio = datetime.combine(dummy_date, inicio_seg)
+        dt_fin = datetime.combine(dummy_date, fin_seg)
+        total_horas_esperadas += (dt_fin - dt_inicio).total_seconds() / 3600.0
+
+        # 1. Buscar MEJOR Entrada
+        entrada_valida = None
+        entrada_idx = -1
+        min_diff_entrada = float('inf')
+
+        inicio_min = inicio_seg.hour * 60 + inicio_seg.minute
+
+        for i, t in enumerate(horas):
+            if i in used_indices:
+                continue
+
+            t_min = t.hour * 60 + t.minute
+
+            # Ventana: 2h antes hasta tolerancia
+            if (inicio_min - 120) <= t_min <= (inicio_min + segmento.tolerancia_minutos + 60):
+                # Candidato válido, verificar si es el más cercano
+                diff = abs(t_min - inicio_min)
+                if diff < min_diff_entrada:
+                    min_diff_entrada = diff
+                    entrada_valida = t
+                    entrada_idx = i
+
+        # 2. Buscar MEJOR Salida
+        salida_valida = None
+        salida_idx = -1
+
+        fin_min = fin_seg.hour * 60 + fin_seg.minute
+
+        candidatos_salida = []  # Lista de tuplas: (index, time_obj, minutes_val, diff_abs)
+
+        if entrada_valida:
+            for i, t in enumerate(horas):
+                if i in used_indices or i == entrada_idx:
+                    continue
+
+                # La salida debe ser posterior a la entrada seleccionada
+                if i <= entrada_idx:
+                    continue
+
+                t_min = t.hour * 60 + t.minute
+
+                # Ventana salida: desde (inicio + 30m) hasta (fin + 4h)
+                if (inicio_min + 30) <= t_min <= (fin_min + 240):
+                    diff = abs(t_min - fin_min)
+                    candidatos_salida.append((i, t, t_min, diff))
+
+        # LÓGICA DE SELECCIÓN PRIORIZADA
+        if candidatos_salida:
+            # 1. Prioridad: registros DESPUES o IGUAL a la hora de salida, el más cercano
+            post_salida = [c for c in candidatos_salida if c[2] >= fin_min]
+
+            if post_salida:
+                post_salida.sort(key=lambda x: x[3])
+                seleccionado = post_salida[0]
+            else:
+                # 2. Fallback: la más cercana en general (salió temprano)
+                candidatos_salida.sort(key=lambda x: x[3])
+                seleccionado = candidatos_salida[0]
+
+            salida_idx = seleccionado[0]
+            salida_valida = seleccionado[1]
+
+        if entrada_valida:
+            logger.debug(f"  [Segmento {inicio_seg}-{fin_seg}] ENTRADA encontrada: {entrada_valida}")
+        else:
+            logger.debug(f"  [Segmento {inicio_seg}-{fin_seg}] NO se encontró entrada válida en ventana "
+                         f"{inicio_min - 120} - {inicio_min + segmento.tolerancia_minutos + 60}")
+        if salida_valida:
+            logger.debug(f"  [Segmento {inicio_seg}-{fin_seg}] SALIDA encontrada: {salida_valida}")
+
+        if entrada_valida:
+            used_indices.add(entrada_idx)
+
+        if salida_valida:
+            used_indices.add(salida_idx)
+
+        if entrada_valida:
+            if not primer_ingreso or entrada_valida < primer_ingreso:
+                primer_ingreso = entrada_valida
+
+            t_ent_min = entrada_valida.hour * 60 + entrada_valida.minute
+            if t_ent_min > (inicio_min + segmento.tolerancia_minutos):
+                llegada_tarde = True
+
+        if salida_valida:
+            if not ultima_salida or salida_valida > ultima_salida:
+                ultima_salida = salida_valida
+
+            dt_ent = datetime.combine(dummy_date, entrada_valida)
+            dt_sal = datetime.combine(dummy_date, salida_valida)
+            total_horas_trabajadas += (dt_sal - dt_ent).total_seconds() / 3600.0
+
+    return {
+        "horas_trabajadas": total_horas_trabajadas,
+        "horas_esperadas": total_horas_esperadas,
+        "llegada_tarde": llegada_tarde,
+        "primer_ingreso": primer_ingreso,
+        "ultima_salida": ultima_salida,
+    }
+
+
+def _microsegundos(t: time) -> int:
+    return ((t.hour * 60 + t.minute) * 60 + t.second) * 1000000 + t.microsecond
+
+
+def emparejar_lote(casos: list) -> list:
+    """
+    emparejar_segmentos para muchos usuario-día a la vez.
+
+    Con NumPy (y CALC_VECTORIZED activo) las ventanas de entrada y salida se evalúan
+    con operaciones sobre matrices (usuario-día x marcación), un segmento a la vez
+    para toda la población; sin NumPy se emparejan uno por uno. Ambos caminos toman
+    las mismas decisiones.
+
+    Parámetros:
+        casos (list): (horas, segmentos) de cada usuario-día, como en emparejar_segmentos
+
+    Retorna:
+        list: Resultado de emparejar_segmentos de cada caso, en el mismo orden
+    """
+    if np is None or not settings.CALC_VECTORIZED:
+        return [emparejar_segmentos(horas, segmentos) for horas, segmentos in casos]
+
+    # Agrupar casos con cantidades de marcaciones parecidas reduce el relleno de las matrices
+    orden = sorted(range(len(casos)), key=lambda i: len(casos[i][0]))
+    resultados = [None] * len(casos)
+    for bloque in _bloques(orden, settings.CALC_BATCH_SIZE):
+        for i, resultado in zip(bloque, _emparejar_matrices([casos[i] for i in bloque])):
+            resultados[i] = resultado
+    return resultados
+
+
+def _emparejar_matrices(casos: list) -> list:
+    """
+    Emparejamiento vectorizado de un bloque de casos (ver emparejar_segmentos)
+    """
+    n = len(casos)
+    ancho = max(1, max(len(horas) for horas, _ in casos))
+    segmentos_max = max(len(segmentos) for _, segmentos in casos)
+    filas = np.arange(n)
+    columnas = np.arange(ancho)
+    lejos = np.int64(1 << 40)
+
+    # Marcaciones: microsegundos y minutos del día por (caso, posición), con máscara de válidas
+    largos = np.fromiter((len(horas) for horas, _ in casos), dtype=np.int64, count=n)
+    micros = np.zeros((n, ancho), dtype=np.int64)
+    valida = columnas[None, :] < largos[:, None]
+    micros[valida] = np.fromiter(
+        (_microsegundos(t) for horas, _ in casos for t in horas), dtype=np.int64, count=int(largos.sum())
+    )
+    minutos = micros // 60000000
+
+    # Segmentos: inicio, fin (minutos y microsegundos) y tolerancia por (caso, segmento)
+    forma = (n, max(1, segmentos_max))
+    seg_activo = np.zeros(forma, dtype=bool)
+    seg_inicio_us = np.zeros(forma, dtype=np.int64)
+    seg_fin_us = np.zeros(forma, dtype=np.int64)
+    seg_tolerancia = np.zeros(forma, dtype=np.int64)
+    for i, (_, segmentos) in enumerate(casos):
+        for k, segmento in enumerate(segmentos):
+            seg_activo[i, k] = True
+            seg_inicio_us[i, k] = _microsegundos(segmento.hora_inicio)
+            seg_fin_us[i, k] = _microsegundos(segmento.hora_fin)
+            seg_tolerancia[i, k] = segmento.tolerancia_minutos
+    seg_inicio = seg_inicio_us // 60000000
+    seg_fin = seg_fin_us // 60000000
+
+    usada = ~valida
+    horas_trabajadas = np.zeros(n)
+    horas_esperadas = np.zeros(n)
+    llegada_tarde = np.zeros(n, dtype=bool)
+    primer_idx = np.full(n, -1)
+    primer_us = np.full(n, lejos)
+    ultima_idx = np.full(n, -1)
+    ultima_us = np.full(n, -lejos)
+
+    for k in range(segmentos_max):
+        activo = seg_activo[:, k]
+        inicio = seg_inicio[:, k, None]
+        fin = seg_fin[:, k, None]
+        tolerancia = seg_tolerancia[:, k, None]
+
+        horas_esperadas += np.where(activo, (seg_fin_us[:, k] - seg_inicio_us[:, k]) / 1e6 / 3600.0, 0.0)
+
+        # Entrada: la marcación libre más cercana al inicio (la primera si empatan)
+        candidata = ~usada & activo[:, None] & (minutos >= inicio - 120) & (minutos <= inicio + tolerancia + 60)
+        entrada = np.where(candidata, np.abs(minutos - inicio), lejos).argmin(axis=1)
+        hay_entrada = candidata.any(axis=1)
+
+        # Salida: posterior a la entrada; primero las iguales o posteriores al fin
+        candidata = (~usada & hay_entrada[:, None] & (columnas[None, :] > entrada[:, None])
+                     & (minutos >= inicio + 30) & (minutos <= fin + 240))
+        post_salida = candidata & (minutos >= fin)
+        candidata = np.where(post_salida.any(axis=1)[:, None], post_salida, candidata)
+        salida = np.where(candidata, np.abs(minutos - fin), lejos).argmin(axis=1)
+        hay_salida = candidata.any(axis=1)
+
+        usada[filas[hay_entrada], entrada[hay_entrada]] = True
+        usada[filas[hay_salida], salida[hay_salida]] = True
+
+        entrada_us = micros[filas, entrada]
+        salida_us = micros[filas, salida]
+        llegada_tarde |= hay_entrada & (minutos[filas, entrada] > seg_inicio[:, k] + seg_tolerancia[:, k])
+
+        antes = hay_entrada & (entrada_us < primer_us)
+        primer_idx = np.where(antes, entrada, primer_idx)
+        primer_us = np.where(antes, entrada_us, primer_us)
+        despues = hay_salida & (salida_us > ultima_us)
+        ultima_idx = np.where(despues, salida, ultima_idx)
+        ultima_us = np.where(despues, salida_us, ultima_us)
+
+        horas_trabajadas += np.where(hay_salida, (salida_us - entrada_us) / 1e6 / 3600.0, 0.0)
+
+    return [
+        {
+            "horas_trabajadas": float(horas_trabajadas[i]),
+            "horas_esperadas": float(horas_esperadas[i]),
+            "llegada_tarde": bool(llegada_tarde[i]),
+            "primer_ingreso": horas[primer_idx[i]] if primer_idx[i] >= 0 else None,
+            "ultima_salida": horas[ultima_idx[i]] if ultima_idx[i] >= 0 else None,
+        }
+        for i, (horas, _) in enumerate(casos)
+    ]
+
+
+def calcular_dia(fecha: date, horario_id: Optional[int], segmentos: list, horas: list, es_feriado: bool,
+                 incidencia: Callable[[], tuple], ahora: datetime, emparejado: Optional[dict] = None) -> dict:
+    """
+    Resultado de un usuario en un día a partir de datos ya cargados.
+
+    Parámetros:
+        fecha (date): Día calculado
+        horario_id (int): Horario de la asignación vigente (None = sin horario)
+        segmentos (list): Segmentos del horario para el día de la semana, por hora_inicio
+        horas (list): datetime.time de las marcaciones del día, en orden cronológico
+        es_feriado (bool): Si el día es feriado
+        incidencia (callable): Retorna (tiene_justificacion, codigo); solo se llama
+                               si la justificación decide el estado
+        ahora (datetime): Momento del cálculo (decide si el día ya terminó)
+        emparejado (dict): Resultado ya calculado de emparejar_segmentos(horas, segmentos)
+                           (p. ej. por emparejar_lote); None = calcularlo aquí
+
+    Retorna:
+        dict: Campos de AsistenciaDiaria (sin user_id ni fecha)
+    """
+    resultado = {
+        "horario_id_snapshot": None,
+        "horas_esperadas": 0.0,
+        "horas_trabajadas": 0.0,
+        "estado_asistencia": "FERIADO" if es_feriado else "FALTA",
+        "es_justificado": bool(es_feriado),
+        "entrada_real": None,
+        "salida_real": None,
+    }
+
+    if horario_id is None:
+        if not es_feriado:
+            resultado["estado_asistencia"] = "SIN_HORARIO"
+        return resultado
+
+    resultado["horario_id_snapshot"] = horario_id
+
+    if not segmentos:
+        if not es_feriado:
+            resultado["estado_asistencia"] = "DIA_LIBRE"
+        return resultado
+
+    if emparejado is None:
+        emparejado = emparejar_segmentos(horas, segmentos)
+    total_horas_trabajadas = emparejado["horas_trabajadas"]
+    total_horas_esperadas = emparejado["horas_esperadas"]
+    llegada_tarde = emparejado["llegada_tarde"]
+    primer_ingreso = emparejado["primer_ingreso"]
+
+    # Estado base (solo horas trabajadas), distinguiendo el día en curso del día terminado
+    estado_base = "FALTA"
+    ultimo_fin_seg = max(seg.hora_fin for seg in segmentos)
+
+    # Limite para marcar salida: Fin de turno + 2h
+    dt_limite_salida = datetime.combine(fecha, ultimo_fin_seg) + timedelta(hours=2)
+    es_dia_pasado_o_terminado = (fecha < ahora.date()) or (fecha == ahora.date() and ahora > dt_limite_salida)
+
+    completo_horas = total_horas_trabajadas >= (total_horas_esperadas - 0.05)
+
+    if completo_horas:
+        estado_base = "TARDE" if llegada_tarde else "PRESENTE"
+    elif not es_dia_pasado_o_terminado and primer_ingreso:
+        # Aún en horario laboral y ya marcó entrada: PRESENTE/TARDE provisional
+        estado_base = "TARDE" if llegada_tarde else "PRESENTE"
+
+    # Prioridad final:
+    # 1. Trabajó completo (PRESENTE/TARDE), aunque sea feriado
+    # 2. Feriado
+    # 3. Incidencia aprobada
+    # 4. Falta
+    if estado_base in ("PRESENTE", "TARDE"):
+        estado_final = estado_base
+    elif es_feriado:
+        estado_final = "FERIADO"
+        resultado["es_justificado"] = True
+    else:
+        tiene_justificacion, codigo_just = incidencia()
+        if tiene_justificacion:
+            estado_final = codigo_just
+            resultado["es_justificado"] = True
+        else:
+            estado_final = "FALTA"
+
+    resultado.update({
+        "horas_esperadas": total_horas_esperadas,
+        "horas_trabajadas": round(total_horas_trabajadas, 2),
+        "estado_asistencia": estado_final,
+        "entrada_real": primer_ingreso,
+        "salida_real": emparejado["ultima_salida"],
+    })
+    return resultado
+
+
+def _bloques(valores: list, tamano: int):
+    for i in range(0, len(valores), tamano):
+        yield valores[i:i + tamano]
+
+
+# Motores de BD de los procesos de cálculo, por URL (se reutilizan entre bloques)
+_motores = {}
+
+
+def _calcular_bloque(url: str, usuarios: list, fecha_inicio: date, fecha_fin: date, indice, ahora: datetime) -> list:
+    """
+    Proceso de cálculo: carga los datos de un bloque de usuarios con una sesión
+    propia y los calcula en memoria. No escribe en la BD.
+    """
+    motor = _motores.get(url)
+    if motor is None:
+        motor = _motores[url] = create_engine(url, pool_pre_ping=True)
+    db = Session(bind=motor)
+    try:
+        datos = CalculoService._cargar_datos(db, usuarios, fecha_inicio, fecha_fin)
+    finally:
+        db.close()
+    datos["incidencias"] = lambda: indice
+    fechas = [fecha_inicio + timedelta(days=i) for i in range((fecha_fin - fecha_inicio).days + 1)]
+    return CalculoService.calcular_usuarios(usuarios, fechas, datos, ahora)
+
+
+class CalculoService:
+    """
+    Cálculo de la asistencia diaria por lotes: carga masiva, cálculo en memoria y una escritura
+    """
+
+    @staticmethod
+    def calcular_rango(db: Session, fecha_inicio: date, fecha_fin: date, user_ids: Optional[list] = None,
+                       al_avanzar: Optional[Callable[[int, int], None]] = None,
+                       procesos: Optional[int] = None) -> list:
+        """
+        Calcula (o recalcula) la asistencia diaria de los usuarios en el rango.
+
+        1. Carga usuarios, asignaciones, segmentos, feriados y marcaciones del rango
+           en unas pocas consultas masivas
+        2. Calcula cada usuario-día en memoria con calcular_dia (mismas reglas que
+           el cálculo por día); las incidencias aprobadas se descargan una sola vez
+           para todo el cálculo (índice en caché) y solo si alguna decide un estado
+        3. Reemplaza los registros del rango en una sola transacción (borrado e
+           inserción masivos)
+
+        Con más de un proceso, los usuarios se reparten en bloques de CALC_CHUNK_USERS
+        y cada bloque se carga y calcula (pasos 1 y 2) en un proceso aparte con su
+        propia sesión; este proceso junta las filas y hace la única escritura.
+
+        Parámetros:
+            user_ids (list): user_id a calcular (None = todos los usuarios)
+            al_avanzar (callable): Se llama con (usuarios_calculados, total) tras cada
+                                   usuario (o bloque); si lanza una excepción no se escribe nada
+            procesos (int): Procesos de cálculo (por defecto CALC_WORKERS; 1 = en este proceso)
+
+        Retorna:
+            list: Filas escritas en asistencia_diaria (diccionarios)
+        """
+        ahora = datetime.now()
+        usuarios = CalculoService._cargar_usuarios(db, user_ids)
+        if not usuarios or fecha_fin < fecha_inicio:
+            return []
+        fechas = [fecha_inicio + timedelta(days=i) for i in range((fecha_fin - fecha_inicio).days + 1)]
+
+        procesos = procesos or settings.CALC_WORKERS
+        url = CalculoService._url_compartible(db) if procesos > 1 and len(usuarios) > settings.CALC_CHUNK_USERS else None
+        if url is None:
+            datos = CalculoService._cargar_datos(db, usuarios, fecha_inicio, fecha_fin)
+            filas = CalculoService.calcular_usuarios(usuarios, fechas, datos, ahora, al_avanzar)
+        else:
+            filas = CalculoService._calcular_en_procesos(url, usuarios, fecha_inicio, fecha_fin, ahora,
+                                                         procesos, al_avanzar)
+
+        CalculoService._guardar(db, [user_id for user_id, _ in usuarios], fecha_inicio, fecha_fin, filas)
+        logger.info(f"Asistencia diaria calculada: {len(usuarios)} usuarios, {len(fechas)} días, "
+                    f"{len(filas)} registros ({fecha_inicio} a {fecha_fin})")
+        return filas
+
+    @staticmethod
+    def calcular_dias(db: Session, pares) -> list:
+        """
+        Recalcula solo los usuario-día indicados (p. ej. los que recibieron marcaciones).
+
+        Los días de cada usuario se juntan en tramos consecutivos y los usuarios con el
+        mismo tramo se calculan juntos, así cada consulta masiva cubre solo los días
+        afectados (un día para la sincronización de hoy, unos días más para un
+        dispositivo que sincroniza tarde) y no el mes completo.
+        No hace commit: el llamador confirma (o descarta) el reemplazo.
+
+        Parámetros:
+            pares: (user_id, fecha) a recalcular
+
+        Retorna:
+            list: Filas escritas en asistencia_diaria (diccionarios)
+        """
+        ahora = datetime.now()
+        por_usuario = {}
+        for user_id, fecha in pares:
+            por_usuario.setdefault(user_id, set()).add(fecha)
+
+        grupos = {}
+        for user_id, fechas in por_usuario.items():
+            fechas = sorted(fechas)
+            inicio = anterior = fechas[0]
+            for fecha in fechas[1:] + [None]:
+                if fecha is not None and fecha == anterior + timedelta(days=1):
+                    anterior = fecha
+                    continue
+                grupos.setdefault((inicio, anterior), []).append(user_id)
+                inicio = anterior = fecha
+
+        filas = []
+        for (fecha_inicio, fecha_fin), user_ids in sorted(grupos.items()):
+            usuarios = CalculoService._cargar_usuarios(db, user_ids)
+            if not usuarios:
+                continue
+            datos = CalculoService._cargar_datos(db, usuarios, fecha_inicio, fecha_fin)
+            fechas = [fecha_inicio + timedelta(days=i) for i in range((fecha_fin - fecha_inicio).days + 1)]
+            calculadas = CalculoService.calcular_usuarios(usuarios, fechas, datos, ahora)
+            CalculoService._reemplazar(db, [user_id for user_id, _ in usuarios], fecha_inicio, fecha_fin, calculadas)
+            filas.extend(calculadas)
+        return filas
+
+    @staticmethod
+    def calcular_usuarios(usuarios: list, fechas: list, datos: dict, ahora: datetime,
+                          al_avanzar: Optional[Callable[[int, int], None]] = None) -> list:
+        """
+        Calcula en memoria, sin acceder a la BD, todos los usuario-día con los datos de _cargar_datos
+
+        Parámetros:
+            usuarios (list): (user_id, uid) de los usuarios
+            fechas (list): Días a calcular
+        """
+        dias = [CalculoService._dias_usuario(user_id, uid, fechas, datos) for user_id, uid in usuarios]
+        # Emparejamiento de marcaciones de toda la población de una vez
+        emparejados = iter(emparejar_lote([
+            (horas, segmentos) for dias_usuario in dias for _, _, segmentos, horas in dias_usuario if segmentos
+        ]))
+
+        filas = []
+        for n, ((user_id, _), dias_usuario) in enumerate(zip(usuarios, dias), start=1):
+            filas.extend(CalculoService.calcular_usuario(user_id, dias_usuario, emparejados, datos, ahora))
+            if al_avanzar is not None:
+                al_avanzar(n, len(usuarios))
+        return filas
+
+    @staticmethod
+    def _url_compartible(db: Session) -> Optional[str]:
+        """
+        URL de la BD de la sesión para abrirla desde otros procesos
+        (None si es una SQLite en memoria, que solo existe en este proceso)
+        """
+        url = db.get_bind().url
+        if url.get_backend_name() == "sqlite" and url.database in (None, "", ":memory:"):
+            logger.warning("La BD es SQLite en memoria: el cálculo se hace en un solo proceso")
+            return None
+        return url.render_as_string(hide_password=False)
+
+    @staticmethod
+    def _calcular_en_procesos(url: str, usuarios: list, fecha_inicio: date, fecha_fin: date, ahora: datetime,
+                              procesos: int, al_avanzar: Optional[Callable[[int, int], None]] = None) -> list:
+        """
+        Reparte los usuarios en bloques entre procesos (spawn) y junta sus filas en orden
+        """
+        # Una sola descarga de incidencias para todos los procesos
+        indice = cache_incidencias.obtener()
+        bloques = list(_bloques(usuarios, settings.CALC_CHUNK_USERS))
+        resultados = [None] * len(bloques)
+        calculados = 0
+
+        contexto = multiprocessing.get_context("spawn")
+        ejecutor = ProcessPoolExecutor(max_workers=min(procesos, len(bloques)), mp_context=contexto)
+        try:
+            futuros = {
+                ejecutor.submit(_calcular_bloque, url, bloque, fecha_inicio, fecha_fin, indice, ahora): i
+                for i, bloque in enumerate(bloques)
+            }
+            for futuro in as_completed(futuros):
+                i = futuros[futuro]
+                resultados[i] = futuro.result()
+                calculados += len(bloques[i])
+                if al_avanzar is not None:
+                    al_avanzar(calculados, len(usuarios))
+        finally:
+            ejecutor.shutdown(wait=True, cancel_futures=True)
+
+        logger.info(f"Cálculo repartido en {len(bloques)} bloques entre {min(procesos, len(bloques))} procesos")
+        return [fila for filas in resultados for fila in filas]
+
+    @staticmethod
+    def _dias_usuario(user_id: str, uid: int, fechas: list, datos: dict) -> list:
+        """
+        (fecha, horario_id, segmentos, horas) de cada día del usuario con los datos de _cargar_datos
+        """
+        asignaciones = datos["asignaciones"].get(user_id, [])
+        dias = []
+        for fecha in fechas:
+            # Asignación vigente más reciente (la lista viene por fecha_inicio descendente)
+            horario_id = next(
+                (a.horario_id for a in asignaciones
+                 if a.fecha_inicio <= fecha and (a.fecha_fin is None or a.fecha_fin >= fecha)),
+                None
+            )
+            segmentos = datos["segmentos"].get((horario_id, fecha.weekday()), []) if horario_id is not None else []
+            horas = datos["marcaciones"].get((uid, fecha), []) if segmentos else []
+            dias.append((fecha, horario_id, segmentos, horas))
+        return dias
+
+    @staticmethod
+    def calcular_usuario(user_id: str, dias: list, emparejados, datos: dict, ahora: datetime) -> list:
+        """
+        Calcula en memoria todos los días de un usuario
+
+        Parámetros:
+            dias (list): (fecha, horario_id, segmentos, horas) de _dias_usuario
+            emparejados: Iterador con el emparejamiento (emparejar_lote) de cada día
+                         con segmentos, en el mismo orden
+        """
+        def incidencia_del_dia(fecha):
+            return lambda: datos["incidencias"]().buscar(user_id, fecha)
+
+        filas = []
+        for fecha, horario_id, segmentos, horas in dias:
+            fila = calcular_dia(
+                fecha, horario_id, segmentos, horas, fecha in datos["feriados"],
+                incidencia_del_dia(fecha), ahora, next(emparejados) if segmentos else None
+            )
+            fila["user_id"] = user_id
+            fila["fecha"] = fecha
+            filas.append(fila)
+        return filas
+
+    @staticmethod
+    def _cargar_usuarios(db: Session, user_ids: Optional[list]) -> list:
+        """
+        (user_id, uid) de los usuarios a calcular
+        """
+        if user_ids is None:
+            filas = db.query(Usuario.user_id, Usuario.uid).filter(Usuario.user_id != None).all()
+        else:
+            filas = []
+            for bloque in _bloques(list(dict.fromkeys(user_ids)), TAMANO_IN):
+                filas.extend(db.query(Usuario.user_id, Usuario.uid).filter(Usuario.user_id.in_(bloque)).all())
+        return [(user_id, uid) for user_id, uid in filas]
+
+    @staticmethod
+    def _cargar_datos(db: Session, usuarios: list, fecha_inicio: date, fecha_fin: date) -> dict:
+        """
+        Todo lo que necesita el cálculo del rango, en consultas masivas:
+
+        - asignaciones: user_id -> asignaciones que tocan el rango (fecha_inicio descendente)
+        - segmentos: (horario_id, dia_semana) -> segmentos ordenados por hora_inicio
+        - feriados: fechas feriadas del rango
+        - marcaciones: (uid, fecha) -> datetime.time en orden cronológico
+        - incidencias: callable que retorna el índice de incidencias aprobadas; se
+          obtiene de la caché la primera vez que se necesita y se reutiliza en todo el rango
+        """
+        user_ids = [user_id for user_id, _ in usuarios]
+        uids = [uid for _, uid in usuarios if uid is not None]
+
+        asignaciones = {}
+        for bloque in _bloques(user_ids, TAMANO_IN):
+            for asignacion in db.query(AsignacionHorario).filter(
+                AsignacionHorario.user_id.in_(bloque),
+                AsignacionHorario.fecha_inicio <= fecha_fin,
+                (AsignacionHorario.fecha_fin == None) | (AsignacionHorario.fecha_fin >= fecha_inicio)
+            ).order_by(AsignacionHorario.fecha_inicio.desc()).all():
+                asignaciones.setdefault(asignacion.user_id, []).append(asignacion)
+
+        segmentos = {}
+        horarios = {a.horario_id for lista in asignaciones.values() for a in lista}
+        for bloque in _bloques(sorted(horarios), TAMANO_IN):
+            for segmento in db.query(SegmentosHorario).filter(
+                SegmentosHorario.horario_id.in_(bloque)
+            ).order_by(SegmentosHorario.hora_inicio).all():
+                segmentos.setdefault((segmento.horario_id, segmento.dia_semana), []).append(segmento)
+
+        feriados = {
+            fecha for (fecha,) in db.query(Feriados.fecha).filter(
+                Feriados.fecha >= fecha_inicio, Feriados.fecha <= fecha_fin
+            ).all()
+        }
+
+        marcaciones = {}
+        inicio = datetime.combine(fecha_inicio, time.min)
+        fin = datetime.combine(fecha_fin, time.max)
+        for bloque in _bloques(uids, TAMANO_IN):
+            filas = db.query(Asistencia.uid, Asistencia.timestamp).filter(
+                Asistencia.uid.in_(bloque),
+                Asistencia.timestamp >= inicio,
+                Asistencia.timestamp <= fin
+            ).order_by(Asistencia.uid, Asistencia.timestamp).yield_per(settings.CALC_BATCH_SIZE)
+            for uid, timestamp in filas:
+                marcaciones.setdefault((uid, timestamp.date()), []).append(timestamp.time())
+
+        indice = None
+
+        def incidencias():
+            nonlocal indice
+            if indice is None:
+                indice = cache_incidencias.obtener()
+            return indice
+
+        return {
+            "asignaciones": asignaciones,
+            "segmentos": segmentos,
+            "feriados": feriados,
+            "marcaciones": marcaciones,
+            "incidencias": incidencias,
+        }
+
+    @staticmethod
+    def _guardar(db: Session, user_ids: list, fecha_inicio: date, fecha_fin: date, filas: list):
+        """
+        Reemplaza los registros de los usuarios en el rango en una sola transacción
+        """
+        try:
+            CalculoService._reemplazar(db, user_ids, fecha_inicio, fecha_fin, filas)
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+
+    @staticmethod
+    def _reemplazar(db: Session, user_ids: list, fecha_inicio: date, fecha_fin: date, filas: list):
+        """
+        Borra los registros de los usuarios en el rango e inserta las filas (sin commit)
+        """
+        for bloque in _bloques(user_ids, TAMANO_IN):
+            db.query(AsistenciaDiaria).filter(
+                AsistenciaDiaria.user_id.in_(bloque),
+                AsistenciaDiaria.fecha >= fecha_inicio,
+                AsistenciaDiaria.fecha <= fecha_fin
+            ).delete(synchronize_session=False)
+        for bloque in _bloques(filas, settings.CALC_BATCH_SIZE):
+            db.execute(AsistenciaDiaria.__table__.insert(), bloque)
@@ -6,7 +6,7 @@ Lógica de negocio para gestión de dispositivos ZKTeco
 from sqlalchemy.orm import Session
 from models.dispositivo import Dispositivo
 from schemas.dispositivo import DispositivoCreate, DispositivoUpdate, DispositivoInfo
-from zkteco_connection import ZKTecoConnection
+from zkteco_pool import pool_conexiones
 from datetime import datetime
 from typing import List, Optional
 import logging
@@ -77,6 +77,9 @@ class DispositivoService:
         db.commit()
         db.refresh(db_dispositivo)
         
+        # La sesión abierta puede usar parámetros anteriores (IP, password...)
+        pool_conexiones.cerrar(dispositivo_id)
+        
         logger.info(f"Dispositivo actualizado: {db_dispositivo.id}")
         return db_dispositivo
     
@@ -93,6 +96,8 @@ class DispositivoService:
         db.delete(db_dispositivo)
         db.commit()
         
+        pool_conexiones.cerrar(dispositivo_id)
+        
         logger.info(f"Dispositivo eliminado: {dispositivo_id}")
         return True
     
@@ -111,54 +116,43 @@ class DispositivoService:
             }
         
         try:
-            # Crear conexión ZKTeco
-            zk = ZKTecoConnection(
-                ip_address=db_dispositivo.ip_address,
-                port=db_dispositivo.puerto,
-                timeout=db_dispositivo.timeout,
-                password=db_dispositivo.password
-            )
-            
-            # Intentar conectar
-            if not zk.conectar():
-                return {
-                    "success": False,
-                    "message": "No se pudo conectar al dispositivo",
-                    "info": None
-                }
-            
-            try:
+            # Tomar la sesión del pool de conexiones
+            with pool_conexiones.sesion(db_dispositivo, lectura=True) as zk:
+                if zk is None:
+                    return {
+                        "success": False,
+                        "message": pool_conexiones.motivo_sin_conexion(db_dispositivo.id),
+                        "info": None
+                    }
+                
                 # Obtener información del dispositivo
                 info = zk.obtener_informacion_dispositivo()
                 hora = zk.obtener_hora_dispositivo()
-                
-                # Actualizar información en la base de datos
-                db_dispositivo.serial_number = info.get('serial_number')
-                db_dispositivo.firmware_version = info.get('firmware_version')
-                db_dispositivo.platform = info.get('platform')
-                db_dispositivo.device_name = info.get('device_name')
-                db_dispositivo.mac_address = info.get('mac_address')
-                db_dispositivo.ultima_sincronizacion = datetime.now()
-                
-                db.commit()
-                
-                return {
-                    "success": True,
-                    "message": "Conexión exitosa",
-                    "info": DispositivoInfo(
-                        serial_number=info.get('serial_number'),
-                        firmware_version=info.get('firmware_version'),
-                        platform=info.get('platform'),
-                        device_name=info.get('device_name'),
-                        mac_address=info.get('mac_address'),
-                        ip_address=db_dispositivo.ip_address,
-                        puerto=db_dispositivo.puerto,
-                        hora_dispositivo=hora
-                    )
-                }
             
-            finally:
-                zk.desconectar()
+            # Actualizar información en la base de datos
+            db_dispositivo.serial_number = info.get('serial_number')
+            db_dispositivo.firmware_version = info.get('firmware_version')
+            db_dispositivo.platform = info.get('platform')
+            db_dispositivo.device_name = info.get('device_name')
+            db_dispositivo.mac_address = info.get('mac_address')
+            db_dispositivo.ultima_sincronizacion = datetime.now()
+            
+            db.commit()
+            
+            return {
+                "success": True,
+                "message": "Conexión exitosa",
+                "info": DispositivoInfo(
+                    serial_number=info.get('serial_number'),
+                    firmware_version=info.get('firmware_version'),
+                    platform=info.get('platform'),
+                    device_name=info.get('device_name'),
+                    mac_address=info.get('mac_address'),
+                    ip_address=db_dispositivo.ip_address,
+                    puerto=db_dispositivo.puerto,
+                    hora_dispositivo=hora
+                )
+            }
         
         except Exception as e:
             logger.error(f"Error al probar conexión: {str(e)}")
@@ -179,28 +173,19 @@ class DispositivoService:
             return None
         
         try:
-            zk = ZKTecoConnection(
-                ip_address=db_dispositivo.ip_address,
-                port=db_dispositivo.puerto,
-                timeout=db_dispositivo.timeout,
-                password=db_dispositivo.password
-            )
-            
-            if not zk.conectar():
-                return None
-            
-            try:
+            with pool_conexiones.sesion(db_dispositivo, lectura=True) as zk:
+                if zk is None:
+                    return None
+                
                 info = zk.obtener_informacion_dispositivo()
                 hora = zk.obtener_hora_dispositivo()
-                info['hora_dispositivo'] = hora
-                # Asegurar campos requeridos por el schema
-                info['puerto'] = db_dispositivo.puerto
-                if 'ip_address' not in info:
-                    info['ip_address'] = db_dispositivo.ip_address
-                return info
             
-            finally:
-                zk.desconectar()
+            info['hora_dispositivo'] = hora
+            # Asegurar campos requeridos por el schema
+            info['puerto'] = db_dispositivo.puerto
+            if 'ip_address' not in info:
+                info['ip_address'] = db_dispositivo.ip_address
+            return info
         
         except Exception as e:
             logger.error(f"Error al obtener información: {str(e)}")
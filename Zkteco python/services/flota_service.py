@@ -0,0 +1,179 @@
+"""
+Servicio de Flota
+Ejecución en paralelo de operaciones sobre varios dispositivos ZKTeco
+"""
+
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Callable, Iterator, List, Optional
+import threading
+import time
+import logging
+
+from sqlalchemy.orm import Session
+from models.database import SessionLocal
+from models.dispositivo import Dispositivo
+from services.asistencia_service import AsistenciaService
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class FlotaService:
+    """
+    Reparte una operación por dispositivo en un pool acotado de hilos.
+    Cada tarea abre su propia sesión de base de datos.
+    """
+
+    # Dispositivos cuya tarea se abandonó por tiempo y sigue en ejecución (retiene la
+    # sesión del pool): las ejecuciones siguientes los omiten hasta que termine
+    _abandonados = set()
+    _lock_abandonados = threading.Lock()
+
+    @staticmethod
+    def ejecutar_en_paralelo(
+        dispositivos: List[tuple],
+        tarea: Callable[[Session, int], dict],
+        max_workers: Optional[int] = None,
+        timeout_dispositivo: Optional[float] = None,
+        plazo_total: Optional[float] = None
+    ) -> Iterator[dict]:
+        """
+        Ejecuta tarea(db, dispositivo_id) para cada dispositivo y entrega los
+        resultados a medida que terminan.
+
+        Un dispositivo que supera timeout_dispositivo (contado desde que empezó a
+        ejecutarse) o que sigue pendiente al agotarse plazo_total se reporta como
+        fallido sin esperar su hilo; el pool de conexiones garantiza que la
+        operación abandonada no se solape con otra sobre el mismo dispositivo.
+        Mientras ese hilo siga en curso, las ejecuciones siguientes reportan el
+        dispositivo como ocupado en lugar de quedar esperando su sesión.
+
+        Parámetros:
+            dispositivos (list): Tuplas (id, nombre)
+            tarea (callable): Función (db, dispositivo_id) -> dict con 'success' y 'message'
+            max_workers (int): Hilos simultáneos (por defecto SYNC_MAX_WORKERS)
+            timeout_dispositivo (float): Segundos máximos por dispositivo (por defecto SYNC_DEVICE_TIMEOUT)
+            plazo_total (float): Segundos máximos para toda la flota (por defecto SYNC_TOTAL_TIMEOUT)
+        """
+        if not dispositivos:
+            return
+
+        max_workers = max_workers or settings.SYNC_MAX_WORKERS
+        timeout_dispositivo = timeout_dispositivo or settings.SYNC_DEVICE_TIMEOUT
+        plazo_total = plazo_total or settings.SYNC_TOTAL_TIMEOUT
+
+        inicio_total = time.monotonic()
+        limite_total = inicio_total + plazo_total
+        inicios = {}
+        en_curso = set()
+        abandonados = FlotaService._abandonados
+        lock_abandonados = FlotaService._lock_abandonados
+
+        def ejecutar(dispositivo_id):
+            with lock_abandonados:
+                en_curso.add(dispositivo_id)
+            inicios[dispositivo_id] = time.monotonic()
+            db = SessionLocal()
+            try:
+                return tarea(db, dispositivo_id)
+            finally:
+                db.close()
+                with lock_abandonados:
+                    en_curso.discard(dispositivo_id)
+                    abandonados.discard(dispositivo_id)
+
+        def abandonar(dispositivo_id):
+            with lock_abandonados:
+                if dispositivo_id in en_curso:
+                    abandonados.add(dispositivo_id)
+
+        def resultado(dispositivo, datos):
+            dispositivo_id, nombre = dispositivo
+            inicio = inicios.get(dispositivo_id)
+            return {
+                "dispositivo_id": dispositivo_id,
+                "dispositivo_nombre": nombre,
+                **datos,
+                "duracion_ms": int((time.monotonic() - inicio) * 1000) if inicio else 0,
+            }
+
+        with lock_abandonados:
+            ocupados = [d for d in dispositivos if d[0] in abandonados]
+        for dispositivo in ocupados:
+            yield resultado(dispositivo, {
+                "success": False,
+                "message": "Dispositivo ocupado: la operación anterior excedió el tiempo y sigue en curso"
+            })
+        dispositivos = [d for d in dispositivos if d not in ocupados]
+        if not dispositivos:
+            return
+
+        executor = ThreadPoolExecutor(
+            max_workers=min(max_workers, len(dispositivos)),
+            thread_name_prefix="zk-flota"
+        )
+        try:
+            pendientes = {executor.submit(ejecutar, d[0]): d for d in dispositivos}
+
+            while pendientes:
+                ahora = time.monotonic()
+                if ahora >= limite_total:
+                    break
+
+                # Esperar hasta el próximo vencimiento (o un sondeo corto para las tareas que aún no arrancan)
+                vencimientos = [
+                    inicios[d[0]] + timeout_dispositivo
+                    for d in pendientes.values() if d[0] in inicios
+                ]
+                espera = min([limite_total, ahora + 1.0] + vencimientos) - ahora
+                terminados, _ = wait(list(pendientes), timeout=max(espera, 0.05), return_when=FIRST_COMPLETED)
+
+                for futuro in terminados:
+                    dispositivo = pendientes.pop(futuro)
+                    try:
+                        datos = futuro.result()
+                    except Exception as e:
+                        logger.error(f"Error en dispositivo {dispositivo[0]}: {e}")
+                        datos = {"success": False, "message": str(e)}
+                    yield resultado(dispositivo, datos)
+
+                ahora = time.monotonic()
+                for futuro, dispositivo in list(pendientes.items()):
+                    inicio = inicios.get(dispositivo[0])
+                    if inicio is not None and ahora - inicio >= timeout_dispositivo:
+                        pendientes.pop(futuro)
+                        abandonar(dispositivo[0])
+                        logger.warning(f"Dispositivo {dispositivo[0]} excedió {timeout_dispositivo}s")
+                        yield resultado(dispositivo, {
+                            "success": False,
+                            "message": f"Tiempo de espera agotado ({timeout_dispositivo}s)"
+                        })
+
+            # Plazo total agotado
+            for futuro, dispositivo in pendientes.items():
+                iniciado = not futuro.cancel()
+                if iniciado:
+                    abandonar(dispositivo[0])
+                yield resultado(dispositivo, {
+                    "success": False,
+                    "message": "Plazo total de sincronización agotado" + ("" if iniciado else " (no iniciado)")
+                })
+        finally:
+            # No se espera a los hilos colgados: terminan por su cuenta (y liberan el dispositivo)
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    @staticmethod
+    def sincronizar_asistencias_todos(db: Session, **opciones) -> Iterator[dict]:
+        """
+        Sincroniza asistencias de todos los dispositivos activos en paralelo.
+        Entrega el resultado de cada dispositivo en cuanto termina.
+        """
+        dispositivos = [
+            (d.id, d.nombre)
+            for d in db.query(Dispositivo).filter(Dispositivo.activo == True).all()
+        ]
+        return FlotaService.ejecutar_en_paralelo(
+            dispositivos,
+            AsistenciaService.sincronizar_asistencias_desde_dispositivo,
+            **opciones
+        )
@@ -0,0 +1,239 @@
+"""
+Servicio de Incidencias para el Cálculo de Asistencia
+Descarga las incidencias aprobadas de la API de incidencias en una sola consulta y
+las indexa en memoria por empleado, para que el cálculo no consulte la API por día
+
+Características:
+- Índice por empleado con las fechas ya parseadas: cada búsqueda es una bisección
+  sobre intervalos ordenados, sin recorrer ni parsear la lista de incidencias
+- Caché con vigencia (INCIDENCIAS_CACHE_TTL): un recálculo reutiliza la descarga
+  de otro reciente
+- Si la API falla o tarda más de INCIDENCIAS_TIMEOUT, se usa el último índice
+  descargado aunque esté vencido
+
+Uso:
+    >>> from services.incidencia_service import cache_incidencias
+    >>> indice = cache_incidencias.obtener()
+    >>> tiene_justificacion, codigo = indice.buscar('42326694', fecha)
+"""
+
+from bisect import bisect_right
+from datetime import date, datetime, timedelta
+from typing import Optional
+import threading
+import time
+import logging
+
+import requests
+
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+
+def descargar_incidencias(empleado_id: Optional[str] = None, timeout: float = 3) -> list:
+    """
+    Incidencias de la API de incidencias (de un empleado, o todas si empleado_id es None).
+
+    Si la respuesta está paginada ({data: [...], pagination: {page, limit, totalPages}})
+    se piden las páginas siguientes hasta la última. timeout es el plazo de la
+    descarga completa.
+
+    Lanza requests.RequestException, ValueError o TimeoutError si la consulta falla.
+    """
+    limite = time.monotonic() + timeout
+    params = {"empleado_id": empleado_id} if empleado_id is not None else {}
+    incidencias = []
+    while True:
+        restante = limite - time.monotonic()
+        if restante <= 0:
+            raise TimeoutError(f"Descarga de incidencias incompleta: {len(incidencias)} recibidas en {timeout}s")
+        resp = requests.get(settings.INCIDENCIAS_API_URL, params=params or None, timeout=restante)
+        if resp.status_code != 200:
+            raise requests.HTTPError(f"Error consultando incidencias: {resp.status_code}")
+
+        data = resp.json()
+        # Manejar estructura paginada { data: [...], pagination: {...} } vs Lista directa [...]
+        if isinstance(data, list):
+            return incidencias + data
+        if not isinstance(data, dict):
+            return incidencias
+        pagina = data.get('data', [])
+        incidencias.extend(pagina)
+
+        paginacion = data.get('pagination') or {}
+        actual = int(paginacion.get('page') or 1)
+        if not pagina or actual >= int(paginacion.get('totalPages') or 1):
+            return incidencias
+        params = {**params, "page": actual + 1}
+        if paginacion.get('limit'):
+            params["limit"] = paginacion['limit']
+
+
+def intervalo_aprobado(inc: dict) -> Optional[tuple]:
+    """
+    (empleado_id, inicio, fin, codigo) de una incidencia aprobada, o None si no lo está
+    o sus datos no son válidos (mismos criterios que AsistenciaService.buscar_incidencia)
+    """
+    estado_obj = inc.get('estado', {})
+    if not estado_obj or estado_obj.get('nombre') != 'Aprobado':
+        return None
+
+    f_inicio_str = inc.get('fecha_inicio')
+    f_fin_str = inc.get('fecha_fin')
+    if not f_inicio_str or not f_fin_str:
+        return None
+
+    try:
+        inicio = datetime.fromisoformat(f_inicio_str.replace('Z', '+00:00')).date()
+        fin = datetime.fromisoformat(f_fin_str.replace('Z', '+00:00')).date()
+        codigo = inc.get('tipo_incidencia', {}).get('codigo', 'JUSTIFICADO')
+    except Exception as e_date:
+        logger.error(f"Error parseando fechas incidencia: {e_date}")
+        return None
+
+    if inicio > fin:
+        return None
+    return str(inc.get('empleado_id')), inicio, fin, codigo
+
+
+class IndiceIncidencias:
+    """
+    Incidencias aprobadas por empleado, en tramos de fechas ordenados
+    """
+
+    def __init__(self, incidencias: list, fecha_carga: Optional[datetime] = None):
+        """
+        Parámetros:
+            incidencias (list): Incidencias tal como las entrega la API
+            fecha_carga (datetime): Momento de la descarga
+        """
+        self.fecha_carga = fecha_carga or datetime.now()
+        self.incidencias = 0
+        # empleado_id -> (inicios de tramo, resultado de la búsqueda en cada tramo)
+        self._por_empleado = {}
+
+        intervalos = {}
+        for inc in incidencias:
+            intervalo = intervalo_aprobado(inc)
+            if intervalo is not None:
+                intervalos.setdefault(intervalo[0], []).append(intervalo[1:])
+                self.incidencias += 1
+        for empleado_id, lista in intervalos.items():
+            self._por_empleado[empleado_id] = self._tramos(lista)
+
+    @staticmethod
+    def _tramos(intervalos: list) -> tuple:
+        """
+        Parte la línea de tiempo del empleado en tramos disjuntos ordenados. Cada tramo
+        lleva el código de la primera incidencia (en el orden de la API) que lo cubre,
+        igual que la búsqueda lineal original cuando las incidencias se superponen.
+
+        Solo contiene datos simples, así que el índice se puede enviar a otros procesos.
+        """
+        inicios = sorted(
+            {inicio for inicio, _, _ in intervalos}
+            | {fin + timedelta(days=1) for _, fin, _ in intervalos if fin < date.max}
+        )
+        resultados = [
+            next(((True, codigo) for inicio, fin, codigo in intervalos if inicio <= punto <= fin), (False, None))
+            for punto in inicios
+        ]
+        return inicios, resultados
+
+    def buscar(self, user_id: str, fecha: date) -> tuple:
+        """
+        Retorna (True, Codigo) si una incidencia aprobada cubre la fecha, o (False, None)
+        """
+        tramos = self._por_empleado.get(str(user_id))
+        if tramos is None:
+            return False, None
+        inicios, resultados = tramos
+        i = bisect_right(inicios, fecha) - 1
+        if i < 0:
+            return False, None
+        return resultados[i]
+
+    def __len__(self):
+        return len(self._por_empleado)
+
+
+class CacheIncidencias:
+    """
+    Último índice de incidencias descargado, con vigencia y respaldo vencido
+    """
+
+    def __init__(self, ttl: float, timeout: float):
+        """
+        Parámetros:
+            ttl (float): Segundos de vigencia de una descarga
+            timeout (float): Segundos máximos de la descarga completa
+        """
+        self.ttl = ttl
+        self.timeout = timeout
+        self._indice = None
+        self._cargado_en = 0.0  # time.monotonic() de la última descarga exitosa
+        self._lock = threading.Lock()
+
+        self.descargas = 0
+        self.aciertos = 0
+        self.fallos = 0
+        self.respaldos = 0  # Fallos cubiertos con un índice vencido
+        self.ultimo_error = None
+
+    def obtener(self, forzar: bool = False) -> IndiceIncidencias:
+        """
+        Índice vigente; lo descarga si no hay uno o venció la vigencia.
+        Si la descarga falla retorna el último índice (vencido) o uno vacío.
+        """
+        with self._lock:
+            if not forzar and self._indice is not None and time.monotonic() - self._cargado_en < self.ttl:
+                self.aciertos += 1
+                return self._indice
+
+            try:
+                incidencias = descargar_incidencias(timeout=self.timeout)
+            except Exception as e:
+                self.fallos += 1
+                self.ultimo_error = str(e)
+                if self._indice is not None:
+                    self.respaldos += 1
+                    logger.warning(f"No se pudo actualizar las incidencias ({e}); se usan las descargadas "
+                                   f"el {self._indice.fecha_carga:%Y-%m-%d %H:%M:%S}")
+                    return self._indice
+                logger.error(f"Excepción verificando incidencias: {e}")
+                return IndiceIncidencias([])
+
+            self._indice = IndiceIncidencias(incidencias)
+            self._cargado_en = time.monotonic()
+            self.descargas += 1
+            logger.info(f"Incidencias descargadas: {self._indice.incidencias} aprobadas "
+                        f"de {len(self._indice)} empleados")
+            return self._indice
+
+    def invalidar(self):
+        """
+        Descarta el índice (la próxima consulta vuelve a descargar)
+        """
+        with self._lock:
+            self._indice = None
+            self._cargado_en = 0.0
+
+    def estadisticas(self) -> dict:
+        with self._lock:
+            return {
+                "cargado": self._indice is not None,
+                "fecha_carga": self._indice.fecha_carga.isoformat() if self._indice else None,
+                "vigente": self._indice is not None and time.monotonic() - self._cargado_en < self.ttl,
+                "empleados": len(self._indice) if self._indice else 0,
+                "incidencias": self._indice.incidencias if self._indice else 0,
+                "descargas": self.descargas,
+                "aciertos": self.aciertos,
+                "fallos": self.fallos,
+                "respaldos": self.respaldos,
+                "ultimo_error": self.ultimo_error,
+            }
+
+
+# Instancia global de la caché de incidencias
+cache_incidencias = CacheIncidencias(settings.INCIDENCIAS_CACHE_TTL, settings.INCIDENCIAS_TIMEOUT)
@@ -0,0 +1,134 @@
+"""
+Servicio de Recálculo Incremental
+Registra los usuario-día que recibieron marcaciones y recalcula solo esos días
+"""
+
+from sqlalchemy import bindparam, func
+from sqlalchemy.orm import Session
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from datetime import datetime
+from time import monotonic
+from typing import Optional
+import logging
+
+from models.usuario import Usuario
+from models.recalculo import DiaPendiente
+from services.calculo_service import CalculoService, TAMANO_IN
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class RecalculoService:
+    """
+    Días pendientes de recálculo (dias_pendientes_recalculo) y su procesamiento por lotes
+    """
+
+    @staticmethod
+    def marcar(db: Session, pares) -> int:
+        """
+        Marca usuario-días como pendientes de recálculo. No hace commit: se llama dentro
+        de la transacción que inserta las marcaciones, así ambas se confirman juntas.
+        Un día ya pendiente no se duplica: se incrementa su versión. Con
+        RECALC_ENABLED desactivado no se marca nada.
+
+        Parámetros:
+            pares: (uid, fecha) de las marcaciones insertadas
+
+        Retorna:
+            int: Usuario-días marcados
+        """
+        if not settings.RECALC_ENABLED:
+            return 0
+        ahora = datetime.now()
+        filas = [{"uid": uid, "fecha": fecha, "version": 1, "fecha_marcado": ahora} for uid, fecha in set(pares)]
+        if not filas:
+            return 0
+
+        tabla = DiaPendiente.__table__
+        dialecto = db.get_bind().dialect.name
+        if dialecto == "mysql":
+            stmt = mysql_insert(tabla)
+            db.execute(stmt.on_duplicate_key_update(version=tabla.c.version + 1), filas)
+        elif dialecto == "sqlite":
+            stmt = sqlite_insert(tabla).on_conflict_do_update(
+                index_elements=[tabla.c.uid, tabla.c.fecha], set_={"version": tabla.c.version + 1}
+            )
+            db.execute(stmt, filas)
+        else:
+            for fila in filas:
+                actualizado = db.execute(
+                    tabla.update().where(tabla.c.uid == fila["uid"], tabla.c.fecha == fila["fecha"])
+                    .values(version=tabla.c.version + 1)
+                )
+                if not actualizado.rowcount:
+                    db.execute(tabla.insert(), fila)
+        return len(filas)
+
+    @staticmethod
+    def procesar_pendientes(db: Session, limite: Optional[int] = None) -> dict:
+        """
+        Recalcula un lote de los días pendientes más antiguos y los quita de la lista.
+
+        Los días del lote se agrupan (CalculoService.calcular_dias) y se reemplazan en
+        la misma transacción que borra sus marcas. Solo se borran las marcas cuya versión
+        no cambió mientras se calculaba: un día que recibió otra marcación en ese lapso
+        queda pendiente para el próximo lote.
+
+        Parámetros:
+            limite (int): Días pendientes por lote (por defecto RECALC_BATCH_SIZE)
+        """
+        inicio = monotonic()
+        limite = limite or settings.RECALC_BATCH_SIZE
+        pendientes = db.query(
+            DiaPendiente.uid, DiaPendiente.fecha, DiaPendiente.version, DiaPendiente.fecha_marcado
+        ).order_by(DiaPendiente.fecha_marcado).limit(limite).all()
+        if not pendientes:
+            return {"pendientes_procesados": 0, "dias_recalculados": 0, "usuarios": 0}
+
+        uids = sorted({p.uid for p in pendientes})
+        user_ids = {}
+        for i in range(0, len(uids), TAMANO_IN):
+            user_ids.update(db.query(Usuario.uid, Usuario.user_id).filter(
+                Usuario.uid.in_(uids[i:i + TAMANO_IN]), Usuario.user_id != None
+            ).all())
+        pares = {(user_ids[p.uid], p.fecha) for p in pendientes if p.uid in user_ids}
+
+        tabla = DiaPendiente.__table__
+        try:
+            filas = CalculoService.calcular_dias(db, pares)
+            db.execute(
+                tabla.delete().where(
+                    tabla.c.uid == bindparam("b_uid"),
+                    tabla.c.fecha == bindparam("b_fecha"),
+                    tabla.c.version == bindparam("b_version")
+                ),
+                [{"b_uid": p.uid, "b_fecha": p.fecha, "b_version": p.version} for p in pendientes]
+            )
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+
+        resultado = {
+            "pendientes_procesados": len(pendientes),
+            "dias_recalculados": len(filas),
+            "usuarios": len({user_id for user_id, _ in pares}),
+            "segundos": round(monotonic() - inicio, 3),
+            "retraso_maximo_segundos": round((datetime.now() - min(p.fecha_marcado for p in pendientes)).total_seconds(), 1),
+        }
+        logger.info(f"Recálculo incremental: {resultado['dias_recalculados']} días de "
+                    f"{resultado['usuarios']} usuarios en {resultado['segundos']}s")
+        return resultado
+
+    @staticmethod
+    def resumen_pendientes(db: Session) -> dict:
+        """
+        Cantidad de días pendientes y antigüedad del más antiguo
+        """
+        cantidad, mas_antiguo = db.query(func.count(), func.min(DiaPendiente.fecha_marcado)).select_from(DiaPendiente).one()
+        return {
+            "dias_pendientes": cantidad,
+            "pendiente_desde": mas_antiguo.isoformat() if mas_antiguo else None,
+        }
@@ -0,0 +1,252 @@
+"""
+Servicio de Rotación de Registros
+Vacía la memoria de marcaciones de los dispositivos una vez verificado que todo está en la BD
+"""
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+from datetime import datetime, timedelta
+from typing import Optional
+import hashlib
+import logging
+
+from models.asistencia import Asistencia
+from models.dispositivo import Dispositivo
+from models.sincronizacion import EstadoSincronizacion
+from models.rotacion import PoliticaRotacion, RotacionRegistros
+from zkteco_pool import pool_conexiones
+from zkteco_tcp_protocol import datetime_a_epoch, epoch_a_datetime
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+
+def checksum_registros(registros) -> str:
+    """
+    Checksum independiente del orden de un conjunto de marcaciones (uid, epoch, status, punch).
+
+    Retorna:
+        str: Suma módulo 2^64 de las huellas de cada registro, en hexadecimal
+    """
+    total = 0
+    for uid, epoch, status, punch in registros:
+        huella = hashlib.blake2b(f"{uid}:{epoch}:{status}:{punch}".encode(), digest_size=8).digest()
+        total = (total + int.from_bytes(huella, "little")) & 0xFFFFFFFFFFFFFFFF
+    return f"{total:016x}"
+
+
+class RotacionService:
+    """
+    Servicio para la rotación (vaciado verificado) de la memoria de marcaciones
+    """
+
+    @staticmethod
+    def obtener_politica(db: Session, dispositivo_id: int) -> Optional[PoliticaRotacion]:
+        return db.query(PoliticaRotacion).filter(PoliticaRotacion.dispositivo_id == dispositivo_id).first()
+
+    @staticmethod
+    def configurar_politica(db: Session, dispositivo_id: int, max_registros: Optional[int] = None,
+                            max_dias: Optional[int] = None, activo: bool = True) -> Optional[PoliticaRotacion]:
+        """
+        Crea o reemplaza la política de rotación de un dispositivo
+        (None si el dispositivo no existe)
+        """
+        if not db.query(Dispositivo.id).filter(Dispositivo.id == dispositivo_id).first():
+            return None
+        politica = RotacionService.obtener_politica(db, dispositivo_id)
+        if politica is None:
+            politica = PoliticaRotacion(dispositivo_id=dispositivo_id)
+            db.add(politica)
+        politica.max_registros = max_registros
+        politica.max_dias = max_dias
+        politica.activo = activo
+        db.commit()
+        db.refresh(politica)
+        return politica
+
+    @staticmethod
+    def obtener_historial(db: Session, dispositivo_id: int, limit: int = 50) -> list:
+        """
+        Auditoría de rotaciones de un dispositivo (más reciente primero)
+        """
+        return db.query(RotacionRegistros).filter(
+            RotacionRegistros.dispositivo_id == dispositivo_id
+        ).order_by(RotacionRegistros.fecha.desc(), RotacionRegistros.id.desc()).limit(limit).all()
+
+    @staticmethod
+    def motivo_rotacion(db: Session, dispositivo_id: int, registros_en_dispositivo: Optional[int]) -> Optional[str]:
+        """
+        Condición de la política que se cumple, o None si no corresponde rotar.
+
+        La antigüedad se estima con la marcación más antigua ingerida desde la última
+        rotación (el dispositivo no informa la fecha de su registro más antiguo sin
+        descargar toda la memoria). Tras un intento fallido no se reintenta hasta
+        pasadas LOG_ROTATION_RETRY_HOURS, para no releer la memoria en cada sincronización.
+        """
+        politica = RotacionService.obtener_politica(db, dispositivo_id)
+        if politica is None or not politica.activo or not (politica.max_registros or politica.max_dias):
+            return None
+
+        ultima = db.query(RotacionRegistros).filter(
+            RotacionRegistros.dispositivo_id == dispositivo_id
+        ).order_by(RotacionRegistros.fecha.desc(), RotacionRegistros.id.desc()).first()
+        if ultima and ultima.resultado != "rotado":
+            if datetime.now() - ultima.fecha < timedelta(hours=settings.LOG_ROTATION_RETRY_HOURS):
+                return None
+
+        if politica.max_registros and registros_en_dispositivo is not None \
+                and registros_en_dispositivo >= politica.max_registros:
+            return f"registros >= {politica.max_registros}"
+
+        if politica.max_dias and registros_en_dispositivo:
+            ultima_rotada = db.query(RotacionRegistros).filter(
+                RotacionRegistros.dispositivo_id == dispositivo_id,
+                RotacionRegistros.resultado == "rotado"
+            ).order_by(RotacionRegistros.fecha.desc()).first()
+            consulta = db.query(func.min(Asistencia.timestamp)).filter(Asistencia.dispositivo_id == dispositivo_id)
+            if ultima_rotada and ultima_rotada.hasta:
+                consulta = consulta.filter(Asistencia.timestamp > ultima_rotada.hasta)
+            mas_antigua = consulta.scalar()
+            if mas_antigua and mas_antigua < datetime.now() - timedelta(days=politica.max_dias):
+                return f"antigüedad > {politica.max_dias} días"
+
+        return None
+
+    @staticmethod
+    def rotar_si_corresponde(db: Session, dispositivo_id: int, registros_en_dispositivo: Optional[int]) -> Optional[dict]:
+        """
+        Tras una sincronización: rota si la política del dispositivo lo indica.
+        Retorna el resultado de la rotación, o None si no correspondía.
+        """
+        motivo = RotacionService.motivo_rotacion(db, dispositivo_id, registros_en_dispositivo)
+        if motivo is None:
+            return None
+        return RotacionService.rotar_dispositivo(db, dispositivo_id, motivo)
+
+    @staticmethod
+    def rotar_dispositivo(db: Session, dispositivo_id: int, motivo: str = "manual") -> dict:
+        """
+        Vacía la memoria de marcaciones del dispositivo solo si TODOS sus registros
+        están en la BD.
+
+        Dentro de una misma sesión del pool (dispositivo deshabilitado, así que no
+        entran marcaciones nuevas entre la verificación y el borrado):
+        1. Descarga la memoria completa de marcaciones
+        2. Compara cantidad y checksum con los mismos registros en la BD
+        3. Si coinciden, borra la memoria del dispositivo
+
+        Cada intento queda en la auditoría (rotaciones_registros).
+        """
+        dispositivo = db.query(Dispositivo).filter(Dispositivo.id == dispositivo_id).first()
+        if not dispositivo:
+            return {"success": False, "message": "Dispositivo no encontrado"}
+
+        auditoria = RotacionRegistros(dispositivo_id=dispositivo_id, motivo=motivo[:100], resultado="error")
+        with pool_conexiones.sesion(dispositivo) as conn:
+            if conn is None:
+                return {"success": False, "message": pool_conexiones.motivo_sin_conexion(dispositivo_id)}
+            try:
+                registros = conn.iterar_asistencias()
+                verificacion = RotacionService._verificar(db, dispositivo_id, registros)
+
+                auditoria.registros_dispositivo = verificacion["registros_dispositivo"]
+                auditoria.registros_verificados = verificacion["registros_verificados"]
+                auditoria.checksum_dispositivo = verificacion["checksum_dispositivo"]
+                auditoria.checksum_bd = verificacion["checksum_bd"]
+                auditoria.desde = verificacion["desde"]
+                auditoria.hasta = verificacion["hasta"]
+
+                if registros.total == 0:
+                    auditoria.resultado = "omitido"
+                    auditoria.mensaje = "El dispositivo no tiene registros"
+                elif not verificacion["coincide"]:
+                    auditoria.resultado = "omitido"
+                    auditoria.mensaje = (
+                        f"Verificación fallida: {verificacion['registros_verificados']}/"
+                        f"{verificacion['registros_dispositivo']} registros en la BD, "
+                        f"{registros.invalidos} inválidos"
+                    )
+                elif conn.limpiar_asistencias():
+                    auditoria.resultado = "rotado"
+                    auditoria.mensaje = f"{registros.total} registros eliminados del dispositivo"
+                else:
+                    auditoria.mensaje = "El dispositivo rechazó el borrado"
+            except Exception as e:
+                auditoria.mensaje = f"Error al verificar o borrar: {e}"[:255]
+
+        try:
+            if auditoria.resultado == "rotado":
+                # La memoria quedó vacía: el próximo incremental empieza desde el índice 0
+                # (la marca de tiempo se conserva y sigue descartando lo ya ingerido; lo
+                # pendiente de usuarios desconocidos quedó en el respaldo y ya no se relee)
+                estado = db.query(EstadoSincronizacion).filter(
+                    EstadoSincronizacion.dispositivo_id == dispositivo_id
+                ).first()
+                if estado is not None:
+                    estado.ultimo_conteo_registros = 0
+                    estado.primer_epoch = None
+                    estado.indice_pendiente = None
+                    estado.usuarios_hasta = None
+            db.add(auditoria)
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            logger.error(f"No se pudo registrar la rotación del dispositivo {dispositivo_id}: {e}")
+
+        logger.info(f"Rotación de registros del dispositivo {dispositivo_id} ({motivo}): "
+                    f"{auditoria.resultado} - {auditoria.mensaje}")
+        return {
+            "success": auditoria.resultado != "error",
+            "rotado": auditoria.resultado == "rotado",
+            "message": auditoria.mensaje,
+            "auditoria": auditoria.to_dict()
+        }
+
+    @staticmethod
+    def _verificar(db: Session, dispositivo_id: int, registros) -> dict:
+        """
+        Compara los registros del dispositivo con la BD por cantidad y checksum.
+        Un registro repetido en el dispositivo cuenta una vez (igual que al ingerirlo).
+        """
+        en_dispositivo = {}
+        for uid, epoch, status, punch in registros:
+            en_dispositivo.setdefault((uid, epoch), (status, punch))
+
+        resultado = {
+            "registros_dispositivo": len(en_dispositivo),
+            "registros_verificados": 0,
+            "checksum_dispositivo": checksum_registros((u, e, s, p) for (u, e), (s, p) in en_dispositivo.items()),
+            "checksum_bd": None,
+            "desde": None,
+            "hasta": None,
+            "coincide": False,
+        }
+        if not en_dispositivo:
+            return resultado
+
+        epochs = [epoch for _, epoch in en_dispositivo]
+        desde, hasta = epoch_a_datetime(min(epochs)), epoch_a_datetime(max(epochs))
+        filas = db.query(Asistencia.uid, Asistencia.timestamp, Asistencia.status, Asistencia.punch).filter(
+            Asistencia.dispositivo_id == dispositivo_id,
+            Asistencia.timestamp >= desde,
+            Asistencia.timestamp <= hasta
+        ).yield_per(5000)
+
+        en_bd = {}
+        for uid, timestamp, status, punch in filas:
+            clave = (uid, datetime_a_epoch(timestamp))
+            if clave in en_dispositivo:
+                en_bd.setdefault(clave, (status, punch))
+
+        resultado.update({
+            "registros_verificados": len(en_bd),
+            "checksum_bd": checksum_registros((u, e, s, p) for (u, e), (s, p) in en_bd.items()),
+            "desde": desde,
+            "hasta": hasta,
+        })
+        resultado["coincide"] = (
+            len(en_bd) == len(en_dispositivo)
+            and resultado["checksum_bd"] == resultado["checksum_dispositivo"]
+            and registros.invalidos == 0
+        )
+        return resultado
@@ -5,9 +5,16 @@ Lógica para sincronización de hora y datos con dispositivos
 
 from sqlalchemy.orm import Session
 from models.dispositivo import Dispositivo
-from zkteco_connection import ZKTecoConnection
-from datetime import datetime
+from models.reloj import DerivaReloj
+from models.sincronizacion import EjecucionSincronizacion
+from zkteco_async import ZKTecoAsyncConnection
+from zkteco_pool import pool_conexiones
+from zkteco_planificador import planificador_sincronizacion
+from zkteco_salud import monitor_salud
+from config import settings
+from datetime import datetime, timedelta
 from typing import Optional
+import asyncio
 import logging
 
 logger = logging.getLogger(__name__)
@@ -30,20 +37,13 @@ class SincronizacionService:
             }
         
         try:
-            zk = ZKTecoConnection(
-                ip_address=dispositivo.ip_address,
-                port=dispositivo.puerto,
-                timeout=dispositivo.timeout,
-                password=dispositivo.password
-            )
-            
-            if not zk.conectar():
-                return {
-                    "success": False,
-                    "message": "No se pudo conectar al dispositivo"
-                }
-            
-            try:
+            with pool_conexiones.sesion(dispositivo) as zk:
+                if zk is None:
+                    return {
+                        "success": False,
+                        "message": pool_conexiones.motivo_sin_conexion(dispositivo.id)
+                    }
+                
                 # Obtener hora actual del dispositivo
                 hora_anterior = zk.obtener_hora_dispositivo()
                 
@@ -67,9 +67,6 @@ class SincronizacionService:
                         "success": False,
                         "message": "Error al establecer la hora del dispositivo"
                     }
-            
-            finally:
-                zk.desconectar()
         
         except Exception as e:
             logger.error(f"Error al sincronizar hora: {str(e)}")
@@ -78,15 +75,118 @@ class SincronizacionService:
                 "message": f"Error: {str(e)}"
             }
     
+    @staticmethod
+    def sincronizar_hora_flota(db: Session, umbral: Optional[float] = None, corregir: bool = True) -> dict:
+        """
+        Mide la deriva del reloj de todos los dispositivos activos en paralelo y
+        corrige solo los que superan el umbral.
+        
+        La medición compensa la latencia de red (varias lecturas de hora con su
+        RTT) y la corrección envía la hora de modo que llegue al inicio de un
+        segundo. Cada medición queda en el historial (tabla deriva_reloj).
+        
+        Cada dispositivo se mide y corrige con el acceso reservado en el pool
+        (ninguna otra operación lo usa mientras tanto); los que tienen el
+        circuito abierto se reportan sin intentar la conexión.
+        
+        Parámetros:
+            umbral (float): Segundos de deriva tolerados (None = CLOCK_DRIFT_THRESHOLD)
+            corregir (bool): Si es False solo se mide
+        """
+        if umbral is None:
+            umbral = settings.CLOCK_DRIFT_THRESHOLD
+        
+        dispositivos = db.query(Dispositivo).filter(Dispositivo.activo == True).all()
+        parametros = [(d.id, d.nombre, d.ip_address, d.puerto, d.timeout, d.password) for d in dispositivos]
+        
+        def medir(p):
+            # El lock del pool se toma y se libera en el mismo hilo
+            with pool_conexiones.reservar(p[0]) as reservado:
+                if not reservado:
+                    return {"dispositivo_id": p[0], "nombre": p[1], "success": False, "corregido": False,
+                            "message": pool_conexiones.motivo_sin_conexion(p[0])}
+                return asyncio.run(SincronizacionService._medir_y_corregir(*p, umbral=umbral, corregir=corregir))
+        
+        async def medir_todos():
+            return await asyncio.gather(*(asyncio.to_thread(medir, p) for p in parametros))
+        
+        resultados = asyncio.run(medir_todos()) if parametros else []
+        
+        for resultado in resultados:
+            if resultado["success"]:
+                db.add(DerivaReloj(
+                    dispositivo_id=resultado["dispositivo_id"],
+                    deriva_segundos=resultado["deriva_segundos"],
+                    incertidumbre_segundos=resultado["incertidumbre_segundos"],
+                    rtt_ms=resultado["rtt_ms"],
+                    corregido=resultado["corregido"],
+                    deriva_posterior=resultado.get("deriva_posterior")
+                ))
+        db.commit()
+        
+        return {
+            "success": True,
+            "message": f"Deriva medida en {sum(r['success'] for r in resultados)} de {len(resultados)} dispositivos",
+            "umbral_segundos": umbral,
+            "corregidos": sum(1 for r in resultados if r.get("corregido")),
+            "dispositivos": resultados
+        }
+    
+    @staticmethod
+    def obtener_historial_deriva(db: Session, dispositivo_id: int, limit: int = 100) -> list:
+        """
+        Historial de mediciones de deriva de un dispositivo (más reciente primero)
+        """
+        return db.query(DerivaReloj).filter(
+            DerivaReloj.dispositivo_id == dispositivo_id
+        ).order_by(DerivaReloj.fecha.desc(), DerivaReloj.id.desc()).limit(limit).all()
+    
+    @staticmethod
+    async def _medir_y_corregir(dispositivo_id, nombre, ip, puerto, timeout, password, umbral, corregir) -> dict:
+        """
+        Mide (y si hace falta corrige) el reloj de un dispositivo
+        """
+        resultado = {"dispositivo_id": dispositivo_id, "nombre": nombre, "success": False, "corregido": False}
+        conexion = ZKTecoAsyncConnection(ip, puerto, timeout=timeout or 5, password=password or 0)
+        try:
+            if not await conexion.conectar(deshabilitar=False):
+                resultado["message"] = "No se pudo conectar al dispositivo"
+                return resultado
+            
+            medicion = await conexion.medir_deriva(settings.CLOCK_DRIFT_SAMPLES)
+            resultado.update(medicion)
+            resultado["success"] = True
+            
+            if corregir and abs(medicion["deriva_segundos"]) > umbral:
+                await conexion.establecer_hora_compensada(medicion["rtt_ms"] / 1000)
+                resultado["corregido"] = True
+                resultado["deriva_posterior"] = (await conexion.medir_deriva(1))["deriva_segundos"]
+                logger.info(f"Reloj de {nombre} corregido (deriva {medicion['deriva_segundos']}s)")
+        except Exception as e:
+            logger.error(f"Error al medir la deriva de {nombre}: {str(e)}")
+            resultado["message"] = f"Error: {str(e)}"
+        finally:
+            await conexion.desconectar()
+        return resultado
+    
     @staticmethod
     def obtener_estado_sincronizacion(db: Session) -> dict:
         """
         Obtiene el estado de sincronización de todos los dispositivos
+        
+        La disponibilidad y la latencia (p50/p95) salen del historial del monitor
+        de salud y los tiempos de bloqueo del pool: esta consulta no se conecta
+        a los dispositivos.
         """
         dispositivos = db.query(Dispositivo).filter(Dispositivo.activo == True).all()
+        automatica = planificador_sincronizacion.estado()
+        salud = monitor_salud.estado()
         
         estado = {
             "total_dispositivos": len(dispositivos),
+            "sincronizacion_automatica": settings.AUTO_SYNC_ENABLED,
+            "monitor_salud": monitor_salud.activo,
+            "dispositivos_alcanzables": sum(1 for d in dispositivos if (salud.get(d.id) or {}).get("alcanzable")),
             "dispositivos": []
         }
         
@@ -106,6 +206,92 @@ class SincronizacionService:
             else:
                 info_dispositivo["minutos_desde_sync"] = None
             
+            info_dispositivo["sincronizacion_automatica"] = automatica.get(dispositivo.id)
+            info_dispositivo["salud"] = salud.get(dispositivo.id)
+            info_dispositivo["bloqueo"] = pool_conexiones.estadisticas_bloqueo(dispositivo.id)
+            
             estado["dispositivos"].append(info_dispositivo)
         
         return estado
+    
+    @staticmethod
+    def obtener_ejecuciones(db: Session, dispositivo_id: Optional[int] = None,
+                            estado: Optional[str] = None, limit: int = 100) -> list:
+        """
+        Registro de ejecuciones de la sincronización de asistencias (más reciente primero)
+        """
+        query = db.query(EjecucionSincronizacion)
+        if dispositivo_id is not None:
+            query = query.filter(EjecucionSincronizacion.dispositivo_id == dispositivo_id)
+        if estado:
+            query = query.filter(EjecucionSincronizacion.estado == estado)
+        return query.order_by(EjecucionSincronizacion.id.desc()).limit(limit).all()
+    
+    @staticmethod
+    def resumen_ejecuciones(db: Session, dias: int = 7) -> dict:
+        """
+        Tiempos y volúmenes por dispositivo de las ejecuciones de los últimos días,
+        para dimensionar la frecuencia de sincronización y la carga de la BD
+        """
+        desde = datetime.now() - timedelta(days=dias)
+        ejecuciones = db.query(EjecucionSincronizacion).filter(
+            EjecucionSincronizacion.fecha_inicio >= desde
+        ).order_by(EjecucionSincronizacion.id).all()
+        
+        por_dispositivo = {}
+        for e in ejecuciones:
+            por_dispositivo.setdefault(e.dispositivo_id, []).append(e)
+        
+        def promedio(valores):
+            valores = [v for v in valores if v is not None]
+            return round(sum(valores) / len(valores), 3) if valores else None
+        
+        dispositivos = []
+        for dispositivo_id, lista in por_dispositivo.items():
+            completadas = [e for e in lista if e.estado == "completado"]
+            duraciones = sorted(
+                (e.fecha_fin - e.fecha_inicio).total_seconds() for e in completadas if e.fecha_fin and e.fecha_inicio
+            )
+            escritas = [e for e in completadas if e.segundos_escritura and e.registros_procesados]
+            dispositivos.append({
+                "dispositivo_id": dispositivo_id,
+                "ejecuciones": len(lista),
+                "completadas": len(completadas),
+                "fallidas": sum(1 for e in lista if e.estado in ("fallido", "interrumpido")),
+                "reanudadas": sum(1 for e in lista if e.reanuda_de),
+                "registros_insertados": sum(e.registros_insertados or 0 for e in lista),
+                "segundos_promedio": promedio(duraciones),
+                "segundos_p95": round(duraciones[int(0.95 * (len(duraciones) - 1))], 3) if duraciones else None,
+                "segundos_descarga_promedio": promedio([e.segundos_descarga for e in completadas]),
+                "segundos_escritura_promedio": promedio([e.segundos_escritura for e in completadas]),
+                "deshabilitado_ms_promedio": promedio([e.dispositivo_deshabilitado_ms for e in completadas]),
+                "registros_por_segundo": round(
+                    sum(e.registros_procesados for e in escritas) / sum(e.segundos_escritura for e in escritas), 1
+                ) if escritas else None,
+            })
+        
+        return {"desde": desde.isoformat(), "dias": dias, "dispositivos": dispositivos}
+    
+    @staticmethod
+    def marcar_ejecuciones_interrumpidas(db: Session) -> int:
+        """
+        Al iniciar: las ejecuciones que quedaron en curso se cortaron con el proceso.
+        Se marcan como interrumpidas para que la próxima sincronización retome su
+        punto de control.
+        """
+        try:
+            cantidad = db.query(EjecucionSincronizacion).filter(
+                EjecucionSincronizacion.estado == "en_curso"
+            ).update({
+                EjecucionSincronizacion.estado: "interrumpido",
+                EjecucionSincronizacion.error: "Proceso detenido durante la sincronización",
+                EjecucionSincronizacion.fecha_fin: datetime.now()
+            }, synchronize_session=False)
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            logger.error(f"No se pudieron marcar las sincronizaciones interrumpidas: {e}")
+            return 0
+        if cantidad:
+            logger.warning(f"{cantidad} sincronizaciones interrumpidas en la ejecución anterior")
+        return cantidad
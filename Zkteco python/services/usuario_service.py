@@ -3,11 +3,14 @@ Servicio de Usuarios
 Lógica de negocio para gestión de usuarios
 """
 
+from sqlalchemy import or_
 from sqlalchemy.orm import Session
 from models.usuario import Usuario
 from models.dispositivo import Dispositivo
+from models.operacion_pendiente import OperacionPendiente
 from schemas.usuario import UsuarioCreate, UsuarioUpdate
-from zkteco_connection import ZKTecoConnection
+from zkteco_pool import pool_conexiones
+from zkteco_indice_usuarios import huella_usuario
 from datetime import datetime
 from typing import List, Optional
 import logging
@@ -133,24 +136,21 @@ class UsuarioService:
         if not db_usuario:
             return False
         
-        # Eliminar del dispositivo si se solicita
+        # Eliminar del dispositivo si se solicita (si el equipo no responde, queda en cola)
         if eliminar_de_dispositivo:
+            dispositivo = db_usuario.dispositivo
             try:
-                dispositivo = db_usuario.dispositivo
-                zk = ZKTecoConnection(
-                    ip_address=dispositivo.ip_address,
-                    port=dispositivo.puerto,
-                    timeout=dispositivo.timeout,
-                    password=dispositivo.password
-                )
-                
-                if zk.conectar():
-                    try:
+                with pool_conexiones.sesion(dispositivo) as zk:
+                    if zk:
                         zk.eliminar_usuario(db_usuario.user_id)
-                    finally:
-                        zk.desconectar()
+                    else:
+                        UsuarioService._encolar_operacion(
+                            db, dispositivo.id, "eliminar", user_id=db_usuario.user_id,
+                            error=pool_conexiones.motivo_sin_conexion(dispositivo.id)
+                        )
             except Exception as e:
                 logger.error(f"Error al eliminar usuario del dispositivo: {str(e)}")
+                UsuarioService._encolar_operacion(db, dispositivo.id, "eliminar", user_id=db_usuario.user_id, error=str(e))
         
         db.delete(db_usuario)
         db.commit()
@@ -162,239 +162,329 @@ class UsuarioService:
     def sincronizar_usuario_a_dispositivo(db: Session, usuario_id: int) -> bool:
         """
         Sincroniza un usuario de la BD al dispositivo ZKTeco
+        
+        Si el dispositivo no responde (o su circuito está abierto) la escritura
+        queda en cola y se aplica cuando el equipo vuelva a estar disponible.
         """
         db_usuario = UsuarioService.obtener_usuario(db, usuario_id)
         
         if not db_usuario:
             return False
         
+        dispositivo = db_usuario.dispositivo
         try:
-            dispositivo = db_usuario.dispositivo
-            zk = ZKTecoConnection(
-                ip_address=dispositivo.ip_address,
-                port=dispositivo.puerto,
-                timeout=dispositivo.timeout,
-                password=dispositivo.password
-            )
-            
-            if not zk.conectar():
-                logger.error("No se pudo conectar al dispositivo")
-                return False
-            
-            try:
-                # LÓGICA DE ASIGNACIÓN DE UID MANUAL (Corrección solicitada)
-                # Si el usuario no tiene UID asignado (es nuevo del sistema), calculamos el siguiente
-                if not db_usuario.uid:
-                    # Buscar el UID máximo actual en la BD
-                    # Importar func aquí para evitar circular imports si fuera necesario, o usar SQL directo
-                    from sqlalchemy import func
-                    max_uid = db.query(func.max(Usuario.uid)).scalar() or 0
-                    nuevo_uid = max_uid + 1
-                    
-                    # Asignar al objeto de BD
-                    db_usuario.uid = nuevo_uid
-                    db.commit() # Guardar el UID generado
-                    logger.info(f"Asignado nuevo UID {nuevo_uid} al usuario {db_usuario.user_id}")
-
-                # Agregar o actualizar usuario en el dispositivo
-                success = zk.agregar_usuario(
-                    user_id=db_usuario.user_id,
-                    name=db_usuario.nombre,
-                    privilege=db_usuario.privilegio,
-                    password=db_usuario.password or '',
-                    group_id=db_usuario.grupo or '',
-                    user_id_num=db_usuario.uid # Usar el UID explícito
-                )
-                
-                if success:
-                    logger.info(f"Usuario {db_usuario.user_id} sincronizado al dispositivo")
+            with pool_conexiones.sesion(dispositivo) as zk:
+                if zk is None:
+                    motivo = pool_conexiones.motivo_sin_conexion(dispositivo.id)
+                    logger.error(f"{motivo}: sincronización del usuario {db_usuario.user_id} en cola")
+                    UsuarioService._encolar_operacion(
+                        db, dispositivo.id, "sincronizar", usuario_id=db_usuario.id,
+                        user_id=db_usuario.user_id, error=motivo
+                    )
+                    return False
                 
-                return success
-            
-            finally:
-                zk.desconectar()
+                return UsuarioService._escribir_en_dispositivo(db, zk, db_usuario)
         
         except Exception as e:
             logger.error(f"Error al sincronizar usuario: {str(e)}")
+            UsuarioService._encolar_operacion(
+                db, dispositivo.id, "sincronizar", usuario_id=db_usuario.id, user_id=db_usuario.user_id, error=str(e)
+            )
             return False
     
     @staticmethod
-    def sincronizar_usuarios_desde_dispositivo(db: Session, dispositivo_id: int) -> dict:
+    def _escribir_en_dispositivo(db: Session, zk, db_usuario: Usuario) -> bool:
+        """
+        Escribe un usuario de la BD en el dispositivo (sesión ya abierta)
         """
-        Sincroniza todos los usuarios desde el dispositivo ZKTeco a la BD (y viceversa)
+        # LÓGICA DE ASIGNACIÓN DE UID MANUAL (Corrección solicitada)
+        # Si el usuario no tiene UID asignado (es nuevo del sistema), calculamos el siguiente
+        if not db_usuario.uid:
+            # Buscar el UID máximo actual en la BD
+            # Importar func aquí para evitar circular imports si fuera necesario, o usar SQL directo
+            from sqlalchemy import func
+            max_uid = db.query(func.max(Usuario.uid)).scalar() or 0
+            nuevo_uid = max_uid + 1
+            
+            # Asignar al objeto de BD
+            db_usuario.uid = nuevo_uid
+            db.commit() # Guardar el UID generado
+            logger.info(f"Asignado nuevo UID {nuevo_uid} al usuario {db_usuario.user_id}")
+
+        # Agregar o actualizar usuario en el dispositivo
+        success = zk.agregar_usuario(
+            user_id=db_usuario.user_id,
+            name=db_usuario.nombre,
+            privilege=db_usuario.privilegio,
+            password=db_usuario.password or '',
+            group_id=db_usuario.grupo or '',
+            user_id_num=db_usuario.uid # Usar el UID explícito
+        )
         
-        NUEVA LÓGICA (STRICT MAPPING):
-        - Fuente de verdad: Dispositivo (ID Numérico -> UID, Nombre -> Nombre)
-        - Matching: EXCLUSIVAMENTE por UID (campo uid en BD).
-        - user_id (DNI): SE IGNORA. Si se crea usuario nuevo, user_id=None.
+        if success:
+            logger.info(f"Usuario {db_usuario.user_id} sincronizado al dispositivo")
+        
+        return success
+    
+    @staticmethod
+    def _encolar_operacion(db: Session, dispositivo_id: int, tipo: str, usuario_id: Optional[int] = None,
+                           user_id: Optional[str] = None, error: Optional[str] = None):
         """
-        dispositivo = db.query(Dispositivo).filter(Dispositivo.id == dispositivo_id).first()
+        Guarda una escritura pendiente; reemplaza la anterior del mismo usuario y dispositivo
+        """
+        condiciones = [OperacionPendiente.user_id == user_id] if user_id else []
+        if usuario_id is not None:
+            condiciones.append(OperacionPendiente.usuario_id == usuario_id)
+        operacion = db.query(OperacionPendiente).filter(
+            OperacionPendiente.dispositivo_id == dispositivo_id, or_(*condiciones)
+        ).first() if condiciones else None
         
-        if not dispositivo:
-            return {
-                "success": False,
-                "message": "Dispositivo no encontrado",
-                "usuarios_nuevos_descargados": 0,
-                "usuarios_actualizados_bd": 0,
-                "usuarios_subidos_dispositivo": 0,
-                "errores_subida": 0
-            }
+        if operacion is None:
+            operacion = OperacionPendiente(dispositivo_id=dispositivo_id, intentos=0)
+            db.add(operacion)
+        operacion.tipo = tipo
+        operacion.usuario_id = usuario_id
+        operacion.user_id = user_id
+        operacion.ultimo_error = (error or "")[:255] or None
+        db.commit()
+        logger.info(f"Operación '{tipo}' del usuario {user_id} en cola para el dispositivo {dispositivo_id}")
+    
+    @staticmethod
+    def obtener_operaciones_pendientes(db: Session, dispositivo_id: Optional[int] = None) -> List[OperacionPendiente]:
+        """
+        Lista las escrituras de usuarios en cola
+        """
+        query = db.query(OperacionPendiente)
+        if dispositivo_id is not None:
+            query = query.filter(OperacionPendiente.dispositivo_id == dispositivo_id)
+        return query.order_by(OperacionPendiente.id).all()
+    
+    @staticmethod
+    def procesar_operaciones_pendientes(db: Session, dispositivos: Optional[List[int]] = None) -> dict:
+        """
+        Aplica las escrituras en cola de los dispositivos disponibles (una sesión por dispositivo)
         
-        try:
-            zk = ZKTecoConnection(
-                ip_address=dispositivo.ip_address,
-                port=dispositivo.puerto,
-                timeout=dispositivo.timeout,
-                password=dispositivo.password
-            )
-            
-            if not zk.conectar():
-                return {
-                    "success": False,
-                    "message": "No se pudo conectar al dispositivo",
-                    "usuarios_nuevos_descargados": 0,
-                    "usuarios_actualizados_bd": 0,
-                    "usuarios_subidos_dispositivo": 0,
-                    "errores_subida": 0
-                }
+        Parámetros:
+            dispositivos (list): IDs de dispositivo a procesar (None = todos los que tengan cola)
+        """
+        query = db.query(OperacionPendiente)
+        if dispositivos is not None:
+            query = query.filter(OperacionPendiente.dispositivo_id.in_(dispositivos))
+        por_dispositivo = {}
+        for operacion in query.order_by(OperacionPendiente.id).all():
+            por_dispositivo.setdefault(operacion.dispositivo_id, []).append(operacion)
+        
+        aplicadas = 0
+        fallidas = 0
+        omitidos = []
+        
+        for dispositivo_id, operaciones in por_dispositivo.items():
+            dispositivo = db.query(Dispositivo).filter(Dispositivo.id == dispositivo_id).first()
+            if dispositivo is None:
+                continue
+            if not pool_conexiones.disponible(dispositivo_id):
+                omitidos.append(dispositivo_id)
+                continue
             
             try:
-                usuarios_zk = zk.obtener_usuarios()
-                usuarios_nuevos = 0
-                usuarios_actualizados = 0
-                
-                # Mapa actual de usuarios en dispositivo: UID -> Objeto ZK
-                mp_usuarios_zk = {}
-                
+                with pool_conexiones.sesion(dispositivo) as zk:
+                    if zk is None:
+                        motivo = pool_conexiones.motivo_sin_conexion(dispositivo_id)
+                        for operacion in operaciones:
+                            operacion.intentos += 1
+                            operacion.ultimo_error = motivo
+                        fallidas += len(operaciones)
+                        omitidos.append(dispositivo_id)
+                        continue
+                    
+                    for operacion in operaciones:
+                        if operacion.tipo == "eliminar":
+                            # False también si el usuario ya no está en el equipo
+                            zk.eliminar_usuario(operacion.user_id)
+                            exito = True
+                        else:
+                            db_usuario = UsuarioService.obtener_usuario(db, operacion.usuario_id)
+                            # Usuario borrado o movido a otro dispositivo: nada que escribir
+                            exito = (
+                                db_usuario is None or db_usuario.dispositivo_id != dispositivo_id
+                                or UsuarioService._escribir_en_dispositivo(db, zk, db_usuario)
+                            )
+                        
+                        if exito:
+                            db.delete(operacion)
+                            aplicadas += 1
+                        else:
+                            operacion.intentos += 1
+                            operacion.ultimo_error = "El dispositivo rechazó la escritura"
+                            fallidas += 1
+            except Exception as e:
+                logger.error(f"Error al procesar la cola del dispositivo {dispositivo_id}: {str(e)}")
+            db.commit()
+        
+        return {
+            "success": True,
+            "operaciones_aplicadas": aplicadas,
+            "operaciones_fallidas": fallidas,
+            "dispositivos_no_disponibles": omitidos,
+            "operaciones_pendientes": db.query(OperacionPendiente).count(),
+        }
+    
+    @staticmethod
+    def sincronizar_usuarios_desde_dispositivo(db: Session, dispositivo_id: int) -> dict:
+        """
+        Reconcilia los usuarios del dispositivo ZKTeco con la BD (en ambos sentidos)
+
+        - Una sola lectura del dispositivo y una sola consulta a la BD
+        - Emparejamiento por clave: user_id numérico del dispositivo = uid de la BD
+          (si no hay uid igual, se empareja por user_id)
+        - Contenido (nombre, privilegio, password, grupo): manda el dispositivo;
+          solo se actualizan los usuarios cuya huella de contenido difiere
+        - Los usuarios de la BD de este dispositivo que faltan en el equipo se
+          suben en un único lote
+        - Un dispositivo sin cambios no genera escrituras en ninguno de los lados
+        """
+        resultado = {
+            "success": False,
+            "message": "",
+            "usuarios_nuevos_descargados": 0,
+            "usuarios_actualizados_bd": 0,
+            "usuarios_sin_cambios": 0,
+            "usuarios_omitidos": 0,
+            "usuarios_subidos_dispositivo": 0,
+            "errores_subida": 0,
+            "lecturas_dispositivo": 0,
+            "cambios": {"descargados": [], "actualizados": [], "subidos": [], "omitidos": []},
+        }
+
+        dispositivo = db.query(Dispositivo).filter(Dispositivo.id == dispositivo_id).first()
+        if not dispositivo:
+            resultado["message"] = "Dispositivo no encontrado"
+            return resultado
+
+        try:
+            with pool_conexiones.sesion(dispositivo) as zk:
+                if zk is None:
+                    resultado["message"] = pool_conexiones.motivo_sin_conexion(dispositivo.id)
+                    return resultado
+
                 # ---------------------------------------------------------
-                # 1. Descarga (Dispositivo -> BD)
+                # 1. Cargar ambos lados
                 # ---------------------------------------------------------
+                usuarios_zk = zk.obtener_usuarios()
+                resultado["lecturas_dispositivo"] = 1
+
+                # Clave: user_id numérico del dispositivo (= uid de la BD)
+                zk_por_clave = {}
+                slots_ocupados = set()
                 for usuario_zk in usuarios_zk:
+                    slots_ocupados.add(usuario_zk.uid)
                     try:
-                        # IMPLEMENTACION SOLICITADA POR USUARIO:
-                        # uid (Sistema) = user_id (Biométrico) [Convertido a entero]
-                        # user_id (Sistema) = NO SE TOCA / NO RELACIONADO AL BIOMETRICO
-                        
-                        try:
-                            # Convertimos el user_id del biométrico (ej. "42326694") a entero para el UID
-                            final_uid = int(usuario_zk.user_id)
-                        except ValueError:
-                            # Si el user_id del biométrico no es numérico, no podemos usarlo como UID
-                            logger.warning(f"Usuario {usuario_zk.name} con ID biometrico '{usuario_zk.user_id}' no es numérico. No se puede mapear a UID sistema.")
-                            continue 
+                        clave = int(usuario_zk.user_id)
+                    except (TypeError, ValueError):
+                        logger.warning(f"Usuario {usuario_zk.name} con ID biometrico '{usuario_zk.user_id}' no es numérico. No se puede mapear a UID sistema.")
+                        resultado["cambios"]["omitidos"].append(usuario_zk.user_id)
+                        continue
+                    zk_por_clave.setdefault(clave, usuario_zk)
 
-                        zk_user_id_str = usuario_zk.user_id # El DNI real
-                        
-                        # Buscar en BD usando este UID (que ahora es el DNI numérico)
-                        db_usuario = db.query(Usuario).filter(
-                            Usuario.uid == final_uid
-                        ).first()
-                        
-                        # Fallback: Si no existe por UID, buscar por user_id (DNI) por si acaso ya existía
-                        if not db_usuario:
-                            db_usuario = db.query(Usuario).filter(
-                                Usuario.user_id == zk_user_id_str
-                            ).first()
-                            if db_usuario:
-                                logger.info(f"Usuario encontrado por user_id '{zk_user_id_str}'. Se actualizará su UID a coincidir con el DNI: {final_uid}.")
-                        
-                        # Preparar datos base (Datos que SIEMPRE se sincronizan desde el dispositivo)
-                        datos_usuario = {
-                            "nombre": usuario_zk.name,
-                            "privilegio": usuario_zk.privilege,
-                            "password": usuario_zk.password,
-                            "grupo": usuario_zk.group_id,
-                            "dispositivo_id": dispositivo_id,
-                        }
+                claves = list(zk_por_clave)
+                user_ids = [u.user_id for u in zk_por_clave.values()]
+                condiciones = [Usuario.dispositivo_id == dispositivo_id]
+                if claves:
+                    condiciones += [Usuario.uid.in_(claves), Usuario.user_id.in_(user_ids)]
+                usuarios_bd = db.query(Usuario).filter(or_(*condiciones)).all()
 
-                        if db_usuario:
-                            # Actualizar
-                            # 1. EXCLUIMOS 'user_id' (DNI) para no perder el dato del sistema
-                            # 2. EXCLUIMOS 'uid' si ya existe, para no perder el índice original
-                            
-                            # Solo si el usuario en BD no tiene UID (caso raro), le asignamos el nuevo
-                            if not db_usuario.uid:
-                                datos_usuario["uid"] = final_uid
-                            
-                            for key, value in datos_usuario.items():
-                                setattr(db_usuario, key, value)
-                            
-                            usuarios_actualizados += 1
-                        else:
-                            # Crear Nuevo
-                            # Solo al crear asignamos user_id y uid iniciales
-                            datos_creacion = datos_usuario.copy()
-                            datos_creacion["user_id"] = zk_user_id_str
-                            datos_creacion["uid"] = final_uid
-                            
-                            nuevo_usuario = Usuario(**datos_creacion)
-                            db.add(nuevo_usuario)
-                            usuarios_nuevos += 1
-                            
-                    except Exception as inner_e:
-                        logger.error(f"Error procesando usuario {usuario_zk.uid}: {inner_e}")
+                bd_por_uid = {u.uid: u for u in usuarios_bd if u.uid is not None}
+                bd_por_user_id = {u.user_id: u for u in usuarios_bd if u.user_id}
+
+                # ---------------------------------------------------------
+                # 2. Diff por clave (Dispositivo -> BD)
+                # ---------------------------------------------------------
+                inserciones = []
+                actualizaciones = []
+                emparejados = set()
+                ahora = datetime.now()
+
+                for clave, usuario_zk in zk_por_clave.items():
+                    db_usuario = bd_por_uid.get(clave) or bd_por_user_id.get(usuario_zk.user_id)
+                    datos_usuario = {
+                        "nombre": usuario_zk.name,
+                        "privilegio": usuario_zk.privilege,
+                        "password": usuario_zk.password,
+                        "grupo": usuario_zk.group_id,
+                        "dispositivo_id": dispositivo_id,
+                    }
+
+                    if db_usuario is None:
+                        inserciones.append({**datos_usuario, "user_id": usuario_zk.user_id, "uid": clave})
+                        resultado["cambios"]["descargados"].append(usuario_zk.user_id)
                         continue
-                
-                db.commit()
-                
+
+                    emparejados.add(db_usuario.id)
+                    huella_zk = huella_usuario(usuario_zk.name, usuario_zk.privilege, usuario_zk.password, usuario_zk.group_id)
+                    huella_bd = huella_usuario(db_usuario.nombre, db_usuario.privilegio, db_usuario.password, db_usuario.grupo)
+                    if huella_zk == huella_bd and db_usuario.dispositivo_id == dispositivo_id and db_usuario.uid is not None:
+                        resultado["usuarios_sin_cambios"] += 1
+                        continue
+
+                    # Se conservan user_id (DNI) y uid existentes del sistema
+                    cambio = {**datos_usuario, "id": db_usuario.id, "fecha_actualizacion": ahora}
+                    if db_usuario.uid is None:
+                        cambio["uid"] = clave
+                    actualizaciones.append(cambio)
+                    resultado["cambios"]["actualizados"].append(db_usuario.user_id)
+
+                if inserciones:
+                    db.bulk_insert_mappings(Usuario, inserciones)
+                if actualizaciones:
+                    db.bulk_update_mappings(Usuario, actualizaciones)
+                if inserciones or actualizaciones:
+                    db.commit()
+
+                resultado["usuarios_nuevos_descargados"] = len(inserciones)
+                resultado["usuarios_actualizados_bd"] = len(actualizaciones)
+                resultado["usuarios_omitidos"] = len(resultado["cambios"]["omitidos"])
+
                 # ---------------------------------------------------------
-                # 2. Subida / Sincronización Inversa (BD -> Dispositivo)
+                # 3. Subida (BD -> Dispositivo) de los que faltan en el equipo
                 # ---------------------------------------------------------
-                
-                # Obtener todos los usuarios de la BD que tienen UID asignado
-                # (Los que no tienen UID no se pueden subir fiablemnete sin riesgo de colisión, 
-                #  o necesitarían asignación de UID previo)
-                usuarios_bd = db.query(Usuario).filter(
-                    Usuario.dispositivo_id == dispositivo_id,
-                    Usuario.uid != None
-                ).all()
-                
-                usuarios_subidos = 0
-                errores_subida = 0
-                
-                for usuario_bd in usuarios_bd:
-                    # Verificar si este UID ya existe en los datos que bajamos del ZK
-                    if usuario_bd.uid not in mp_usuarios_zk:
-                        try:
-                            # Subir usuario al dispositivo
-                            logger.info(f"Subiendo usuario faltante al dispositivo: {usuario_bd.nombre} (UID: {usuario_bd.uid})")
-                            
-                            if zk.agregar_usuario(
-                                user_id=str(usuario_bd.uid), # ID en String
-                                name=usuario_bd.nombre,
-                                privilege=usuario_bd.privilegio,
-                                password=usuario_bd.password or '',
-                                group_id=usuario_bd.grupo or '',
-                                user_id_num=usuario_bd.uid # ID Numérico
-                            ):
-                                usuarios_subidos += 1
-                            else:
-                                errores_subida += 1
-                                logger.error(f"Fallo al subir usuario UID {usuario_bd.uid}")
-                        except Exception as e:
-                            errores_subida += 1
-                            logger.error(f"Excepción al subir usuario UID {usuario_bd.uid}: {str(e)}")
+                pendientes = [
+                    u for u in usuarios_bd
+                    if u.dispositivo_id == dispositivo_id and u.uid is not None
+                    and u.id not in emparejados and u.uid not in zk_por_clave
+                ]
+
+                lote = []
+                siguiente_slot = 1
+                for usuario_bd in pendientes:
+                    # El UID interno del equipo es de 16 bits: se reutiliza el uid de la BD si cabe y está libre
+                    slot = usuario_bd.uid
+                    if not 0 < slot <= 0xFFFF or slot in slots_ocupados:
+                        while siguiente_slot in slots_ocupados:
+                            siguiente_slot += 1
+                        slot = siguiente_slot
+                    slots_ocupados.add(slot)
+                    lote.append((
+                        slot, usuario_bd.nombre, usuario_bd.privilegio or 0, usuario_bd.password or '',
+                        usuario_bd.grupo or '', str(usuario_bd.uid)
+                    ))
+
+                if lote:
+                    logger.info(f"Subiendo {len(lote)} usuarios faltantes al dispositivo {dispositivo.nombre}")
+                    escritos = zk.agregar_usuarios_lote(lote)
+                    resultado["usuarios_subidos_dispositivo"] = escritos
+                    resultado["errores_subida"] = len(lote) - escritos
+                    resultado["cambios"]["subidos"] = [usuario[5] for usuario in lote]
+
+                resultado["success"] = True
+                resultado["message"] = (
+                    f"Reconciliación exitosa: {len(inserciones)} nuevos, {len(actualizaciones)} actualizados, "
+                    f"{resultado['usuarios_sin_cambios']} sin cambios, {resultado['usuarios_subidos_dispositivo']} subidos"
+                )
+                return resultado
 
-                return {
-                    "success": True,
-                    "message": f"Sincronización bidireccional (Modo estricto UID) exitosa",
-                    "usuarios_nuevos_descargados": usuarios_nuevos,
-                    "usuarios_actualizados_bd": usuarios_actualizados,
-                    "usuarios_subidos_dispositivo": usuarios_subidos,
-                    "errores_subida": errores_subida
-                }
-            
-            finally:
-                zk.desconectar()
-        
         except Exception as e:
-            db.rollback() 
+            db.rollback()
             logger.error(f"Error al sincronizar usuarios: {str(e)}")
-            return {
-                "success": False,
-                "message": f"Error: {str(e)}",
-                "usuarios_nuevos_descargados": 0,
-                "usuarios_actualizados_bd": 0,
-                "usuarios_subidos_dispositivo": 0,
-                "errores_subida": 0
-            }
+            resultado["success"] = False
+            resultado["message"] = f"Error: {str(e)}"
+            return resultado
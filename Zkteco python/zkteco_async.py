@@ -0,0 +1,703 @@
+"""
+Cliente Asíncrono para Dispositivos ZKTeco
+Implementación del protocolo TCP sobre asyncio (sin pyzk)
+
+Ofrece los mismos métodos que ZKTecoConnection, pero como corrutinas, de modo
+que un solo event loop puede atender cientos de dispositivos a la vez sin un
+hilo por dispositivo. Los registros devueltos son los mismos objetos
+Attendance y User de pyzk, por lo que el código de los servicios no cambia.
+
+Uso:
+    >>> async with ZKTecoAsyncConnection('192.168.1.201') as zk:
+    >>>     asistencias = await zk.obtener_asistencias()
+
+    >>> # Varios dispositivos en paralelo
+    >>> async def conteos(ip):
+    >>>     async with ZKTecoAsyncConnection(ip, deshabilitar=False) as zk:
+    >>>         return await zk.obtener_conteos()
+    >>> resultados = await asyncio.gather(*(conteos(ip) for ip in ips))
+"""
+
+import asyncio
+import struct
+import time
+import logging
+from datetime import datetime
+
+from zk.attendance import Attendance
+from zk.user import User
+
+import zkteco_tcp_protocol as protocolo
+from zkteco_tcp_protocol import ZKPacket, DecodificadorAsistencias
+
+logger = logging.getLogger(__name__)
+
+
+class ZKErrorRespuesta(Exception):
+    """El dispositivo respondió con un código inesperado"""
+
+
+class ZKTecoAsyncConnection:
+    """
+    Conexión asíncrona con un dispositivo ZKTeco por TCP
+    """
+
+    def __init__(self, ip_address, port=4370, timeout=5, password=0, deshabilitar=True, encoding='UTF-8'):
+        """
+        Parámetros:
+            ip_address (str): Dirección IP del dispositivo en la red LAN
+            port (int): Puerto TCP del dispositivo (por defecto 4370)
+            timeout (int): Segundos de espera por cada respuesta
+            password (int): Contraseña de comunicación (0 = sin contraseña)
+            deshabilitar (bool): Deshabilitar el dispositivo al usar 'async with'
+            encoding (str): Codificación de nombres y contraseñas
+        """
+        self.ip_address = ip_address
+        self.port = port
+        self.timeout = timeout
+        self.password = password
+        self.encoding = encoding
+        self._deshabilitar = deshabilitar
+
+        self._reader = None
+        self._writer = None
+        self._lock = asyncio.Lock()  # Un comando a la vez por conexión
+        self._session_id = 0
+        self._reply_id = protocolo.USHRT_MAX - 1
+
+        # Tamaño de registro de usuario (28 o 72); se detecta al leer usuarios
+        self.user_packet_size = 72
+        self._siguiente_uid = None
+
+    @property
+    def conectado(self):
+        return self._writer is not None
+
+    async def __aenter__(self):
+        if not await self.conectar(self._deshabilitar):
+            raise ConnectionError(f"No se pudo conectar a {self.ip_address}:{self.port}")
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.desconectar()
+
+    # ---------------------------------------------------------
+    # CONEXIÓN
+    # ---------------------------------------------------------
+
+    async def conectar(self, deshabilitar=True):
+        """
+        Abre la conexión TCP, realiza el handshake (y la autenticación si el
+        dispositivo la pide) y opcionalmente deshabilita el dispositivo.
+
+        Retorna:
+            bool: True si la conexión fue exitosa, False en caso contrario
+        """
+        try:
+            await self._handshake()
+
+            if deshabilitar:
+                await self.deshabilitar_dispositivo()
+
+            logger.debug(f"Conectado a {self.ip_address}:{self.port} (sesión {self._session_id})")
+            return True
+
+        except Exception as e:
+            logger.error(f"No se pudo conectar a {self.ip_address}:{self.port}: {e}")
+            await self._cerrar_socket()
+            return False
+
+    async def sondear(self):
+        """
+        Handshake mínimo (CMD_CONNECT y CMD_EXIT) para medir disponibilidad y latencia.
+
+        A diferencia de conectar(), propaga las excepciones para que el llamador
+        pueda clasificar el error. La conexión queda cerrada al terminar.
+
+        Retorna:
+            float: Segundos hasta completar el handshake (incluye la conexión TCP)
+        """
+        inicio = time.perf_counter()
+        try:
+            await self._handshake()
+            rtt = time.perf_counter() - inicio
+            await self._enviar(protocolo.CMD_EXIT)
+            return rtt
+        finally:
+            await self._cerrar_socket()
+
+    async def desconectar(self):
+        """
+        Habilita el dispositivo y cierra la sesión de forma segura
+        """
+        if not self.conectado:
+            return
+        try:
+            await self._enviar(protocolo.CMD_ENABLE_DEVICE)
+            await self._enviar(protocolo.CMD_EXIT)
+        except Exception as e:
+            logger.warning(f"Error al desconectar de {self.ip_address}: {e}")
+        finally:
+            await self._cerrar_socket()
+
+    async def deshabilitar_dispositivo(self):
+        """
+        Deshabilita el dispositivo. Propaga las excepciones (como ZKTecoConnection).
+        """
+        await self._comando(protocolo.CMD_DISABLE_DEVICE)
+
+    async def habilitar_dispositivo(self):
+        """
+        Habilita el dispositivo. Propaga las excepciones.
+        """
+        await self._comando(protocolo.CMD_ENABLE_DEVICE)
+
+    async def verificar_conexion(self):
+        """
+        Sondea la sesión con CMD_GET_TIME. Retorna True si el dispositivo respondió.
+        """
+        if not self.conectado:
+            return False
+        try:
+            await self._comando(protocolo.CMD_GET_TIME)
+            return True
+        except Exception:
+            return False
+
+    async def test_conexion(self):
+        """
+        Conecta, lee la información básica y desconecta.
+
+        Retorna:
+            bool: True si el dispositivo respondió correctamente
+        """
+        if not await self.conectar(deshabilitar=False):
+            return False
+        try:
+            return bool(await self.obtener_numero_serie())
+        finally:
+            await self.desconectar()
+
+    # ---------------------------------------------------------
+    # ASISTENCIAS
+    # ---------------------------------------------------------
+
+    async def obtener_asistencias(self):
+        """
+        Obtiene todos los registros de asistencia almacenados en el dispositivo.
+
+        Retorna:
+            list: Lista de objetos Attendance, o lista vacía si hay error
+        """
+        if not self.conectado:
+            logger.error("No hay conexión activa. Llame a conectar() primero.")
+            return []
+
+        try:
+            conteos = await self._leer_conteos()
+            if not conteos['registros']:
+                return []
+
+            datos = await self._leer_con_buffer(protocolo.CMD_ATTLOG_RRQ)
+            if len(datos) < 4:
+                return []
+
+            total = struct.unpack('<I', datos[:4])[0]
+            tam_registro = total // conteos['registros']
+            registros = protocolo.unpack_attendance(datos[4:4 + total], tam_registro)
+
+            # Los formatos de 8 y 16 bytes traen solo uno de los identificadores
+            usuarios = {}
+            if tam_registro in (8, 16):
+                usuarios = await self.obtener_usuarios()
+
+            por_uid = {u.uid: u.user_id for u in usuarios} if tam_registro == 8 else {}
+            por_user_id = {u.user_id: u.uid for u in usuarios} if tam_registro == 16 else {}
+
+            asistencias = []
+            for uid, user_id, timestamp, status, punch in registros:
+                if uid is None:
+                    uid = por_user_id.get(user_id, user_id)
+                if user_id is None:
+                    user_id = por_uid.get(uid, str(uid))
+                asistencias.append(Attendance(user_id, timestamp, status, punch, uid))
+
+            logger.info(f"{self.ip_address}: {len(asistencias)} registros de asistencia")
+            return asistencias
+
+        except Exception as e:
+            logger.error(f"Error al obtener asistencias de {self.ip_address}: {e}")
+            return []
+
+    async def iterar_asistencias(self, decodificador=None, **filtros):
+        """
+        Recorre la memoria de marcaciones bloque a bloque, sin descargarla entera.
+
+        Cada bloque recibido se decodifica al instante y solo se conserva el
+        resto de un registro partido, así que la memoria usada no depende de la
+        cantidad de registros. Produce tuplas (uid, epoch, estado, punch).
+
+        Parámetros:
+            decodificador (DecodificadorAsistencias): Opcional, para consultar
+                total, maximo_epoch e invalidos al terminar
+            **filtros: indice_desde, marca_epoch, epoch_min y epoch_max
+
+        Lanza:
+            Exception: Si no hay conexión o el dispositivo no responde
+
+        Ejemplo:
+            >>> decodificador = DecodificadorAsistencias(None, marca_epoch=ultimo)
+            >>> async for uid, epoch, estado, punch in zk.iterar_asistencias(decodificador):
+            >>>     ...
+        """
+        if decodificador is None:
+            decodificador = DecodificadorAsistencias(None, **filtros)
+
+        conteos = await self._leer_conteos()
+        decodificador.registros = conteos['registros']
+        if not conteos['registros']:
+            return
+
+        datos, total = await self._preparar_buffer(protocolo.CMD_ATTLOG_RRQ)
+        if (total - 4) // conteos['registros'] == 8 and not decodificador.mapa_uid:
+            # Los registros de 8 bytes solo traen el uid interno: leer antes los usuarios
+            if datos is None:
+                await self._comando(protocolo.CMD_FREE_DATA)
+            decodificador.mapa_uid = {u.uid: u.user_id for u in await self.obtener_usuarios()}
+            datos, total = await self._preparar_buffer(protocolo.CMD_ATTLOG_RRQ)
+
+        if datos is not None:
+            for registro in decodificador.alimentar(datos):
+                yield registro
+            return
+
+        async for bloque in self._bloques_buffer(total):
+            for registro in decodificador.alimentar(bloque):
+                yield registro
+
+    async def limpiar_asistencias(self):
+        """
+        Elimina TODOS los registros de asistencia del dispositivo.
+
+        Retorna:
+            bool: True si se limpiaron exitosamente, False en caso contrario
+        """
+        try:
+            await self._comando(protocolo.CMD_CLEAR_ATTLOG)
+            return True
+        except Exception as e:
+            logger.error(f"Error al limpiar asistencias de {self.ip_address}: {e}")
+            return False
+
+    # ---------------------------------------------------------
+    # USUARIOS
+    # ---------------------------------------------------------
+
+    async def obtener_usuarios(self):
+        """
+        Obtiene todos los usuarios registrados en el dispositivo.
+
+        Retorna:
+            list: Lista de objetos User, o lista vacía si hay error
+        """
+        if not self.conectado:
+            logger.error("No hay conexión activa. Llame a conectar() primero.")
+            return []
+
+        try:
+            conteos = await self._leer_conteos()
+            if not conteos['usuarios']:
+                self._siguiente_uid = 1
+                return []
+
+            datos = await self._leer_con_buffer(protocolo.CMD_USERTEMP_RRQ, protocolo.FCT_USER)
+            if len(datos) <= 4:
+                return []
+
+            total = struct.unpack('<I', datos[:4])[0]
+            tam = total // conteos['usuarios']
+            if tam in (28, 72):
+                self.user_packet_size = tam
+
+            usuarios = [
+                User(uid, name, privilege, password, group_id, user_id, card)
+                for uid, name, privilege, password, group_id, user_id, card
+                in protocolo.unpack_users(datos[4:4 + total], self.user_packet_size, self.encoding)
+            ]
+            self._siguiente_uid = max((u.uid for u in usuarios), default=0) + 1
+            return usuarios
+
+        except Exception as e:
+            logger.error(f"Error al obtener usuarios de {self.ip_address}: {e}")
+            return []
+
+    async def agregar_usuario(self, user_id, name, privilege=0, password='', group_id='', user_id_num=0):
+        """
+        Agrega (o sobrescribe) un usuario en el dispositivo.
+
+        Parámetros:
+            user_id (str): ID del usuario (número de empleado)
+            name (str): Nombre del usuario
+            privilege (int): Nivel de privilegio (0=usuario normal, 14=administrador)
+            password (str): Contraseña del usuario (opcional)
+            group_id (str): ID del grupo al que pertenece (opcional)
+            user_id_num (int): UID interno (0 = siguiente libre)
+
+        Retorna:
+            bool: True si se agregó exitosamente, False en caso contrario
+        """
+        try:
+            uid = user_id_num
+            if not uid:
+                if self._siguiente_uid is None:
+                    await self.obtener_usuarios()
+                uid = self._siguiente_uid or 1
+
+            await self._escribir_usuario(uid, name, privilege, password, group_id, user_id)
+            if uid == self._siguiente_uid:
+                self._siguiente_uid += 1
+            return True
+
+        except Exception as e:
+            logger.error(f"Error al agregar usuario {user_id} en {self.ip_address}: {e}")
+            return False
+
+    async def eliminar_usuario(self, user_id):
+        """
+        Elimina un usuario del dispositivo por su user_id.
+
+        Retorna:
+            bool: True si se eliminó exitosamente, False en caso contrario
+        """
+        try:
+            usuario = await self._buscar_usuario(user_id)
+            if not usuario:
+                logger.error(f"Usuario {user_id} no encontrado en {self.ip_address}")
+                return False
+
+            await self._comando(protocolo.CMD_DELETE_USER, struct.pack('<h', usuario.uid))
+            await self._comando(protocolo.CMD_REFRESHDATA)
+            return True
+
+        except Exception as e:
+            logger.error(f"Error al eliminar usuario {user_id} en {self.ip_address}: {e}")
+            return False
+
+    async def modificar_usuario(self, user_id, name=None, privilege=None, password=None):
+        """
+        Modifica la información de un usuario existente.
+
+        Retorna:
+            bool: True si se modificó exitosamente, False en caso contrario
+        """
+        try:
+            usuario = await self._buscar_usuario(user_id)
+            if not usuario:
+                logger.error(f"Usuario {user_id} no encontrado en {self.ip_address}")
+                return False
+
+            await self._escribir_usuario(
+                usuario.uid,
+                name if name is not None else usuario.name,
+                privilege if privilege is not None else usuario.privilege,
+                password if password is not None else usuario.password,
+                usuario.group_id,
+                user_id
+            )
+            return True
+
+        except Exception as e:
+            logger.error(f"Error al modificar usuario {user_id} en {self.ip_address}: {e}")
+            return False
+
+    # ---------------------------------------------------------
+    # HORA E INFORMACIÓN
+    # ---------------------------------------------------------
+
+    async def obtener_hora_dispositivo(self):
+        """
+        Retorna:
+            datetime: Hora del dispositivo, o None si hay error
+        """
+        try:
+            datos = await self._comando(protocolo.CMD_GET_TIME)
+            return protocolo.decode_time(datos[:4])
+        except Exception as e:
+            logger.error(f"Error al obtener hora de {self.ip_address}: {e}")
+            return None
+
+    async def establecer_hora_dispositivo(self, nueva_hora=None):
+        """
+        Parámetros:
+            nueva_hora (datetime): Nueva fecha/hora (None = usar hora del sistema)
+
+        Retorna:
+            bool: True si se estableció exitosamente, False en caso contrario
+        """
+        try:
+            if nueva_hora is None:
+                nueva_hora = datetime.now()
+            await self._comando(protocolo.CMD_SET_TIME, protocolo.encode_time(nueva_hora))
+            return True
+        except Exception as e:
+            logger.error(f"Error al establecer hora de {self.ip_address}: {e}")
+            return False
+
+    async def medir_deriva(self, muestras=3):
+        """
+        Mide el desfase del reloj del dispositivo respecto del servidor compensando la red.
+
+        El reloj del equipo tiene resolución de un segundo: cada muestra (envío t0,
+        respuesta t1, hora leída h) acota el desfase a [h - t1, h + 1 - t0]. Se
+        intersectan los intervalos de todas las muestras y se toma el punto medio.
+
+        Parámetros:
+            muestras (int): Lecturas de hora a realizar
+
+        Retorna:
+            dict: deriva_segundos (positivo = adelantado), incertidumbre_segundos y rtt_ms (mínimo)
+        """
+        inferior, superior, rtt_minimo = float('-inf'), float('inf'), None
+        for _ in range(max(1, muestras)):
+            t0 = time.time()
+            datos = await self._comando(protocolo.CMD_GET_TIME)
+            t1 = time.time()
+            # La hora del equipo es hora local naive: timestamp() la lleva a la escala de time.time()
+            hora = protocolo.decode_time(datos[:4]).timestamp()
+            inferior = max(inferior, hora - t1)
+            superior = min(superior, hora + 1 - t0)
+            rtt_minimo = t1 - t0 if rtt_minimo is None else min(rtt_minimo, t1 - t0)
+
+        if inferior > superior:
+            # Intervalos incompatibles (el reloj saltó entre muestras): cota de la última muestra
+            inferior, superior = hora - t1, hora + 1 - t0
+        return {
+            'deriva_segundos': round((inferior + superior) / 2, 3),
+            'incertidumbre_segundos': round((superior - inferior) / 2, 3),
+            'rtt_ms': round(rtt_minimo * 1000, 2),
+        }
+
+    async def establecer_hora_compensada(self, rtt_segundos=0.0):
+        """
+        Pone el reloj del dispositivo en la hora del servidor compensando la latencia.
+
+        Espera hasta que, sumado el retardo de ida (RTT/2), el comando llegue justo
+        al inicio de un segundo, y envía ese segundo.
+
+        Retorna:
+            datetime: Hora enviada al dispositivo
+        """
+        ida = max(0.0, rtt_segundos / 2)
+        llegada = time.time() + ida
+        segundo = int(llegada) + 1
+        await asyncio.sleep(segundo - llegada)
+        nueva_hora = datetime.fromtimestamp(segundo)
+        await self._comando(protocolo.CMD_SET_TIME, protocolo.encode_time(nueva_hora))
+        return nueva_hora
+
+    async def obtener_informacion_dispositivo(self):
+        """
+        Retorna:
+            dict: Serial, firmware, plataforma, nombre, MAC, IP y puerto ({} si hay error)
+        """
+        try:
+            version = await self._comando(protocolo.CMD_GET_VERSION)
+            return {
+                'serial_number': await self._leer_opcion('~SerialNumber'),
+                'firmware_version': version.split(b'\x00')[0].decode(errors='ignore'),
+                'platform': await self._leer_opcion('~Platform'),
+                'device_name': await self._leer_opcion('~DeviceName'),
+                'mac_address': await self._leer_opcion('MAC'),
+                'ip_address': self.ip_address,
+                'port': self.port
+            }
+        except Exception as e:
+            logger.error(f"Error al obtener información de {self.ip_address}: {e}")
+            return {}
+
+    async def obtener_conteos(self):
+        """
+        Retorna:
+            dict: Cantidad de usuarios, registros y capacidades, o {} si hay error
+        """
+        try:
+            return await self._leer_conteos()
+        except Exception as e:
+            logger.error(f"Error al obtener contadores de {self.ip_address}: {e}")
+            return {}
+
+    async def obtener_numero_serie(self):
+        """
+        Retorna:
+            str: Número de serie, o None si hay error
+        """
+        try:
+            return await self._leer_opcion('~SerialNumber')
+        except Exception as e:
+            logger.error(f"Error al obtener número de serie de {self.ip_address}: {e}")
+            return None
+
+    # ---------------------------------------------------------
+    # LÓGICA INTERNA
+    # ---------------------------------------------------------
+
+    async def _handshake(self):
+        """
+        Abre el socket y autentica la sesión (propaga las excepciones)
+        """
+        self._reader, self._writer = await asyncio.wait_for(
+            asyncio.open_connection(self.ip_address, self.port), self.timeout
+        )
+        self._session_id = 0
+        self._reply_id = protocolo.USHRT_MAX - 1
+
+        codigo, _ = await self._enviar(protocolo.CMD_CONNECT)
+        if codigo == protocolo.CMD_ACK_UNAUTH:
+            clave = protocolo.make_commkey(self.password, self._session_id)
+            codigo, _ = await self._enviar(protocolo.CMD_AUTH, clave)
+
+        if codigo != protocolo.CMD_ACK_OK:
+            raise ZKErrorRespuesta("No autenticado" if codigo == protocolo.CMD_ACK_UNAUTH else f"Respuesta {codigo}")
+
+    async def _cerrar_socket(self):
+        if self._writer:
+            try:
+                self._writer.close()
+                await self._writer.wait_closed()
+            except Exception:
+                pass
+        self._reader = None
+        self._writer = None
+
+    async def _leer_paquete(self):
+        """
+        Lee un paquete completo (encabezado TCP + paquete) del socket
+        """
+        encabezado = await asyncio.wait_for(self._reader.readexactly(protocolo.TCP_HEADER_SIZE), self.timeout)
+        longitud = ZKPacket.parse_tcp_header(encabezado)
+        cuerpo = await asyncio.wait_for(self._reader.readexactly(longitud), self.timeout)
+        return ZKPacket.parse(cuerpo)
+
+    async def _enviar(self, comando, datos=b''):
+        """
+        Envía un comando y espera su respuesta.
+
+        Retorna:
+            tuple: (código de respuesta, datos)
+        """
+        if not self.conectado:
+            raise ConnectionError("No hay conexión activa")
+
+        async with self._lock:
+            paquete = ZKPacket(comando, datos, self._session_id, self._reply_id)
+            self._writer.write(paquete.build_tcp())
+            await self._writer.drain()
+
+            respuesta = await self._leer_paquete()
+            if comando == protocolo.CMD_CONNECT:
+                self._session_id = respuesta['session_id']
+            self._reply_id = respuesta['reply_id']
+            return respuesta['reply_code'], respuesta['data']
+
+    async def _comando(self, comando, datos=b''):
+        """
+        Envía un comando que debe responder CMD_ACK_OK/CMD_DATA y retorna los datos
+        """
+        codigo, respuesta = await self._enviar(comando, datos)
+        if codigo not in (protocolo.CMD_ACK_OK, protocolo.CMD_PREPARE_DATA, protocolo.CMD_DATA):
+            raise ZKErrorRespuesta(f"Comando {comando} rechazado (respuesta {codigo})")
+        return respuesta
+
+    async def _leer_conteos(self):
+        datos = await self._comando(protocolo.CMD_GET_FREE_SIZES)
+        if len(datos) < 80:
+            raise ZKErrorRespuesta("Respuesta de CMD_GET_FREE_SIZES incompleta")
+        campos = struct.unpack('<20i', datos[:80])
+        return {
+            'usuarios': campos[4],
+            'registros': campos[8],
+            'huellas': campos[6],
+            'capacidad_usuarios': campos[15],
+            'capacidad_registros': campos[16]
+        }
+
+    async def _leer_opcion(self, nombre):
+        datos = await self._comando(protocolo.CMD_OPTIONS_RRQ, nombre.encode() + b'\x00')
+        return datos.split(b'=', 1)[-1].split(b'\x00')[0].replace(b'=', b'').decode(errors='ignore')
+
+    async def _preparar_buffer(self, comando, fct=0, ext=0):
+        """
+        Envía CMD_PREPARE_BUFFER.
+
+        Retorna:
+            tuple: (datos, tamaño). Si los datos son pequeños vienen en la misma
+                   respuesta; si no, datos es None y hay que leerlos por bloques.
+        """
+        codigo, datos = await self._enviar(
+            protocolo.CMD_PREPARE_BUFFER, struct.pack('<bhii', 1, comando, fct, ext)
+        )
+        if codigo == protocolo.CMD_DATA:
+            return datos, len(datos)
+        if codigo != protocolo.CMD_ACK_OK:
+            raise ZKErrorRespuesta(f"Lectura con buffer no soportada (respuesta {codigo})")
+        return None, struct.unpack('<I', datos[1:5])[0]
+
+    async def _bloques_buffer(self, total):
+        """
+        Lee el buffer preparado en bloques de CMD_READ_BUFFER y lo libera al final
+        """
+        inicio = 0
+        while inicio < total:
+            tam = min(protocolo.MAX_CHUNK, total - inicio)
+            yield await self._leer_bloque(inicio, tam)
+            inicio += tam
+        await self._comando(protocolo.CMD_FREE_DATA)
+
+    async def _leer_con_buffer(self, comando, fct=0, ext=0):
+        """
+        Lectura con buffer completa (CMD_PREPARE_BUFFER + bloques de CMD_READ_BUFFER)
+        """
+        datos, total = await self._preparar_buffer(comando, fct, ext)
+        if datos is not None:
+            return datos
+        return b''.join([bloque async for bloque in self._bloques_buffer(total)])
+
+    async def _leer_bloque(self, inicio, tam):
+        async with self._lock:
+            paquete = ZKPacket(protocolo.CMD_READ_BUFFER, struct.pack('<ii', inicio, tam), self._session_id, self._reply_id)
+            self._writer.write(paquete.build_tcp())
+            await self._writer.drain()
+
+            respuesta = await self._leer_paquete()
+            self._reply_id = respuesta['reply_id']
+            if respuesta['reply_code'] == protocolo.CMD_DATA:
+                return respuesta['data']
+            if respuesta['reply_code'] != protocolo.CMD_PREPARE_DATA:
+                raise ZKErrorRespuesta(f"No se pudo leer el bloque {inicio}:{tam}")
+
+            # CMD_PREPARE_DATA: siguen paquetes CMD_DATA hasta un CMD_ACK_OK
+            partes = []
+            while True:
+                respuesta = await self._leer_paquete()
+                if respuesta['reply_code'] == protocolo.CMD_DATA:
+                    partes.append(respuesta['data'])
+                elif respuesta['reply_code'] == protocolo.CMD_ACK_OK:
+                    return b''.join(partes)
+                else:
+                    raise ZKErrorRespuesta(f"Respuesta inesperada {respuesta['reply_code']} leyendo bloque")
+
+    async def _buscar_usuario(self, user_id):
+        for usuario in await self.obtener_usuarios():
+            if usuario.user_id == str(user_id):
+                return usuario
+        return None
+
+    async def _escribir_usuario(self, uid, name, privilege, password, group_id, user_id):
+        if privilege not in (0, 14):
+            privilege = 0
+        registro = protocolo.pack_user(
+            self.user_packet_size, uid, name, int(privilege), password or '',
+            group_id or '', user_id or str(uid), 0, self.encoding
+        )
+        await self._comando(protocolo.CMD_USER_WRQ, registro)
+        await self._comando(protocolo.CMD_REFRESHDATA)
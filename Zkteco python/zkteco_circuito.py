@@ -0,0 +1,127 @@
+"""
+Circuit Breaker por Dispositivo ZKTeco
+
+Evita que un terminal apagado o fuera de la red cueste el timeout completo en cada
+operación: tras varios fallos de conexión seguidos el circuito se abre y las
+operaciones fallan al instante hasta que vence una espera (con backoff exponencial).
+Vencida la espera se permite un único intento de prueba (semiabierto): si conecta el
+circuito se cierra, si no se vuelve a abrir con una espera mayor.
+
+También estima el RTT del dispositivo (promedio y variación exponenciales, como TCP)
+para usar un timeout de conexión acorde a la red en lugar del configurado.
+
+Uso:
+    >>> circuito = Circuito(umbral_fallos=3, espera_base=30, espera_maxima=600)
+    >>> if circuito.permitir():
+    >>>     ... conectar ...
+    >>>     circuito.registrar_exito(rtt)  # o circuito.registrar_fallo()
+"""
+
+import threading
+import time
+
+CERRADO = "cerrado"
+ABIERTO = "abierto"
+SEMIABIERTO = "semiabierto"
+
+
+class Circuito:
+    """
+    Estado del circuit breaker y de la latencia de un dispositivo
+    """
+
+    def __init__(self, umbral_fallos: int = 3, espera_base: float = 30, espera_maxima: float = 600,
+                 timeout_minimo: float = 1.0):
+        """
+        Parámetros:
+            umbral_fallos (int): Fallos consecutivos que abren el circuito
+            espera_base (float): Segundos de la primera espera con el circuito abierto
+            espera_maxima (float): Espera máxima (el backoff se duplica en cada reapertura)
+            timeout_minimo (float): Piso del timeout adaptativo de conexión
+        """
+        self.umbral_fallos = umbral_fallos
+        self.espera_base = espera_base
+        self.espera_maxima = espera_maxima
+        self.timeout_minimo = timeout_minimo
+
+        self.estado = CERRADO
+        self.fallos_consecutivos = 0
+        self.aperturas = 0  # Reaperturas seguidas (para el backoff)
+        self.reintentar_en = 0.0  # time.monotonic() a partir del cual se permite la prueba
+        self.ultimo_error = None
+
+        # Estimación de RTT en segundos (RFC 6298)
+        self.rtt_promedio = None
+        self.rtt_variacion = None
+
+        self._lock = threading.Lock()
+
+    def permitir(self) -> bool:
+        """
+        Indica si se puede intentar una operación. Al vencer la espera del circuito
+        abierto deja pasar un único intento de prueba.
+        """
+        with self._lock:
+            if self.estado == CERRADO:
+                return True
+            if self.estado == ABIERTO and time.monotonic() >= self.reintentar_en:
+                self.estado = SEMIABIERTO
+                return True
+            return False
+
+    def disponible(self) -> bool:
+        """
+        Como permitir(), pero sin consumir el intento de prueba
+        """
+        with self._lock:
+            return self.estado == CERRADO or (self.estado == ABIERTO and time.monotonic() >= self.reintentar_en)
+
+    def registrar_exito(self, rtt: float = None):
+        """
+        Parámetros:
+            rtt (float): Segundos de la operación observada (opcional)
+        """
+        with self._lock:
+            self.estado = CERRADO
+            self.fallos_consecutivos = 0
+            self.aperturas = 0
+            self.ultimo_error = None
+            if rtt is not None:
+                if self.rtt_promedio is None:
+                    self.rtt_promedio = rtt
+                    self.rtt_variacion = rtt / 2
+                else:
+                    self.rtt_variacion = 0.75 * self.rtt_variacion + 0.25 * abs(self.rtt_promedio - rtt)
+                    self.rtt_promedio = 0.875 * self.rtt_promedio + 0.125 * rtt
+
+    def registrar_fallo(self, error: str = None):
+        with self._lock:
+            self.fallos_consecutivos += 1
+            self.ultimo_error = error
+            if self.estado == SEMIABIERTO or self.fallos_consecutivos >= self.umbral_fallos:
+                espera = min(self.espera_base * (2 ** self.aperturas), self.espera_maxima)
+                self.aperturas += 1
+                self.estado = ABIERTO
+                self.reintentar_en = time.monotonic() + espera
+
+    def timeout_adaptativo(self, configurado: float) -> float:
+        """
+        Timeout de conexión derivado del RTT observado (nunca mayor que el configurado)
+        """
+        if self.rtt_promedio is None:
+            return configurado
+        return min(configurado, max(self.timeout_minimo, self.rtt_promedio + 4 * self.rtt_variacion))
+
+    def segundos_para_reintento(self) -> int:
+        if self.estado != ABIERTO:
+            return 0
+        return max(0, int(self.reintentar_en - time.monotonic() + 0.999))
+
+    def resumen(self) -> dict:
+        return {
+            "circuito": self.estado,
+            "fallos_consecutivos": self.fallos_consecutivos,
+            "segundos_para_reintento": self.segundos_para_reintento(),
+            "rtt_ms": round(self.rtt_promedio * 1000, 2) if self.rtt_promedio is not None else None,
+            "ultimo_error": self.ultimo_error,
+        }
@@ -10,8 +10,17 @@ Fecha: 2025-11-26
 """
 
 from zk import ZK, const
+from contextlib import contextmanager, ExitStack
 from datetime import datetime
+import struct
 import sys
+import time
+
+from zkteco_tcp_protocol import DecodificadorAsistencias, pack_users_lote
+from zkteco_indice_usuarios import indices_usuarios, huella_usuario
+from zkteco_pyzk import (ajustar_timeout, guardar_usuarios_lote, leer_inicio_buffer,
+                         preparar_buffer, leer_bloques_buffer, iniciar_captura)
+
 
 class ZKTecoConnection:
     """
@@ -19,7 +28,7 @@ class ZKTecoConnection:
     mediante protocolo TCP sobre LAN.
     """
     
-    def __init__(self, ip_address, port=4370, timeout=5, password=0):
+    def __init__(self, ip_address, port=4370, timeout=5, password=0, ommit_ping=False, timeout_conexion=None):
         """
         Inicializa los parámetros de conexión al dispositivo ZKTeco.
         
@@ -28,6 +37,9 @@ class ZKTecoConnection:
             port (int): Puerto TCP del dispositivo (por defecto 4370)
             timeout (int): Tiempo de espera para la conexión en segundos
             password (int): Contraseña del dispositivo (por defecto 0 = sin contraseña)
+            ommit_ping (bool): Omitir el ping ICMP previo a la conexión TCP
+            timeout_conexion (float): Timeout solo para el handshake (None = timeout);
+                                      tras conectar se usa timeout para las operaciones
         
         Ejemplo:
             >>> dispositivo = ZKTecoConnection('192.168.1.201')
@@ -37,15 +49,23 @@ class ZKTecoConnection:
         self.port = port
         self.timeout = timeout
         self.password = password
+        self.timeout_conexion = timeout_conexion
         
         # Crear el objeto de conexión ZK con los parámetros especificados
         # Este objeto maneja toda la comunicación TCP con el dispositivo
         self.conn = None
-        self.zk = ZK(ip_address, port=port, timeout=timeout, password=password)
+        self._serial = None  # Número de serie leído en la sesión actual
+        
+        # Ventanas de bloqueo (dispositivo deshabilitado)
+        self.ventana_en_lecturas = False  # Deshabilitar solo durante las lecturas con buffer
+        self.al_habilitar = None  # Callback(segundos) al cerrar cada ventana de bloqueo
+        self._deshabilitado_desde = None
+        self._segundos_deshabilitado = 0.0  # Ventanas ya cerradas en esta conexión
+        self.zk = ZK(ip_address, port=port, timeout=timeout_conexion or timeout, password=password, ommit_ping=ommit_ping)
         
         print(f"[INFO] Configuración de conexión creada para {ip_address}:{port}")
     
-    def conectar(self):
+    def conectar(self, deshabilitar=True):
         """
         Establece la conexión TCP con el dispositivo ZKTeco.
         
@@ -54,6 +74,10 @@ class ZKTecoConnection:
         2. Deshabilita el dispositivo temporalmente para operaciones
         3. Retorna True si la conexión fue exitosa, False en caso contrario
         
+        Parámetros:
+            deshabilitar (bool): Deshabilitar el dispositivo tras conectar
+                                 (False = la sesión queda abierta con el dispositivo operativo)
+        
         Retorna:
             bool: True si la conexión fue exitosa, False en caso contrario
         
@@ -67,11 +91,22 @@ class ZKTecoConnection:
             # Establecer la conexión TCP con el dispositivo
             # Este método abre un socket TCP y realiza el handshake inicial
             self.conn = self.zk.connect()
+            self._serial = None
+            
+            # El timeout de conexión puede ser más corto que el de las operaciones
+            if self.timeout_conexion and self.timeout_conexion != self.timeout:
+                if not ajustar_timeout(self.zk, self.timeout):
+                    # pyzk sin verificar: nueva sesión con el timeout de las operaciones
+                    self.zk.disconnect()
+                    self.conn = ZK(self.ip_address, port=self.port, timeout=self.timeout,
+                                   password=self.password, ommit_ping=True).connect()
             
             # Deshabilitar el dispositivo temporalmente
             # Esto previene que el dispositivo procese huellas/tarjetas mientras
             # estamos realizando operaciones de lectura/escritura
-            self.conn.disable_device()
+            if deshabilitar:
+                self.conn.disable_device()
+                self._deshabilitado_desde = time.monotonic()
             
             print(f"[ÉXITO] Conectado exitosamente al dispositivo {self.ip_address}")
             return True
@@ -109,8 +144,147 @@ class ZKTecoConnection:
                 print(f"[ERROR] Error al desconectar: {str(e)}")
             finally:
                 # Asegurarse de limpiar la referencia de conexión
+                self._cerrar_ventana()
                 self.conn = None
     
+    def deshabilitar_dispositivo(self):
+        """
+        Deshabilita el dispositivo (bloquea marcaciones) sobre una sesión ya abierta.
+        
+        A diferencia de los demás métodos, NO captura las excepciones: un fallo
+        aquí indica que la sesión TCP ya no es válida y quien llama (por ejemplo
+        el pool de conexiones) debe decidir si reconecta.
+        
+        Ejemplo:
+            >>> dispositivo.conectar(deshabilitar=False)
+            >>> dispositivo.deshabilitar_dispositivo()
+        """
+        if not self.conn:
+            raise ConnectionError("No hay conexión activa")
+        self.conn.disable_device()
+        if self._deshabilitado_desde is None:
+            self._deshabilitado_desde = time.monotonic()
+    
+    def habilitar_dispositivo(self):
+        """
+        Habilita nuevamente el dispositivo sin cerrar la sesión TCP.
+        
+        Igual que deshabilitar_dispositivo(), propaga las excepciones.
+        
+        Ejemplo:
+            >>> dispositivo.habilitar_dispositivo()
+        """
+        if not self.conn:
+            raise ConnectionError("No hay conexión activa")
+        self.conn.enable_device()
+        self._cerrar_ventana()
+    
+    @property
+    def deshabilitado(self):
+        """
+        Indica si el dispositivo está deshabilitado por esta sesión
+        """
+        return self._deshabilitado_desde is not None
+    
+    def tiempo_deshabilitado(self):
+        """
+        Segundos acumulados con el dispositivo deshabilitado por esta conexión
+        (incluida la ventana en curso). La diferencia entre dos lecturas mide
+        cuánto bloqueó una operación.
+        """
+        abierta = time.monotonic() - self._deshabilitado_desde if self._deshabilitado_desde is not None else 0.0
+        return self._segundos_deshabilitado + abierta
+    
+    @contextmanager
+    def ventana_lectura(self):
+        """
+        Deshabilita el dispositivo solo durante una lectura con buffer, si la sesión
+        trabaja en modo ventana (ventana_en_lecturas) y el dispositivo está habilitado.
+        Así la lectura es consistente (no entran marcaciones a mitad de la descarga)
+        y el equipo queda bloqueado el menor tiempo posible.
+        
+        Ejemplo:
+            >>> with dispositivo.ventana_lectura():
+            >>>     datos = dispositivo.conn.get_users()
+        """
+        if not self.ventana_en_lecturas or self.deshabilitado:
+            yield
+            return
+        self.deshabilitar_dispositivo()
+        try:
+            yield
+        finally:
+            try:
+                self.habilitar_dispositivo()
+            except Exception as e:
+                print(f"[ADVERTENCIA] No se pudo habilitar el dispositivo tras la lectura: {str(e)}")
+    
+    def _cerrar_ventana(self):
+        """
+        Registra el fin de una ventana de bloqueo (dispositivo habilitado nuevamente)
+        """
+        if self._deshabilitado_desde is None:
+            return
+        segundos = time.monotonic() - self._deshabilitado_desde
+        self._deshabilitado_desde = None
+        self._segundos_deshabilitado += segundos
+        if self.al_habilitar:
+            try:
+                self.al_habilitar(segundos)
+            except Exception:
+                pass
+    
+    def verificar_conexion(self):
+        """
+        Sondea la sesión abierta con un comando liviano (CMD_GET_TIME).
+        
+        Se usa como keepalive: mantiene viva la sesión en el dispositivo y
+        detecta sockets caídos sin imprimir errores.
+        
+        Retorna:
+            bool: True si el dispositivo respondió, False en caso contrario
+        """
+        if not self.conn:
+            return False
+        try:
+            self.conn.get_time()
+            return True
+        except Exception:
+            return False
+    
+    def capturar_eventos(self, timeout=1, usuarios=None):
+        """
+        Se suscribe a los eventos de marcación en tiempo real (CMD_REG_EVENT).
+        
+        El dispositivo queda habilitado mientras dura la captura. Es un generador:
+        entrega un objeto Attendance por cada marcación y None cada vez que pasan
+        'timeout' segundos sin eventos (para poder revisar si se debe detener).
+        La captura termina al llamar a detener_captura().
+        
+        Parámetros:
+            timeout (int): Segundos de espera por evento antes de entregar None
+            usuarios (dict): user_id -> uid interno ya leído del dispositivo; evita
+                             que cada inicio de la captura lea todos los usuarios
+        
+        Ejemplo:
+            >>> for marcacion in dispositivo.capturar_eventos():
+            >>>     if marcacion:
+            >>>         print(marcacion.user_id, marcacion.timestamp)
+        """
+        if not self.conn:
+            raise ConnectionError("No hay conexión activa")
+        eventos = iniciar_captura(self.conn, timeout, usuarios) if usuarios is not None else None
+        if eventos is None:
+            eventos = self.conn.live_capture(new_timeout=timeout)
+        yield from eventos
+    
+    def detener_captura(self):
+        """
+        Finaliza la captura en tiempo real al vencer la espera en curso
+        """
+        if self.conn:
+            self.conn.end_live_capture = True
+    
     def obtener_asistencias(self):
         """
         Obtiene todos los registros de asistencia almacenados en el dispositivo.
@@ -139,7 +313,8 @@ class ZKTecoConnection:
             # Obtener todos los registros de asistencia desde el dispositivo
             # Este método envía un comando TCP al dispositivo solicitando
             # todos los registros almacenados en su memoria
-            asistencias = self.conn.get_attendance()
+            with self.ventana_lectura():
+                asistencias = self.conn.get_attendance()
             
             print(f"[ÉXITO] Se obtuvieron {len(asistencias)} registros de asistencia")
             
@@ -150,6 +325,114 @@ class ZKTecoConnection:
             print(f"[ERROR] Error al obtener asistencias: {str(e)}")
             return []
     
+    def iterar_asistencias(self, **filtros):
+        """
+        Lee la memoria de marcaciones y la decodifica de forma perezosa.
+
+        A diferencia de obtener_asistencias(), no crea un objeto Attendance por
+        registro ni junta el buffer completo en memoria: retorna un
+        DecodificadorAsistencias cuyos bloques son la lectura en curso
+        (CMD_READ_BUFFER, bloque a bloque) y que, al iterarlo, produce tuplas
+        (uid, epoch, estado, punch) aplicando los filtros en la decodificación.
+        Debe recorrerse dentro de la sesión; quien necesite la descarga después
+        de liberarla la vuelca antes (p. ej. al spool de ingesta).
+
+        Parámetros:
+            **filtros: indice_desde, marca_epoch, epoch_min y epoch_max
+                       (ver DecodificadorAsistencias)
+
+        Retorna:
+            DecodificadorAsistencias: Iterable de registros; total, maximo_epoch
+                                      e invalidos quedan disponibles al recorrerlo
+
+        Lanza:
+            Exception: Si no hay conexión o el dispositivo no responde
+
+        Ejemplo:
+            >>> registros = dispositivo.iterar_asistencias(marca_epoch=ultimo)
+            >>> for uid, epoch, estado, punch in registros:
+            >>>     print(uid, epoch)
+        """
+        if not self.conn:
+            raise ConnectionError("No hay conexión activa")
+
+        # Conteo y buffer dentro de la misma ventana: la descarga es consistente.
+        # La ventana se cierra al terminar de leer los bloques
+        ventana = ExitStack()
+        ventana.enter_context(self.ventana_lectura())
+        try:
+            self.conn.read_sizes()
+            registros = self.conn.records
+            if not registros:
+                ventana.close()
+                return DecodificadorAsistencias(0, **filtros)
+
+            preparado = preparar_buffer(self.conn, const.CMD_ATTLOG_RRQ)
+            if preparado is None:
+                # pyzk no verificado: descarga completa con la API pública
+                datos, tam = self.conn.read_with_buffer(const.CMD_ATTLOG_RRQ)
+                ventana.close()
+                mapa_uid = None
+                if tam >= 4 and struct.unpack('<I', datos[:4])[0] // registros == 8:
+                    mapa_uid = {u.uid: u.user_id for u in self.conn.get_users()}
+                return DecodificadorAsistencias(
+                    registros, mapa_uid, bloques=(memoryview(datos)[:tam],), **filtros
+                )
+
+            datos, total = preparado
+            mapa_uid = None
+            if (total - 4) // registros == 8:
+                # Los registros de 8 bytes solo traen el uid interno: leer antes los usuarios
+                if datos is None:
+                    self.conn.free_data()
+                mapa_uid = {u.uid: u.user_id for u in self.conn.get_users()}
+                datos, total = preparar_buffer(self.conn, const.CMD_ATTLOG_RRQ)
+        except BaseException:
+            ventana.close()
+            raise
+
+        return DecodificadorAsistencias(
+            registros, mapa_uid, bloques=self._bloques_asistencias(datos, total, ventana), **filtros
+        )
+
+    def _bloques_asistencias(self, datos, total, ventana):
+        """
+        Bloques del buffer de marcaciones preparado; cierra la ventana de lectura al terminar
+        """
+        with ventana:
+            if datos is not None:
+                yield datos
+                return
+            yield from leer_bloques_buffer(self.conn, total)
+
+    def obtener_primera_marcacion(self):
+        """
+        Epoch de la primera marcación almacenada, leyendo solo el inicio del buffer.
+
+        Identifica el contenido de la memoria: si se borró y volvió a llenarse
+        (aunque sea con la misma cantidad de registros) la primera marcación cambia.
+
+        Retorna:
+            int: Epoch, o None si no hay marcaciones o no se puede leer solo el inicio
+                 (versión de pyzk no verificada, conteo inconsistente)
+
+        Lanza:
+            Exception: Si no hay conexión o el dispositivo no responde
+        """
+        if not self.conn:
+            raise ConnectionError("No hay conexión activa")
+
+        self.conn.read_sizes()
+        if not self.conn.records:
+            return None
+        inicio = leer_inicio_buffer(self.conn, const.CMD_ATTLOG_RRQ, 4 + 40)
+        if inicio is None:
+            return None
+        decodificador = DecodificadorAsistencias(self.conn.records, bloques=(inicio,))
+        for _ in decodificador:
+            pass
+        return decodificador.primer_epoch
+
     def mostrar_asistencias(self, asistencias):
         """
         Muestra los registros de asistencia en formato legible.
@@ -240,10 +523,17 @@ class ZKTecoConnection:
             
             # Obtener todos los usuarios registrados en el dispositivo
             # Este método envía un comando TCP solicitando la lista de usuarios
-            usuarios = self.conn.get_users()
+            with self.ventana_lectura():
+                usuarios = self.conn.get_users()
             
             print(f"[ÉXITO] Se obtuvieron {len(usuarios)} usuarios")
             
+            # La lectura completa deja el índice de usuarios al día
+            try:
+                indices_usuarios.obtener((self.ip_address, self.port)).cargar(self._numero_serie(), usuarios)
+            except Exception as e:
+                print(f"[ADVERTENCIA] No se pudo actualizar el índice de usuarios: {str(e)}")
+            
             return usuarios
             
         except Exception as e:
@@ -287,6 +577,9 @@ class ZKTecoConnection:
         """
         Agrega un nuevo usuario al dispositivo.
         
+        Si el user_id ya existe en el dispositivo se reescribe en su mismo UID
+        interno, y si los datos no cambiaron no se envía nada.
+        
         Parámetros:
             user_id (str): ID del usuario (número de empleado)
             name (str): Nombre del usuario
@@ -308,16 +601,31 @@ class ZKTecoConnection:
         try:
             print(f"[INFO] Agregando usuario {user_id} - {name}...")
             
+            indice = self._indice_usuarios()
+            registro = indice.buscar(user_id)
+            if registro and registro[6] == huella_usuario(name, privilege, password, group_id):
+                print(f"[INFO] Usuario {user_id} ya existe sin cambios")
+                return True
+            
+            # El UID interno es de 16 bits: si el solicitado no cabe o está ocupado se usa uno libre
+            if registro:
+                uid = registro[0]
+            elif 0 < user_id_num <= 0xFFFF and indice.uid_libre(user_id_num):
+                uid = user_id_num
+            else:
+                uid = indice.siguiente_uid()
+            
             # Enviar comando TCP para crear un nuevo usuario en el dispositivo
             # El dispositivo almacenará esta información en su memoria interna
             self.conn.set_user(
-                uid=user_id_num,  # UID único (0 = auto-asignar)
+                uid=uid,  # UID interno del dispositivo
                 name=name,  # Nombre del usuario
                 privilege=privilege,  # Nivel de privilegio
                 password=password,  # Contraseña
                 group_id=group_id,  # Grupo
                 user_id=user_id  # ID de usuario
             )
+            indice.registrar(uid, name, privilege, password, group_id, user_id)
             
             print(f"[ÉXITO] Usuario {user_id} agregado exitosamente")
             return True
@@ -326,6 +634,52 @@ class ZKTecoConnection:
             print(f"[ERROR] Error al agregar usuario: {str(e)}")
             return False
     
+    def agregar_usuarios_lote(self, usuarios):
+        """
+        Escribe varios usuarios en el dispositivo con un único envío (CMD_SAVE_USERTEMPS).
+
+        Si el dispositivo rechaza el lote (o la versión de pyzk no está verificada
+        en zkteco_pyzk), se escriben uno a uno con set_user.
+
+        Parámetros:
+            usuarios (list): Tuplas (uid, nombre, privilegio, password, grupo, user_id)
+
+        Retorna:
+            int: Cantidad de usuarios escritos
+        """
+        if not self.conn:
+            print("[ERROR] No hay conexión activa. Llame a conectar() primero.")
+            return 0
+        if not usuarios:
+            return 0
+
+        tam_usuario = self.conn.user_packet_size
+        try:
+            print(f"[INFO] Escribiendo lote de {len(usuarios)} usuarios...")
+            buffer = pack_users_lote(tam_usuario, [
+                (uid, name, privilege, password or '', group_id or '', user_id, 0)
+                for uid, name, privilege, password, group_id, user_id in usuarios
+            ])
+            guardar_usuarios_lote(self.conn, buffer)
+            self.conn.refresh_data()
+            self._registrar_en_indice(usuarios)
+            print(f"[ÉXITO] Lote de {len(usuarios)} usuarios escrito")
+            return len(usuarios)
+        except Exception as e:
+            print(f"[ADVERTENCIA] Escritura por lote no disponible ({str(e)}), escribiendo uno a uno")
+
+        escritos = []
+        for usuario in usuarios:
+            uid, name, privilege, password, group_id, user_id = usuario
+            try:
+                self.conn.set_user(uid=uid, name=name, privilege=privilege, password=password or '',
+                                   group_id=group_id or '', user_id=str(user_id))
+                escritos.append(usuario)
+            except Exception as e:
+                print(f"[ERROR] Error al escribir usuario {user_id}: {str(e)}")
+        self._registrar_en_indice(escritos)
+        return len(escritos)
+
     def eliminar_usuario(self, user_id):
         """
         Elimina un usuario del dispositivo.
@@ -349,21 +703,17 @@ class ZKTecoConnection:
         try:
             print(f"[INFO] Eliminando usuario {user_id}...")
             
-            # Primero obtener el UID del usuario basado en su user_id
-            usuarios = self.conn.get_users()
-            usuario_encontrado = None
-            
-            for usuario in usuarios:
-                if usuario.user_id == user_id:
-                    usuario_encontrado = usuario
-                    break
+            # Resolver el UID interno con el índice (sin descargar la tabla de usuarios)
+            indice = self._indice_usuarios()
+            registro = indice.buscar(user_id)
             
-            if not usuario_encontrado:
+            if not registro:
                 print(f"[ERROR] Usuario {user_id} no encontrado")
                 return False
             
             # Enviar comando TCP para eliminar el usuario del dispositivo
-            self.conn.delete_user(uid=usuario_encontrado.uid)
+            self.conn.delete_user(uid=registro[0])
+            indice.quitar(user_id)
             
             print(f"[ÉXITO] Usuario {user_id} eliminado exitosamente")
             return True
@@ -395,33 +745,36 @@ class ZKTecoConnection:
         try:
             print(f"[INFO] Modificando usuario {user_id}...")
             
-            # Obtener la información actual del usuario
-            usuarios = self.conn.get_users()
-            usuario_actual = None
+            # Obtener la información actual del usuario desde el índice
+            indice = self._indice_usuarios()
+            registro = indice.buscar(user_id)
             
-            for usuario in usuarios:
-                if usuario.user_id == user_id:
-                    usuario_actual = usuario
-                    break
-            
-            if not usuario_actual:
+            if not registro:
                 print(f"[ERROR] Usuario {user_id} no encontrado")
                 return False
             
+            uid, nombre_actual, privilegio_actual, password_actual, grupo, tarjeta, huella = registro
+            
             # Usar los valores actuales si no se proporcionan nuevos
-            nuevo_nombre = name if name is not None else usuario_actual.name
-            nuevo_privilegio = privilege if privilege is not None else usuario_actual.privilege
-            nuevo_password = password if password is not None else usuario_actual.password
+            nuevo_nombre = name if name is not None else nombre_actual
+            nuevo_privilegio = privilege if privilege is not None else privilegio_actual
+            nuevo_password = password if password is not None else password_actual
+            
+            if huella_usuario(nuevo_nombre, nuevo_privilegio, nuevo_password, grupo) == huella:
+                print(f"[INFO] Usuario {user_id} sin cambios")
+                return True
             
             # Actualizar el usuario con la nueva información
             self.conn.set_user(
-                uid=usuario_actual.uid,
+                uid=uid,
                 name=nuevo_nombre,
                 privilege=nuevo_privilegio,
                 password=nuevo_password,
-                group_id=usuario_actual.group_id,
-                user_id=user_id
+                group_id=grupo,
+                user_id=user_id,
+                card=tarjeta
             )
+            indice.registrar(uid, nuevo_nombre, nuevo_privilegio, nuevo_password, grupo, user_id, tarjeta)
             
             print(f"[ÉXITO] Usuario {user_id} modificado exitosamente")
             return True
@@ -430,6 +783,38 @@ class ZKTecoConnection:
             print(f"[ERROR] Error al modificar usuario: {str(e)}")
             return False
     
+    def _numero_serie(self):
+        """
+        Número de serie del dispositivo, leído una sola vez por sesión
+        """
+        if self._serial is None:
+            self._serial = self.conn.get_serialnumber()
+        return self._serial
+    
+    def _indice_usuarios(self):
+        """
+        Índice de usuarios del dispositivo, validado contra el serial y la
+        cantidad de usuarios (CMD_GET_FREE_SIZES). Solo si no coincide se
+        vuelve a descargar la tabla de usuarios.
+        """
+        indice = indices_usuarios.obtener((self.ip_address, self.port))
+        serial = self._numero_serie()
+        self.conn.read_sizes()
+        if not indice.vigente(serial, self.conn.users):
+            print("[INFO] Índice de usuarios desactualizado, leyendo usuarios del dispositivo...")
+            indice.cargar(serial, self.conn.get_users())
+        return indice
+    
+    def _registrar_en_indice(self, usuarios):
+        """
+        Refleja en el índice usuarios escritos (uid, nombre, privilegio, password, grupo, user_id)
+        """
+        indice = indices_usuarios.obtener((self.ip_address, self.port))
+        if not indice.cargado:
+            return
+        for uid, name, privilege, password, group_id, user_id in usuarios:
+            indice.registrar(uid, name, privilege, password, group_id, user_id)
+    
     def obtener_hora_dispositivo(self):
         """
         Obtiene la fecha y hora actual configurada en el dispositivo.
@@ -557,6 +942,57 @@ class ZKTecoConnection:
             print(f"[ERROR] Error al obtener información del dispositivo: {str(e)}")
             return {}
     
+    def obtener_conteos(self):
+        """
+        Obtiene los contadores de memoria del dispositivo (CMD_GET_FREE_SIZES).
+        
+        Es una lectura de un solo paquete, mucho más barata que descargar los
+        registros, por lo que sirve para saber si hubo marcaciones nuevas.
+        
+        Retorna:
+            dict: Cantidad de usuarios, registros y capacidades, o {} si hay error
+            
+        Ejemplo:
+            >>> conteos = dispositivo.obtener_conteos()
+            >>> print(f"Registros almacenados: {conteos.get('registros')}")
+        """
+        if not self.conn:
+            print("[ERROR] No hay conexión activa. Llame a conectar() primero.")
+            return {}
+        
+        try:
+            # read_sizes() actualiza los contadores del objeto de conexión
+            self.conn.read_sizes()
+            
+            return {
+                'usuarios': self.conn.users,
+                'registros': self.conn.records,
+                'huellas': self.conn.fingers,
+                'capacidad_usuarios': self.conn.users_cap,
+                'capacidad_registros': self.conn.rec_cap
+            }
+            
+        except Exception as e:
+            print(f"[ERROR] Error al obtener contadores: {str(e)}")
+            return {}
+    
+    def obtener_numero_serie(self):
+        """
+        Obtiene solo el número de serie del dispositivo.
+        
+        Retorna:
+            str: Número de serie, o None si hay error
+        """
+        if not self.conn:
+            print("[ERROR] No hay conexión activa. Llame a conectar() primero.")
+            return None
+        
+        try:
+            return self.conn.get_serialnumber()
+        except Exception as e:
+            print(f"[ERROR] Error al obtener número de serie: {str(e)}")
+            return None
+    
     def mostrar_informacion_dispositivo(self, info):
         """
         Muestra la información del dispositivo en formato legible.
@@ -0,0 +1,150 @@
+"""
+Índice de Usuarios por Dispositivo ZKTeco
+
+Mantiene en memoria, por dispositivo, la relación user_id <-> uid interno <-> huella
+del registro, para que eliminar o modificar un usuario no requiera descargar la
+tabla completa de usuarios del equipo.
+
+Características:
+- Se carga con la lectura de usuarios que ya hace el servicio (obtener_usuarios)
+- Las escrituras propias (alta, modificación, baja, lote) lo mantienen al día
+- Se invalida si cambia el número de serie del equipo o su cantidad de usuarios
+  (alguien escribió en el equipo por fuera de este sistema)
+
+Uso:
+    >>> from zkteco_indice_usuarios import indices_usuarios
+    >>> indice = indices_usuarios.obtener(('192.168.1.201', 4370))
+    >>> if indice.vigente(serial, conteo):
+    >>>     registro = indice.buscar('42326694')
+"""
+
+import hashlib
+import threading
+
+
+def huella_usuario(name, privilege=0, password='', group_id=''):
+    """
+    Huella del contenido de un usuario, para comparar BD y dispositivo sin campo a campo.
+
+    Retorna:
+        str: Hash hexadecimal de 16 caracteres
+    """
+    contenido = "\x1f".join((
+        (name or '').strip(), str(int(privilege or 0)), password or '', str(group_id or '').strip()
+    ))
+    return hashlib.blake2b(contenido.encode('utf-8'), digest_size=8).hexdigest()
+
+
+class IndiceUsuarios:
+    """
+    Usuarios de un dispositivo indexados por user_id y por uid interno
+    """
+
+    def __init__(self):
+        self.serial = None
+        self.cargado = False
+        # user_id -> (uid, nombre, privilegio, password, grupo, tarjeta, huella)
+        self._por_user_id = {}
+        # uid interno -> user_id
+        self._por_uid = {}
+
+    def cargar(self, serial, usuarios):
+        """
+        Reemplaza el índice con la tabla de usuarios leída del dispositivo (objetos User de pyzk)
+        """
+        self.serial = serial
+        self._por_user_id = {}
+        self._por_uid = {}
+        for usuario in usuarios:
+            self.registrar(usuario.uid, usuario.name, usuario.privilege, usuario.password,
+                           usuario.group_id, usuario.user_id, usuario.card)
+        self.cargado = True
+
+    def invalidar(self):
+        self.cargado = False
+        self._por_user_id = {}
+        self._por_uid = {}
+
+    def vigente(self, serial, conteo_usuarios) -> bool:
+        """
+        Indica si el índice corresponde al equipo (mismo serial y misma cantidad de usuarios)
+        """
+        return self.cargado and self.serial == serial and len(self._por_uid) == conteo_usuarios
+
+    def buscar(self, user_id):
+        """
+        Retorna:
+            tuple: (uid, nombre, privilegio, password, grupo, tarjeta, huella) o None
+        """
+        return self._por_user_id.get(str(user_id))
+
+    def registrar(self, uid, name, privilege, password, group_id, user_id, card=0):
+        """
+        Agrega o reemplaza un usuario (tras escribirlo en el dispositivo)
+        """
+        user_id = str(user_id)
+        anterior = self._por_uid.get(uid)
+        if anterior is not None and anterior != user_id:
+            # El slot pasó a otro usuario: el anterior fue sobrescrito en el equipo
+            self._por_user_id.pop(anterior, None)
+        registro = self._por_user_id.get(user_id)
+        if registro is not None and registro[0] != uid:
+            self._por_uid.pop(registro[0], None)
+
+        self._por_user_id[user_id] = (
+            uid, name, privilege, password or '', group_id or '', card or 0,
+            huella_usuario(name, privilege, password, group_id)
+        )
+        self._por_uid[uid] = user_id
+
+    def quitar(self, user_id):
+        registro = self._por_user_id.pop(str(user_id), None)
+        if registro is not None:
+            self._por_uid.pop(registro[0], None)
+
+    def uid_libre(self, uid) -> bool:
+        return uid not in self._por_uid
+
+    def siguiente_uid(self) -> int:
+        """
+        Primer uid interno libre
+        """
+        uid = 1
+        while uid in self._por_uid:
+            uid += 1
+        return uid
+
+    def __len__(self):
+        return len(self._por_uid)
+
+
+class RegistroIndices:
+    """
+    Índices de usuarios de todos los dispositivos, por dirección (ip, puerto)
+    """
+
+    def __init__(self):
+        self._indices = {}
+        self._lock = threading.Lock()
+
+    def obtener(self, clave) -> IndiceUsuarios:
+        with self._lock:
+            indice = self._indices.get(clave)
+            if indice is None:
+                indice = IndiceUsuarios()
+                self._indices[clave] = indice
+            return indice
+
+    def invalidar(self, clave=None):
+        """
+        Descarta el índice de un dispositivo (o de todos si clave es None)
+        """
+        with self._lock:
+            indices = list(self._indices.values()) if clave is None else [self._indices.get(clave)]
+        for indice in indices:
+            if indice is not None:
+                indice.invalidar()
+
+
+# Instancia global de índices
+indices_usuarios = RegistroIndices()
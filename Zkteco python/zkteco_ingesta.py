@@ -0,0 +1,238 @@
+"""
+Ingesta por Etapas de Marcaciones ZKTeco
+Separa la descarga del dispositivo de la escritura en la base de datos
+
+Etapas:
+1. Descarga: el buffer crudo de marcaciones se lee bloque a bloque con el dispositivo
+   deshabilitado y la sesión se libera de inmediato (el equipo vuelve a aceptar marcaciones)
+2. Spool: cada bloque se escribe en disco (SYNC_SPOOL_DIR) a medida que llega, antes de
+   tocar la BD; si el proceso cae a mitad de la escritura, el volcado se reproduce al
+   reiniciar. El volcado se vuelve a leer del archivo por bloques, así que la memoria no
+   depende del tamaño de la memoria de marcaciones
+3. Escritura: un hilo productor decodifica el volcado y entrega lotes por una cola
+   acotada (SYNC_QUEUE_SIZE) al consumidor que inserta en la BD, de modo que la
+   decodificación se solapa con las escrituras sin acumular todo en memoria
+
+Formato del spool: 4 bytes (longitud de la cabecera) + cabecera JSON + buffer crudo.
+
+Uso:
+    >>> from zkteco_ingesta import spool_ingesta, flujo_acotado
+    >>> with pool_conexiones.sesion(dispositivo, lectura=True) as conn:
+    >>>     ruta, registros = spool_ingesta.descargar(dispositivo_id, conn.iterar_asistencias(), serial, conteos)
+    >>> for uid, epoch, status, punch in flujo_acotado(registros):
+    >>>     ...
+    >>> spool_ingesta.descartar(ruta)
+"""
+
+from datetime import datetime
+import json
+import os
+import queue
+import struct
+import threading
+import logging
+
+from zkteco_tcp_protocol import DecodificadorAsistencias, MAX_CHUNK
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+
+def flujo_acotado(iterable, lote: int = 5000, capacidad: int = 4):
+    """
+    Recorre iterable en un hilo productor y entrega sus elementos a través de una
+    cola acotada de lotes. Las excepciones del productor se relanzan en el consumidor;
+    si el consumidor deja de iterar, el productor se detiene.
+
+    Parámetros:
+        iterable: Fuente de elementos (p. ej. un DecodificadorAsistencias)
+        lote (int): Elementos por lote encolado
+        capacidad (int): Lotes en cola como máximo (el productor espera si se llena)
+    """
+    cola = queue.Queue(maxsize=capacidad)
+    fin = object()
+    detener = threading.Event()
+
+    def poner(elemento) -> bool:
+        while not detener.is_set():
+            try:
+                cola.put(elemento, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def productor():
+        try:
+            bloque = []
+            for elemento in iterable:
+                bloque.append(elemento)
+                if len(bloque) >= lote:
+                    if not poner(bloque):
+                        return
+                    bloque = []
+            if bloque and not poner(bloque):
+                return
+            poner(fin)
+        except BaseException as e:
+            poner(e)
+
+    hilo = threading.Thread(target=productor, name="zk-ingesta", daemon=True)
+    hilo.start()
+    try:
+        while True:
+            elemento = cola.get()
+            if elemento is fin:
+                break
+            if isinstance(elemento, BaseException):
+                raise elemento
+            yield from elemento
+    finally:
+        detener.set()
+        hilo.join(timeout=5)
+
+
+class SpoolIngesta:
+    """
+    Volcados crudos de marcaciones pendientes de escribir en la BD
+    """
+
+    def __init__(self, directorio: str):
+        """
+        Parámetros:
+            directorio (str): Carpeta de los volcados ('' = sin spool, solo en memoria)
+        """
+        self.directorio = directorio
+
+    @property
+    def habilitado(self) -> bool:
+        return bool(self.directorio)
+
+    def descargar(self, dispositivo_id: int, registros: DecodificadorAsistencias, serial=None, conteos=None):
+        """
+        Consume la lectura en curso (registros recién retornado por iterar_asistencias,
+        aún sin recorrer) y la deja lista para recorrer después de liberar la sesión:
+        volcada al spool y leída desde el archivo bloque a bloque o, si el spool está
+        deshabilitado o no se puede crear el archivo, con los bloques en memoria.
+
+        Retorna:
+            tuple: (ruta del volcado o None, DecodificadorAsistencias listo para recorrer)
+        """
+        ruta = self.guardar(dispositivo_id, registros, serial, conteos)
+        if ruta is not None:
+            return ruta, self.cargar(ruta)[1]
+        registros.bloques = list(registros.bloques)
+        return None, registros
+
+    def guardar(self, dispositivo_id: int, registros: DecodificadorAsistencias, serial=None, conteos=None):
+        """
+        Guarda el volcado crudo (aún sin recorrer) con lo necesario para decodificarlo igual.
+        Los bloques se escriben a medida que se leen. La escritura es atómica: el archivo
+        aparece completo o no aparece.
+
+        Retorna:
+            str: Ruta del volcado, o None si el spool está deshabilitado o no se pudo
+                 crear el archivo (los bloques quedan sin consumir)
+
+        Lanza:
+            OSError: Si la escritura falla a mitad del volcado (los bloques ya leídos
+                     se perdieron)
+        """
+        if not self.habilitado:
+            return None
+        cabecera = json.dumps({
+            "dispositivo_id": dispositivo_id,
+            "serial": serial,
+            "conteos": conteos or {},
+            "fecha": datetime.now().isoformat(),
+            "registros": registros.registros,
+            "mapa_uid": {str(k): v for k, v in registros.mapa_uid.items()},
+            "indice_desde": registros.indice_desde,
+            "marca_epoch": registros.marca_epoch,
+            "epoch_min": registros.epoch_min,
+            "epoch_max": registros.epoch_max,
+        }).encode("utf-8")
+
+        nombre = f"{dispositivo_id}-{datetime.now():%Y%m%d%H%M%S%f}.spool"
+        ruta = os.path.join(self.directorio, nombre)
+        temporal = ruta + ".tmp"
+        try:
+            os.makedirs(self.directorio, exist_ok=True)
+            archivo = open(temporal, "wb")
+        except OSError as e:
+            logger.warning(f"No se pudo guardar el volcado del dispositivo {dispositivo_id} en el spool: {e}")
+            return None
+        try:
+            with archivo:
+                archivo.write(struct.pack("<I", len(cabecera)))
+                archivo.write(cabecera)
+                for bloque in registros.bloques:
+                    archivo.write(bloque)
+                archivo.flush()
+                os.fsync(archivo.fileno())
+            os.replace(temporal, ruta)
+            return ruta
+        except BaseException:
+            try:
+                os.remove(temporal)
+            except OSError:
+                pass
+            raise
+
+    def cargar(self, ruta: str) -> tuple:
+        """
+        Retorna:
+            tuple: (cabecera, DecodificadorAsistencias listo para recorrer; lee el
+                   buffer del archivo bloque a bloque al iterarlo)
+        """
+        with open(ruta, "rb") as archivo:
+            largo = struct.unpack("<I", archivo.read(4))[0]
+            cabecera = json.loads(archivo.read(largo).decode("utf-8"))
+        registros = DecodificadorAsistencias(
+            cabecera["registros"],
+            {int(k): v for k, v in cabecera["mapa_uid"].items()},
+            indice_desde=cabecera["indice_desde"],
+            marca_epoch=cabecera["marca_epoch"],
+            epoch_min=cabecera["epoch_min"],
+            epoch_max=cabecera["epoch_max"],
+            bloques=self._bloques(ruta, 4 + largo)
+        )
+        return cabecera, registros
+
+    @staticmethod
+    def _bloques(ruta: str, desde: int):
+        with open(ruta, "rb") as archivo:
+            archivo.seek(desde)
+            while True:
+                bloque = archivo.read(MAX_CHUNK)
+                if not bloque:
+                    return
+                yield bloque
+
+    def descartar(self, ruta: str):
+        """
+        Elimina un volcado ya escrito en la BD
+        """
+        if not ruta:
+            return
+        try:
+            os.remove(ruta)
+        except OSError as e:
+            logger.warning(f"No se pudo eliminar el volcado {ruta}: {e}")
+
+    def pendientes(self, dispositivo_id: int = None) -> list:
+        """
+        Volcados pendientes, del más antiguo al más reciente
+        """
+        if not self.habilitado or not os.path.isdir(self.directorio):
+            return []
+        prefijo = f"{dispositivo_id}-" if dispositivo_id is not None else ""
+        return sorted(
+            os.path.join(self.directorio, nombre)
+            for nombre in os.listdir(self.directorio)
+            if nombre.endswith(".spool") and nombre.startswith(prefijo)
+        )
+
+
+# Instancia global del spool
+spool_ingesta = SpoolIngesta(settings.spool_dir)
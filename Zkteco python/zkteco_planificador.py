@@ -0,0 +1,198 @@
+"""
+Planificador de Sincronización Automática
+Sincroniza en segundo plano las asistencias de los dispositivos activos
+
+Características:
+- Controlado por AUTO_SYNC_ENABLED y AUTO_SYNC_INTERVAL
+- Próxima ejecución independiente por dispositivo, con jitter para no
+  sincronizar toda la flota en el mismo instante
+- Backoff exponencial para dispositivos que fallan
+- Omite los dispositivos con captura en tiempo real activa
+- Hilo propio: no ocupa los workers de las peticiones HTTP
+
+Uso:
+    >>> from zkteco_planificador import planificador_sincronizacion
+    >>> planificador_sincronizacion.iniciar()
+    >>> planificador_sincronizacion.detener()
+"""
+
+from datetime import datetime
+import random
+import threading
+import time
+import logging
+
+from models.database import SessionLocal
+from models.dispositivo import Dispositivo
+from services.asistencia_service import AsistenciaService
+from services.flota_service import FlotaService
+from zkteco_tiempo_real import captura_tiempo_real
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class EstadoPlanificacion:
+    """
+    Estado de la sincronización automática de un dispositivo
+    """
+
+    def __init__(self, dispositivo_id: int, proxima_ejecucion: float):
+        self.dispositivo_id = dispositivo_id
+        self.proxima_ejecucion = proxima_ejecucion  # time.monotonic()
+        self.fallos_consecutivos = 0
+        self.ultima_ejecucion = None  # datetime
+        self.ultimo_resultado = None  # mensaje
+
+
+class PlanificadorSincronizacion:
+    """
+    Ejecuta periódicamente la sincronización de asistencias de la flota
+    """
+
+    def __init__(self, intervalo: int = 300, jitter: float = 0.1, backoff_maximo: int = 3600):
+        """
+        Parámetros:
+            intervalo (int): Segundos entre sincronizaciones de un mismo dispositivo
+            jitter (float): Fracción aleatoria (±) aplicada al intervalo
+            backoff_maximo (int): Espera máxima para un dispositivo que falla
+        """
+        self.intervalo = intervalo
+        self.jitter = jitter
+        self.backoff_maximo = backoff_maximo
+
+        self._estados = {}
+        self._lock = threading.Lock()
+        self._hilo = None
+        self._detener = threading.Event()
+
+    # ---------------------------------------------------------
+    # API PÚBLICA
+    # ---------------------------------------------------------
+
+    def iniciar(self):
+        """
+        Inicia el hilo del planificador (idempotente)
+        """
+        if self._hilo and self._hilo.is_alive():
+            return
+        self._detener.clear()
+        self._hilo = threading.Thread(target=self._bucle, name="zk-auto-sync", daemon=True)
+        self._hilo.start()
+        logger.info(f"Sincronización automática iniciada (intervalo {self.intervalo}s)")
+
+    def detener(self, timeout: float = 10):
+        """
+        Detiene el planificador. Una ronda en curso termina por su cuenta.
+        """
+        self._detener.set()
+        if self._hilo:
+            self._hilo.join(timeout=timeout)
+            self._hilo = None
+        logger.info("Sincronización automática detenida")
+
+    def estado(self) -> dict:
+        """
+        Estado por dispositivo: {dispositivo_id: {...}}
+        """
+        ahora = time.monotonic()
+        with self._lock:
+            estados = list(self._estados.values())
+        return {
+            e.dispositivo_id: {
+                "segundos_para_proxima": max(0, int(e.proxima_ejecucion - ahora)),
+                "fallos_consecutivos": e.fallos_consecutivos,
+                "ultima_ejecucion": e.ultima_ejecucion.isoformat() if e.ultima_ejecucion else None,
+                "ultimo_resultado": e.ultimo_resultado,
+            }
+            for e in estados
+        }
+
+    # ---------------------------------------------------------
+    # LÓGICA INTERNA
+    # ---------------------------------------------------------
+
+    def _con_jitter(self, segundos: float) -> float:
+        return segundos * (1 + random.uniform(-self.jitter, self.jitter))
+
+    def _espera_tras_fallo(self, fallos: int) -> float:
+        return min(self.intervalo * (2 ** fallos), self.backoff_maximo)
+
+    def _bucle(self):
+        # Paso del bucle: suficiente para respetar la próxima ejecución de cada dispositivo
+        paso = max(1, min(10, self.intervalo // 10))
+        while not self._detener.wait(paso):
+            try:
+                self._ejecutar_ronda()
+            except Exception as e:
+                logger.error(f"Error en la sincronización automática: {e}")
+
+    def _actualizar_dispositivos(self) -> list:
+        """
+        Sincroniza el estado con los dispositivos activos y devuelve los que tocan
+        """
+        db = SessionLocal()
+        try:
+            activos = [(d.id, d.nombre) for d in db.query(Dispositivo).filter(Dispositivo.activo == True).all()]
+        finally:
+            db.close()
+
+        ahora = time.monotonic()
+        ids = {d[0] for d in activos}
+        with self._lock:
+            for dispositivo_id in list(self._estados):
+                if dispositivo_id not in ids:
+                    del self._estados[dispositivo_id]
+            for dispositivo_id, _ in activos:
+                if dispositivo_id not in self._estados:
+                    # Primera ejecución repartida en todo el intervalo: al arrancar, la
+                    # flota no se sincroniza en la misma ronda
+                    self._estados[dispositivo_id] = EstadoPlanificacion(
+                        dispositivo_id, ahora + random.uniform(0, self.intervalo)
+                    )
+            vencidos = [d for d in activos if self._estados[d[0]].proxima_ejecucion <= ahora]
+
+        # Los dispositivos con captura en tiempo real activa no necesitan la descarga periódica
+        return [d for d in vencidos if not captura_tiempo_real.en_linea(d[0])]
+
+    def _ejecutar_ronda(self):
+        pendientes = self._actualizar_dispositivos()
+        if not pendientes:
+            return
+
+        logger.info(f"Sincronización automática: {len(pendientes)} dispositivo(s)")
+        resultados = FlotaService.ejecutar_en_paralelo(
+            pendientes,
+            AsistenciaService.sincronizar_asistencias_desde_dispositivo
+        )
+        for resultado in resultados:
+            self._registrar(resultado)
+
+    def _registrar(self, resultado: dict):
+        with self._lock:
+            estado = self._estados.get(resultado["dispositivo_id"])
+            if estado is None:
+                return
+
+            estado.ultima_ejecucion = datetime.now()
+            estado.ultimo_resultado = resultado.get("message")
+            if resultado.get("success"):
+                estado.fallos_consecutivos = 0
+                espera = self.intervalo
+            else:
+                estado.fallos_consecutivos += 1
+                espera = self._espera_tras_fallo(estado.fallos_consecutivos)
+                logger.warning(
+                    f"Sincronización automática fallida en dispositivo {estado.dispositivo_id} "
+                    f"({estado.fallos_consecutivos} seguidas): {estado.ultimo_resultado}. "
+                    f"Reintento en {int(espera)}s"
+                )
+            estado.proxima_ejecucion = time.monotonic() + self._con_jitter(espera)
+
+
+# Instancia global del planificador
+planificador_sincronizacion = PlanificadorSincronizacion(
+    intervalo=settings.AUTO_SYNC_INTERVAL,
+    jitter=settings.AUTO_SYNC_JITTER,
+    backoff_maximo=settings.AUTO_SYNC_MAX_BACKOFF
+)
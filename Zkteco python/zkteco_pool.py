@@ -0,0 +1,447 @@
+"""
+Pool de Conexiones Persistentes a Dispositivos ZKTeco
+
+Mantiene una sesión TCP autenticada por dispositivo (clave: Dispositivo.id)
+para no repetir el handshake CMD_CONNECT en cada operación de los servicios.
+
+Características:
+- Una sesión por dispositivo, reutilizada entre peticiones
+- Acceso serializado por dispositivo (un solo hilo opera a la vez)
+- Keepalive en segundo plano y cierre de sesiones inactivas
+- Reconexión automática tras inactividad o error
+- Al cerrar la aplicación todos los dispositivos quedan habilitados
+- Circuit breaker por dispositivo: un equipo caído falla al instante (sin esperar
+  el timeout) hasta su próximo intento de prueba; timeout de conexión adaptado al RTT
+- Bloqueo según la operación: las escrituras deshabilitan el dispositivo toda la
+  sesión; las lecturas (lectura=True) no lo deshabilitan o lo hacen solo durante la
+  descarga con buffer (ZK_READ_LOCK_MODE). Se mide cada ventana de bloqueo por dispositivo
+
+Uso:
+    >>> from zkteco_pool import pool_conexiones
+    >>> with pool_conexiones.sesion(dispositivo) as zk:
+    >>>     if zk is None:
+    >>>         print("No se pudo conectar")
+    >>>     else:
+    >>>         asistencias = zk.obtener_asistencias()
+    >>> with pool_conexiones.sesion(dispositivo, lectura=True) as zk:
+    >>>     info = zk.obtener_informacion_dispositivo()  # El equipo sigue aceptando marcaciones
+"""
+
+from contextlib import contextmanager
+import threading
+import time
+import logging
+
+from zkteco_connection import ZKTecoConnection
+from zkteco_circuito import Circuito, ABIERTO
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class SesionDispositivo:
+    """
+    Estado de la sesión de un dispositivo dentro del pool
+    """
+
+    def __init__(self, dispositivo_id):
+        self.dispositivo_id = dispositivo_id
+        self.parametros = None  # (ip, puerto, timeout, password) con los que se abrió
+        self.conexion = None  # ZKTecoConnection autenticada (o None)
+        self.lock = threading.RLock()  # Serializa el acceso al dispositivo
+        self.ultimo_uso = 0.0
+        self.esperando = 0  # Hilos esperando el lock
+        self.conexiones_realizadas = 0
+        self.operaciones = 0
+        # Ventanas de bloqueo (dispositivo deshabilitado)
+        self.bloqueos = 0
+        self.segundos_bloqueado = 0.0
+        self.ultimo_bloqueo = None
+        self.bloqueo_maximo = 0.0
+        self.circuito = Circuito(
+            umbral_fallos=settings.CIRCUIT_FAILURE_THRESHOLD,
+            espera_base=settings.CIRCUIT_BASE_BACKOFF,
+            espera_maxima=settings.CIRCUIT_MAX_BACKOFF,
+            timeout_minimo=settings.ZK_ADAPTIVE_TIMEOUT_MIN
+        )
+
+    def registrar_bloqueo(self, segundos: float):
+        """
+        Callback de la conexión al habilitar el dispositivo
+        """
+        self.bloqueos += 1
+        self.segundos_bloqueado += segundos
+        self.ultimo_bloqueo = segundos
+        self.bloqueo_maximo = max(self.bloqueo_maximo, segundos)
+
+    def resumen_bloqueos(self) -> dict:
+        return {
+            "bloqueos": self.bloqueos,
+            "segundos_bloqueado": round(self.segundos_bloqueado, 3),
+            "ultimo_bloqueo_ms": round(self.ultimo_bloqueo * 1000, 1) if self.ultimo_bloqueo is not None else None,
+            "bloqueo_maximo_ms": round(self.bloqueo_maximo * 1000, 1),
+            "bloqueo_promedio_ms": round(self.segundos_bloqueado * 1000 / self.bloqueos, 1) if self.bloqueos else None,
+        }
+
+    def cerrar(self):
+        """
+        Habilita el dispositivo y cierra la sesión TCP (si existe)
+        """
+        if self.conexion:
+            try:
+                self.conexion.desconectar()
+            except Exception as e:
+                logger.warning(f"Error cerrando sesión del dispositivo {self.dispositivo_id}: {e}")
+        self.conexion = None
+        self.parametros = None
+
+
+class PoolConexiones:
+    """
+    Pool de sesiones ZKTeco indexado por Dispositivo.id
+    """
+
+    def __init__(self, keepalive_intervalo: int = 30, tiempo_inactividad: int = 300):
+        """
+        Parámetros:
+            keepalive_intervalo (int): Segundos entre sondeos de las sesiones abiertas
+            tiempo_inactividad (int): Segundos sin uso tras los cuales se cierra la sesión
+        """
+        self.keepalive_intervalo = keepalive_intervalo
+        self.tiempo_inactividad = tiempo_inactividad
+
+        self._sesiones = {}
+        self._lock = threading.Lock()
+        self._hilo_keepalive = None
+        self._detener = threading.Event()
+
+    # ---------------------------------------------------------
+    # API PÚBLICA
+    # ---------------------------------------------------------
+
+    @contextmanager
+    def sesion(self, dispositivo, deshabilitar: bool = True, lectura: bool = False):
+        """
+        Presta la sesión del dispositivo con el dispositivo deshabilitado.
+
+        El bloque tiene acceso exclusivo al dispositivo. Al salir, el dispositivo
+        se habilita nuevamente pero la sesión TCP queda abierta para la próxima
+        operación. Si no es posible conectar, o el circuito del dispositivo está
+        abierto, se entrega None (ver motivo_sin_conexion()).
+
+        Parámetros:
+            dispositivo (Dispositivo): Modelo del dispositivo (se leen ip, puerto, timeout y password)
+            deshabilitar (bool): Si es False el dispositivo sigue operativo durante el bloque
+            lectura (bool): Operación de solo lectura; el bloqueo lo decide ZK_READ_LOCK_MODE:
+                            'sesion' (todo el bloque), 'ventana' (solo las descargas con
+                            buffer) o 'nunca'
+        """
+        self._asegurar_keepalive()
+
+        modo_lectura = settings.ZK_READ_LOCK_MODE if lectura else "sesion"
+        if modo_lectura != "sesion":
+            deshabilitar = False
+
+        parametros = (dispositivo.ip_address, dispositivo.puerto, dispositivo.timeout, dispositivo.password)
+
+        # Circuito abierto: se falla sin esperar el lock del dispositivo
+        with self._lock:
+            previa = self._sesiones.get(dispositivo.id)
+        if previa and not previa.circuito.disponible():
+            yield None
+            return
+
+        sesion = self._adquirir(dispositivo.id)
+
+        try:
+            if not sesion.circuito.permitir():
+                yield None
+                return
+
+            inicio = time.monotonic()
+            zk = self._preparar(sesion, parametros, deshabilitar)
+            if zk is None:
+                sesion.circuito.registrar_fallo("conexion")
+                if sesion.circuito.estado == ABIERTO:
+                    logger.warning(
+                        f"Circuito del dispositivo {sesion.dispositivo_id} abierto "
+                        f"(reintento en {sesion.circuito.segundos_para_reintento()}s)"
+                    )
+                yield None
+                return
+            sesion.circuito.registrar_exito(time.monotonic() - inicio)
+
+            zk.ventana_en_lecturas = modo_lectura == "ventana"
+            error = False
+            try:
+                yield zk
+            except Exception:
+                error = True
+                raise
+            finally:
+                zk.ventana_en_lecturas = False
+                sesion.operaciones += 1
+                sesion.ultimo_uso = time.monotonic()
+                # Solo se habilita si la sesión (o una ventana de lectura que no llegó a
+                # cerrarse) dejó el dispositivo deshabilitado: las lecturas sin bloqueo
+                # no pagan el CMD_ENABLEDEVICE
+                if zk.deshabilitado:
+                    try:
+                        zk.habilitar_dispositivo()
+                    except Exception as e:
+                        logger.warning(f"No se pudo habilitar el dispositivo {sesion.dispositivo_id}: {e}")
+                        error = True
+                if error:
+                    # Estado de la sesión desconocido: se descarta y se reabre en el próximo uso
+                    sesion.cerrar()
+        finally:
+            sesion.lock.release()
+
+    @contextmanager
+    def reservar(self, dispositivo_id: int):
+        """
+        Acceso exclusivo al dispositivo para una operación que usa su propia conexión
+        (p. ej. el cliente asíncrono). Respeta el lock y el circuito del dispositivo y
+        cierra la sesión TCP del pool, que se reabre en el próximo uso (algunos
+        firmwares admiten una sola sesión). Entrega False si el circuito está abierto.
+        """
+        with self._lock:
+            previa = self._sesiones.get(dispositivo_id)
+        if previa and not previa.circuito.disponible():
+            yield False
+            return
+
+        sesion = self._adquirir(dispositivo_id)
+        try:
+            sesion.cerrar()
+            yield True
+        finally:
+            sesion.lock.release()
+
+    def cerrar(self, dispositivo_id: int):
+        """
+        Cierra la sesión de un dispositivo (por ejemplo al editarlo o eliminarlo)
+        """
+        with self._lock:
+            sesion = self._sesiones.pop(dispositivo_id, None)
+        if sesion:
+            with sesion.lock:
+                sesion.cerrar()
+            logger.info(f"Sesión del dispositivo {dispositivo_id} cerrada")
+
+    def cerrar_todas(self):
+        """
+        Detiene el keepalive, habilita todos los dispositivos y cierra las sesiones
+        """
+        self._detener.set()
+        if self._hilo_keepalive:
+            self._hilo_keepalive.join(timeout=self.keepalive_intervalo)
+            self._hilo_keepalive = None
+
+        with self._lock:
+            sesiones = list(self._sesiones.values())
+            self._sesiones.clear()
+
+        for sesion in sesiones:
+            # Si una operación sigue en curso se espera un tiempo prudente
+            timeout = (sesion.parametros[2] if sesion.parametros else 5) * 2
+            if sesion.lock.acquire(timeout=timeout):
+                try:
+                    sesion.cerrar()
+                finally:
+                    sesion.lock.release()
+            else:
+                logger.warning(f"Dispositivo {sesion.dispositivo_id} ocupado, no se pudo cerrar su sesión")
+
+        logger.info(f"Pool de conexiones cerrado ({len(sesiones)} sesiones)")
+
+    def motivo_sin_conexion(self, dispositivo_id: int) -> str:
+        """
+        Mensaje para el usuario cuando sesion() entregó None
+        """
+        with self._lock:
+            sesion = self._sesiones.get(dispositivo_id)
+        if sesion and sesion.circuito.estado == ABIERTO:
+            return (
+                f"Dispositivo fuera de servicio tras {sesion.circuito.fallos_consecutivos} fallos de conexión "
+                f"(próximo intento en {sesion.circuito.segundos_para_reintento()} s)"
+            )
+        return "No se pudo conectar al dispositivo"
+
+    def disponible(self, dispositivo_id: int) -> bool:
+        """
+        Indica si el circuito del dispositivo admite operaciones (sin consumir el intento de prueba)
+        """
+        with self._lock:
+            sesion = self._sesiones.get(dispositivo_id)
+        return sesion is None or sesion.circuito.disponible()
+
+    def sesion_abierta(self, dispositivo_id: int) -> bool:
+        """
+        Indica si el pool mantiene una sesión TCP con el dispositivo (en uso o no).
+        Algunos firmwares admiten una sola sesión: quien quiera conectarse por fuera
+        del pool lo consulta antes.
+        """
+        with self._lock:
+            sesion = self._sesiones.get(dispositivo_id)
+        return bool(sesion and sesion.conexion is not None)
+
+    def registrar_sondeo(self, dispositivo_id: int, rtt_segundos: float = None, exito: bool = True, error: str = None):
+        """
+        Incorpora al circuito el resultado de un sondeo externo (monitor de salud).
+        Un sondeo exitoso cierra el circuito y alimenta el RTT del timeout adaptativo.
+        """
+        with self._lock:
+            sesion = self._sesiones.get(dispositivo_id)
+            if sesion is None:
+                sesion = SesionDispositivo(dispositivo_id)
+                self._sesiones[dispositivo_id] = sesion
+        if exito:
+            sesion.circuito.registrar_exito(rtt_segundos)
+        else:
+            sesion.circuito.registrar_fallo(error)
+
+    def estadisticas_bloqueo(self, dispositivo_id: int) -> dict:
+        """
+        Ventanas en que el dispositivo estuvo deshabilitado por este servidor
+        (cantidad, total, última, máxima y promedio)
+        """
+        with self._lock:
+            sesion = self._sesiones.get(dispositivo_id)
+        return sesion.resumen_bloqueos() if sesion else SesionDispositivo(dispositivo_id).resumen_bloqueos()
+
+    def hay_espera(self, dispositivo_id: int) -> bool:
+        """
+        Indica si otro hilo espera la sesión del dispositivo.
+        Las operaciones largas (captura en tiempo real) lo consultan para cederla.
+        """
+        with self._lock:
+            sesion = self._sesiones.get(dispositivo_id)
+        return bool(sesion and sesion.esperando)
+
+    def estado(self) -> list:
+        """
+        Resumen de las sesiones del pool (para diagnóstico)
+        """
+        ahora = time.monotonic()
+        with self._lock:
+            sesiones = list(self._sesiones.values())
+
+        return [
+            {
+                "dispositivo_id": s.dispositivo_id,
+                "conectado": s.conexion is not None,
+                "segundos_inactivo": int(ahora - s.ultimo_uso) if s.ultimo_uso else None,
+                "conexiones_realizadas": s.conexiones_realizadas,
+                "operaciones": s.operaciones,
+                **s.resumen_bloqueos(),
+                **s.circuito.resumen(),
+            }
+            for s in sesiones
+        ]
+
+    # ---------------------------------------------------------
+    # LÓGICA INTERNA
+    # ---------------------------------------------------------
+
+    def _adquirir(self, dispositivo_id: int) -> SesionDispositivo:
+        """
+        Obtiene la sesión del dispositivo con su lock adquirido.
+        Si mientras se esperaba el lock la sesión fue retirada del pool
+        (cerrar()), se vuelve a intentar con la sesión vigente.
+        """
+        while True:
+            with self._lock:
+                sesion = self._sesiones.get(dispositivo_id)
+                if sesion is None:
+                    sesion = SesionDispositivo(dispositivo_id)
+                    self._sesiones[dispositivo_id] = sesion
+
+            with self._lock:
+                sesion.esperando += 1
+            sesion.lock.acquire()
+            with self._lock:
+                sesion.esperando -= 1
+                vigente = self._sesiones.get(dispositivo_id) is sesion
+            if vigente:
+                return sesion
+            sesion.lock.release()
+
+    def _preparar(self, sesion: SesionDispositivo, parametros: tuple, deshabilitar: bool = True):
+        """
+        Devuelve la conexión lista (autenticada y, si se pide, deshabilitada) o None.
+        Debe llamarse con sesion.lock adquirido.
+        """
+        # Cambió la configuración del dispositivo: la sesión anterior no sirve
+        if sesion.conexion and sesion.parametros != parametros:
+            sesion.cerrar()
+
+        # Sesión reutilizada: el propio disable_device sirve de sondeo
+        if sesion.conexion:
+            try:
+                if deshabilitar:
+                    sesion.conexion.deshabilitar_dispositivo()
+                    return sesion.conexion
+                if sesion.conexion.verificar_conexion():
+                    return sesion.conexion
+                raise ConnectionError("sin respuesta")
+            except Exception as e:
+                logger.info(f"Sesión del dispositivo {sesion.dispositivo_id} caída ({e}), reconectando...")
+                sesion.cerrar()
+
+        ip, puerto, timeout, password = parametros
+        zk = ZKTecoConnection(
+            ip, puerto, timeout, password, ommit_ping=True,
+            timeout_conexion=sesion.circuito.timeout_adaptativo(timeout)
+        )
+        zk.al_habilitar = sesion.registrar_bloqueo
+        if not zk.conectar(deshabilitar=deshabilitar):
+            return None
+
+        sesion.conexion = zk
+        sesion.parametros = parametros
+        sesion.conexiones_realizadas += 1
+        return zk
+
+    def _asegurar_keepalive(self):
+        if self._hilo_keepalive and self._hilo_keepalive.is_alive():
+            return
+        with self._lock:
+            if self._hilo_keepalive and self._hilo_keepalive.is_alive():
+                return
+            self._detener.clear()
+            self._hilo_keepalive = threading.Thread(
+                target=self._bucle_keepalive,
+                name="zk-pool-keepalive",
+                daemon=True
+            )
+            self._hilo_keepalive.start()
+
+    def _bucle_keepalive(self):
+        while not self._detener.wait(self.keepalive_intervalo):
+            with self._lock:
+                sesiones = list(self._sesiones.values())
+
+            for sesion in sesiones:
+                # Si el dispositivo está en uso, el sondeo no es necesario
+                if not sesion.lock.acquire(blocking=False):
+                    continue
+                try:
+                    if not sesion.conexion:
+                        continue
+                    inactivo = time.monotonic() - sesion.ultimo_uso
+                    if inactivo >= self.tiempo_inactividad:
+                        logger.info(f"Cerrando sesión inactiva del dispositivo {sesion.dispositivo_id}")
+                        sesion.cerrar()
+                    elif not sesion.conexion.verificar_conexion():
+                        logger.info(f"Keepalive fallido en dispositivo {sesion.dispositivo_id}, sesión descartada")
+                        sesion.cerrar()
+                finally:
+                    sesion.lock.release()
+
+
+# Instancia global del pool
+pool_conexiones = PoolConexiones(
+    keepalive_intervalo=settings.ZK_POOL_KEEPALIVE_INTERVAL,
+    tiempo_inactividad=settings.ZK_POOL_IDLE_TIMEOUT
+)
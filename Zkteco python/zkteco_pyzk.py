@@ -0,0 +1,237 @@
+"""
+Adaptador de los Internos de pyzk
+Único módulo del proyecto que usa atributos privados de la clase ZK de pyzk
+
+pyzk no expone el socket de la sesión ni el envío de comandos arbitrarios. Las
+pocas operaciones que los necesitan pasan por aquí y solo se ejecutan con una
+versión de pyzk verificada (VERSIONES_VERIFICADAS) que además tenga los atributos
+esperados. Con cualquier otra versión las funciones lo informan (False o
+NotImplementedError) y quien llama usa la API pública de pyzk.
+
+Al actualizar pyzk: revisar estas funciones contra zk/base.py y agregar la
+versión a VERSIONES_VERIFICADAS.
+
+Operaciones:
+- ajustar_timeout: timeout de las operaciones distinto al del handshake
+- guardar_usuarios_lote: escritura de usuarios por lote (CMD_SAVE_USERTEMPS)
+- leer_inicio_buffer: primeros bytes de un buffer de lectura, sin descargar el resto
+- preparar_buffer / leer_bloques_buffer: lectura con buffer bloque a bloque, sin
+  juntar el buffer completo en memoria (read_with_buffer lo concatena)
+- iniciar_captura: captura en tiempo real con el mapa de usuarios ya conocido
+  (live_capture lee todos los usuarios en cada inicio)
+
+Uso:
+    >>> from zkteco_pyzk import ajustar_timeout
+    >>> if not ajustar_timeout(zk, 30):
+    >>>     ...  # Versión de pyzk no verificada: alternativa con la API pública
+"""
+
+from typing import Optional
+from socket import timeout as SocketTimeout
+import struct
+import logging
+
+import zk as pyzk
+from zk import const
+from zk.attendance import Attendance
+
+from zkteco_tcp_protocol import CMD_SAVE_USERTEMPS, CMD_PREPARE_BUFFER, CMD_DATA, MAX_CHUNK
+
+logger = logging.getLogger(__name__)
+
+_advertidas = set()  # Operaciones ya advertidas (una advertencia por proceso)
+
+# Versiones de pyzk cuyos internos se revisaron
+VERSIONES_VERIFICADAS = {(0, 9)}
+VERSION_PYZK = tuple(getattr(pyzk, "VERSION", ()))
+
+
+def compatible(zk, *atributos) -> bool:
+    """
+    True si la versión de pyzk está verificada y el objeto ZK tiene los atributos
+    """
+    if VERSION_PYZK not in VERSIONES_VERIFICADAS:
+        return False
+    return all(hasattr(zk, atributo) for atributo in atributos)
+
+
+def _advertir(operacion: str):
+    if operacion in _advertidas:
+        return
+    _advertidas.add(operacion)
+    logger.warning(f"pyzk {'.'.join(map(str, VERSION_PYZK)) or '?'} no verificado para {operacion}: "
+                   f"se usa la API pública")
+
+
+def ajustar_timeout(zk, segundos: float) -> bool:
+    """
+    Cambia el timeout de la sesión ya conectada (socket y comandos siguientes).
+
+    Retorna:
+        bool: False si la versión de pyzk no está verificada (no se cambió nada)
+    """
+    if not compatible(zk, "_ZK__timeout", "_ZK__sock"):
+        _advertir("ajustar el timeout de la sesión")
+        return False
+    zk._ZK__timeout = segundos
+    zk._ZK__sock.settimeout(segundos)
+    return True
+
+
+def guardar_usuarios_lote(zk, buffer: bytes):
+    """
+    Envía un lote de usuarios empaquetado (pack_users_lote) y lo guarda con
+    CMD_SAVE_USERTEMPS, como hace pyzk en save_user_template con un solo usuario.
+
+    Lanza:
+        NotImplementedError: Si la versión de pyzk no está verificada
+        RuntimeError: Si el dispositivo rechaza el lote
+    """
+    if not compatible(zk, "_send_with_buffer", "_ZK__send_command"):
+        raise NotImplementedError(f"pyzk {'.'.join(map(str, VERSION_PYZK)) or '?'} no verificado "
+                                  f"para la escritura por lote")
+    zk._send_with_buffer(buffer)
+    respuesta = zk._ZK__send_command(CMD_SAVE_USERTEMPS, struct.pack('<IHH', 12, 0, 8))
+    if not respuesta.get('status'):
+        raise RuntimeError("el dispositivo rechazó el lote")
+
+
+def preparar_buffer(zk, comando: int) -> Optional[tuple]:
+    """
+    Envía CMD_PREPARE_BUFFER para un comando de lectura (p. ej. CMD_ATTLOG_RRQ).
+
+    Retorna:
+        tuple: (datos, total). Si el buffer es pequeño viene completo en la respuesta
+               (datos); si no, datos es None y se lee con leer_bloques_buffer(zk, total).
+               None si la versión de pyzk no está verificada.
+    """
+    if not compatible(zk, "_ZK__send_command", "_ZK__recieve_raw_data", "_ZK__data", "_ZK__tcp_length"):
+        _advertir("preparar un buffer de lectura")
+        return None
+    respuesta = zk._ZK__send_command(CMD_PREPARE_BUFFER, struct.pack('<bhii', 1, comando, 0, 0), 1024)
+    if not respuesta.get('status'):
+        raise RuntimeError("el dispositivo no preparó el buffer")
+    datos = zk._ZK__data
+    if respuesta['code'] == CMD_DATA:
+        # El buffer completo vino en la respuesta: se consume el resto del paquete
+        faltan = zk._ZK__tcp_length - 8 - len(datos)
+        if faltan > 0:
+            datos += zk._ZK__recieve_raw_data(faltan)
+        return datos, len(datos)
+    return None, struct.unpack('<I', datos[1:5])[0]
+
+
+def leer_bloques_buffer(zk, total: int):
+    """
+    Lee el buffer preparado con preparar_buffer en bloques de CMD_READ_BUFFER, como
+    read_with_buffer pero entregando cada bloque al recibirlo. Libera el buffer del
+    dispositivo al terminar (también si se deja de iterar).
+
+    Lanza:
+        NotImplementedError: Si la versión de pyzk no está verificada
+    """
+    if not compatible(zk, "_ZK__read_chunk", "free_data", "tcp"):
+        raise NotImplementedError(f"pyzk {'.'.join(map(str, VERSION_PYZK)) or '?'} no verificado "
+                                  f"para la lectura por bloques")
+    maximo = MAX_CHUNK if zk.tcp else 16 * 1024
+    try:
+        inicio = 0
+        while inicio < total:
+            tam = min(maximo, total - inicio)
+            yield zk._ZK__read_chunk(inicio, tam)
+            inicio += tam
+    finally:
+        zk.free_data()
+
+
+def leer_inicio_buffer(zk, comando: int, tam: int) -> Optional[bytes]:
+    """
+    Primeros tam bytes del buffer de un comando de lectura (p. ej. CMD_ATTLOG_RRQ,
+    incluidos los 4 bytes de tamaño total) sin descargar el resto: el dispositivo
+    prepara el buffer y solo se pide su primer bloque (CMD_READ_BUFFER).
+
+    Retorna:
+        bytes: Inicio del buffer, o None si la versión de pyzk no está verificada
+    """
+    if not compatible(zk, "_ZK__read_chunk", "free_data", "tcp"):
+        _advertir("leer el inicio de un buffer")
+        return None
+    preparado = preparar_buffer(zk, comando)
+    if preparado is None:
+        return None
+    datos, total = preparado
+    if datos is not None:
+        return datos[:tam]
+    for bloque in leer_bloques_buffer(zk, min(tam, total)):
+        return bloque
+
+
+def iniciar_captura(zk, timeout: float, usuarios: dict):
+    """
+    Captura de eventos en tiempo real como ZK.live_capture, pero con el mapa
+    user_id -> uid interno que ya tiene quien llama: live_capture lee todos los
+    usuarios del dispositivo (get_users) cada vez que se inicia. La captura
+    termina al poner zk.end_live_capture = True.
+
+    Retorna:
+        generator: Attendance por cada marcación y None cada timeout segundos sin
+                   eventos, o None si la versión de pyzk no está verificada
+    """
+    if not compatible(zk, "_ZK__sock", "_ZK__ack_ok", "_ZK__decode_timehex", "_ZK__timeout",
+                      "tcp", "is_enabled", "reg_event"):
+        _advertir("la captura en tiempo real sin leer los usuarios")
+        return None
+    return _capturar(zk, timeout, usuarios)
+
+
+def _capturar(zk, timeout: float, usuarios: dict):
+    estaba_habilitado = zk.is_enabled
+    zk.cancel_capture()
+    zk.verify_user()
+    if not zk.is_enabled:
+        zk.enable_device()
+    zk.reg_event(const.EF_ATTLOG)
+    zk._ZK__sock.settimeout(timeout)
+    zk.end_live_capture = False
+    while not zk.end_live_capture:
+        try:
+            paquete = zk._ZK__sock.recv(1032)
+        except SocketTimeout:
+            yield None
+            continue
+        zk._ZK__ack_ok()
+        if zk.tcp:
+            cabecera = struct.unpack('<4H', paquete[8:16])
+            datos = paquete[16:]
+        else:
+            cabecera = struct.unpack('<4H', paquete[:8])
+            datos = paquete[8:]
+        if cabecera[0] != const.CMD_REG_EVENT:
+            continue
+        # Mismos formatos de evento que live_capture en pyzk 0.9
+        while len(datos) >= 12:
+            if len(datos) == 12:
+                user_id, estado, punch, tiempo = struct.unpack('<IBB6s', datos)
+                datos = datos[12:]
+            elif len(datos) == 32:
+                user_id, estado, punch, tiempo = struct.unpack('<24sBB6s', datos[:32])
+                datos = datos[32:]
+            elif len(datos) == 36:
+                user_id, estado, punch, tiempo, _ = struct.unpack('<24sBB6s4s', datos[:36])
+                datos = datos[36:]
+            elif len(datos) >= 52:
+                user_id, estado, punch, tiempo, _ = struct.unpack('<24sBB6s20s', datos[:52])
+                datos = datos[52:]
+            else:
+                break
+            if isinstance(user_id, int):
+                user_id = str(user_id)
+            else:
+                user_id = user_id.split(b'\x00')[0].decode(errors='ignore')
+            uid = usuarios.get(user_id)
+            yield Attendance(user_id, zk._ZK__decode_timehex(tiempo), estado, punch,
+                             uid if uid is not None else int(user_id))
+    zk._ZK__sock.settimeout(zk._ZK__timeout)
+    zk.reg_event(0)
+    if not estaba_habilitado:
+        zk.disable_device()
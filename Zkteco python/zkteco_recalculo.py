@@ -0,0 +1,147 @@
+"""
+Recálculo Incremental de la Asistencia Diaria
+Mantiene AsistenciaDiaria al día a medida que entran marcaciones
+
+Características:
+- Toda ingesta (sincronización, captura en tiempo real, volcados, registro manual)
+  marca en dias_pendientes_recalculo los usuario-día que recibieron marcaciones,
+  en la misma transacción que las inserta
+- Este hilo revisa la lista cada RECALC_INTERVAL segundos (o al recibir un aviso),
+  junta los días pendientes y los recalcula por lotes de RECALC_BATCH_SIZE, incluidos
+  días pasados si un dispositivo sincroniza tarde
+- Solo se consultan los días afectados, nunca el mes completo
+- Hilo propio: no ocupa los workers de las peticiones HTTP
+
+Uso:
+    >>> from zkteco_recalculo import recalculador_incremental
+    >>> recalculador_incremental.iniciar()
+    >>> recalculador_incremental.avisar()  # Recalcular sin esperar el intervalo
+    >>> recalculador_incremental.detener()
+"""
+
+from datetime import datetime
+import threading
+import logging
+
+from models.database import SessionLocal
+from services.recalculo_service import RecalculoService
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class RecalculadorIncremental:
+    """
+    Procesa en segundo plano los días pendientes de recálculo
+    """
+
+    def __init__(self, intervalo: float = 5):
+        """
+        Parámetros:
+            intervalo (float): Segundos máximos entre revisiones de la lista de pendientes
+        """
+        self.intervalo = intervalo
+
+        self._hilo = None
+        self._detener = threading.Event()
+        self._aviso = threading.Event()
+        self._lock = threading.Lock()
+
+        self.lotes = 0
+        self.dias_recalculados = 0
+        self.ultima_ejecucion = None
+        self.ultimo_resultado = None
+        self.ultimo_error = None
+
+    # ---------------------------------------------------------
+    # API PÚBLICA
+    # ---------------------------------------------------------
+
+    def iniciar(self):
+        """
+        Inicia el hilo del recalculador (idempotente)
+        """
+        if self._hilo and self._hilo.is_alive():
+            return
+        self._detener.clear()
+        self._hilo = threading.Thread(target=self._bucle, name="zk-recalculo", daemon=True)
+        self._hilo.start()
+        logger.info(f"Recálculo incremental iniciado (intervalo {self.intervalo}s)")
+
+    def detener(self, timeout: float = 10):
+        """
+        Detiene el recalculador. Un lote en curso termina por su cuenta.
+        """
+        self._detener.set()
+        self._aviso.set()
+        if self._hilo:
+            self._hilo.join(timeout=timeout)
+            self._hilo = None
+        logger.info("Recálculo incremental detenido")
+
+    @property
+    def activo(self) -> bool:
+        return bool(self._hilo and self._hilo.is_alive())
+
+    def avisar(self):
+        """
+        Revisa los pendientes ya, sin esperar el intervalo
+        """
+        self._aviso.set()
+
+    def procesar(self) -> dict:
+        """
+        Recalcula lotes hasta vaciar la lista de pendientes.
+
+        Retorna:
+            dict: Lotes y días recalculados en esta pasada
+        """
+        total = {"lotes": 0, "dias_recalculados": 0}
+        with self._lock:
+            while not self._detener.is_set():
+                db = SessionLocal()
+                try:
+                    resultado = RecalculoService.procesar_pendientes(db)
+                finally:
+                    db.close()
+                if not resultado["pendientes_procesados"]:
+                    break
+                total["lotes"] += 1
+                total["dias_recalculados"] += resultado["dias_recalculados"]
+                self.lotes += 1
+                self.dias_recalculados += resultado["dias_recalculados"]
+                self.ultimo_resultado = resultado
+            self.ultima_ejecucion = datetime.now()
+        return total
+
+    def estado(self) -> dict:
+        return {
+            "activo": self.activo,
+            "intervalo": self.intervalo,
+            "lotes": self.lotes,
+            "dias_recalculados": self.dias_recalculados,
+            "ultima_ejecucion": self.ultima_ejecucion.isoformat() if self.ultima_ejecucion else None,
+            "ultimo_resultado": self.ultimo_resultado,
+            "ultimo_error": self.ultimo_error,
+        }
+
+    # ---------------------------------------------------------
+    # LÓGICA INTERNA
+    # ---------------------------------------------------------
+
+    def _bucle(self):
+        while not self._detener.is_set():
+            self._aviso.wait(self.intervalo)
+            self._aviso.clear()
+            if self._detener.is_set():
+                break
+            try:
+                self.procesar()
+                self.ultimo_error = None
+            except Exception as e:
+                self.ultimo_error = str(e)
+                logger.error(f"Error en el recálculo incremental: {e}")
+
+
+# Instancia global del recalculador
+recalculador_incremental = RecalculadorIncremental(intervalo=settings.RECALC_INTERVAL)
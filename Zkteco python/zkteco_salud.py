@@ -0,0 +1,257 @@
+"""
+Monitor de Salud de Dispositivos ZKTeco
+Sondea en segundo plano la disponibilidad y la latencia de la flota
+
+Características:
+- Controlado por HEALTH_PROBE_ENABLED y HEALTH_PROBE_INTERVAL
+- Sondea todos los dispositivos activos a la vez (un solo event loop asyncio)
+- Sondeo liviano: solo el handshake CMD_CONNECT / CMD_EXIT, sin deshabilitar el equipo
+- No sondea los dispositivos con una sesión abierta en el pool (firmwares de una sola
+  sesión): esa sesión ya demuestra que responden y el keepalive del pool la vigila
+- Guarda por dispositivo un historial circular de (instante, RTT, éxito, clase de error)
+- Las consultas de estado leen el historial en memoria: nunca tocan los dispositivos
+- Alimenta el circuit breaker del pool y, cuando un dispositivo vuelve a responder,
+  aplica las escrituras de usuarios que quedaron en cola
+
+Uso:
+    >>> from zkteco_salud import monitor_salud
+    >>> monitor_salud.iniciar()
+    >>> monitor_salud.estado()  # {dispositivo_id: {"alcanzable": True, "rtt_p50_ms": 12.3, ...}}
+    >>> monitor_salud.detener()
+"""
+
+from collections import deque
+from datetime import datetime
+import asyncio
+import math
+import threading
+import logging
+
+from models.database import SessionLocal
+from models.dispositivo import Dispositivo
+from zkteco_async import ZKTecoAsyncConnection, ZKErrorRespuesta
+from zkteco_pool import pool_conexiones
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+
+def clasificar_error(error: Exception) -> str:
+    """
+    Clase de error de un sondeo fallido (para agrupar causas en el estado)
+    """
+    if isinstance(error, asyncio.TimeoutError):
+        return "timeout"
+    if isinstance(error, ConnectionRefusedError):
+        return "rechazado"
+    if isinstance(error, ZKErrorRespuesta):
+        return "autenticacion" if "autenticado" in str(error) else "protocolo"
+    if isinstance(error, asyncio.IncompleteReadError):
+        return "desconexion"
+    if isinstance(error, OSError):
+        return "red"
+    return "desconocido"
+
+
+def percentil(valores: list, p: float):
+    """
+    Percentil por rango más cercano de una lista ya ordenada (None si está vacía)
+    """
+    if not valores:
+        return None
+    rango = math.ceil(p / 100 * len(valores))
+    return valores[max(rango, 1) - 1]
+
+
+class HistorialSalud:
+    """
+    Historial circular de sondeos de un dispositivo
+    """
+
+    def __init__(self, dispositivo_id: int, capacidad: int):
+        self.dispositivo_id = dispositivo_id
+        # (datetime, rtt_ms o None, éxito, clase de error o None)
+        self.muestras = deque(maxlen=capacidad)
+        self.fallos_consecutivos = 0
+
+    def registrar(self, rtt_ms, exito: bool, error: str = None):
+        self.muestras.append((datetime.now(), rtt_ms, exito, error))
+        self.fallos_consecutivos = 0 if exito else self.fallos_consecutivos + 1
+
+    def resumen(self) -> dict:
+        muestras = list(self.muestras)
+        if not muestras:
+            return {"alcanzable": None, "muestras": 0}
+
+        ultimo, rtt, exito, error = muestras[-1]
+        latencias = sorted(m[1] for m in muestras if m[2])
+        errores = {}
+        for m in muestras:
+            if not m[2]:
+                errores[m[3]] = errores.get(m[3], 0) + 1
+
+        return {
+            "alcanzable": exito,
+            "ultimo_sondeo": ultimo.isoformat(),
+            "ultimo_rtt_ms": rtt,
+            "ultimo_error": error,
+            "fallos_consecutivos": self.fallos_consecutivos,
+            "muestras": len(muestras),
+            "disponibilidad": round(len(latencias) / len(muestras), 3),
+            "rtt_p50_ms": percentil(latencias, 50),
+            "rtt_p95_ms": percentil(latencias, 95),
+            "errores": errores,
+        }
+
+
+class MonitorSalud:
+    """
+    Sondea periódicamente los dispositivos activos y conserva su historial
+    """
+
+    def __init__(self, intervalo: int = 60, timeout: float = 3, capacidad: int = 120):
+        """
+        Parámetros:
+            intervalo (int): Segundos entre rondas de sondeo
+            timeout (float): Segundos máximos por sondeo
+            capacidad (int): Muestras conservadas por dispositivo
+        """
+        self.intervalo = intervalo
+        self.timeout = timeout
+        self.capacidad = capacidad
+
+        self._historiales = {}
+        self._lock = threading.Lock()
+        self._hilo = None
+        self._detener = threading.Event()
+
+    # ---------------------------------------------------------
+    # API PÚBLICA
+    # ---------------------------------------------------------
+
+    def iniciar(self):
+        """
+        Inicia el hilo del monitor (idempotente)
+        """
+        if self._hilo and self._hilo.is_alive():
+            return
+        self._detener.clear()
+        self._hilo = threading.Thread(target=self._bucle, name="zk-health-probe", daemon=True)
+        self._hilo.start()
+        logger.info(f"Monitor de salud iniciado (intervalo {self.intervalo}s)")
+
+    def detener(self, timeout: float = 10):
+        """
+        Detiene el monitor. Una ronda en curso termina por su cuenta.
+        """
+        self._detener.set()
+        if self._hilo:
+            self._hilo.join(timeout=timeout)
+            self._hilo = None
+        logger.info("Monitor de salud detenido")
+
+    @property
+    def activo(self) -> bool:
+        return bool(self._hilo and self._hilo.is_alive())
+
+    def estado(self) -> dict:
+        """
+        Resumen por dispositivo: {dispositivo_id: {...}}
+        """
+        with self._lock:
+            historiales = list(self._historiales.values())
+        return {h.dispositivo_id: h.resumen() for h in historiales}
+
+    def sondear(self, dispositivos: list) -> dict:
+        """
+        Ejecuta una ronda de sondeo sobre los dispositivos indicados y registra los resultados.
+        Los que tienen una sesión abierta en el pool se omiten (conservan su historial).
+
+        Parámetros:
+            dispositivos (list): Tuplas (id, ip, puerto, password)
+
+        Retorna:
+            dict: Resumen por dispositivo tras la ronda
+        """
+        a_sondear = [d for d in dispositivos if not pool_conexiones.sesion_abierta(d[0])]
+        resultados = asyncio.run(self._sondear_todos(a_sondear)) if a_sondear else []
+        with self._lock:
+            vigentes = {id_ for id_, *_ in dispositivos}
+            # Los dispositivos eliminados o desactivados dejan de reportarse
+            for id_ in list(self._historiales):
+                if id_ not in vigentes:
+                    del self._historiales[id_]
+            for dispositivo_id, rtt_ms, exito, error in resultados:
+                historial = self._historiales.get(dispositivo_id)
+                if historial is None:
+                    historial = HistorialSalud(dispositivo_id, self.capacidad)
+                    self._historiales[dispositivo_id] = historial
+                historial.registrar(rtt_ms, exito, error)
+
+        # Los sondeos alimentan el circuit breaker y el timeout adaptativo del pool
+        for dispositivo_id, rtt_ms, exito, error in resultados:
+            pool_conexiones.registrar_sondeo(dispositivo_id, rtt_ms / 1000 if exito else None, exito, error)
+        return self.estado()
+
+    # ---------------------------------------------------------
+    # LÓGICA INTERNA
+    # ---------------------------------------------------------
+
+    async def _sondear_todos(self, dispositivos: list) -> list:
+        return await asyncio.gather(*(self._sondear_uno(*d) for d in dispositivos))
+
+    async def _sondear_uno(self, dispositivo_id: int, ip: str, puerto: int, password) -> tuple:
+        conexion = ZKTecoAsyncConnection(ip, puerto, timeout=self.timeout, password=password or 0)
+        try:
+            rtt = await asyncio.wait_for(conexion.sondear(), self.timeout * 2)
+            return dispositivo_id, round(rtt * 1000, 2), True, None
+        except Exception as e:
+            return dispositivo_id, None, False, clasificar_error(e)
+
+    def _dispositivos_activos(self) -> list:
+        db = SessionLocal()
+        try:
+            return [
+                (d.id, d.ip_address, d.puerto, d.password)
+                for d in db.query(Dispositivo).filter(Dispositivo.activo == True).all()
+            ]
+        finally:
+            db.close()
+
+    def _procesar_pendientes(self, alcanzables: list):
+        """
+        Aplica las escrituras de usuarios en cola de los dispositivos que respondieron
+        """
+        if not alcanzables:
+            return
+        from models.operacion_pendiente import OperacionPendiente
+        from services.usuario_service import UsuarioService
+
+        db = SessionLocal()
+        try:
+            if db.query(OperacionPendiente.id).filter(OperacionPendiente.dispositivo_id.in_(alcanzables)).first():
+                resultado = UsuarioService.procesar_operaciones_pendientes(db, alcanzables)
+                logger.info(f"Cola de usuarios: {resultado['operaciones_aplicadas']} operaciones aplicadas")
+        except Exception as e:
+            logger.error(f"Error al procesar la cola de usuarios: {str(e)}")
+        finally:
+            db.close()
+
+    def _bucle(self):
+        while not self._detener.is_set():
+            try:
+                dispositivos = self._dispositivos_activos()
+                if dispositivos:
+                    estado = self.sondear(dispositivos)
+                    self._procesar_pendientes([i for i, e in estado.items() if e.get("alcanzable")])
+            except Exception as e:
+                logger.error(f"Error en la ronda de sondeo: {str(e)}")
+            self._detener.wait(self.intervalo)
+
+
+# Instancia global del monitor
+monitor_salud = MonitorSalud(
+    intervalo=settings.HEALTH_PROBE_INTERVAL,
+    timeout=settings.HEALTH_PROBE_TIMEOUT,
+    capacidad=settings.HEALTH_PROBE_HISTORY
+)
@@ -0,0 +1,465 @@
+"""
+Simulador de Dispositivos ZKTeco
+Servidor TCP local que habla el protocolo de zkteco_tcp_protocol.py
+
+Permite ejercitar la sincronización de asistencias, la de usuarios y la de hora
+sin un terminal físico en la red: tanto pyzk (ZKTecoConnection) como
+ZKTecoAsyncConnection se conectan a él como a un equipo real.
+
+Soporta:
+- Handshake con session id y autenticación por contraseña (CMD_AUTH)
+- Deshabilitar/habilitar el equipo (lleva la cuenta del tiempo deshabilitado)
+- Lectura con buffer de marcaciones y usuarios en varios bloques
+- Escritura (individual y por lote) y borrado de usuarios, borrado de marcaciones
+- Lectura y ajuste de hora (con desfase configurable del reloj)
+- Eventos de marcación en tiempo real (CMD_REG_EVENT) con marcar_en_vivo()
+- Latencia, jitter, pérdida de paquetes y desconexiones configurables
+
+Uso:
+    >>> from zkteco_simulador import SimuladorFlota, ConfiguracionSimulador
+    >>> flota = SimuladorFlota([ConfiguracionSimulador(registros=10000) for _ in range(20)])
+    >>> direcciones = flota.iniciar()  # [('127.0.0.1', puerto), ...]
+    >>> ...
+    >>> flota.detener()
+
+Línea de comandos: python scripts/run_simulador.py --dispositivos 20 --registros 10000
+"""
+
+import asyncio
+import random
+import struct
+import threading
+import time
+import logging
+from datetime import datetime, timedelta
+
+import zkteco_tcp_protocol as protocolo
+from zkteco_tcp_protocol import ZKPacket
+
+logger = logging.getLogger(__name__)
+
+
+class ConfiguracionSimulador:
+    """
+    Parámetros de un dispositivo simulado
+    """
+
+    def __init__(self, registros=1000, usuarios=50, tam_registro=40, tam_usuario=72,
+                 proporcion_duplicados=0.0, inicio=None, intervalo=60,
+                 latencia=0.0, jitter=0.0, perdida=0.0, desconexion=0.0,
+                 password=0, desfase_reloj=0, serial=None, semilla=None, primer_user_id=1001):
+        """
+        Parámetros:
+            registros (int): Marcaciones almacenadas al iniciar
+            usuarios (int): Usuarios registrados (user_id consecutivos desde primer_user_id)
+            tam_registro (int): Formato de marcación del firmware (8, 16 o 40 bytes)
+            tam_usuario (int): Formato de usuario del firmware (28 o 72 bytes)
+            proporcion_duplicados (float): Fracción de marcaciones que repiten una anterior
+            inicio (datetime): Hora de la primera marcación (por defecto, hace 30 días)
+            intervalo (int): Segundos entre marcaciones consecutivas
+            latencia (float): Segundos de espera antes de cada respuesta
+            jitter (float): Variación aleatoria (±) de la latencia, en segundos
+            perdida (float): Probabilidad de no responder a un comando
+            desconexion (float): Probabilidad de cerrar la conexión al recibir un comando
+            password (int): Contraseña de comunicación (0 = sin contraseña)
+            desfase_reloj (float): Segundos de adelanto (+) o atraso (-) del reloj
+            serial (str): Número de serie (por defecto, uno derivado del puerto)
+            semilla (int): Semilla del generador aleatorio (resultados reproducibles)
+            primer_user_id (int): user_id del primer usuario (rangos distintos por dispositivo)
+        """
+        self.registros = registros
+        self.usuarios = usuarios
+        self.tam_registro = tam_registro
+        self.tam_usuario = tam_usuario
+        self.proporcion_duplicados = proporcion_duplicados
+        self.inicio = inicio
+        self.intervalo = intervalo
+        self.latencia = latencia
+        self.jitter = jitter
+        self.perdida = perdida
+        self.desconexion = desconexion
+        self.password = password
+        self.desfase_reloj = desfase_reloj
+        self.serial = serial
+        self.semilla = semilla
+        self.primer_user_id = primer_user_id
+
+
+class DispositivoSimulado:
+    """
+    Estado y atención de comandos de un terminal simulado
+    """
+
+    def __init__(self, configuracion: ConfiguracionSimulador):
+        self.configuracion = configuracion
+        self.puerto = None
+        self.serial = configuracion.serial
+        self.desfase_reloj = configuracion.desfase_reloj
+        self._aleatorio = random.Random(configuracion.semilla)
+
+        # Usuarios: uid -> (nombre, privilegio, password, grupo, user_id, tarjeta)
+        primero = configuracion.primer_user_id
+        self.usuarios = {
+            uid: (f"Usuario {primero + uid - 1}", 0, "", "", str(primero + uid - 1), 0)
+            for uid in range(1, configuracion.usuarios + 1)
+        }
+        # Marcaciones: (uid, user_id, timestamp, estado, punch)
+        self.marcaciones = []
+        inicio = configuracion.inicio or (datetime.now() - timedelta(days=30)).replace(microsecond=0)
+        self._proxima = inicio
+        self.agregar_marcaciones(configuracion.registros)
+
+        self._sesiones = 0
+        self._servidor = None
+        self._conexiones_abiertas = set()
+        self._suscritas = {}  # writer -> sesión suscrita a eventos (CMD_REG_EVENT)
+
+        # Estadísticas
+        self.conexiones = 0
+        self.comandos = 0
+        self.escrituras = 0
+        self.lecturas_usuarios = 0
+        self.deshabilitado_desde = None
+        self.segundos_deshabilitado = 0.0
+
+    # ---------------------------------------------------------
+    # API PÚBLICA
+    # ---------------------------------------------------------
+
+    def agregar_marcaciones(self, cantidad: int):
+        """
+        Agrega marcaciones nuevas al final de la memoria (como si se marcara en el equipo)
+        """
+        uids = sorted(self.usuarios)
+        if not uids:
+            return
+        for _ in range(cantidad):
+            if self.marcaciones and self._aleatorio.random() < self.configuracion.proporcion_duplicados:
+                self.marcaciones.append(self._aleatorio.choice(self.marcaciones))
+                continue
+            uid = self._aleatorio.choice(uids)
+            self.marcaciones.append((uid, self.usuarios[uid][4], self._proxima, 0, 0))
+            self._proxima += timedelta(seconds=self.configuracion.intervalo)
+
+    def marcar_en_vivo(self, uid: int) -> tuple:
+        """
+        Marcación del usuario uid en el equipo: se agrega a la memoria y se notifica a
+        las sesiones suscritas a eventos. Debe llamarse dentro del event loop de los
+        dispositivos (SimuladorFlota.ejecutar).
+
+        Retorna:
+            tuple: La marcación (uid, user_id, timestamp, estado, punch)
+        """
+        marcacion = (uid, self.usuarios[uid][4], self._proxima, 0, 0)
+        self._proxima += timedelta(seconds=self.configuracion.intervalo)
+        self.marcaciones.append(marcacion)
+        ts = marcacion[2]
+        evento = struct.pack('<24sBB6s4s', marcacion[1].encode(), 0, 0,
+                             bytes([ts.year - 2000, ts.month, ts.day, ts.hour, ts.minute, ts.second]), b'\x00' * 4)
+        for writer, sesion in list(self._suscritas.items()):
+            writer.write(ZKPacket(protocolo.CMD_REG_EVENT, evento, sesion["id"], 0).build_tcp())
+        return marcacion
+
+    def hora(self) -> datetime:
+        return (datetime.now() + timedelta(seconds=self.desfase_reloj)).replace(microsecond=0)
+
+    def estadisticas(self) -> dict:
+        deshabilitado = self.segundos_deshabilitado
+        if self.deshabilitado_desde is not None:
+            deshabilitado += time.monotonic() - self.deshabilitado_desde
+        return {
+            "puerto": self.puerto,
+            "serial": self.serial,
+            "usuarios": len(self.usuarios),
+            "registros": len(self.marcaciones),
+            "conexiones": self.conexiones,
+            "comandos": self.comandos,
+            "escrituras": self.escrituras,
+            "lecturas_usuarios": self.lecturas_usuarios,
+            "suscritas": len(self._suscritas),
+            "segundos_deshabilitado": round(deshabilitado, 3),
+        }
+
+    async def iniciar(self, host: str = "127.0.0.1", puerto: int = 0):
+        self._servidor = await asyncio.start_server(self._atender, host, puerto)
+        self.puerto = self._servidor.sockets[0].getsockname()[1]
+        if self.serial is None:
+            self.serial = f"SIM{self.puerto:05d}"
+        return host, self.puerto
+
+    async def detener(self):
+        if self._servidor:
+            self._servidor.close()
+            for writer in list(self._conexiones_abiertas):
+                writer.close()
+            await self._servidor.wait_closed()
+            self._servidor = None
+
+    # ---------------------------------------------------------
+    # LÓGICA INTERNA
+    # ---------------------------------------------------------
+
+    async def _atender(self, reader, writer):
+        self.conexiones += 1
+        self._conexiones_abiertas.add(writer)
+        self._sesiones = (self._sesiones % 0xFFFE) + 1
+        sesion = {"id": self._sesiones, "autenticado": not self.configuracion.password, "buffer": b'', "entrada": b'',
+                  "writer": writer}
+        try:
+            while True:
+                try:
+                    encabezado = await reader.readexactly(protocolo.TCP_HEADER_SIZE)
+                    paquete = ZKPacket.parse(await reader.readexactly(ZKPacket.parse_tcp_header(encabezado)))
+                except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+                    return
+
+                self.comandos += 1
+                if self._aleatorio.random() < self.configuracion.desconexion:
+                    return
+                if self._aleatorio.random() < self.configuracion.perdida:
+                    continue
+
+                respuestas = self._procesar(sesion, paquete['reply_code'], paquete['data'])
+
+                espera = self.configuracion.latencia + self._aleatorio.uniform(-1, 1) * self.configuracion.jitter
+                if espera > 0:
+                    await asyncio.sleep(espera)
+
+                # El dispositivo responde con el mismo reply_id que recibió
+                # (ZKPacket.build lo avanza en uno, por eso se resta aquí)
+                reply_id = (paquete['reply_id'] - 1) % protocolo.USHRT_MAX
+                writer.write(b''.join(
+                    ZKPacket(codigo, datos, sesion["id"], reply_id).build_tcp() for codigo, datos in respuestas
+                ))
+                await writer.drain()
+
+                if paquete['reply_code'] == protocolo.CMD_EXIT:
+                    return
+        finally:
+            if self.deshabilitado_desde is not None:
+                # Una sesión cortada no deja el equipo deshabilitado
+                self._habilitar()
+            self._conexiones_abiertas.discard(writer)
+            self._suscritas.pop(writer, None)
+            writer.close()
+
+    def _habilitar(self):
+        if self.deshabilitado_desde is not None:
+            self.segundos_deshabilitado += time.monotonic() - self.deshabilitado_desde
+            self.deshabilitado_desde = None
+
+    def _procesar(self, sesion: dict, comando: int, datos: bytes) -> list:
+        """
+        Atiende un comando y retorna la lista de paquetes de respuesta [(código, datos)]
+        """
+        ok = [(protocolo.CMD_ACK_OK, b'')]
+
+        if comando == protocolo.CMD_CONNECT:
+            return ok if sesion["autenticado"] else [(protocolo.CMD_ACK_UNAUTH, b'')]
+
+        if comando == protocolo.CMD_AUTH:
+            sesion["autenticado"] = datos[:4] == protocolo.make_commkey(self.configuracion.password, sesion["id"])
+            return ok if sesion["autenticado"] else [(protocolo.CMD_ACK_UNAUTH, b'')]
+
+        if not sesion["autenticado"]:
+            return [(protocolo.CMD_ACK_UNAUTH, b'')]
+
+        if comando == protocolo.CMD_DISABLE_DEVICE:
+            if self.deshabilitado_desde is None:
+                self.deshabilitado_desde = time.monotonic()
+            return ok
+
+        if comando == protocolo.CMD_ENABLE_DEVICE:
+            self._habilitar()
+            return ok
+
+        if comando == protocolo.CMD_GET_FREE_SIZES:
+            campos = [0] * 20
+            campos[4] = len(self.usuarios)
+            campos[8] = len(self.marcaciones)
+            campos[15] = 3000
+            campos[16] = 100000
+            return [(protocolo.CMD_ACK_OK, struct.pack('<20i', *campos))]
+
+        if comando == protocolo.CMD_PREPARE_BUFFER:
+            _, leido, _fct, _ext = struct.unpack('<bhii', datos[:11])
+            if leido == protocolo.CMD_ATTLOG_RRQ:
+                cuerpo = self._memoria_marcaciones()
+            elif leido == protocolo.CMD_USERTEMP_RRQ:
+                self.lecturas_usuarios += 1
+                cuerpo = self._memoria_usuarios()
+            else:
+                return [(protocolo.CMD_ACK_ERROR, b'')]
+            sesion["buffer"] = struct.pack('<I', len(cuerpo)) + cuerpo
+            # Los datos pequeños se envían en la misma respuesta
+            if len(sesion["buffer"]) <= 1024:
+                return [(protocolo.CMD_DATA, sesion["buffer"])]
+            return [(protocolo.CMD_ACK_OK, b'\x00' + struct.pack('<I', len(sesion["buffer"])) + b'\x00' * 4)]
+
+        if comando == protocolo.CMD_READ_BUFFER:
+            inicio, tam = struct.unpack('<ii', datos[:8])
+            return [(protocolo.CMD_DATA, sesion["buffer"][inicio:inicio + tam])]
+
+        if comando == protocolo.CMD_FREE_DATA:
+            sesion["buffer"] = b''
+            return ok
+
+        if comando == protocolo.CMD_PREPARE_DATA:
+            # El cliente anuncia un buffer que enviará en bloques CMD_DATA
+            sesion["entrada"] = b''
+            return ok
+
+        if comando == protocolo.CMD_DATA:
+            sesion["entrada"] += datos
+            return ok
+
+        if comando == protocolo.CMD_SAVE_USERTEMPS:
+            for uid, nombre, privilegio, password, grupo, user_id, tarjeta in protocolo.unpack_users_lote(sesion["entrada"]):
+                self.usuarios[uid] = (nombre, privilegio, password, grupo, user_id, tarjeta)
+            sesion["entrada"] = b''
+            self.escrituras += 1
+            return ok
+
+        if comando == protocolo.CMD_USER_WRQ:
+            self.escrituras += 1
+            for uid, nombre, privilegio, password, grupo, user_id, tarjeta in protocolo.unpack_users(
+                datos, self.configuracion.tam_usuario
+            ):
+                self.usuarios[uid] = (nombre, privilegio, password, grupo, user_id, tarjeta)
+            return ok
+
+        if comando == protocolo.CMD_DELETE_USER:
+            self.escrituras += 1
+            uid = struct.unpack('<h', datos[:2])[0]
+            if self.usuarios.pop(uid, None) is None:
+                return [(protocolo.CMD_ACK_ERROR, b'')]
+            return ok
+
+        if comando == protocolo.CMD_CLEAR_ATTLOG:
+            self.marcaciones = []
+            return ok
+
+        if comando == protocolo.CMD_GET_TIME:
+            return [(protocolo.CMD_ACK_OK, protocolo.encode_time(self.hora()))]
+
+        if comando == protocolo.CMD_SET_TIME:
+            nueva = protocolo.decode_time(datos[:4])
+            self.desfase_reloj = (nueva - datetime.now()).total_seconds()
+            return ok
+
+        if comando == protocolo.CMD_OPTIONS_RRQ:
+            nombre = datos.split(b'\x00')[0].decode(errors='ignore')
+            valores = {
+                '~SerialNumber': self.serial,
+                '~Platform': 'ZMM220_TFT',
+                '~DeviceName': 'Simulador',
+                'MAC': '00:17:61:00:%02x:%02x' % ((self.puerto or 0) >> 8 & 0xFF, (self.puerto or 0) & 0xFF),
+            }
+            return [(protocolo.CMD_ACK_OK, f"{nombre}={valores.get(nombre, '')}".encode() + b'\x00')]
+
+        if comando == protocolo.CMD_GET_VERSION:
+            return [(protocolo.CMD_ACK_OK, b'Ver 6.60 Sim\x00')]
+
+        if comando == protocolo.CMD_REG_EVENT:
+            if struct.unpack('<I', datos[:4])[0]:
+                self._suscritas[sesion["writer"]] = sesion
+            else:
+                self._suscritas.pop(sesion["writer"], None)
+            return ok
+
+        if comando == protocolo.CMD_ACK_OK:
+            # Confirmación de un evento: no lleva respuesta
+            return []
+
+        # CMD_EXIT, CMD_REFRESHDATA y demás: aceptar
+        return ok
+
+    def _memoria_marcaciones(self) -> bytes:
+        tam = self.configuracion.tam_registro
+        return b''.join(
+            protocolo.pack_attendance(tam, uid, user_id, timestamp, estado, punch)
+            for uid, user_id, timestamp, estado, punch in self.marcaciones
+        )
+
+    def _memoria_usuarios(self) -> bytes:
+        tam = self.configuracion.tam_usuario
+        return b''.join(
+            protocolo.pack_user(tam, uid, nombre, privilegio, password, grupo, user_id, tarjeta)
+            for uid, (nombre, privilegio, password, grupo, user_id, tarjeta) in sorted(self.usuarios.items())
+        )
+
+
+class SimuladorFlota:
+    """
+    Ejecuta varios dispositivos simulados en un event loop propio (hilo en segundo plano),
+    para usarlos desde código síncrono (servicios, pruebas, benchmarks).
+    """
+
+    def __init__(self, configuraciones: list, host: str = "127.0.0.1", direcciones_distintas: bool = False):
+        """
+        Parámetros:
+            configuraciones (list): Una ConfiguracionSimulador por dispositivo
+            host (str): Dirección en la que escuchan los dispositivos
+            direcciones_distintas (bool): Una IP de loopback por dispositivo (127.0.0.1,
+                127.0.0.2, ...), necesario para registrarlos en la BD, donde la IP es
+                única. Solo en Linux, donde toda la red 127.0.0.0/8 es local.
+        """
+        self.host = host
+        self.direcciones_distintas = direcciones_distintas
+        self.dispositivos = [DispositivoSimulado(c) for c in configuraciones]
+        self._loop = None
+        self._hilo = None
+        self.direcciones = []
+
+    def iniciar(self) -> list:
+        """
+        Inicia los dispositivos (puertos libres asignados por el sistema).
+
+        Retorna:
+            list: [(host, puerto)] en el mismo orden que las configuraciones
+        """
+        self._loop = asyncio.new_event_loop()
+        self._hilo = threading.Thread(target=self._loop.run_forever, name="zk-simulador", daemon=True)
+        self._hilo.start()
+        self.direcciones = self._ejecutar(self._iniciar_todos())
+        return self.direcciones
+
+    def detener(self):
+        if not self._loop:
+            return
+        self._ejecutar(self._detener_todos())
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._hilo.join(timeout=5)
+        self._loop.close()
+        self._loop = None
+
+    def ejecutar(self, funcion, *args):
+        """
+        Ejecuta funcion(*args) dentro del event loop de los dispositivos
+        (p. ej. agregar marcaciones mientras se sincroniza) y retorna su resultado.
+        """
+        async def llamar():
+            return funcion(*args)
+        return self._ejecutar(llamar())
+
+    def estadisticas(self) -> list:
+        return self.ejecutar(lambda: [d.estadisticas() for d in self.dispositivos])
+
+    def __enter__(self):
+        self.iniciar()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.detener()
+
+    def _ejecutar(self, corrutina):
+        return asyncio.run_coroutine_threadsafe(corrutina, self._loop).result()
+
+    async def _iniciar_todos(self):
+        if self.direcciones_distintas:
+            return [await d.iniciar(f"127.0.{(i + 1) // 256}.{(i + 1) % 256}") for i, d in enumerate(self.dispositivos)]
+        return [await d.iniciar(self.host) for d in self.dispositivos]
+
+    async def _detener_todos(self):
+        for dispositivo in self.dispositivos:
+            await dispositivo.detener()
@@ -6,15 +6,16 @@ Este módulo contiene la implementación de bajo nivel del protocolo TCP
 utilizado por los dispositivos ZKTeco. Incluye constantes, comandos y
 funciones auxiliares para construir y parsear paquetes TCP.
 
-NOTA: Este archivo es principalmente para referencia y entendimiento
-del protocolo. La librería pyzk ya implementa todo esto internamente.
+El formato es el mismo que usa la librería pyzk (y el SDK oficial), por lo
+que este módulo es la base del cliente asíncrono (zkteco_async.py).
 
 Autor: Sistema de Control de Asistencia
 Fecha: 2025-11-26
 """
 
 import struct
-from datetime import datetime
+import calendar
+from datetime import datetime, timedelta
 
 # ============================================================================
 # CONSTANTES DEL PROTOCOLO ZKTECO
@@ -26,33 +27,55 @@ CMD_CONNECT = 1000          # Establecer conexión con el dispositivo
 CMD_EXIT = 1001             # Cerrar conexión
 CMD_ENABLE_DEVICE = 1002    # Habilitar el dispositivo para operación normal
 CMD_DISABLE_DEVICE = 1003   # Deshabilitar el dispositivo temporalmente
+CMD_REFRESHDATA = 1013      # Recargar los datos en el dispositivo tras escribir
+CMD_AUTH = 1102             # Autenticación con contraseña de comunicación
 
 CMD_GET_TIME = 201          # Obtener la hora del dispositivo
 CMD_SET_TIME = 202          # Establecer la hora del dispositivo
 
 CMD_USER_WRQ = 8            # Escribir datos de usuario
-CMD_USERTEMP_RRQ = 9        # Leer plantillas de huellas
+CMD_USERTEMP_RRQ = 9        # Leer usuarios / plantillas de huellas
+CMD_OPTIONS_RRQ = 11        # Leer una opción de configuración ('~SerialNumber', ...)
 CMD_DELETE_USER = 18        # Eliminar un usuario
 CMD_DELETE_USERTEMP = 19    # Eliminar plantilla de huella
+CMD_SAVE_USERTEMPS = 110    # Guardar un lote de usuarios (y huellas) enviado con buffer
 
 CMD_ATTLOG_RRQ = 13         # Leer registros de asistencia
-CMD_CLEAR_ATTLOG = 14       # Limpiar registros de asistencia
+CMD_CLEAR_ATTLOG = 15       # Limpiar registros de asistencia
 
-CMD_GET_FREE_SIZES = 50     # Obtener espacio disponible
-CMD_GET_PLATFORM = 51       # Obtener información de plataforma
+CMD_GET_FREE_SIZES = 50     # Obtener contadores y capacidad de memoria
 CMD_GET_VERSION = 1100      # Obtener versión de firmware
-CMD_GET_DEVICE_NAME = 52    # Obtener nombre del dispositivo
-CMD_GET_SERIALNUMBER = 53   # Obtener número de serie
-CMD_GET_MAC = 54            # Obtener dirección MAC
+
+CMD_REG_EVENT = 500         # Suscribirse a eventos en tiempo real
+
+# Lectura con buffer (datos de más de un paquete)
+CMD_PREPARE_DATA = 1500     # Anuncia el tamaño de los datos que siguen
+CMD_DATA = 1501             # Paquete con datos
+CMD_FREE_DATA = 1502        # Liberar el buffer del dispositivo
+CMD_PREPARE_BUFFER = 1503   # Preparar el buffer de un comando de lectura
+CMD_READ_BUFFER = 1504      # Leer un bloque del buffer preparado
 
 # Estados de respuesta del dispositivo
 CMD_ACK_OK = 2000           # Comando ejecutado exitosamente
 CMD_ACK_ERROR = 2001        # Error al ejecutar comando
 CMD_ACK_DATA = 2002         # Respuesta con datos
+CMD_ACK_UNAUTH = 2005       # Se requiere autenticación (CMD_AUTH)
+
+# Parámetros de CMD_USERTEMP_RRQ / CMD_REG_EVENT
+FCT_USER = 5                # Tabla de usuarios
+EF_ATTLOG = 1               # Evento de marcación
 
 # Tamaños de paquete
 PACKET_HEADER_SIZE = 8      # Tamaño del encabezado del paquete (bytes)
+TCP_HEADER_SIZE = 8         # Tamaño del encabezado TCP que envuelve al paquete
 MAX_PACKET_SIZE = 65535     # Tamaño máximo de un paquete TCP
+MAX_CHUNK = 0xFFC0          # Tamaño máximo de un bloque de CMD_READ_BUFFER
+
+# Marca de inicio del encabezado TCP
+MACHINE_PREPARE_DATA_1 = 0x5050
+MACHINE_PREPARE_DATA_2 = 0x7D82
+
+USHRT_MAX = 65535
 
 # Puerto por defecto
 DEFAULT_PORT = 4370         # Puerto TCP estándar de ZKTeco
@@ -68,120 +91,206 @@ DEFAULT_TIMEOUT = 5         # Segundos
 class ZKPacket:
     """
     Representa un paquete del protocolo TCP de ZKTeco.
-    
-    Estructura de un paquete:
-    - Bytes 0-1: Inicio del paquete (siempre 0x5050)
-    - Bytes 2-3: ID de la sesión
-    - Bytes 4-5: Código de respuesta/comando
-    - Bytes 6-7: Checksum
-    - Bytes 8+: Datos del paquete
-    """
-    
-    def __init__(self, command, data=b'', session_id=0):
+
+    Estructura sobre TCP:
+    - Encabezado TCP (8 bytes):
+        - Bytes 0-1: 0x5050
+        - Bytes 2-3: 0x7D82
+        - Bytes 4-7: Longitud del paquete que sigue
+    - Paquete:
+        - Bytes 0-1: Código del comando/respuesta
+        - Bytes 2-3: Checksum
+        - Bytes 4-5: ID de la sesión
+        - Bytes 6-7: ID de respuesta (contador de paquetes)
+        - Bytes 8+: Datos del paquete
+    """
+
+    def __init__(self, command, data=b'', session_id=0, reply_id=0):
         """
         Inicializa un paquete ZKTeco.
-        
+
         Parámetros:
             command (int): Código del comando a enviar
             data (bytes): Datos adicionales del comando
             session_id (int): ID de la sesión actual
+            reply_id (int): ID de respuesta usado para el checksum
         """
         self.command = command
         self.data = data
         self.session_id = session_id
-    
+        self.reply_id = reply_id
+
     def build(self):
         """
-        Construye el paquete completo en formato binario para enviar por TCP.
-        
+        Construye el paquete completo en formato binario (sin encabezado TCP).
+
         Proceso:
-        1. Crear el encabezado con el comando y session_id
-        2. Calcular el checksum de los datos
+        1. Calcular el checksum del encabezado (con checksum en 0) + datos
+        2. Avanzar el reply_id (el paquete viaja con el siguiente valor)
         3. Combinar encabezado + datos
-        4. Retornar el paquete completo en bytes
-        
+
         Retorna:
-            bytes: Paquete completo listo para enviar
+            bytes: Paquete completo
         """
         # Paso 1: Calcular el checksum
-        # El checksum es la suma de todos los bytes de datos
-        checksum = self._calculate_checksum(self.data)
-        
-        # Paso 2: Construir el encabezado del paquete
-        # Formato: inicio(2) + session_id(2) + command(2) + checksum(2)
+        # Se calcula sobre el encabezado con checksum = 0 seguido de los datos
+        header = struct.pack('<4H', self.command, 0, self.session_id, self.reply_id)
+        checksum = self._calculate_checksum(header + self.data)
+
+        # Paso 2: Avanzar el contador de paquetes
+        reply_id = (self.reply_id + 1) % USHRT_MAX
+
+        # Paso 3: Construir el encabezado definitivo y combinarlo con los datos
         header = struct.pack(
-            '<HHHH',  # < = little-endian, H = unsigned short (2 bytes)
-            0x5050,   # Inicio del paquete (constante)
-            self.session_id,  # ID de sesión
+            '<4H',  # < = little-endian, H = unsigned short (2 bytes)
             self.command,     # Código del comando
-            checksum          # Checksum calculado
+            checksum,         # Checksum calculado
+            self.session_id,  # ID de sesión
+            reply_id          # ID de respuesta
         )
-        
-        # Paso 3: Combinar encabezado y datos
-        packet = header + self.data
-        
-        return packet
-    
+
+        return header + self.data
+
+    def build_tcp(self):
+        """
+        Construye el paquete con su encabezado TCP, listo para enviar por el socket.
+
+        Retorna:
+            bytes: Encabezado TCP + paquete
+        """
+        packet = self.build()
+        return struct.pack('<HHI', MACHINE_PREPARE_DATA_1, MACHINE_PREPARE_DATA_2, len(packet)) + packet
+
+    @staticmethod
+    def parse_tcp_header(header_bytes):
+        """
+        Valida el encabezado TCP y retorna la longitud del paquete que sigue.
+
+        Parámetros:
+            header_bytes (bytes): Los 8 bytes del encabezado TCP
+
+        Retorna:
+            int: Longitud del paquete
+        """
+        if len(header_bytes) < TCP_HEADER_SIZE:
+            raise ValueError("Encabezado TCP demasiado corto")
+
+        marca_1, marca_2, length = struct.unpack('<HHI', header_bytes[:TCP_HEADER_SIZE])
+        if marca_1 != MACHINE_PREPARE_DATA_1 or marca_2 != MACHINE_PREPARE_DATA_2:
+            raise ValueError("Encabezado TCP inválido")
+
+        return length
+
     @staticmethod
     def parse(packet_bytes):
         """
-        Parsea un paquete recibido del dispositivo.
-        
+        Parsea un paquete recibido (sin el encabezado TCP).
+
         Parámetros:
-            packet_bytes (bytes): Bytes recibidos del dispositivo
-        
+            packet_bytes (bytes): Bytes del paquete
+
         Retorna:
             dict: Diccionario con los componentes del paquete
         """
         # Verificar que el paquete tenga al menos el tamaño del encabezado
         if len(packet_bytes) < PACKET_HEADER_SIZE:
             raise ValueError("Paquete demasiado corto")
-        
+
         # Parsear el encabezado
-        # Formato: inicio(2) + session_id(2) + reply_code(2) + checksum(2)
-        start, session_id, reply_code, checksum = struct.unpack(
-            '<HHHH',
+        # Formato: comando(2) + checksum(2) + session_id(2) + reply_id(2)
+        reply_code, checksum, session_id, reply_id = struct.unpack(
+            '<4H',
             packet_bytes[:PACKET_HEADER_SIZE]
         )
-        
-        # Verificar que el inicio sea correcto
-        if start != 0x5050:
-            raise ValueError("Inicio de paquete inválido")
-        
+
         # Extraer los datos (todo después del encabezado)
         data = packet_bytes[PACKET_HEADER_SIZE:]
-        
+
         # Retornar los componentes parseados
         return {
             'session_id': session_id,
             'reply_code': reply_code,
             'checksum': checksum,
+            'reply_id': reply_id,
             'data': data
         }
-    
+
     @staticmethod
     def _calculate_checksum(data):
         """
-        Calcula el checksum de los datos.
-        
-        El checksum es simplemente la suma de todos los bytes,
-        tomando solo los 16 bits menos significativos.
-        
+        Calcula el checksum de los datos (algoritmo de zkemsdk.c).
+
+        Se suman los datos como palabras de 16 bits little-endian,
+        plegando el acumulado a 16 bits, y se toma el complemento.
+
         Parámetros:
             data (bytes): Datos para calcular checksum
-        
+
         Retorna:
             int: Checksum calculado (16 bits)
         """
-        # Sumar todos los bytes
-        checksum = sum(data)
-        
-        # Tomar solo los 16 bits menos significativos
-        checksum = checksum & 0xFFFF
-        
+        checksum = 0
+
+        # Sumar palabras de 16 bits
+        pares = len(data) // 2
+        for (palabra,) in struct.iter_unpack('<H', data[:pares * 2]):
+            checksum += palabra
+            if checksum > USHRT_MAX:
+                checksum -= USHRT_MAX
+
+        # Byte impar al final
+        if len(data) % 2:
+            checksum += data[-1]
+
+        while checksum > USHRT_MAX:
+            checksum -= USHRT_MAX
+
+        # Complemento
+        checksum = ~checksum
+        while checksum < 0:
+            checksum += USHRT_MAX
+
         return checksum
 
 
+def make_commkey(key, session_id, ticks=50):
+    """
+    Genera la clave de CMD_AUTH a partir de la contraseña de comunicación.
+
+    Algoritmo MakeKey de commpro.c.
+
+    Parámetros:
+        key (int): Contraseña de comunicación del dispositivo
+        session_id (int): ID de sesión entregado por CMD_CONNECT
+        ticks (int): Semilla (por defecto 50)
+
+    Retorna:
+        bytes: 4 bytes a enviar con CMD_AUTH
+    """
+    key = int(key)
+    session_id = int(session_id)
+
+    # Invertir el orden de los 32 bits de la contraseña
+    k = 0
+    for i in range(32):
+        if key & (1 << i):
+            k = (k << 1 | 1)
+        else:
+            k = k << 1
+    k += session_id
+
+    # Mezclar con 'ZKSO'
+    k = struct.unpack('BBBB', struct.pack('I', k & 0xFFFFFFFF))
+    k = struct.pack('BBBB', k[0] ^ ord('Z'), k[1] ^ ord('K'), k[2] ^ ord('S'), k[3] ^ ord('O'))
+    k = struct.unpack('HH', k)
+    k = struct.pack('HH', k[1], k[0])
+
+    # Mezclar con la semilla
+    b = 0xFF & ticks
+    k = struct.unpack('BBBB', k)
+    return struct.pack('BBBB', k[0] ^ b, k[1] ^ b, b, k[3] ^ b)
+
+
 # ============================================================================
 # FUNCIONES AUXILIARES PARA CODIFICACIÓN DE DATOS
 # ============================================================================
@@ -189,76 +298,75 @@ class ZKPacket:
 def encode_time(dt):
     """
     Codifica un objeto datetime en el formato que ZKTeco espera.
-    
-    ZKTeco usa un formato de 4 bytes para representar fecha/hora:
-    - Año: desde 2000
-    - Mes: 1-12
-    - Día: 1-31
-    - Hora: 0-23
-    - Minuto: 0-59
-    - Segundo: 0-59
-    
+
+    ZKTeco usa un entero de 4 bytes (segundos en un calendario de meses de
+    31 días contados desde el año 2000). Es el formato de CMD_GET_TIME,
+    CMD_SET_TIME y de los registros de asistencia.
+
     Parámetros:
         dt (datetime): Objeto datetime a codificar
-    
+
     Retorna:
         bytes: 4 bytes representando la fecha/hora
     """
-    # Codificar cada componente
-    year = dt.year - 2000  # Año relativo a 2000
-    month = dt.month
-    day = dt.day
-    hour = dt.hour
-    minute = dt.minute
-    second = dt.second
-    
-    # Empaquetar en 4 bytes
-    # Formato específico de ZKTeco
-    encoded = struct.pack(
-        'BBBBBB',  # 6 bytes unsigned
-        year, month, day, hour, minute, second
+    # Fórmula de EncodeTime (zkemsdk.c)
+    valor = (
+        ((dt.year % 100) * 12 * 31 + ((dt.month - 1) * 31) + dt.day - 1) *
+        (24 * 60 * 60) + (dt.hour * 60 + dt.minute) * 60 + dt.second
     )
-    
-    return encoded
+
+    return struct.pack('<I', valor)
 
 
 def decode_time(time_bytes):
     """
     Decodifica bytes de tiempo de ZKTeco a un objeto datetime.
-    
+
     Parámetros:
-        time_bytes (bytes): Bytes de tiempo del dispositivo
-    
+        time_bytes (bytes): 4 bytes de tiempo del dispositivo
+
     Retorna:
         datetime: Objeto datetime decodificado
     """
-    # Desempaquetar los bytes
-    year, month, day, hour, minute, second = struct.unpack(
-        'BBBBBB',
-        time_bytes[:6]
-    )
-    
-    # Crear objeto datetime
-    # Sumar 2000 al año
-    dt = datetime(
-        year + 2000,
-        month,
-        day,
-        hour,
-        minute,
-        second
-    )
-    
-    return dt
+    # Desempaquetar el entero y separar sus componentes
+    t = struct.unpack('<I', time_bytes[:4])[0]
+    second = t % 60
+    t //= 60
+    minute = t % 60
+    t //= 60
+    hour = t % 24
+    t //= 24
+    day = t % 31 + 1
+    t //= 31
+    month = t % 12 + 1
+    t //= 12
+
+    return datetime(t + 2000, month, day, hour, minute, second)
+
+
+def encode_timehex(dt):
+    """
+    Codifica un datetime en el formato de 6 bytes (año-2000, mes, día,
+    hora, minuto, segundo) que usan los eventos en tiempo real.
+    """
+    return struct.pack('6B', dt.year - 2000, dt.month, dt.day, dt.hour, dt.minute, dt.second)
+
+
+def decode_timehex(time_bytes):
+    """
+    Decodifica el formato de 6 bytes de los eventos en tiempo real.
+    """
+    year, month, day, hour, minute, second = struct.unpack('6B', time_bytes[:6])
+    return datetime(year + 2000, month, day, hour, minute, second)
 
 
 def encode_user_id(user_id):
     """
     Codifica un ID de usuario en el formato de ZKTeco.
-    
+
     Parámetros:
         user_id (str): ID del usuario
-    
+
     Retorna:
         bytes: ID codificado
     """
@@ -271,18 +379,413 @@ def encode_user_id(user_id):
 def decode_user_id(user_bytes):
     """
     Decodifica bytes de ID de usuario de ZKTeco.
-    
+
     Parámetros:
         user_bytes (bytes): Bytes del ID de usuario
-    
+
     Retorna:
         str: ID de usuario decodificado
     """
-    # Decodificar y remover el null terminator
-    user_id = user_bytes.rstrip(b'\x00').decode('ascii')
+    # Decodificar hasta el primer null terminator
+    user_id = bytes(user_bytes).split(b'\x00')[0].decode('ascii', errors='ignore')
     return user_id
 
 
+# ============================================================================
+# REGISTROS DE USUARIO
+# ============================================================================
+
+# Formatos de registro de usuario según el firmware
+USER_FORMAT_28 = '<HB5s8sIxBhI'       # uid, privilegio, password, nombre, tarjeta, grupo, zona, user_id
+USER_FORMAT_72 = '<HB8s24sIx7sx24s'   # uid, privilegio, password, nombre, tarjeta, grupo, user_id
+
+
+def pack_user(packet_size, uid, name, privilege=0, password='', group_id='', user_id='', card=0, encoding='UTF-8'):
+    """
+    Empaqueta un usuario para CMD_USER_WRQ (y para la tabla de usuarios).
+
+    Parámetros:
+        packet_size (int): 28 (firmware antiguo) o 72 bytes
+
+    Retorna:
+        bytes: Registro de usuario
+    """
+    if packet_size == 28:
+        return struct.pack(
+            USER_FORMAT_28, uid, privilege,
+            password.encode(encoding, errors='ignore'),
+            name.encode(encoding, errors='ignore'),
+            card, int(group_id or 0), 0, int(user_id)
+        )
+
+    return struct.pack(
+        USER_FORMAT_72, uid, privilege,
+        password.encode(encoding, errors='ignore'),
+        name.encode(encoding, errors='ignore'),
+        int(card), str(group_id).encode(), str(user_id).encode()
+    )
+
+
+# Formatos de usuario en los lotes de CMD_SAVE_USERTEMPS (1 byte de marca + registro)
+USER_BATCH_FORMAT_29 = '<BHB5s8sIxBhI'
+USER_BATCH_FORMAT_73 = '<BHB8s24sIB7sx24s'
+
+
+def pack_users_lote(packet_size, usuarios, encoding='UTF-8'):
+    """
+    Empaqueta un lote de usuarios para CMD_SAVE_USERTEMPS (sin huellas).
+
+    Parámetros:
+        packet_size (int): Tamaño del registro de usuario del dispositivo (28 o 72)
+        usuarios (list): Tuplas (uid, nombre, privilegio, password, grupo, user_id, tarjeta)
+
+    Retorna:
+        bytes: Buffer completo (encabezado de tamaños + usuarios)
+    """
+    registros = []
+    for uid, name, privilege, password, group_id, user_id, card in usuarios:
+        if packet_size == 28:
+            registros.append(struct.pack(
+                USER_BATCH_FORMAT_29, 2, uid, privilege,
+                password.encode(encoding, errors='ignore'), name.encode(encoding, errors='ignore'),
+                card, int(group_id or 0), 0, int(user_id)
+            ))
+        else:
+            registros.append(struct.pack(
+                USER_BATCH_FORMAT_73, 2, uid, privilege,
+                password.encode(encoding, errors='ignore'), name.encode(encoding, errors='ignore'),
+                card, 1, str(group_id).encode(encoding, errors='ignore'), str(user_id).encode(encoding, errors='ignore')
+            ))
+    datos = b''.join(registros)
+    # Tamaños de: usuarios, tabla de huellas, huellas
+    return struct.pack('<III', len(datos), 0, 0) + datos
+
+
+def unpack_users_lote(buffer, encoding='UTF-8'):
+    """
+    Decodifica los usuarios de un buffer de CMD_SAVE_USERTEMPS.
+
+    Retorna:
+        list: Tuplas (uid, nombre, privilegio, password, grupo, user_id, tarjeta)
+    """
+    tam_usuarios = struct.unpack('<I', buffer[:4])[0]
+    datos = buffer[12:12 + tam_usuarios]
+    usuarios = []
+    if tam_usuarios % 73 == 0:
+        for _marca, uid, privilege, password, name, card, _x, group_id, user_id in struct.iter_unpack(USER_BATCH_FORMAT_73, datos):
+            usuarios.append((
+                uid, name.split(b'\x00')[0].decode(encoding, errors='ignore').strip(), privilege,
+                password.split(b'\x00')[0].decode(encoding, errors='ignore'),
+                group_id.split(b'\x00')[0].decode(encoding, errors='ignore').strip(),
+                user_id.split(b'\x00')[0].decode(encoding, errors='ignore'), card
+            ))
+    else:
+        for _marca, uid, privilege, password, name, card, group_id, _zona, user_id in struct.iter_unpack(USER_BATCH_FORMAT_29, datos):
+            usuarios.append((
+                uid, name.split(b'\x00')[0].decode(encoding, errors='ignore').strip(), privilege,
+                password.split(b'\x00')[0].decode(encoding, errors='ignore'), str(group_id), str(user_id), card
+            ))
+    return usuarios
+
+
+def unpack_users(user_data, packet_size, encoding='UTF-8'):
+    """
+    Decodifica la tabla de usuarios (sin los 4 bytes de tamaño inicial).
+
+    Retorna:
+        list: Tuplas (uid, nombre, privilegio, password, grupo, user_id, tarjeta)
+    """
+    usuarios = []
+    formato = USER_FORMAT_28 if packet_size == 28 else USER_FORMAT_72
+    util = len(user_data) - len(user_data) % packet_size
+
+    for campos in struct.iter_unpack(formato, user_data[:util]):
+        if packet_size == 28:
+            uid, privilege, password, name, card, group_id, _zona, user_id = campos
+            group_id = str(group_id)
+            user_id = str(user_id)
+        else:
+            uid, privilege, password, name, card, group_id, user_id = campos
+            group_id = group_id.split(b'\x00')[0].decode(encoding, errors='ignore').strip()
+            user_id = user_id.split(b'\x00')[0].decode(encoding, errors='ignore')
+
+        password = password.split(b'\x00')[0].decode(encoding, errors='ignore')
+        name = name.split(b'\x00')[0].decode(encoding, errors='ignore').strip()
+        if not name:
+            name = "NN-%s" % user_id
+
+        usuarios.append((uid, name, privilege, password, group_id, user_id, card))
+
+    return usuarios
+
+
+# ============================================================================
+# REGISTROS DE ASISTENCIA
+# ============================================================================
+
+# Formatos de registro de asistencia según el firmware
+ATTENDANCE_FORMAT_8 = '<HB4sB'          # uid, estado, tiempo, punch
+ATTENDANCE_FORMAT_16 = '<I4sBB2sI'      # user_id, tiempo, estado, punch, reservado, workcode
+ATTENDANCE_FORMAT_40 = '<H24sB4sB8s'    # uid, user_id, estado, tiempo, punch, reservado
+
+
+def pack_attendance(record_size, uid, user_id, timestamp, status=1, punch=0):
+    """
+    Empaqueta un registro de asistencia (formato de la memoria del dispositivo).
+    """
+    if record_size == 8:
+        return struct.pack(ATTENDANCE_FORMAT_8, uid, status, encode_time(timestamp), punch)
+    if record_size == 16:
+        return struct.pack(ATTENDANCE_FORMAT_16, int(user_id), encode_time(timestamp), status, punch, b'', 0)
+    return struct.pack(ATTENDANCE_FORMAT_40, uid, str(user_id).encode(), status, encode_time(timestamp), punch, b'')
+
+
+def unpack_attendance(attendance_data, record_size):
+    """
+    Decodifica la memoria de marcaciones (sin los 4 bytes de tamaño inicial).
+
+    Retorna:
+        list: Tuplas (uid, user_id, timestamp, estado, punch). En los formatos
+              de 8 y 16 bytes falta uno de los dos identificadores (None).
+    """
+    registros = []
+    util = len(attendance_data) - len(attendance_data) % record_size
+
+    if record_size == 8:
+        for uid, status, tiempo, punch in struct.iter_unpack(ATTENDANCE_FORMAT_8, attendance_data[:util]):
+            registros.append((uid, None, decode_time(tiempo), status, punch))
+    elif record_size == 16:
+        for user_id, tiempo, status, punch, _reservado, _workcode in struct.iter_unpack(ATTENDANCE_FORMAT_16, attendance_data[:util]):
+            registros.append((None, str(user_id), decode_time(tiempo), status, punch))
+    else:
+        for uid, user_id, status, tiempo, punch, _reservado in struct.iter_unpack(ATTENDANCE_FORMAT_40, attendance_data[:util]):
+            registros.append((uid, decode_user_id(user_id), decode_time(tiempo), status, punch))
+
+    return registros
+
+
+# ============================================================================
+# DECODIFICACIÓN EN STREAMING DE LA MEMORIA DE MARCACIONES
+# ============================================================================
+
+# Los "epoch" de este módulo son segundos desde 1970-01-01 en la hora local del
+# dispositivo (la hora de pared, sin zona horaria), igual que los datetime naive
+# que se guardan en la base de datos.
+_EPOCH_BASE = datetime(1970, 1, 1)
+EPOCH_MAXIMO_VALIDO = calendar.timegm((2050, 12, 31, 23, 59, 59))  # Fechas posteriores son basura del equipo
+
+
+def datetime_a_epoch(dt):
+    """Convierte un datetime naive (hora del dispositivo) a epoch"""
+    return calendar.timegm(dt.timetuple())
+
+
+def epoch_a_datetime(epoch):
+    """Convierte un epoch (hora del dispositivo) a datetime naive"""
+    return _EPOCH_BASE + timedelta(seconds=epoch)
+
+
+# Posición del campo de hora dentro de cada formato de marcación
+DESPLAZAMIENTO_HORA = {8: 3, 16: 4, 40: 27}
+
+
+class DecodificadorAsistencias:
+    """
+    Decodifica la memoria de marcaciones por bloques, sin materializarla.
+
+    Recibe los bloques tal como llegan del dispositivo (el primero empieza con
+    los 4 bytes de tamaño total) y produce tuplas (uid, epoch, estado, punch),
+    donde uid es el user_id numérico del empleado (la columna Asistencia.uid).
+    Recorre cada bloque con memoryview + struct.iter_unpack: solo se guarda
+    entre bloques el resto de un registro partido, así que la memoria usada no
+    depende de la cantidad de registros.
+
+    El filtro de la marca de agua se aplica al decodificar. Se entrega un
+    registro si está dentro de [epoch_min, epoch_max) y, cuando hay marca_epoch,
+    si su posición es >= indice_desde o su epoch es > marca_epoch (la memoria
+    pudo haberse borrado).
+
+    Mientras decodifica lleva estadísticas de TODOS los registros (total,
+    maximo_epoch de los válidos, invalidos, primer_epoch), que es lo que necesita
+    la marca de agua, aunque el registro no pase el filtro.
+
+    Con con_posicion=True cada tupla empieza con la posición del registro en la
+    memoria del dispositivo (posicion, uid, epoch, estado, punch), lo que permite
+    guardar puntos de control de la ingesta.
+
+    Uso:
+        >>> decodificador = DecodificadorAsistencias(conteos['registros'], marca_epoch=ultimo)
+        >>> for bloque in bloques:
+        >>>     for uid, epoch, estado, punch in decodificador.alimentar(bloque):
+        >>>         ...
+    """
+
+    def __init__(self, registros, mapa_uid=None, indice_desde=0, marca_epoch=None,
+                 epoch_min=None, epoch_max=None, bloques=()):
+        """
+        Parámetros:
+            registros (int): Cantidad de registros informada por CMD_GET_FREE_SIZES
+            mapa_uid (dict): uid interno -> user_id, solo necesario con registros de 8 bytes
+            indice_desde (int): Posición desde la que los registros son nuevos
+            marca_epoch (int): Epoch de la última marcación ya ingerida
+            epoch_min (int), epoch_max (int): Rango [min, max) de fechas a entregar
+            bloques (iterable): Bloques a decodificar al iterar el objeto
+        """
+        self.registros = registros
+        self.mapa_uid = mapa_uid or {}
+        self.indice_desde = indice_desde
+        self.marca_epoch = marca_epoch
+        self.epoch_min = epoch_min
+        self.epoch_max = epoch_max
+        self.bloques = bloques
+        self.con_posicion = False
+
+        self.tam_registro = None
+        self.total = 0          # Registros decodificados (todos)
+        self.invalidos = 0      # Fechas imposibles o user_id no numérico
+        self.maximo_epoch = None
+        self.primer_epoch = None  # Hora del registro 0: identifica el contenido de la memoria
+
+        self._restante = None   # Bytes de datos aún por llegar (None = falta el tamaño)
+        self._resto = b''
+        self._dias = {}         # Fecha codificada (días) -> epoch de la medianoche
+        self._user_ids = {}     # user_id crudo (40 bytes) -> int
+        self._uids = None       # uid interno -> user_id numérico (8 bytes)
+
+    def __iter__(self):
+        for bloque in self.bloques:
+            yield from self.alimentar(bloque)
+
+    def alimentar(self, bloque):
+        """
+        Decodifica un bloque y produce los registros que pasan el filtro
+        """
+        vista = memoryview(bloque)
+        if self._resto:
+            vista = memoryview(self._resto + bytes(vista))
+            self._resto = b''
+
+        if self._restante is None:
+            if len(vista) < 4:
+                self._resto = bytes(vista)
+                return
+            self._restante = struct.unpack_from('<I', vista)[0]
+            vista = vista[4:]
+            self.tam_registro = self._tamano_registro(self._restante)
+            if self.tam_registro is None:
+                self._restante = 0
+                return
+
+        vista = vista[:self._restante]
+        util = len(vista) - len(vista) % self.tam_registro
+        self._restante -= util
+        if util < len(vista):
+            self._resto = bytes(vista[util:])
+
+        yield from self._decodificar(vista[:util])
+
+    def _tamano_registro(self, tam_buffer):
+        """
+        Tamaño de cada registro (None si el buffer está vacío).
+
+        Sin bloqueo (ZK_READ_LOCK_MODE="nunca") el conteo y el buffer se leen en
+        momentos distintos y pueden no coincidir: si la división no es exacta se
+        usa el formato que divide el buffer con la cantidad más cercana al conteo.
+
+        Lanza:
+            ValueError: Si ningún formato divide el buffer
+        """
+        if not tam_buffer:
+            return None
+        if self.registros and tam_buffer % self.registros == 0 \
+                and tam_buffer // self.registros in DESPLAZAMIENTO_HORA:
+            return tam_buffer // self.registros
+        candidatos = [tam for tam in (40, 16, 8) if tam_buffer % tam == 0]
+        if not candidatos:
+            raise ValueError(f"Buffer de marcaciones de {tam_buffer} bytes no corresponde "
+                             f"a ningún formato ({self.registros} registros informados)")
+        return min(candidatos, key=lambda t: abs(tam_buffer // t - self.registros))
+
+    def _epoch(self, tiempo):
+        dia, segundos = divmod(tiempo, 86400)
+        base = self._dias.get(dia)
+        if base is None:
+            t = dia
+            day = t % 31 + 1
+            t //= 31
+            month = t % 12 + 1
+            year = t // 12 + 2000
+            try:
+                base = datetime_a_epoch(datetime(year, month, day))
+            except ValueError:
+                base = -1  # Fecha imposible (p. ej. 31 de febrero)
+            self._dias[dia] = base
+        return base + segundos if base >= 0 else None
+
+    def _user_id(self, crudo):
+        valor = self._user_ids.get(crudo, False)
+        if valor is False:
+            try:
+                valor = int(crudo.split(b'\x00')[0])
+            except ValueError:
+                valor = None
+            self._user_ids[crudo] = valor
+        return valor
+
+    def _decodificar(self, vista):
+        tam = self.tam_registro
+        indice = self.total
+        desde = self.indice_desde
+        marca = self.marca_epoch
+        con_posicion = self.con_posicion
+        minimo = self.epoch_min
+        maximo = self.epoch_max
+        mayor = self.maximo_epoch if self.maximo_epoch is not None else -1
+
+        if indice == 0 and len(vista) >= tam:
+            self.primer_epoch = self._epoch(struct.unpack_from('<I', vista, DESPLAZAMIENTO_HORA[tam])[0])
+
+        if tam == 8:
+            if self._uids is None:
+                self._uids = {
+                    uid: int(user_id) for uid, user_id in self.mapa_uid.items() if str(user_id).isdigit()
+                }
+            filas = ((self._uids.get(uid), tiempo, status, punch)
+                     for uid, status, tiempo, punch in struct.iter_unpack('<HBIB', vista))
+        elif tam == 16:
+            filas = struct.iter_unpack('<IIBB6x', vista)
+        else:
+            filas = ((self._user_id(user_id), tiempo, status, punch)
+                     for _uid, user_id, status, tiempo, punch in struct.iter_unpack('<H24sBIB8x', vista))
+
+        for uid, tiempo, status, punch in filas:
+            posicion = indice
+            indice += 1
+            epoch = self._epoch(tiempo)
+            if epoch is None or epoch > EPOCH_MAXIMO_VALIDO:
+                self.invalidos += 1
+                continue
+            if epoch > mayor:
+                mayor = epoch
+            if uid is None:
+                self.invalidos += 1
+                continue
+            if marca is not None and posicion < desde and epoch <= marca:
+                continue
+            if minimo is not None and epoch < minimo:
+                continue
+            if maximo is not None and epoch >= maximo:
+                continue
+            if con_posicion:
+                yield posicion, uid, epoch, status, punch
+            else:
+                yield uid, epoch, status, punch
+
+        self.total = indice
+        if mayor >= 0:
+            self.maximo_epoch = mayor
+
+
 # ============================================================================
 # INFORMACIÓN DE REFERENCIA
 # ============================================================================
@@ -292,30 +795,37 @@ FLUJO DE COMUNICACIÓN TCP CON ZKTECO:
 
 1. CONEXIÓN:
    Cliente → Dispositivo: CMD_CONNECT
-   Dispositivo → Cliente: CMD_ACK_OK + session_id
-   
+   Dispositivo → Cliente: CMD_ACK_OK + session_id (en el encabezado)
+   Si el dispositivo tiene contraseña responde CMD_ACK_UNAUTH y el cliente
+   envía CMD_AUTH + make_commkey(password, session_id)
+
 2. DESHABILITAR DISPOSITIVO (para operaciones):
    Cliente → Dispositivo: CMD_DISABLE_DEVICE
    Dispositivo → Cliente: CMD_ACK_OK
-   
+
 3. OPERACIONES (ejemplos):
-   
+
    a) Obtener hora:
       Cliente → Dispositivo: CMD_GET_TIME
-      Dispositivo → Cliente: CMD_ACK_OK + datos de hora
-   
-   b) Obtener asistencias:
-      Cliente → Dispositivo: CMD_ATTLOG_RRQ
-      Dispositivo → Cliente: CMD_ACK_DATA + registros (puede ser múltiples paquetes)
-   
+      Dispositivo → Cliente: CMD_ACK_OK + 4 bytes de hora
+
+   b) Obtener asistencias (lectura con buffer):
+      Cliente → Dispositivo: CMD_PREPARE_BUFFER (CMD_ATTLOG_RRQ)
+      Dispositivo → Cliente: CMD_DATA + datos (si caben en un paquete)
+                             o CMD_ACK_OK + tamaño total
+      Cliente → Dispositivo: CMD_READ_BUFFER (inicio, tamaño) por cada bloque
+      Dispositivo → Cliente: CMD_DATA, o CMD_PREPARE_DATA + CMD_DATA + CMD_ACK_OK
+      Cliente → Dispositivo: CMD_FREE_DATA
+
    c) Agregar usuario:
       Cliente → Dispositivo: CMD_USER_WRQ + datos de usuario
       Dispositivo → Cliente: CMD_ACK_OK
-   
+      Cliente → Dispositivo: CMD_REFRESHDATA
+
 4. HABILITAR DISPOSITIVO:
    Cliente → Dispositivo: CMD_ENABLE_DEVICE
    Dispositivo → Cliente: CMD_ACK_OK
-   
+
 5. DESCONEXIÓN:
    Cliente → Dispositivo: CMD_EXIT
    Dispositivo → Cliente: CMD_ACK_OK
@@ -324,8 +834,8 @@ NOTAS IMPORTANTES:
 - Todos los números se envían en formato little-endian
 - Los strings se terminan con byte null (\\x00)
 - El dispositivo puede enviar datos en múltiples paquetes
-- Siempre verificar el checksum de los paquetes recibidos
 - El session_id debe mantenerse durante toda la sesión
+- El reply_id de cada respuesta es el que se usa en el siguiente comando
 """
 
 # ============================================================================
@@ -334,15 +844,14 @@ NOTAS IMPORTANTES:
 
 if __name__ == "__main__":
     """
-    Este código es solo para referencia del protocolo.
-    Para uso real, utiliza la clase ZKTecoConnection que implementa
-    todo esto usando la librería pyzk.
+    Muestra los comandos principales y ejemplos de codificación.
+    Para uso real, utiliza ZKTecoConnection (pyzk) o ZKTecoAsyncConnection.
     """
-    
+
     print("="*80)
     print("PROTOCOLO TCP DE ZKTECO - INFORMACIÓN DE REFERENCIA")
     print("="*80)
-    
+
     print("\nComandos principales:")
     print(f"  CMD_CONNECT: {CMD_CONNECT}")
     print(f"  CMD_DISABLE_DEVICE: {CMD_DISABLE_DEVICE}")
@@ -350,23 +859,24 @@ if __name__ == "__main__":
     print(f"  CMD_GET_TIME: {CMD_GET_TIME}")
     print(f"  CMD_ATTLOG_RRQ: {CMD_ATTLOG_RRQ}")
     print(f"  CMD_USER_WRQ: {CMD_USER_WRQ}")
-    
+
     print("\nRespuestas del dispositivo:")
     print(f"  CMD_ACK_OK: {CMD_ACK_OK}")
     print(f"  CMD_ACK_ERROR: {CMD_ACK_ERROR}")
     print(f"  CMD_ACK_DATA: {CMD_ACK_DATA}")
-    
+
     print("\nEjemplo de construcción de paquete:")
-    packet = ZKPacket(CMD_CONNECT, session_id=0)
-    packet_bytes = packet.build()
+    packet = ZKPacket(CMD_CONNECT, session_id=0, reply_id=USHRT_MAX - 1)
+    packet_bytes = packet.build_tcp()
     print(f"  Paquete CMD_CONNECT: {packet_bytes.hex()}")
-    
+
     print("\nEjemplo de codificación de tiempo:")
-    now = datetime.now()
+    now = datetime.now().replace(microsecond=0)
     encoded_time = encode_time(now)
     print(f"  Tiempo actual: {now}")
     print(f"  Codificado: {encoded_time.hex()}")
-    
+    print(f"  Decodificado: {decode_time(encoded_time)}")
+
     print("\n" + "="*80)
-    print("Para uso real, consulta zkteco_connection.py y ejemplo_uso.py")
+    print("Para uso real, consulta zkteco_connection.py, zkteco_async.py y ejemplo_uso.py")
     print("="*80)
@@ -0,0 +1,374 @@
+"""
+Captura de Marcaciones en Tiempo Real
+Suscripción a los eventos de los dispositivos ZKTeco y difusión a clientes
+
+Cada dispositivo activo tiene un hilo que mantiene su sesión del pool en modo
+captura (CMD_REG_EVENT). Cada marcación recibida se guarda de inmediato en la
+base de datos y se publica en el difusor, del que se alimentan los clientes
+conectados por Server-Sent Events.
+
+Los dispositivos en línea no necesitan la descarga periódica de asistencias:
+el planificador de sincronización automática los omite mientras la captura
+esté activa.
+
+Si otra operación necesita el dispositivo (sincronizar usuarios, hora, etc.),
+la captura cede la sesión del pool y se reanuda al terminar. Mientras está cedida
+el dispositivo figura fuera de línea. Antes de reanudarla se compara la cantidad
+de registros del equipo con la esperada (la del inicio de la captura más las
+marcaciones recibidas): solo si difiere, una sincronización incremental recupera
+lo marcado durante la pausa.
+
+Reanudar es barato: el mapa de usuarios del dispositivo (user_id -> uid) queda en
+caché y solo se vuelve a leer si cambia la cantidad de usuarios, y cada marcación
+se inserta sola, verificando el usuario contra un caché de uids conocidos.
+
+Uso:
+    >>> from zkteco_tiempo_real import captura_tiempo_real, difusor_eventos
+    >>> captura_tiempo_real.iniciar()
+    >>> suscripcion = difusor_eventos.suscribir()  # dentro del event loop
+"""
+
+import asyncio
+import threading
+import time
+import logging
+
+from models.database import SessionLocal
+from models.dispositivo import Dispositivo
+from models.usuario import Usuario
+from services.asistencia_service import AsistenciaService
+from zkteco_pool import pool_conexiones
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class Suscripcion:
+    """
+    Cola acotada de eventos de un cliente.
+    Si el cliente no consume a tiempo se descartan los eventos más antiguos.
+    """
+
+    def __init__(self, loop, dispositivo_id=None, capacidad: int = 100):
+        self.loop = loop
+        self.dispositivo_id = dispositivo_id  # None = todos los dispositivos
+        self.cola = asyncio.Queue(maxsize=capacidad)
+        self.descartados = 0
+
+
+class DifusorEventos:
+    """
+    Publica eventos desde cualquier hilo hacia las suscripciones asyncio
+    """
+
+    def __init__(self, capacidad: int = 100):
+        self.capacidad = capacidad
+        self._suscripciones = set()
+        self._lock = threading.Lock()
+
+    def suscribir(self, dispositivo_id: int = None) -> Suscripcion:
+        """
+        Crea una suscripción. Debe llamarse desde el event loop que la consumirá.
+        """
+        suscripcion = Suscripcion(asyncio.get_running_loop(), dispositivo_id, self.capacidad)
+        with self._lock:
+            self._suscripciones.add(suscripcion)
+        return suscripcion
+
+    def cancelar(self, suscripcion: Suscripcion):
+        with self._lock:
+            self._suscripciones.discard(suscripcion)
+        if suscripcion.descartados:
+            logger.info(f"Suscripción cerrada con {suscripcion.descartados} eventos descartados")
+
+    def publicar(self, evento: dict):
+        """
+        Entrega el evento a las suscripciones interesadas (no bloquea)
+        """
+        with self._lock:
+            suscripciones = list(self._suscripciones)
+        for suscripcion in suscripciones:
+            if suscripcion.dispositivo_id not in (None, evento.get("dispositivo_id")):
+                continue
+            try:
+                suscripcion.loop.call_soon_threadsafe(self._entregar, suscripcion, evento)
+            except RuntimeError:
+                # El event loop del cliente ya no existe
+                self.cancelar(suscripcion)
+
+    @staticmethod
+    def _entregar(suscripcion: Suscripcion, evento: dict):
+        if suscripcion.cola.full():
+            suscripcion.cola.get_nowait()
+            suscripcion.descartados += 1
+        suscripcion.cola.put_nowait(evento)
+
+    def total_suscripciones(self) -> int:
+        with self._lock:
+            return len(self._suscripciones)
+
+
+class CapturaTiempoReal:
+    """
+    Mantiene la captura de eventos de todos los dispositivos activos
+    """
+
+    def __init__(self, difusor: DifusorEventos, timeout_evento: int = 1,
+                 reintento: int = 30, refresco: int = 60):
+        """
+        Parámetros:
+            difusor (DifusorEventos): Destino de los eventos capturados
+            timeout_evento (int): Segundos de espera por evento (cada cuánto se revisa si ceder la sesión)
+            reintento (int): Segundos base antes de reintentar un dispositivo fuera de línea
+            refresco (int): Segundos entre revisiones de la lista de dispositivos activos
+        """
+        self.difusor = difusor
+        self.timeout_evento = timeout_evento
+        self.reintento = reintento
+        self.refresco = refresco
+
+        self._hilos = {}  # dispositivo_id -> (Thread, Event)
+        self._en_linea = {}  # dispositivo_id -> bool
+        self._eventos = {}  # dispositivo_id -> marcaciones recibidas
+        self._usuarios = {}  # dispositivo_id -> (cantidad de usuarios, {user_id: uid interno})
+        self._uids_conocidos = set()  # Usuario.uid existentes en la BD
+        self._lock = threading.Lock()
+        self._hilo = None
+        self._detener = threading.Event()
+
+    # ---------------------------------------------------------
+    # API PÚBLICA
+    # ---------------------------------------------------------
+
+    def iniciar(self):
+        """
+        Inicia el supervisor de captura (idempotente)
+        """
+        if self._hilo and self._hilo.is_alive():
+            return
+        self._detener.clear()
+        self._hilo = threading.Thread(target=self._supervisar, name="zk-live-capture", daemon=True)
+        self._hilo.start()
+        logger.info("Captura en tiempo real iniciada")
+
+    def detener(self, timeout: float = 10):
+        """
+        Detiene la captura de todos los dispositivos y libera sus sesiones
+        """
+        self._detener.set()
+        if self._hilo:
+            self._hilo.join(timeout=timeout)
+            self._hilo = None
+        with self._lock:
+            hilos = list(self._hilos.values())
+            self._hilos.clear()
+        for hilo, _ in hilos:
+            hilo.join(timeout=self.timeout_evento * 3)
+        logger.info("Captura en tiempo real detenida")
+
+    def en_linea(self, dispositivo_id: int) -> bool:
+        """
+        True si el dispositivo está entregando eventos en tiempo real
+        """
+        with self._lock:
+            return self._en_linea.get(dispositivo_id, False)
+
+    def estado(self) -> dict:
+        with self._lock:
+            return {
+                dispositivo_id: {
+                    "en_linea": self._en_linea.get(dispositivo_id, False),
+                    "marcaciones_recibidas": self._eventos.get(dispositivo_id, 0),
+                }
+                for dispositivo_id in self._hilos
+            }
+
+    # ---------------------------------------------------------
+    # LÓGICA INTERNA
+    # ---------------------------------------------------------
+
+    def _supervisar(self):
+        while not self._detener.is_set():
+            try:
+                db = SessionLocal()
+                try:
+                    activos = {d.id for d in db.query(Dispositivo).filter(Dispositivo.activo == True).all()}
+                finally:
+                    db.close()
+
+                with self._lock:
+                    # Dispositivos desactivados o eliminados
+                    for dispositivo_id in list(self._hilos):
+                        if dispositivo_id not in activos or not self._hilos[dispositivo_id][0].is_alive():
+                            _, parar = self._hilos.pop(dispositivo_id)
+                            parar.set()
+                            self._en_linea.pop(dispositivo_id, None)
+                    # Dispositivos nuevos
+                    for dispositivo_id in activos - set(self._hilos):
+                        parar = threading.Event()
+                        hilo = threading.Thread(
+                            target=self._capturar,
+                            args=(dispositivo_id, parar),
+                            name=f"zk-live-{dispositivo_id}",
+                            daemon=True
+                        )
+                        self._hilos[dispositivo_id] = (hilo, parar)
+                        hilo.start()
+            except Exception as e:
+                logger.error(f"Error revisando dispositivos para captura en tiempo real: {e}")
+
+            self._detener.wait(self.refresco)
+
+    def _marcar(self, dispositivo_id: int, en_linea: bool):
+        with self._lock:
+            self._en_linea[dispositivo_id] = en_linea
+
+    def _capturar(self, dispositivo_id: int, parar: threading.Event):
+        fallos = 0
+        recuperar = False  # Hubo una pausa en la captura: marcaciones sin recibir en el equipo
+        esperado = None  # Registros que debería tener el equipo si no se marcó durante la pausa
+        while not (self._detener.is_set() or parar.is_set()):
+            db = SessionLocal()
+            try:
+                dispositivo = db.query(Dispositivo).filter(Dispositivo.id == dispositivo_id).first()
+            finally:
+                db.close()
+            if not dispositivo or not dispositivo.activo:
+                break
+
+            if recuperar and self._recuperar(dispositivo, esperado):
+                recuperar = False
+
+            try:
+                with pool_conexiones.sesion(dispositivo, deshabilitar=False) as zk:
+                    if zk is None:
+                        fallos += 1
+                    else:
+                        fallos = 0
+                        conteos = zk.obtener_conteos()
+                        esperado = conteos.get('registros')
+                        usuarios = self._mapa_usuarios(dispositivo_id, zk, conteos.get('usuarios'))
+                        self._marcar(dispositivo_id, True)
+                        for marcacion in zk.capturar_eventos(self.timeout_evento, usuarios):
+                            # pyzk ya confirmó el evento al dispositivo: se guarda siempre
+                            if marcacion is not None:
+                                self._procesar(dispositivo_id, marcacion)
+                                if esperado is not None:
+                                    esperado += 1
+                            if self._detener.is_set() or parar.is_set() or pool_conexiones.hay_espera(dispositivo_id):
+                                # La captura termina al vencer la espera en curso
+                                zk.detener_captura()
+            except Exception as e:
+                logger.warning(f"Captura en tiempo real interrumpida en dispositivo {dispositivo_id}: {e}")
+                fallos += 1
+
+            # Fuera de línea mientras la sesión está cedida o caída: el planificador
+            # vuelve a incluir el dispositivo y al reanudar se recupera lo marcado
+            self._marcar(dispositivo_id, False)
+            recuperar = True
+            if fallos:
+                espera = min(self.reintento * (2 ** (fallos - 1)), 600)
+            else:
+                # Sesión cedida a otra operación: reintentar enseguida
+                espera = self.timeout_evento / 2
+            self._detener.wait(espera)
+
+        self._marcar(dispositivo_id, False)
+
+    def _mapa_usuarios(self, dispositivo_id: int, zk, cantidad) -> dict:
+        """
+        user_id -> uid interno de los usuarios del dispositivo, en caché mientras no
+        cambie la cantidad de usuarios (None si no se pudo leer: pyzk los lee al capturar)
+        """
+        with self._lock:
+            guardado = self._usuarios.get(dispositivo_id)
+        if guardado is not None and cantidad is not None and guardado[0] == cantidad:
+            return guardado[1]
+        usuarios = zk.obtener_usuarios()
+        if cantidad is None or len(usuarios) != cantidad:
+            return None
+        mapa = {u.user_id: u.uid for u in usuarios}
+        with self._lock:
+            self._usuarios[dispositivo_id] = (cantidad, mapa)
+        return mapa
+
+    def _recuperar(self, dispositivo, esperado) -> bool:
+        """
+        Sincronización incremental antes de reanudar la captura: trae lo marcado
+        mientras no hubo suscripción a eventos. Se omite si el equipo tiene los
+        registros esperados (nada se marcó durante la pausa). Retorna True si no
+        queda nada por recuperar.
+        """
+        dispositivo_id = dispositivo.id
+        if esperado is not None:
+            with pool_conexiones.sesion(dispositivo, deshabilitar=False) as zk:
+                registros = zk.obtener_conteos().get('registros') if zk is not None else None
+            if registros == esperado:
+                return True
+
+        db = SessionLocal()
+        try:
+            resultado = AsistenciaService.sincronizar_asistencias_desde_dispositivo(db, dispositivo_id)
+        except Exception as e:
+            resultado = {"success": False, "message": str(e)}
+        finally:
+            db.close()
+        if not resultado.get("success"):
+            logger.warning(f"No se recuperaron las marcaciones del dispositivo {dispositivo_id} "
+                           f"antes de reanudar la captura: {resultado.get('message')}")
+            return False
+        if resultado.get("registros_nuevos"):
+            logger.info(f"Dispositivo {dispositivo_id}: {resultado['registros_nuevos']} marcaciones "
+                        f"recuperadas de la pausa de la captura en tiempo real")
+        return True
+
+    def _uid_conocido(self, db, uid: int) -> bool:
+        """
+        True si el usuario existe en la BD. Los uids encontrados quedan en caché:
+        solo un uid aún no visto cuesta una consulta (por clave)
+        """
+        with self._lock:
+            if uid in self._uids_conocidos:
+                return True
+        if db.query(Usuario.id).filter(Usuario.uid == uid).first() is None:
+            return False
+        with self._lock:
+            self._uids_conocidos.add(uid)
+        return True
+
+    def _procesar(self, dispositivo_id: int, marcacion):
+        """
+        Guarda la marcación y la publica
+        """
+        guardada = False
+        registro = AsistenciaService._registro_de_marcacion(marcacion)
+        db = SessionLocal()
+        try:
+            if registro is not None and self._uid_conocido(db, registro[0]):
+                guardada = AsistenciaService.guardar_marcacion(db, dispositivo_id, *registro)
+            elif registro is not None:
+                logger.warning(f"Marcación en tiempo real de un usuario inexistente en la BD: {marcacion.user_id}")
+        except Exception as e:
+            # Puede fallar por un usuario eliminado después de quedar en caché
+            with self._lock:
+                self._uids_conocidos.discard(registro[0])
+            logger.error(f"No se pudo guardar la marcación en tiempo real de {marcacion.user_id}: {e}")
+        finally:
+            db.close()
+
+        with self._lock:
+            self._eventos[dispositivo_id] = self._eventos.get(dispositivo_id, 0) + 1
+
+        self.difusor.publicar({
+            "dispositivo_id": dispositivo_id,
+            "user_id": marcacion.user_id,
+            "timestamp": marcacion.timestamp.isoformat(),
+            "status": marcacion.status,
+            "punch": marcacion.punch,
+            "guardada": guardada,
+        })
+
+
+# Instancias globales
+difusor_eventos = DifusorEventos(capacidad=settings.LIVE_CAPTURE_QUEUE_SIZE)
+captura_tiempo_real = CapturaTiempoReal(difusor_eventos)
@@ -0,0 +1,420 @@
+"""
+Trabajos en Segundo Plano
+Ejecuta las operaciones largas (sincronizaciones, cálculos) fuera de la petición HTTP
+
+Características:
+- El envío devuelve de inmediato el id del trabajo; la ejecución ocurre en un pool
+  acotado de hilos (JOBS_MAX_WORKERS), sin ocupar los workers de las peticiones
+- Estado, progreso y resultado se guardan en la tabla trabajos (consultables por id)
+- Un trabajo idéntico (mismo tipo y parámetros) que aún no terminó no se duplica:
+  se devuelve el que está en curso
+- Cancelación: un trabajo pendiente no llega a ejecutarse; uno en curso se detiene
+  en su siguiente punto de control (cada vez que informa progreso). Las tareas sin
+  puntos de control (cancelable=False) rechazan la cancelación una vez iniciadas
+- Al iniciar la API los trabajos que quedaron a medias se marcan como fallidos
+
+Uso:
+    >>> from zkteco_trabajos import gestor_trabajos
+    >>> trabajo, nuevo = gestor_trabajos.enviar("sincronizar_asistencias", {"dispositivo_id": 1})
+    >>> gestor_trabajos.obtener(trabajo["id"])  # {"estado": "en_curso", "progreso": 40, ...}
+    >>> gestor_trabajos.cancelar(trabajo["id"])
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+from typing import Callable, Optional
+import json
+import threading
+import uuid
+import logging
+
+from models.database import SessionLocal
+from models.trabajo import Trabajo
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+PENDIENTE = "pendiente"
+EN_CURSO = "en_curso"
+COMPLETADO = "completado"
+FALLIDO = "fallido"
+CANCELADO = "cancelado"
+
+ESTADOS_FINALES = (COMPLETADO, FALLIDO, CANCELADO)
+
+
+class TrabajoCancelado(Exception):
+    """
+    Se lanza en un punto de control cuando se pidió cancelar el trabajo
+    """
+
+
+class CancelacionNoAdmitida(Exception):
+    """
+    Se lanza al pedir la cancelación de un trabajo en curso cuya tarea no la admite
+    """
+
+
+class ContextoTrabajo:
+    """
+    Lo que recibe cada tarea para informar su avance y atender la cancelación
+    """
+
+    def __init__(self, trabajo_id: str, cancelacion: threading.Event):
+        self.trabajo_id = trabajo_id
+        self._cancelacion = cancelacion
+
+    @property
+    def cancelado(self) -> bool:
+        return self._cancelacion.is_set()
+
+    def verificar(self):
+        """
+        Punto de control: lanza TrabajoCancelado si se pidió cancelar
+        """
+        if self._cancelacion.is_set():
+            raise TrabajoCancelado()
+
+    def progreso(self, porcentaje: float, mensaje: str = None):
+        """
+        Guarda el avance (en su propia sesión, independiente de la de la tarea)
+        y actúa como punto de control de la cancelación.
+        """
+        self.verificar()
+        GestorTrabajos._actualizar(
+            self.trabajo_id,
+            progreso=max(0, min(100, int(porcentaje))),
+            mensaje=mensaje[:255] if mensaje else None
+        )
+
+
+class GestorTrabajos:
+    """
+    Registro de tareas y ejecución de trabajos en un pool acotado de hilos
+    """
+
+    def __init__(self, max_workers: int = 4, retencion_dias: int = 7):
+        """
+        Parámetros:
+            max_workers (int): Trabajos ejecutados a la vez
+            retencion_dias (int): Días que se conservan los trabajos terminados
+        """
+        self.max_workers = max_workers
+        self.retencion_dias = retencion_dias
+
+        self._tareas = {}
+        self._no_cancelables = set()  # Tipos que no se pueden detener una vez iniciados
+        self._activos = {}  # clave -> trabajo_id (pendientes o en curso)
+        self._cancelaciones = {}  # trabajo_id -> threading.Event
+        self._futuros = {}  # trabajo_id -> Future
+        self._lock = threading.Lock()
+        self._executor = None
+
+    # ---------------------------------------------------------
+    # API PÚBLICA
+    # ---------------------------------------------------------
+
+    def registrar(self, tipo: str, tarea: Callable, cancelable: bool = True):
+        """
+        Registra una tarea: tarea(db, contexto, **parametros) -> dict.
+        Si el dict trae success=False el trabajo termina como fallido.
+        cancelable=False indica que la tarea no pasa por puntos de control: solo
+        se puede cancelar mientras está pendiente.
+        """
+        self._tareas[tipo] = tarea
+        if cancelable:
+            self._no_cancelables.discard(tipo)
+        else:
+            self._no_cancelables.add(tipo)
+
+    @property
+    def tipos(self) -> list:
+        return sorted(self._tareas)
+
+    def enviar(self, tipo: str, parametros: dict = None) -> tuple:
+        """
+        Encola un trabajo, o devuelve el equivalente que aún no terminó.
+
+        Retorna:
+            tuple: (trabajo como dict, True si se creó uno nuevo)
+        """
+        if tipo not in self._tareas:
+            raise ValueError(f"Tipo de trabajo desconocido: {tipo}")
+
+        parametros = json.loads(json.dumps(parametros or {}, default=str))
+        clave = f"{tipo}:{json.dumps(parametros, sort_keys=True)}"
+
+        with self._lock:
+            existente = self._activos.get(clave)
+            if existente is not None:
+                trabajo = self.obtener(existente)
+                if trabajo and trabajo["estado"] not in ESTADOS_FINALES:
+                    return trabajo, False
+
+            trabajo_id = uuid.uuid4().hex
+            db = SessionLocal()
+            try:
+                trabajo = Trabajo(
+                    id=trabajo_id,
+                    tipo=tipo,
+                    clave=clave[:255],
+                    parametros=json.dumps(parametros),
+                    estado=PENDIENTE,
+                    progreso=0
+                )
+                db.add(trabajo)
+                db.commit()
+                datos = trabajo.to_dict()
+            finally:
+                db.close()
+
+            self._activos[clave] = trabajo_id
+            self._cancelaciones[trabajo_id] = threading.Event()
+            self._futuros[trabajo_id] = self._pool().submit(self._ejecutar, trabajo_id, tipo, parametros)
+
+        logger.info(f"Trabajo {trabajo_id} ({tipo}) encolado")
+        return datos, True
+
+    def obtener(self, trabajo_id: str) -> Optional[dict]:
+        db = SessionLocal()
+        try:
+            trabajo = db.query(Trabajo).filter(Trabajo.id == trabajo_id).first()
+            return trabajo.to_dict() if trabajo else None
+        finally:
+            db.close()
+
+    def listar(self, estado: str = None, tipo: str = None, limit: int = 50) -> list:
+        db = SessionLocal()
+        try:
+            query = db.query(Trabajo)
+            if estado:
+                query = query.filter(Trabajo.estado == estado)
+            if tipo:
+                query = query.filter(Trabajo.tipo == tipo)
+            return [t.to_dict() for t in query.order_by(Trabajo.fecha_creacion.desc()).limit(limit).all()]
+        finally:
+            db.close()
+
+    def cancelar(self, trabajo_id: str) -> Optional[dict]:
+        """
+        Pide la cancelación de un trabajo. Un trabajo pendiente se cancela en el acto;
+        uno en curso termina como cancelado en su siguiente punto de control.
+
+        Retorna:
+            dict: Estado del trabajo tras la solicitud (None si no existe)
+
+        Lanza:
+            CancelacionNoAdmitida: El trabajo está en curso y su tarea no es cancelable
+        """
+        with self._lock:
+            cancelacion = self._cancelaciones.get(trabajo_id)
+            futuro = self._futuros.get(trabajo_id)
+        if cancelacion is None:
+            # Terminado (o de una ejecución anterior de la API): nada que cancelar
+            return self.obtener(trabajo_id)
+
+        if futuro is not None and futuro.cancel():
+            cancelacion.set()
+            self._liberar(trabajo_id)
+            self._finalizar(trabajo_id, CANCELADO, mensaje="Cancelado antes de iniciar")
+            return self.obtener(trabajo_id)
+
+        trabajo = self.obtener(trabajo_id)
+        if trabajo is None or trabajo["estado"] in ESTADOS_FINALES:
+            return trabajo
+        if trabajo["tipo"] in self._no_cancelables:
+            raise CancelacionNoAdmitida(f"El trabajo {trabajo['tipo']} ya está en curso y no admite cancelación")
+        cancelacion.set()
+        self._actualizar(trabajo_id, mensaje="Cancelación solicitada")
+        return self.obtener(trabajo_id)
+
+    def recuperar(self):
+        """
+        Al iniciar la API: marca como fallidos los trabajos que quedaron sin terminar
+        y elimina los terminados más antiguos que JOBS_RETENTION_DAYS.
+        """
+        db = SessionLocal()
+        try:
+            interrumpidos = db.query(Trabajo).filter(
+                Trabajo.estado.in_([PENDIENTE, EN_CURSO])
+            ).update({
+                Trabajo.estado: FALLIDO,
+                Trabajo.error: "Interrumpido por reinicio del servidor",
+                Trabajo.fecha_fin: datetime.now()
+            }, synchronize_session=False)
+
+            limite = datetime.now() - timedelta(days=self.retencion_dias)
+            eliminados = db.query(Trabajo).filter(
+                Trabajo.estado.in_(ESTADOS_FINALES),
+                Trabajo.fecha_creacion < limite
+            ).delete(synchronize_session=False)
+            db.commit()
+            if interrumpidos or eliminados:
+                logger.info(f"Trabajos: {interrumpidos} interrumpidos marcados como fallidos, {eliminados} antiguos eliminados")
+        finally:
+            db.close()
+
+    def detener(self):
+        """
+        Cancela los trabajos pendientes y pide detenerse a los que están en curso
+        """
+        with self._lock:
+            cancelaciones = list(self._cancelaciones.values())
+            executor, self._executor = self._executor, None
+        for cancelacion in cancelaciones:
+            cancelacion.set()
+        if executor:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    # ---------------------------------------------------------
+    # LÓGICA INTERNA
+    # ---------------------------------------------------------
+
+    def _pool(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="zk-trabajo")
+        return self._executor
+
+    def _ejecutar(self, trabajo_id: str, tipo: str, parametros: dict):
+        cancelacion = self._cancelaciones[trabajo_id]
+        try:
+            if cancelacion.is_set():
+                self._finalizar(trabajo_id, CANCELADO, mensaje="Cancelado antes de iniciar")
+                return
+
+            self._actualizar(trabajo_id, estado=EN_CURSO, fecha_inicio=datetime.now())
+            db = SessionLocal()
+            try:
+                resultado = self._tareas[tipo](db, ContextoTrabajo(trabajo_id, cancelacion), **parametros)
+                if isinstance(resultado, dict) and resultado.get("success") is False:
+                    self._finalizar(trabajo_id, FALLIDO, resultado=resultado, error=resultado.get("message"))
+                else:
+                    self._finalizar(trabajo_id, COMPLETADO, resultado=resultado, progreso=100)
+            except TrabajoCancelado:
+                db.rollback()
+                self._finalizar(trabajo_id, CANCELADO, mensaje="Cancelado durante la ejecución")
+            except Exception as e:
+                db.rollback()
+                logger.error(f"Trabajo {trabajo_id} ({tipo}) fallido: {str(e)}")
+                self._finalizar(trabajo_id, FALLIDO, error=str(e))
+            finally:
+                db.close()
+        finally:
+            self._liberar(trabajo_id)
+
+    def _liberar(self, trabajo_id: str):
+        """
+        Quita el trabajo de los activos: un envío idéntico posterior crea uno nuevo
+        """
+        with self._lock:
+            for clave, activo in list(self._activos.items()):
+                if activo == trabajo_id:
+                    del self._activos[clave]
+            self._cancelaciones.pop(trabajo_id, None)
+            self._futuros.pop(trabajo_id, None)
+
+    @staticmethod
+    def _finalizar(trabajo_id: str, estado: str, resultado=None, **campos):
+        if resultado is not None:
+            campos["resultado"] = json.dumps(resultado, default=str)
+        GestorTrabajos._actualizar(trabajo_id, estado=estado, fecha_fin=datetime.now(), **campos)
+        logger.info(f"Trabajo {trabajo_id} {estado}")
+
+    @staticmethod
+    def _actualizar(trabajo_id: str, **campos):
+        db = SessionLocal()
+        try:
+            db.query(Trabajo).filter(Trabajo.id == trabajo_id).update(
+                {getattr(Trabajo, campo): valor for campo, valor in campos.items()},
+                synchronize_session=False
+            )
+            db.commit()
+        finally:
+            db.close()
+
+
+# ---------------------------------------------------------
+# TAREAS
+# ---------------------------------------------------------
+
+def _tarea_sincronizar_asistencias(db, contexto: ContextoTrabajo, dispositivo_id: int, completo: bool = False) -> dict:
+    from services.asistencia_service import AsistenciaService
+
+    contexto.progreso(0, f"Sincronizando asistencias del dispositivo {dispositivo_id}")
+    # Cancelar detiene la escritura tras el siguiente lote confirmado
+    return AsistenciaService.sincronizar_asistencias_desde_dispositivo(
+        db, dispositivo_id, completo, verificar=contexto.verificar
+    )
+
+
+def _tarea_sincronizar_todos(db, contexto: ContextoTrabajo) -> dict:
+    from models.dispositivo import Dispositivo
+    from services.flota_service import FlotaService
+
+    total = db.query(Dispositivo).filter(Dispositivo.activo == True).count()
+    resultados = FlotaService.sincronizar_asistencias_todos(db)
+    lista = []
+    try:
+        for resultado in resultados:
+            lista.append(resultado)
+            # Cancelar cierra el generador: los dispositivos no iniciados no llegan a ejecutarse
+            contexto.progreso(
+                len(lista) * 100 / total,
+                f"{len(lista)}/{total} dispositivos ({resultado.get('dispositivo_nombre')})"
+            )
+    finally:
+        resultados.close()
+    return {
+        "total_dispositivos": len(lista),
+        "exitosos": sum(1 for r in lista if r.get("success")),
+        "resultados": lista
+    }
+
+
+def _tarea_sincronizar_usuarios(db, contexto: ContextoTrabajo, dispositivo_id: int) -> dict:
+    from services.usuario_service import UsuarioService
+
+    contexto.progreso(0, f"Sincronizando usuarios del dispositivo {dispositivo_id}")
+    return UsuarioService.sincronizar_usuarios_desde_dispositivo(db, dispositivo_id)
+
+
+def _tarea_calcular(db, contexto: ContextoTrabajo, fecha_inicio: str, fecha_fin: str, user_id: str = None,
+                    procesos: int = None) -> dict:
+    from services.asistencia_service import AsistenciaService
+
+    inicio = date.fromisoformat(fecha_inicio)
+    fin = date.fromisoformat(fecha_fin)
+    avance = {"porcentaje": -1}
+
+    def al_avanzar(calculados: int, total: int):
+        # El cálculo es en memoria y se escribe al final: cancelar no deja el rango a medias
+        porcentaje = int(calculados * 95 / total)
+        if porcentaje > avance["porcentaje"]:
+            avance["porcentaje"] = porcentaje
+            contexto.progreso(porcentaje, f"{calculados}/{total} usuarios calculados")
+        else:
+            contexto.verificar()
+
+    procesados = len(AsistenciaService.calcular_rango_asistencia(db, inicio, fin, user_id, al_avanzar=al_avanzar,
+                                                                 procesos=procesos))
+    return {"message": "Cálculo completado", "dias_procesados": procesados}
+
+
+def _tarea_reproducir_spool(db, contexto: ContextoTrabajo, dispositivo_id: int = None) -> dict:
+    from services.asistencia_service import AsistenciaService
+
+    contexto.progreso(0, "Reproduciendo volcados pendientes")
+    return AsistenciaService.reproducir_descargas_pendientes(db, dispositivo_id, verificar=contexto.verificar)
+
+
+# Instancia global del gestor
+gestor_trabajos = GestorTrabajos(
+    max_workers=settings.JOBS_MAX_WORKERS,
+    retencion_dias=settings.JOBS_RETENTION_DAYS
+)
+gestor_trabajos.registrar("sincronizar_asistencias", _tarea_sincronizar_asistencias)
+gestor_trabajos.registrar("sincronizar_todos", _tarea_sincronizar_todos)
+# La sincronización de usuarios no tiene puntos de control: solo se cancela mientras espera
+gestor_trabajos.registrar("sincronizar_usuarios", _tarea_sincronizar_usuarios, cancelable=False)
+gestor_trabajos.registrar("calcular_asistencia", _tarea_calcular)
+gestor_trabajos.registrar("reproducir_spool", _tarea_reproducir_spool)